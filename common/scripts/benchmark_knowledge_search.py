@@ -0,0 +1,594 @@
+#!/usr/bin/env python3
+"""
+ナレッジ検索ベンチマークスクリプト
+
+検索インデックスの各方式について、再現率とレイテンシを計測します。
+取り込み済みインデックスには触れず、ナレッジファイルからメモリ上で構築して比較します。
+
+使用例:
+    python common/scripts/benchmark_knowledge_search.py tokenizer
+    python common/scripts/benchmark_knowledge_search.py tokenizer --limit 5 --repeat 200
+    python common/scripts/benchmark_knowledge_search.py index-format --scale 200
+    python common/scripts/benchmark_knowledge_search.py ann --docs 200000 --nprobe 1 4 16 64
+    python common/scripts/benchmark_knowledge_search.py batch --scale 100
+    python common/scripts/benchmark_knowledge_search.py pruning --docs 500000
+    python common/scripts/benchmark_knowledge_search.py postings --docs 500000
+    python common/scripts/benchmark_knowledge_search.py local-embedding --scale 20
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import logging
+import statistics
+import tempfile
+import tracemalloc
+from pathlib import Path
+from typing import Dict, List, Any, Callable
+
+import numpy as np
+
+# プロジェクトルートをパスに追加
+project_root = Path(__file__).parent.parent.parent
+sys.path.append(str(project_root))
+
+# ingest_knowledge のログ出力先を用意してから読み込む
+os.makedirs("common/logs", exist_ok=True)
+
+from common.scripts.ingest_knowledge import KnowledgeIngestor
+from common.utils.local_embeddings import (
+    DEFAULT_FIT_SAMPLE_SIZE, DEFAULT_HASH_FEATURES, DEFAULT_MAX_FEATURES, LocalEmbeddingModel
+)
+from common.utils.knowledge_index import InvertedIndex
+from common.utils.knowledge_postings import POSTING_ENCODINGS, RAW_ENCODING
+from common.utils.knowledge_pruning import PRUNING_MIN_POSTINGS
+from common.utils.knowledge_search import KnowledgeSearcher
+from common.utils.knowledge_store import KnowledgeStore, build_store_bytes, write_knowledge_store
+from common.utils.knowledge_tokenizer import create_tokenizer, normalize_text
+from common.utils.vector_index import IVFFlatIndex, NumpyVectorIndex, normalize_rows
+
+# 同梱ナレッジを対象にした評価クエリ（全角・半角の表記揺れを含む）
+DEFAULT_QUERIES = [
+    "API統合 料金",
+    "価格相談",
+    "セキュリティ要件",
+    "マーケティングオートメーション",
+    "顧客管理システム",
+    "リアルタイム",
+    "ＡＰＩ 連携",
+    "ｻﾎﾟｰﾄ",
+    "プラットフォーム",
+    "enterprise pricing",
+    "データ移行",
+    "監査ログ",
+]
+
+
+def load_corpus(config_path: str) -> Dict[str, Dict[str, Any]]:
+    """ナレッジファイルを取り込み時と同じ方法でチャンク化"""
+    ingestor = KnowledgeIngestor(config_path)
+    corpus = {}
+    for file_path in ingestor.scan_knowledge_base():
+        metadata = ingestor.extract_metadata(file_path)
+        content = file_path.read_text(encoding='utf-8')
+        for chunk in ingestor.chunk_content(content, metadata):
+            corpus[chunk["metadata"]["chunk_id"]] = chunk
+    return corpus
+
+
+def scale_corpus(corpus: Dict[str, Dict[str, Any]], scale: int) -> Dict[str, Dict[str, Any]]:
+    """チャンクを複製して大きなコーパスを作る（ID・ファイルパスは複製ごとに別物にする）"""
+    if scale <= 1:
+        return corpus
+
+    scaled = {}
+    for copy in range(scale):
+        for chunk_id, chunk in corpus.items():
+            metadata = dict(chunk["metadata"])
+            metadata["chunk_id"] = f"{chunk_id}_copy{copy}"
+            metadata["file_path"] = f"{metadata['file_path']}#copy{copy}"
+            scaled[metadata["chunk_id"]] = dict(chunk, metadata=metadata)
+    return scaled
+
+
+def build_inverted_index(corpus: Dict[str, Dict[str, Any]], spec: Dict[str, Any]) -> InvertedIndex:
+    """コーパスから転置インデックスを構築"""
+    index = InvertedIndex(tokenizer=create_tokenizer(spec))
+    for chunk_id, chunk in corpus.items():
+        index.add_chunk(chunk_id, chunk["content"], chunk["fields"],
+                        chunk["metadata"].get("category", ""))
+    return index
+
+
+def relevant_chunks(corpus: Dict[str, Dict[str, Any]], query: str) -> set:
+    """正解集合: 正規化後の本文・メタデータにクエリの全語を部分文字列として含むチャンク"""
+    words = normalize_text(query).split()
+    relevant = set()
+    for chunk_id, chunk in corpus.items():
+        text = normalize_text(chunk["content"]) + "\n" + chunk["fields"]["metadata_text"]
+        if all(word in text for word in words):
+            relevant.add(chunk_id)
+    return relevant
+
+
+def measure(search: Callable[[str], List[str]], queries: List[str],
+            truth: Dict[str, set], limit: int, repeat: int) -> Dict[str, float]:
+    """検索関数の再現率@k とクエリあたりレイテンシを計測"""
+    recalls = []
+    latencies = []
+    for query in queries:
+        hits = search(query)[:limit]
+        relevant = truth[query]
+        if relevant:
+            recalls.append(len(set(hits) & relevant) / min(limit, len(relevant)))
+
+        start = time.perf_counter()
+        for _ in range(repeat):
+            search(query)
+        latencies.append((time.perf_counter() - start) / repeat * 1000)
+
+    return {
+        "recall": statistics.mean(recalls) if recalls else 0.0,
+        "p50_ms": statistics.median(latencies),
+        "max_ms": max(latencies),
+    }
+
+
+def benchmark_tokenizers(args: argparse.Namespace) -> None:
+    """トークナイザ別の再現率・レイテンシ比較"""
+    corpus = load_corpus(args.config)
+    queries = args.queries or DEFAULT_QUERIES
+    truth = {query: relevant_chunks(corpus, query) for query in queries}
+    print(f"コーパス: {len(corpus)}チャンク / クエリ: {len(queries)}件 / limit={args.limit}")
+
+    specs = {
+        "regex（従来）": {"type": "regex"},
+        "ngram[2]": {"type": "ngram", "ngram_sizes": [2]},
+        "ngram[2,3]": {"type": "ngram", "ngram_sizes": [2, 3]},
+        "morph": {"type": "morph", "backend": "auto"},
+    }
+
+    rows = []
+    for name, spec in specs.items():
+        tokenizer = create_tokenizer(spec)
+        if tokenizer.spec["type"] != spec["type"]:
+            continue  # 形態素解析器が未インストール
+
+        start = time.perf_counter()
+        index = build_inverted_index(corpus, spec)
+        build_ms = (time.perf_counter() - start) * 1000
+
+        def search(query, index=index):
+            return [chunk_id for chunk_id, _ in
+                    index.search(index.tokenizer.tokenize(query), args.limit)]
+
+        result = measure(search, queries, truth, args.limit, args.repeat)
+        result.update({"terms": len(index.postings), "build_ms": build_ms})
+        rows.append((name, result))
+
+    # 参考: インデックスを使わない従来の全件走査
+    searcher = KnowledgeSearcher()
+
+    def scan(query):
+        results = searcher._search_from_index(query, None, args.limit, corpus)
+        return [r["metadata"]["chunk_id"] for r in results]
+
+    rows.append(("全件走査（従来）", measure(scan, queries, truth, args.limit, args.repeat)))
+
+    print(f"\n{'方式':<16}{'recall@k':>10}{'p50(ms)':>10}{'max(ms)':>10}{'語彙数':>8}{'構築(ms)':>10}")
+    for name, result in rows:
+        print(f"{name:<16}{result['recall']:>10.3f}{result['p50_ms']:>10.3f}{result['max_ms']:>10.3f}"
+              f"{result.get('terms', '-'):>8}{result.get('build_ms', 0):>10.1f}")
+
+
+def benchmark_index_format(args: argparse.Namespace) -> None:
+    """JSONインデックスとバイナリ（mmap）インデックスのサイズ・読み込み時間・ヒープ使用量の比較"""
+    corpus = scale_corpus(load_corpus(args.config), args.scale)
+    index = build_inverted_index(corpus, {"type": "ngram", "ngram_sizes": [2]})
+    chunks = list(corpus.values())
+    query_terms = index.tokenizer.tokenize("API統合 料金")
+    print(f"コーパス: {len(chunks)}チャンク（複製 {args.scale}倍）")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_path = Path(tmp_dir)
+        json_files = [tmp_path / "knowledge_index.json", tmp_path / "inverted_index.json"]
+        with open(json_files[0], 'w', encoding='utf-8') as f:
+            json.dump(corpus, f, ensure_ascii=False, indent=2)
+        index.save(json_files[1])
+        bin_file = tmp_path / "knowledge_index.bin"
+        write_knowledge_store(bin_file, chunks, index)
+
+        def load_json():
+            with open(json_files[0], 'r', encoding='utf-8') as f:
+                chunk_index = json.load(f)
+            return chunk_index, InvertedIndex.load(json_files[1])
+
+        def load_bin():
+            return KnowledgeStore.open(bin_file)
+
+        rows = []
+        for name, load, search in (
+            ("JSON", load_json, lambda loaded: loaded[1].search(query_terms, 10)),
+            ("binary(mmap)", load_bin, lambda loaded: loaded.search(query_terms, 10)),
+        ):
+            tracemalloc.start()
+            start = time.perf_counter()
+            loaded = load()
+            load_ms = (time.perf_counter() - start) * 1000
+            heap_mb = tracemalloc.get_traced_memory()[0] / 1024 / 1024
+            tracemalloc.stop()
+
+            start = time.perf_counter()
+            for _ in range(args.repeat):
+                search(loaded)
+            query_ms = (time.perf_counter() - start) / args.repeat * 1000
+
+            size_mb = sum(path.stat().st_size for path in
+                          (json_files if name == "JSON" else [bin_file])) / 1024 / 1024
+            rows.append((name, size_mb, load_ms, heap_mb, query_ms))
+            del loaded
+
+    print(f"\n{'形式':<14}{'サイズ(MB)':>12}{'読込(ms)':>10}{'ヒープ(MB)':>12}{'検索(ms)':>10}")
+    for name, size_mb, load_ms, heap_mb, query_ms in rows:
+        print(f"{name:<14}{size_mb:>12.2f}{load_ms:>10.1f}{heap_mb:>12.2f}{query_ms:>10.3f}")
+
+
+def benchmark_batch(args: argparse.Namespace) -> None:
+    """クエリごとの検索と一括検索（search_many）のレイテンシ比較"""
+    corpus = scale_corpus(load_corpus(args.config), args.scale)
+    index = build_inverted_index(corpus, {"type": "ngram", "ngram_sizes": [2]})
+    store = KnowledgeStore.from_bytes(
+        build_store_bytes(list(corpus.values()), index)
+    )
+    queries = (args.queries or DEFAULT_QUERIES) * args.multiply
+    print(f"コーパス: {store.doc_count}チャンク / クエリ: {len(queries)}件 / limit={args.limit}")
+
+    def one_by_one():
+        return [store.search(store.tokenizer.tokenize(query), args.limit) for query in queries]
+
+    def batched():
+        return store.search_many([store.tokenizer.tokenize(query) for query in queries], args.limit)
+
+    assert [[doc for doc, _ in hits] for hits in one_by_one()] == \
+        [[doc for doc, _ in hits] for hits in batched()], "一括検索の結果が一致しません"
+
+    print(f"\n{'方式':<12}{'合計(ms)':>10}{'クエリあたり(ms)':>18}")
+    for name, run in (("クエリごと", one_by_one), ("一括", batched)):
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            run()
+        total_ms = (time.perf_counter() - start) / args.repeat * 1000
+        print(f"{name:<12}{total_ms:>10.2f}{total_ms / len(queries):>18.3f}")
+
+
+def benchmark_local_embedding(args: argparse.Namespace) -> None:
+    """ローカル埋め込み（ハッシュ化TF-IDF + SVD）の学習時間・埋め込みスループット・再現率"""
+    base_corpus = load_corpus(args.config)
+    corpus = scale_corpus(base_corpus, args.scale)
+    chunk_ids = list(corpus)
+    texts = [corpus[chunk_id]["content"] for chunk_id in chunk_ids]
+    spec = {"type": "ngram", "ngram_sizes": [2]}
+    queries = args.queries or DEFAULT_QUERIES
+    truth = {query: relevant_chunks(corpus, query) for query in queries}
+    print(f"コーパス: {len(texts)}チャンク (平均 {statistics.mean(len(text) for text in texts):.0f}文字) "
+          f"/ 学習標本: {min(args.fit_sample_size, len(texts))}チャンク")
+
+    print(f"\n{'次元':>6}{'学習(秒)':>10}{'埋め込み(件/秒)':>18}{'クエリ(ms)':>12}{'recall@' + str(args.limit):>12}")
+    for dim in args.dim:
+        start = time.perf_counter()
+        model = LocalEmbeddingModel.fit(texts[:args.fit_sample_size], spec, dim=dim,
+                                        hash_features=DEFAULT_HASH_FEATURES,
+                                        max_features=args.max_features)
+        fit_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        embeddings = model.embed_array(texts)
+        rate = len(texts) / (time.perf_counter() - start)
+        index = NumpyVectorIndex(embeddings, normalized=True)
+
+        def search(query, model=model, index=index):
+            return [chunk_ids[doc] for doc, _ in index.search(model.embed_array([query])[0], args.limit)]
+
+        result = measure(search, queries, truth, args.limit, args.repeat)
+        print(f"{model.dim:>6}{fit_seconds:>10.2f}{rate:>18.0f}{result['p50_ms']:>12.2f}"
+              f"{result['recall']:>12.3f}")
+
+
+def synthetic_index(docs: int, vocabulary: int, terms_per_doc: int, zipf: float,
+                    seed: int = 0) -> tuple:
+    """
+    語の出現頻度がZipf分布に従う合成コーパスの転置インデックス
+
+    語 "w<順位>" は順位が小さいほど頻出で、上位の語は「顧客」「API」のように
+    大半の文書に出現します。5件に1件は先頭の2語を見出しにも持たせます。
+
+    Returns:
+        (転置インデックス, チャンクのリスト)
+    """
+    rng = np.random.default_rng(seed)
+    probabilities = 1.0 / np.arange(1, vocabulary + 1) ** zipf
+    probabilities /= probabilities.sum()
+    lengths = rng.poisson(terms_per_doc, docs) + 1
+    words = rng.choice(vocabulary, size=int(lengths.sum()), p=probabilities).tolist()
+    offsets = np.concatenate([[0], np.cumsum(lengths)]).tolist()
+    names = [f"w{rank}" for rank in range(vocabulary)]
+
+    index = InvertedIndex(tokenizer=create_tokenizer({"type": "regex"}))
+    chunks = []
+    for doc in range(docs):
+        terms = [names[word] for word in words[offsets[doc]:offsets[doc + 1]]]
+        category = f"category{doc % 4}"
+        index.add_document(f"synthetic_{doc}", {
+            "content": terms,
+            "title": terms[:2] if doc % 5 == 0 else [],
+            "metadata": []
+        }, category)
+        chunks.append({"content": "", "metadata": {
+            "chunk_id": f"synthetic_{doc}", "file_path": f"synthetic/{doc // 20}.md",
+            "category": category
+        }})
+    return index, chunks
+
+
+def synthetic_queries(count: int, vocabulary: int, seed: int = 1) -> List[List[str]]:
+    """頻出語・中頻度語・希少語を組み合わせた合成クエリ"""
+    rng = np.random.default_rng(seed)
+    bands = {"common": (0, 20), "middle": (20, 2000), "rare": (2000, vocabulary)}
+    patterns = [("common",), ("common", "common"), ("common", "rare"), ("middle", "rare"),
+                ("common", "middle", "rare"), ("common", "common", "middle")]
+    queries = []
+    for query_no in range(count):
+        pattern = patterns[query_no % len(patterns)]
+        ranks = {int(rng.integers(*bands[band])) for band in pattern}
+        queries.append([f"w{rank}" for rank in sorted(ranks)])
+    return queries
+
+
+def benchmark_pruning(args: argparse.Namespace) -> None:
+    """動的枝刈り（Block-Max MaxScore）と全件採点の比較（採点したポスティングの割合・レイテンシ）"""
+    start = time.perf_counter()
+    index, chunks = synthetic_index(args.docs, args.vocabulary, args.terms_per_doc, args.zipf)
+    store = KnowledgeStore.from_bytes(build_store_bytes(chunks, index))
+    del index, chunks
+    queries = synthetic_queries(args.queries, args.vocabulary)
+    print(f"合成コーパス: {store.doc_count}チャンク / 語彙 {store.term_count}語 / "
+          f"構築 {time.perf_counter() - start:.1f}秒")
+    print(f"クエリ: {len(queries)}件 / limit={args.limit} / カテゴリ絞り込み: {args.categories or 'なし'}")
+
+    def run(pruning: bool, min_postings: int) -> tuple:
+        store.pruning = pruning
+        store.pruning_min_postings = min_postings
+        store.pruning_stats.reset()
+        results = [store.search(terms, args.limit, args.categories) for terms in queries]
+        latencies = []
+        for terms in queries:
+            begin = time.perf_counter()
+            for _ in range(args.repeat):
+                store.search(terms, args.limit, args.categories)
+            latencies.append((time.perf_counter() - begin) / args.repeat * 1000)
+        return results, latencies, store.pruning_stats.as_dict()
+
+    rows = []
+    exhaustive = None
+    for name, pruning, min_postings in (("全件採点", False, 0),
+                                        ("枝刈り（全クエリ）", True, 0),
+                                        (f"枝刈り（{PRUNING_MIN_POSTINGS}件以上）", True, PRUNING_MIN_POSTINGS)):
+        results, latencies, stats = run(pruning, min_postings)
+        if exhaustive is None:
+            exhaustive = results
+        mismatches = sum(
+            [doc for doc, _ in hits] != [doc for doc, _ in expected]
+            or not np.allclose([score for _, score in hits], [score for _, score in expected])
+            for hits, expected in zip(results, exhaustive)
+        )
+        rows.append((name, stats["scored"] / (args.repeat + 1) / len(queries),
+                     stats["scored_ratio"], statistics.median(latencies),
+                     float(np.percentile(latencies, 99)), mismatches))
+
+    print(f"\n{'方式':<22}{'採点数/クエリ':>14}{'採点率':>8}{'p50(ms)':>10}{'p99(ms)':>10}{'不一致':>8}")
+    for name, scored, ratio, p50, p99, mismatches in rows:
+        print(f"{name:<22}{scored:>14.0f}{ratio:>8.3f}{p50:>10.2f}{p99:>10.2f}{mismatches:>8}")
+
+
+# 形式ごとのポスティングのセクション
+POSTING_SECTIONS = {
+    "raw": ("posting_docs", "posting_tfs"),
+    "delta-varint": ("posting_data", "block_offsets", "block_last_docs"),
+}
+
+
+def benchmark_postings(args: argparse.Namespace) -> None:
+    """ポスティングの格納形式別のインデックスサイズ・展開スループット・検索レイテンシの比較"""
+    start = time.perf_counter()
+    index, chunks = synthetic_index(args.docs, args.vocabulary, args.terms_per_doc, args.zipf)
+    data = {encoding: build_store_bytes(chunks, index, posting_encoding=encoding)
+            for encoding in POSTING_ENCODINGS}
+    stores = {encoding: KnowledgeStore.from_bytes(store_bytes) for encoding, store_bytes in data.items()}
+    del index, chunks
+    queries = synthetic_queries(args.queries, args.vocabulary)
+    raw = stores[RAW_ENCODING]
+    posting_count = int(raw.section("term_postings")[-1])
+    term_lengths = np.diff(raw.section("term_postings"))
+    long_terms = np.flatnonzero(term_lengths >= args.long_postings).tolist()
+    print(f"合成コーパス: {raw.doc_count}チャンク / 語彙 {raw.term_count}語 / "
+          f"ポスティング {posting_count}件 / 構築 {time.perf_counter() - start:.1f}秒")
+    print(f"長いリスト: {args.long_postings}件以上の {len(long_terms)}語 "
+          f"（ポスティング {int(term_lengths[long_terms].sum())}件）")
+
+    def decode_rate(store: KnowledgeStore, term_ids: List[int]) -> float:
+        """ポスティングの展開スループット（百万件/秒）"""
+        begin = time.perf_counter()
+        decoded = 0
+        for _ in range(args.repeat):
+            for term_id in term_ids:
+                decoded += len(store.postings(term_id)[0])
+        return decoded / (time.perf_counter() - begin) / 1e6
+
+    def latencies(store: KnowledgeStore, pruning: bool) -> tuple:
+        store.pruning = pruning
+        store.pruning_min_postings = 0
+        results = [store.search(terms, args.limit) for terms in queries]
+        elapsed = []
+        for terms in queries:
+            begin = time.perf_counter()
+            for _ in range(args.repeat):
+                store.search(terms, args.limit)
+            elapsed.append((time.perf_counter() - begin) / args.repeat * 1000)
+        return results, elapsed
+
+    rows = []
+    expected = {}
+    for encoding, store in stores.items():
+        total_mb = len(data[encoding]) / 1024 / 1024
+        posting_bytes = sum(store.section(name).nbytes for name in POSTING_SECTIONS[encoding])
+        all_rate = decode_rate(store, list(range(store.term_count)))
+        long_rate = decode_rate(store, long_terms)
+        for pruning in (False, True):
+            results, elapsed = latencies(store, pruning)
+            expected.setdefault(pruning, results)
+            mismatches = sum(
+                [doc for doc, _ in hits] != [doc for doc, _ in reference]
+                or not np.allclose([score for _, score in hits], [score for _, score in reference])
+                for hits, reference in zip(results, expected[pruning])
+            )
+            rows.append((f"{encoding}{'（枝刈り）' if pruning else ''}", total_mb,
+                         posting_bytes / posting_count, all_rate, long_rate,
+                         statistics.median(elapsed), float(np.percentile(elapsed, 99)), mismatches))
+
+    print(f"\n{'形式':<20}{'サイズ(MB)':>12}{'B/件':>7}{'展開 全語(M件/s)':>18}{'展開 長(M件/s)':>16}"
+          f"{'p50(ms)':>9}{'p99(ms)':>9}{'不一致':>8}")
+    for name, total_mb, per_posting, all_rate, long_rate, p50, p99, mismatches in rows:
+        print(f"{name:<20}{total_mb:>12.2f}{per_posting:>7.2f}{all_rate:>18.1f}{long_rate:>16.1f}"
+              f"{p50:>9.2f}{p99:>9.2f}{mismatches:>8}")
+
+
+def synthetic_embeddings(docs: int, dim: int, clusters: int, noise: float,
+                         seed: int = 0) -> np.ndarray:
+    """クラスタ構造を持つ合成埋め込み（実際の文書埋め込みと同様に偏りがある）"""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, clusters, docs)
+    noise = rng.standard_normal((docs, dim)).astype(np.float32) * noise
+    return normalize_rows(centers[labels] + noise)
+
+
+def benchmark_ann(args: argparse.Namespace) -> None:
+    """IVF近似検索と厳密検索の recall@k・QPS 比較"""
+    matrix = synthetic_embeddings(args.docs + args.queries, args.dim, args.clusters, args.noise)
+    embeddings, queries = matrix[:args.docs], matrix[args.docs:]
+    print(f"埋め込み: {args.docs}件×{args.dim}次元 / クエリ: {args.queries}件 / k={args.limit}")
+
+    exact = NumpyVectorIndex(embeddings, normalized=True)
+
+    def run(index) -> tuple:
+        start = time.perf_counter()
+        results = [index.search(query, args.limit) for query in queries]
+        return results, len(queries) / (time.perf_counter() - start)
+
+    truth, exact_qps = run(exact)
+    truth = [{doc for doc, _ in hits} for hits in truth]
+
+    start = time.perf_counter()
+    centroids, list_offsets, list_docs = IVFFlatIndex.train(embeddings, n_lists=args.n_lists)
+    train_s = time.perf_counter() - start
+    print(f"IVF学習: {centroids.shape[0]}リスト / {train_s:.1f}秒")
+
+    print(f"\n{'方式':<16}{'recall@k':>10}{'QPS':>10}{'速度比':>8}")
+    print(f"{'厳密検索':<16}{1.0:>10.3f}{exact_qps:>10.0f}{1.0:>8.1f}")
+    for nprobe in args.nprobe:
+        index = IVFFlatIndex(embeddings, centroids, list_offsets, list_docs,
+                             normalized=True, nprobe=nprobe)
+        results, qps = run(index)
+        recall = statistics.mean(
+            len({doc for doc, _ in hits} & relevant) / len(relevant)
+            for hits, relevant in zip(results, truth)
+        )
+        print(f"{'IVF nprobe=' + str(nprobe):<16}{recall:>10.3f}{qps:>10.0f}{qps / exact_qps:>8.1f}")
+
+
+def main():
+    """メイン関数"""
+    parser = argparse.ArgumentParser(description="ナレッジ検索ベンチマーク")
+    parser.add_argument('--config', type=str, default="common/config/knowledge_config.yml",
+                        help='設定ファイルのパス')
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    tokenizer_parser = subparsers.add_parser('tokenizer', help='トークナイザ別の再現率・レイテンシ比較')
+    tokenizer_parser.add_argument('--limit', type=int, default=5, help='評価する上位件数')
+    tokenizer_parser.add_argument('--repeat', type=int, default=100, help='レイテンシ計測の反復回数')
+    tokenizer_parser.add_argument('--queries', nargs='+', help='評価クエリ（省略時は同梱クエリ）')
+    tokenizer_parser.set_defaults(func=benchmark_tokenizers)
+
+    format_parser = subparsers.add_parser('index-format', help='JSONとバイナリインデックスの比較')
+    format_parser.add_argument('--scale', type=int, default=100, help='同梱ナレッジの複製倍率')
+    format_parser.add_argument('--repeat', type=int, default=20, help='検索レイテンシ計測の反復回数')
+    format_parser.set_defaults(func=benchmark_index_format)
+
+    batch_parser = subparsers.add_parser('batch', help='クエリごとの検索と一括検索の比較')
+    batch_parser.add_argument('--scale', type=int, default=100, help='同梱ナレッジの複製倍率')
+    batch_parser.add_argument('--limit', type=int, default=10, help='クエリごとの最大結果数')
+    batch_parser.add_argument('--multiply', type=int, default=1, help='クエリ集合の繰り返し数')
+    batch_parser.add_argument('--repeat', type=int, default=10, help='計測の反復回数')
+    batch_parser.add_argument('--queries', nargs='+', help='評価クエリ（省略時は同梱クエリ）')
+    batch_parser.set_defaults(func=benchmark_batch)
+
+    pruning_parser = subparsers.add_parser('pruning', help='動的枝刈りと全件採点の比較（合成コーパス）')
+    pruning_parser.add_argument('--docs', type=int, default=500000, help='合成コーパスのチャンク数')
+    pruning_parser.add_argument('--vocabulary', type=int, default=50000, help='語彙数')
+    pruning_parser.add_argument('--terms-per-doc', type=int, default=12, help='チャンクあたりの平均語数')
+    pruning_parser.add_argument('--zipf', type=float, default=1.0, help='語の出現頻度のZipf指数')
+    pruning_parser.add_argument('--queries', type=int, default=120, help='クエリ数')
+    pruning_parser.add_argument('--limit', type=int, default=10, help='クエリごとの最大結果数')
+    pruning_parser.add_argument('--repeat', type=int, default=3, help='レイテンシ計測の反復回数')
+    pruning_parser.add_argument('--categories', nargs='+', help='カテゴリ絞り込み（例: category0）')
+    pruning_parser.set_defaults(func=benchmark_pruning)
+
+    postings_parser = subparsers.add_parser('postings', help='ポスティングの格納形式（圧縮・非圧縮）の比較（合成コーパス）')
+    postings_parser.add_argument('--docs', type=int, default=500000, help='合成コーパスのチャンク数')
+    postings_parser.add_argument('--vocabulary', type=int, default=50000, help='語彙数')
+    postings_parser.add_argument('--terms-per-doc', type=int, default=12, help='チャンクあたりの平均語数')
+    postings_parser.add_argument('--zipf', type=float, default=1.0, help='語の出現頻度のZipf指数')
+    postings_parser.add_argument('--queries', type=int, default=120, help='クエリ数')
+    postings_parser.add_argument('--limit', type=int, default=10, help='クエリごとの最大結果数')
+    postings_parser.add_argument('--repeat', type=int, default=3, help='計測の反復回数')
+    postings_parser.add_argument('--long-postings', type=int, default=10000,
+                                 help='展開スループットを別に集計する長いリストのポスティング数')
+    postings_parser.set_defaults(func=benchmark_postings)
+
+    local_parser = subparsers.add_parser('local-embedding',
+                                         help='ローカル埋め込み（ハッシュ化TF-IDF + SVD）の学習・埋め込み速度と再現率')
+    local_parser.add_argument('--scale', type=int, default=20, help='同梱ナレッジの複製倍率')
+    local_parser.add_argument('--dim', type=int, nargs='+', default=[64, 128, 256], help='比較する埋め込み次元')
+    local_parser.add_argument('--fit-sample-size', type=int, default=DEFAULT_FIT_SAMPLE_SIZE,
+                              help='学習に使うチャンク数')
+    local_parser.add_argument('--max-features', type=int, default=DEFAULT_MAX_FEATURES, help='特徴数の上限')
+    local_parser.add_argument('--limit', type=int, default=10, help='評価する上位件数')
+    local_parser.add_argument('--repeat', type=int, default=20, help='クエリレイテンシ計測の反復回数')
+    local_parser.add_argument('--queries', nargs='+', help='評価クエリ（省略時は同梱クエリ）')
+    local_parser.set_defaults(func=benchmark_local_embedding)
+
+    ann_parser = subparsers.add_parser('ann', help='IVF近似検索と厳密検索の recall@k・QPS 比較')
+    ann_parser.add_argument('--docs', type=int, default=100000, help='合成埋め込みの件数')
+    ann_parser.add_argument('--dim', type=int, default=256, help='埋め込み次元')
+    ann_parser.add_argument('--clusters', type=int, default=500, help='合成データのクラスタ数')
+    ann_parser.add_argument('--noise', type=float, default=1.5,
+                            help='クラスタ中心からのばらつき（大きいほど近似が難しい）')
+    ann_parser.add_argument('--queries', type=int, default=200, help='クエリ数')
+    ann_parser.add_argument('--limit', type=int, default=10, help='評価する上位件数')
+    ann_parser.add_argument('--n-lists', type=int, default=0, help='IVFのリスト数（0=√件数）')
+    ann_parser.add_argument('--nprobe', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32],
+                            help='比較する nprobe')
+    ann_parser.set_defaults(func=benchmark_ann)
+
+    args = parser.parse_args()
+    
+    # 取り込み処理のINFOログで結果表が埋もれないようにする
+    logging.getLogger().setLevel(logging.WARNING)
+    
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
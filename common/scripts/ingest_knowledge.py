@@ -7,8 +7,11 @@ Vector DB統合、メタデータ抽出、検索インデックス作成を自
 
 使用例:
     python ingest_knowledge.py --update-all
+    python ingest_knowledge.py --update-all --workers 4
     python ingest_knowledge.py --category customer-support --force
     python ingest_knowledge.py --file path/to/document.md
+    python ingest_knowledge.py --rebuild-related
+    python ingest_knowledge.py --compact
 """
 
 import os
@@ -16,12 +19,42 @@ import sys
 import json
 import argparse
 import logging
+import random
 from datetime import datetime
 from pathlib import Path
-from typing import Dict, List, Optional, Any
+from typing import Dict, List, Optional, Any, Tuple
 import yaml
-import hashlib
-import re
+
+# プロジェクトルートをパスに追加
+project_root = Path(__file__).parent.parent.parent
+sys.path.append(str(project_root))
+
+from common.utils.embedding_cache import CACHE_DIR_NAME, DEFAULT_MAX_ENTRIES, EmbeddingCache
+from common.utils.embeddings import BatchEmbedder, DEFAULT_BATCH_SIZE, create_batch_embedder
+from common.utils.knowledge_chunker import KnowledgeChunker
+from common.utils.knowledge_index import (
+    InvertedIndex, DEFAULT_K1, DEFAULT_B, extract_chunk_fields, load_manifest
+)
+from common.utils.knowledge_pipeline import IngestPipeline
+from common.utils.knowledge_postings import DEFAULT_POSTING_ENCODING, RAW_ENCODING
+from common.utils.knowledge_pruning import BLOCK_SIZE
+from common.utils.knowledge_store import STORE_FILE
+from common.utils.knowledge_shards import (
+    DEFAULT_MAX_SEGMENTS, ShardedKnowledgeStore, SHARDED_LAYOUT, append_segment, shard_name_for,
+    write_sharded_index
+)
+from common.utils.knowledge_related import (
+    DEFAULT_TOP_N, build_related_table, load_document_vectors, load_related_table, update_related_table,
+    write_related_table
+)
+from common.utils.knowledge_tokenizer import create_tokenizer
+from common.utils.local_embeddings import (
+    DEFAULT_FIT_SAMPLE_SIZE, DEFAULT_HASH_FEATURES, DEFAULT_LOCAL_DIM, DEFAULT_MAX_FEATURES,
+    DEFAULT_SVD_ITERATIONS, LocalEmbeddingModel, is_local_model, remove_unused_local_models
+)
+from common.utils.vector_store import (
+    chroma_settings, get_chroma_collection, set_collection_embedding_model, to_chroma_metadata
+)
 
 # 環境変数の読み込み
 from dotenv import load_dotenv
@@ -41,20 +74,50 @@ logger = logging.getLogger(__name__)
 class KnowledgeIngestor:
     """ナレッジベース取り込み・処理クラス"""
     
-    def __init__(self, config_path: str = "common/config/knowledge_config.yml"):
+    def __init__(self, config_path: str = "common/config/knowledge_config.yml",
+                 export_json: bool = False, workers: int = 1, compact: bool = False):
         self.config = self._load_config(config_path)
         self.knowledge_base_path = Path("common/knowledge")
         self.index_path = Path("common/knowledge/.index")
         self.index_path.mkdir(exist_ok=True)
+        self.chunker = KnowledgeChunker(self.config, self.knowledge_base_path)
         
         # Vector DB設定（環境変数から取得）
-        self.vector_db_type = os.getenv("VECTOR_DB_TYPE", "chroma")  # chroma, pinecone, weaviate
+        self.vector_db_type = os.getenv("VECTOR_DB_TYPE", "chroma")  # chroma, pinecone, weaviate, numpy
+        # chroma・pinecone 以外はローカルインデックスに保存（numpy・未設定）
+        self.writes_local_index = self.vector_db_type not in ("chroma", "pinecone")
         self.vector_db_url = os.getenv("VECTOR_DB_URL", "")
         self.vector_db_key = os.getenv("VECTOR_DB_API_KEY", "")
         
         # 埋め込みモデル設定
         self.embedding_model = os.getenv("EMBEDDING_MODEL", "text-embedding-ada-002")
         self.openai_api_key = os.getenv("OPENAI_API_KEY", "")
+        # auto: API Keyがなければローカル埋め込み（取り込み時に学習、モデル名は学習後に決まる）。
+        # モデルはローカルインデックスに保存するため、ローカルインデックスに書き込む場合のみ使用
+        provider = self.config.get("embedding", {}).get("provider", "auto")
+        self.use_local_embedding = self.writes_local_index and (
+            provider == "local" or (provider == "auto" and not self.openai_api_key)
+        )
+        self.embedder = (create_batch_embedder(self.config.get("embedding", {}), self.embedding_model)
+                         if self.openai_api_key and not self.use_local_embedding else None)
+        self._local_embedding_refitted = False
+        # 本文が同じチャンクは前回の埋め込みを再利用（ファイル編集時は変わったチャンクだけAPIを呼ぶ）。
+        # ローカル埋め込みは対象外: 学習済みモデルでの埋め込みはメモリ上の計算だけで済み
+        # （11,912チャンクで約3万件/秒、キャッシュから読んでも約2倍）、学習し直すとモデル名が変わって
+        # キャッシュファイルが使われなくなるため
+        cache_config = self.config.get("embedding", {}).get("cache", {}) or {}
+        self.embedding_cache = (EmbeddingCache(self.index_path / CACHE_DIR_NAME, self.embedding_model,
+                                               cache_config.get("max_entries", DEFAULT_MAX_ENTRIES))
+                                if self.embedder is not None and cache_config.get("enabled", True) else None)
+        
+        # ローカルインデックス（build_search_index で一括書き出し）
+        self._pending_chunks: Dict[str, List[Dict[str, Any]]] = {}
+        self.export_json = export_json
+        # True なら差分をセグメントとして追記せず、全件構築でシャードにまとめ直す
+        self.compact = compact
+        
+        # 2以上ならファイル処理をパイプライン（解析: プロセス, 埋め込み: スレッド）で並列化
+        self.workers = max(1, workers)
         
         logger.info(f"KnowledgeIngestor初期化完了 - Vector DB: {self.vector_db_type}")
 
@@ -71,8 +134,10 @@ class KnowledgeIngestor:
         """デフォルト設定"""
         return {
             "supported_formats": [".md", ".txt", ".json", ".yml", ".yaml"],
-            "chunk_size": 1000,
-            "chunk_overlap": 200,
+            "chunking": {
+                "chunk_size": 1000,
+                "chunk_overlap": 200
+            },
             "metadata_fields": [
                 "date", "category", "tags", "priority", "status",
                 "industry", "customer_segment", "product_name"
@@ -87,178 +152,47 @@ class KnowledgeIngestor:
         """ナレッジベースのファイルスキャン"""
         logger.info("ナレッジベースのスキャンを開始")
         
-        if category:
-            scan_path = self.knowledge_base_path / category
-            if not scan_path.exists():
-                logger.error(f"カテゴリが見つかりません: {category}")
-                return []
-        else:
-            scan_path = self.knowledge_base_path
-        
-        files = []
-        supported_formats = self.config["supported_formats"]
-        exclude_patterns = self.config["exclude_patterns"]
-        
-        for file_path in scan_path.rglob("*"):
-            if file_path.is_file() and file_path.suffix in supported_formats:
-                # 除外パターンチェック
-                if not any(file_path.match(pattern) for pattern in exclude_patterns):
-                    files.append(file_path)
+        if category and not (self.knowledge_base_path / category).exists():
+            logger.error(f"カテゴリが見つかりません: {category}")
+            return []
         
+        files = self.chunker.scan(category)
         logger.info(f"スキャン完了: {len(files)}個のファイルを発見")
         return files
 
     def extract_metadata(self, file_path: Path) -> Dict[str, Any]:
         """ファイルからメタデータを抽出"""
-        metadata = {
-            "file_path": str(file_path),
-            "file_name": file_path.name,
-            "file_size": file_path.stat().st_size,
-            "modified_time": datetime.fromtimestamp(file_path.stat().st_mtime).isoformat(),
-            "category": self._extract_category_from_path(file_path),
-            "file_hash": self._calculate_file_hash(file_path)
-        }
-        
-        # ファイル内容からYAML Front Matterを抽出
-        try:
-            content = file_path.read_text(encoding='utf-8')
-            yaml_metadata = self._extract_yaml_frontmatter(content)
-            metadata.update(yaml_metadata)
-        except Exception as e:
-            logger.warning(f"メタデータ抽出エラー {file_path}: {e}")
-        
-        return metadata
-
-    def _extract_category_from_path(self, file_path: Path) -> str:
-        """ファイルパスからカテゴリを抽出"""
-        relative_path = file_path.relative_to(self.knowledge_base_path)
-        return str(relative_path.parent).replace(os.sep, "/")
-
-    def _calculate_file_hash(self, file_path: Path) -> str:
-        """ファイルのハッシュ値を計算"""
-        hasher = hashlib.md5()
-        with open(file_path, 'rb') as f:
-            hasher.update(f.read())
-        return hasher.hexdigest()
-
-    def _extract_yaml_frontmatter(self, content: str) -> Dict[str, Any]:
-        """YAML Front Matterを抽出"""
-        pattern = r'^---\s*\n(.*?)\n---\s*\n'
-        match = re.match(pattern, content, re.DOTALL)
-        
-        if match:
-            try:
-                return yaml.safe_load(match.group(1))
-            except yaml.YAMLError as e:
-                logger.warning(f"YAML解析エラー: {e}")
-        
-        return {}
+        return self.chunker.extract_metadata(file_path)
 
     def chunk_content(self, content: str, metadata: Dict[str, Any]) -> List[Dict[str, Any]]:
         """コンテンツをチャンクに分割"""
-        chunk_size = self.config["chunk_size"]
-        chunk_overlap = self.config["chunk_overlap"]
-        
-        # マークダウンの見出しベースで分割を試行
-        chunks = self._split_by_headers(content)
-        
-        # サイズが大きい場合は更に分割
-        final_chunks = []
-        for i, chunk_text in enumerate(chunks):
-            if len(chunk_text) <= chunk_size:
-                chunk_metadata = metadata.copy()
-                chunk_metadata.update({
-                    "chunk_id": f"{metadata['file_hash']}_chunk_{i}",
-                    "chunk_index": i,
-                    "chunk_size": len(chunk_text)
-                })
-                final_chunks.append({
-                    "content": chunk_text,
-                    "metadata": chunk_metadata
-                })
-            else:
-                # 大きなチャンクを更に分割
-                sub_chunks = self._split_large_chunk(chunk_text, chunk_size, chunk_overlap)
-                for j, sub_chunk in enumerate(sub_chunks):
-                    chunk_metadata = metadata.copy()
-                    chunk_metadata.update({
-                        "chunk_id": f"{metadata['file_hash']}_chunk_{i}_{j}",
-                        "chunk_index": f"{i}.{j}",
-                        "chunk_size": len(sub_chunk)
-                    })
-                    final_chunks.append({
-                        "content": sub_chunk,
-                        "metadata": chunk_metadata
-                    })
-        
-        return final_chunks
-
-    def _split_by_headers(self, content: str) -> List[str]:
-        """マークダウンの見出しでコンテンツを分割"""
-        # YAML Front Matterを除去
-        content = re.sub(r'^---\s*\n.*?\n---\s*\n', '', content, flags=re.DOTALL)
-        
-        # 見出しで分割
-        header_pattern = r'^(#{1,6}\s+.+)$'
-        parts = re.split(header_pattern, content, flags=re.MULTILINE)
-        
-        chunks = []
-        current_chunk = ""
-        
-        for part in parts:
-            if re.match(header_pattern, part):
-                if current_chunk.strip():
-                    chunks.append(current_chunk.strip())
-                current_chunk = part + "\n"
-            else:
-                current_chunk += part
-        
-        if current_chunk.strip():
-            chunks.append(current_chunk.strip())
-        
-        return chunks if chunks else [content]
-
-    def _split_large_chunk(self, text: str, chunk_size: int, overlap: int) -> List[str]:
-        """大きなチャンクを固定サイズで分割"""
-        chunks = []
-        start = 0
-        
-        while start < len(text):
-            end = start + chunk_size
-            chunk = text[start:end]
-            chunks.append(chunk)
-            start = end - overlap
-        
-        return chunks
+        return self.chunker.chunk_content(content, metadata)
 
     def create_embeddings(self, chunks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-        """チャンクの埋め込みベクトルを生成"""
-        if not self.openai_api_key:
-            logger.warning("OpenAI API Keyが設定されていません。埋め込み生成をスキップします。")
+        """チャンクの埋め込みベクトルを生成（embedding.batch_size 件ずつまとめてリクエスト）"""
+        if not chunks:
+            return chunks
+        if self.embedder is None:
+            if self.use_local_embedding:
+                logger.warning("ローカル埋め込みモデルがないため、埋め込み生成をスキップします。")
+            else:
+                logger.warning("OpenAI API Keyが設定されていません。埋め込み生成をスキップします。")
             return chunks
         
         try:
-            import openai
-            openai.api_key = self.openai_api_key
-            
-            logger.info(f"{len(chunks)}個のチャンクの埋め込みを生成中...")
-            
-            for i, chunk in enumerate(chunks):
-                try:
-                    response = openai.Embedding.create(
-                        model=self.embedding_model,
-                        input=chunk["content"]
-                    )
-                    chunk["embedding"] = response["data"][0]["embedding"]
-                    
-                    if (i + 1) % 10 == 0:
-                        logger.info(f"埋め込み生成進捗: {i + 1}/{len(chunks)}")
-                        
-                except Exception as e:
-                    logger.error(f"埋め込み生成エラー (chunk {i}): {e}")
-                    chunk["embedding"] = None
-            
-            logger.info("埋め込み生成完了")
+            texts = [chunk["content"] for chunk in chunks]
+            vectors = (self.embedding_cache.get_many(texts) if self.embedding_cache is not None
+                       else [None] * len(texts))
+            missing = [i for i, vector in enumerate(vectors) if vector is None]
+            if missing:
+                logger.debug(f"{len(missing)}/{len(chunks)}個のチャンクの埋め込みを生成中...")
+                new_vectors = self.embedder.embed([texts[i] for i in missing])
+                for i, vector in zip(missing, new_vectors):
+                    vectors[i] = vector
+                if self.embedding_cache is not None:
+                    self.embedding_cache.put_many([texts[i] for i in missing], new_vectors)
+            for chunk, vector in zip(chunks, vectors):
+                chunk["embedding"] = vector
             
         except ImportError:
             logger.warning("openaiライブラリがインストールされていません")
@@ -267,41 +201,121 @@ class KnowledgeIngestor:
         
         return chunks
 
+    def prepare_local_embedding(self, refit: bool = False) -> None:
+        """
+        ローカル埋め込みモデルを読み込み、なければナレッジベースの標本から学習して保存
+        
+        学習・再学習した場合は、build_search_index で既存チャンクも新しいモデルで埋め込み直します。
+        新しいモデルは指紋付きの別ファイルに保存するため、構築が終わるまで（失敗した場合も）
+        検索側は現在のインデックスが参照するモデルを使い続けます。
+        
+        Args:
+            refit: 保存済みのモデルがあっても学習し直す
+        """
+        if not self.use_local_embedding or self.embedder is not None:
+            return
+        
+        embedding_config = self.config.get("embedding", {})
+        local_config = embedding_config.get("local", {}) or {}
+        tokenizer_spec = self.config.get("tokenizer", {"type": "ngram"})
+        settings = LocalEmbeddingModel.make_settings(
+            tokenizer_spec,
+            dim=local_config.get("dim", DEFAULT_LOCAL_DIM),
+            hash_features=local_config.get("hash_features", DEFAULT_HASH_FEATURES),
+            max_features=local_config.get("max_features", DEFAULT_MAX_FEATURES)
+        )
+        # インデックスに記録されたモデル（学習後に構築が失敗した場合も、インデックスと同じモデルを使う）
+        indexed_model = load_manifest(self.index_path).get("embedding_model")
+        model = (LocalEmbeddingModel.load(self.index_path, indexed_model)
+                 if not refit and is_local_model(indexed_model) else None)
+        if model is not None and model.settings != settings:
+            logger.info("ローカル埋め込みの設定が変わったため、モデルを学習し直します")
+            model = None
+        
+        if model is None:
+            texts = self._sample_chunk_texts(local_config.get("fit_sample_size", DEFAULT_FIT_SAMPLE_SIZE))
+            if not texts:
+                logger.warning("ローカル埋め込みモデルの学習に使うチャンクがありません")
+                return
+            try:
+                model = LocalEmbeddingModel.fit(
+                    texts, tokenizer_spec, dim=settings["dim"],
+                    hash_features=settings["hash_features"], max_features=settings["max_features"],
+                    iterations=local_config.get("svd_iterations", DEFAULT_SVD_ITERATIONS)
+                )
+                model.save(self.index_path)
+            except Exception as e:
+                logger.error(f"ローカル埋め込みモデルの学習エラー: {e}")
+                return
+            self._local_embedding_refitted = True
+        
+        self.embedding_model = model.name
+        self.embedder = BatchEmbedder(model, batch_size=embedding_config.get("batch_size", DEFAULT_BATCH_SIZE),
+                                      max_retries=0)
+        logger.info(f"ローカル埋め込みを使用: {model.name} ({model.dim}次元)")
+
+    def _sample_chunk_texts(self, sample_size: int) -> List[str]:
+        """ナレッジベース全体から無作為に選んだファイルのチャンク本文（sample_size 件まで）"""
+        files = self.chunker.scan()
+        random.Random(0).shuffle(files)
+        texts: List[str] = []
+        for file_path in files:
+            if len(texts) >= sample_size:
+                break
+            try:
+                metadata = self.extract_metadata(file_path)
+                content = file_path.read_text(encoding='utf-8')
+                texts.extend(chunk["content"] for chunk in self.chunk_content(content, metadata))
+            except Exception as e:
+                logger.warning(f"学習用チャンクの読み込みエラー {file_path}: {e}")
+        return texts[:sample_size]
+
     def save_to_vector_db(self, chunks: List[Dict[str, Any]]) -> bool:
         """Vector DBにデータを保存"""
         if self.vector_db_type == "chroma":
             return self._save_to_chroma(chunks)
         elif self.vector_db_type == "pinecone":
             return self._save_to_pinecone(chunks)
+        elif self.vector_db_type == "numpy":
+            logger.info("NumPyベクトル検索用にローカルインデックスに保存")
+            return self._save_to_local_index(chunks)
         else:
             logger.info("Vector DB未設定のため、ローカルインデックスに保存")
             return self._save_to_local_index(chunks)
 
     def _save_to_chroma(self, chunks: List[Dict[str, Any]]) -> bool:
-        """ChromaDBに保存"""
+        """ChromaDBに保存（検索側と同じ永続化ディレクトリ・共有クライアントを使用）"""
         try:
-            import chromadb
-            client = chromadb.Client()
-            collection = client.get_or_create_collection("knowledge_base")
-            
-            ids = [chunk["metadata"]["chunk_id"] for chunk in chunks]
-            documents = [chunk["content"] for chunk in chunks]
-            metadatas = [chunk["metadata"] for chunk in chunks]
-            embeddings = [chunk.get("embedding") for chunk in chunks if chunk.get("embedding")]
+            persist_directory, collection_name = chroma_settings(
+                self.config, self.knowledge_base_path.parent.parent
+            )
+            collection = get_chroma_collection(persist_directory, collection_name, create=True)
             
-            if embeddings:
-                collection.add(
-                    ids=ids,
-                    documents=documents,
-                    metadatas=metadatas,
-                    embeddings=embeddings
+            # 再取り込みで同じチャンクIDを上書きできるよう upsert を使用
+            if self.embedder is None:
+                # 埋め込みはChromaDBの既定の埋め込み関数で生成
+                collection.upsert(
+                    ids=[chunk["metadata"]["chunk_id"] for chunk in chunks],
+                    documents=[chunk["content"] for chunk in chunks],
+                    metadatas=[to_chroma_metadata(chunk["metadata"]) for chunk in chunks]
                 )
             else:
-                collection.add(
-                    ids=ids,
-                    documents=documents,
-                    metadatas=metadatas
-                )
+                # ID・本文・メタデータ・埋め込みは同じチャンクの並びで渡す
+                embedded = [chunk for chunk in chunks if chunk.get("embedding")]
+                if embedded:
+                    collection.upsert(
+                        ids=[chunk["metadata"]["chunk_id"] for chunk in embedded],
+                        documents=[chunk["content"] for chunk in embedded],
+                        metadatas=[to_chroma_metadata(chunk["metadata"]) for chunk in embedded],
+                        embeddings=[chunk["embedding"] for chunk in embedded]
+                    )
+                    # 検索側が同じモデルでクエリを埋め込めるよう記録
+                    set_collection_embedding_model(collection, self.embedding_model)
+                if len(embedded) < len(chunks):
+                    # 既定の埋め込み関数のベクトルは混在させず、次回の取り込みで再処理する
+                    logger.warning(f"埋め込みを生成できなかった{len(chunks) - len(embedded)}個のチャンクを"
+                                   f"ChromaDBに保存しませんでした")
+                    return False
             
             logger.info(f"ChromaDBに{len(chunks)}個のチャンクを保存しました")
             return True
@@ -314,35 +328,272 @@ class KnowledgeIngestor:
             return False
 
     def _save_to_local_index(self, chunks: List[Dict[str, Any]]) -> bool:
-        """ローカルインデックスに保存"""
+        """
+        ローカルインデックスへの保存対象として登録（書き出しは build_search_index で一括）
+        
+        埋め込みを生成できなかったチャンクは登録せず False を返します（ChromaDBと同じく
+        処理履歴に記録しないため、次回の取り込みでファイルごと再処理される）。
+        """
+        if not chunks:
+            return True
+        
+        file_path = chunks[0]["metadata"]["file_path"]
+        embedded = chunks
+        if self.embedder is not None:
+            embedded = [chunk for chunk in chunks if chunk.get("embedding") is not None]
+        if embedded:
+            self._pending_chunks[file_path] = embedded
+            logger.info(f"ローカルインデックスに{len(embedded)}個のチャンクを登録しました")
+        if len(embedded) < len(chunks):
+            logger.warning(f"埋め込みを生成できなかった{len(chunks) - len(embedded)}個のチャンクを"
+                           f"ローカルインデックスに登録しませんでした: {file_path}")
+            return False
+        return True
+
+    def _load_indexed_chunks(self) -> List[Dict[str, Any]]:
+        """既存のローカルインデックスから全チャンクを読み込み"""
+        store = ShardedKnowledgeStore.open(self.index_path)
+        if store is not None:
+            return list(store.iter_chunks())
+        
+        # 旧形式（JSON）からの移行
+        legacy_file = self.index_path / "knowledge_index.json"
+        if legacy_file.exists():
+            with open(legacy_file, 'r', encoding='utf-8') as f:
+                return list(json.load(f).values())
+        
+        return []
+
+    def build_search_index(self) -> bool:
+        """
+        登録済みチャンクをローカルインデックスに反映
+
+        通常は変更したファイルのチャンクだけをセグメントとして追記し、既存のシャードは書き換えません。
+        compact 指定時・インデックスの形式や設定を変更した場合・セグメント数が上限に達した場合は、
+        全チャンクからカテゴリ別シャードを書き出し直します（セグメントはシャードにまとめられる）。
+        """
+        manifest = load_manifest(self.index_path)
+        is_sharded = manifest.get("layout") == SHARDED_LAYOUT
+        # シャード形式の knowledge_index.json は --export-json のデバッグ用出力なので旧形式とみなさない
+        has_legacy = ((self.index_path / STORE_FILE).exists()
+                      or (not is_sharded and (self.index_path / "knowledge_index.json").exists()))
+        # metadata_fields を変更した場合はファセットの値索引を作り直す
+        facets_changed = is_sharded and (manifest.get("facet_fields")
+                                         != list(self.config.get("metadata_fields", [])))
+        # 出現位置の保存を切り替えた場合も作り直す
+        store_positions = self.config.get("search", {}).get("positions", {}).get("enabled", True)
+        positions_changed = is_sharded and manifest.get("positions", False) != store_positions
+        # スコア上限（動的枝刈り用）のブロック長が異なる・ない旧インデックスも作り直す
+        blocks_changed = is_sharded and manifest.get("block_size") != BLOCK_SIZE
+        # ポスティングの格納形式（圧縮・非圧縮）を切り替えた場合も作り直す
+        posting_encoding = self.config.get("search", {}).get("postings", {}).get(
+            "encoding", DEFAULT_POSTING_ENCODING
+        )
+        encoding_changed = is_sharded and manifest.get("posting_encoding", RAW_ENCODING) != posting_encoding
+        if (not self._pending_chunks and not facets_changed and not positions_changed
+                and not blocks_changed and not encoding_changed and not self._local_embedding_refitted
+                and not (self.compact and is_sharded and manifest.get("segments"))
+                and (is_sharded or not has_legacy)):
+            logger.info("ローカルインデックスの更新対象がないため、構築をスキップ")
+            return True
+        
+        pending_files = list(self._pending_chunks)
+        pending_chunks = [chunk for file_chunks in self._pending_chunks.values() for chunk in file_chunks]
+        has_embeddings = any(chunk.get("embedding") for chunk in pending_chunks)
+        # 埋め込みモデルが変わった場合は既存のチャンクとベクトルを比較できないため全件構築
+        model_changed = (has_embeddings and manifest.get("embedding_model") is not None
+                         and manifest.get("embedding_model") != self.embedding_model)
+        max_segments = self.config.get("search", {}).get("segments", {}).get(
+            "max_segments", DEFAULT_MAX_SEGMENTS
+        )
+        full_rebuild = (self.compact or not is_sharded or has_legacy or facets_changed or positions_changed
+                        or blocks_changed or encoding_changed or self._local_embedding_refitted
+                        or model_changed or len(manifest.get("segments", [])) >= max_segments)
         try:
-            index_file = self.index_path / "knowledge_index.json"
-            
-            # 既存インデックスの読み込み
-            existing_index = {}
-            if index_file.exists():
-                with open(index_file, 'r', encoding='utf-8') as f:
-                    existing_index = json.load(f)
+            tokenizer = create_tokenizer(self.config.get("tokenizer", {"type": "ngram"}))
+            ann_config = self.config.get("vector_db", {}).get("numpy", {}).get("ann")
+            if full_rebuild:
+                # 更新されたファイルの古いチャンクを置き換え
+                chunks = [
+                    chunk for chunk in self._load_indexed_chunks()
+                    if chunk.get("metadata", {}).get("file_path") not in self._pending_chunks
+                ]
+                chunks.extend(pending_chunks)
+                if not chunks:
+                    # チャンクのないインデックスで既存のインデックス・直接検索を上書きしない
+                    logger.info("ローカルインデックスに保存するチャンクがないため、構築をスキップ")
+                    self._local_embedding_refitted = False
+                    return True
+                if self._local_embedding_refitted:
+                    # 学習し直したモデルで、今回処理していないファイルのチャンクも埋め込み直す
+                    self.create_embeddings(chunks[:len(chunks) - len(pending_chunks)])
+                
+                shard_chunks, shard_indexes = self._group_into_shards(chunks, tokenizer, store_positions)
+                has_embeddings = any(chunk.get("embedding") for chunk in chunks)
+                generation, size = write_sharded_index(
+                    self.index_path, shard_chunks, shard_indexes,
+                    self.embedding_model if has_embeddings else None, ann_config,
+                    facet_fields=self.config.get("metadata_fields", []),
+                    posting_encoding=posting_encoding
+                )
+                if self.embedding_cache is not None:
+                    # 現在のチャンクにない本文（編集・削除前の版）の埋め込みをキャッシュから除く
+                    self.embedding_cache.compact(chunk["content"] for chunk in chunks)
+            else:
+                # 変更したファイルのチャンクだけをセグメントとして追記
+                shard_chunks, shard_indexes = self._group_into_shards(pending_chunks, tokenizer,
+                                                                      store_positions)
+                generation, size = append_segment(
+                    self.index_path, shard_chunks, shard_indexes,
+                    self.embedding_model if has_embeddings else None, ann_config,
+                    facet_fields=self.config.get("metadata_fields", []),
+                    posting_encoding=posting_encoding
+                )
+            # 切り替え前後の世代が参照しない（古い・構築に使われなかった）ローカル埋め込みモデルを削除
+            remove_unused_local_models(self.index_path, [manifest.get("embedding_model"),
+                                                         load_manifest(self.index_path).get("embedding_model")])
+            if self.export_json:
+                ShardedKnowledgeStore.open(self.index_path).export_json(self.index_path)
+            if self.config.get("related_documents", {}).get("enabled", True):
+                if full_rebuild:
+                    # モデルを学習し直した場合は全文書の埋め込みが変わるため、関連文書も全件再計算
+                    self._update_related_documents(chunks, tokenizer,
+                                                   None if self._local_embedding_refitted else pending_files)
+                elif not self._append_related_documents(pending_chunks, tokenizer):
+                    # 保存済みの文書ベクトルがない・使えない場合だけ全チャンクを読み込む
+                    self._update_related_documents(self._load_indexed_chunks(), tokenizer, pending_files)
+            self._pending_chunks.clear()
+            self._local_embedding_refitted = False
             
-            # 新しいチャンクを追加
-            for chunk in chunks:
-                chunk_id = chunk["metadata"]["chunk_id"]
-                existing_index[chunk_id] = chunk
+            if full_rebuild:
+                logger.info(f"ローカルインデックスを構築しました "
+                            f"({len(chunks)}チャンク, {len(shard_indexes)}シャード, "
+                            f"{size / 1024:.1f}KB, 世代 {generation})")
+            else:
+                logger.info(f"ローカルインデックスにセグメントを追記しました "
+                            f"({len(pending_chunks)}チャンク, {len(shard_indexes)}セグメント, "
+                            f"{size / 1024:.1f}KB, 世代 {generation})")
+            return True
             
-            # インデックスの保存
-            with open(index_file, 'w', encoding='utf-8') as f:
-                json.dump(existing_index, f, ensure_ascii=False, indent=2)
+        except Exception as e:
+            logger.error(f"ローカルインデックス構築エラー: {e}")
+            # 次回の取り込みで再処理されるよう処理履歴から外す
+            self._forget_processing_history(pending_files)
+            self._pending_chunks.clear()
+            return False
+
+    def _group_into_shards(self, chunks: List[Dict[str, Any]], tokenizer,
+                           store_positions: bool) -> Tuple[Dict[str, List[Dict[str, Any]]],
+                                                           Dict[str, InvertedIndex]]:
+        """
+        チャンクをナレッジベースのディレクトリ単位でシャードに振り分け、転置インデックスを作成
+        
+        Args:
+            chunks: 振り分けるチャンク
+            tokenizer: 転置インデックスのトークナイザ
+            store_positions: 出現位置を保存するか
             
-            logger.info(f"ローカルインデックスに{len(chunks)}個のチャンクを保存しました")
+        Returns:
+            (シャード名 -> チャンクのリスト, シャード名 -> 転置インデックス)
+        """
+        bm25_config = self.config.get("search", {}).get("bm25", {})
+        shard_chunks: Dict[str, List[Dict[str, Any]]] = {}
+        shard_indexes: Dict[str, InvertedIndex] = {}
+        for chunk in chunks:
+            content = chunk.get("content", "")
+            metadata = chunk.get("metadata", {})
+            shard_name = shard_name_for(metadata.get("file_path", ""), self.knowledge_base_path)
+            if shard_name not in shard_indexes:
+                shard_chunks[shard_name] = []
+                shard_indexes[shard_name] = InvertedIndex(
+                    k1=bm25_config.get("k1", DEFAULT_K1),
+                    b=bm25_config.get("b", DEFAULT_B),
+                    tokenizer=tokenizer,
+                    field_weights=self.config.get("search", {}).get("field_weights"),
+                    store_positions=store_positions
+                )
+            fields = chunk.get("fields") or extract_chunk_fields(content, metadata)
+            shard_chunks[shard_name].append(chunk)
+            shard_indexes[shard_name].add_chunk(metadata["chunk_id"], content, fields,
+                                                category=metadata.get("category", ""))
+        return shard_chunks, shard_indexes
+
+    def _update_related_documents(self, chunks: List[Dict[str, Any]], tokenizer,
+                                  changed_files: Optional[List[str]] = None) -> bool:
+        """
+        関連文書テーブルを更新
+        
+        Args:
+            chunks: 全チャンク
+            tokenizer: TF-IDFで使うトークナイザ
+            changed_files: 変更・追加されたファイル（None=全件を並列で再計算）
+        """
+        related_config = self.config.get("related_documents", {})
+        if not related_config.get("enabled", True):
             return True
+        
+        try:
+            previous = None if changed_files is None else load_related_table(self.index_path)
+            table, vectors = build_related_table(
+                chunks, tokenizer,
+                top_n=related_config.get("top_n", DEFAULT_TOP_N),
+                method=related_config.get("method", "auto"),
+                previous=previous,
+                changed_files=changed_files,
+                max_workers=related_config.get("max_workers", 4),
+                full_rebuild_ratio=related_config.get("full_rebuild_ratio", 0.2)
+            )
+            write_related_table(self.index_path, table, vectors)
+            return True
+        except Exception as e:
+            logger.warning(f"関連文書テーブル更新エラー: {e}")
+            return False
+
+    def _append_related_documents(self, chunks: List[Dict[str, Any]], tokenizer) -> bool:
+        """
+        変更したファイルのチャンクと保存済みの文書ベクトルから関連文書テーブルを差分更新
+        
+        Args:
+            chunks: 変更・追加されたファイルのチャンク
+            tokenizer: TF-IDFで使うトークナイザ
             
+        Returns:
+            更新できたか（False=全チャンクからの計算が必要）
+        """
+        related_config = self.config.get("related_documents", {})
+        try:
+            previous = load_related_table(self.index_path)
+            previous_vectors = load_document_vectors(self.index_path)
+            if previous is None or previous_vectors is None:
+                return False
+            updated = update_related_table(
+                chunks, tokenizer, previous, previous_vectors,
+                top_n=related_config.get("top_n", DEFAULT_TOP_N),
+                method=related_config.get("method", "auto"),
+                max_workers=related_config.get("max_workers", 4),
+                full_rebuild_ratio=related_config.get("full_rebuild_ratio", 0.2)
+            )
+            if updated is None:
+                return False
+            write_related_table(self.index_path, *updated)
+            return True
         except Exception as e:
-            logger.error(f"ローカルインデックス保存エラー: {e}")
+            logger.warning(f"関連文書テーブル差分更新エラー: {e}")
+            return False
+
+    def rebuild_related_documents(self) -> bool:
+        """既存のローカルインデックスから関連文書テーブルを全件再計算"""
+        chunks = self._load_indexed_chunks()
+        if not chunks:
+            logger.warning("ローカルインデックスがないため、関連文書テーブルを計算できません")
             return False
+        tokenizer = create_tokenizer(self.config.get("tokenizer", {"type": "ngram"}))
+        return self._update_related_documents(chunks, tokenizer)
 
     def process_file(self, file_path: Path, force: bool = False) -> bool:
         """単一ファイルの処理"""
         logger.info(f"ファイル処理開始: {file_path}")
+        self.prepare_local_embedding()
         
         try:
             # メタデータ抽出
@@ -363,19 +614,77 @@ class KnowledgeIngestor:
             chunks = self.create_embeddings(chunks)
             
             # Vector DBに保存
-            success = self.save_to_vector_db(chunks)
-            
-            if success:
-                # 処理履歴の更新
-                self._update_processing_history(metadata)
-                logger.info(f"ファイル処理完了: {file_path}")
-            
-            return success
+            return self._save_file(metadata, chunks)
             
         except Exception as e:
             logger.error(f"ファイル処理エラー {file_path}: {e}")
             return False
 
+    def _save_file(self, metadata: Dict[str, Any], chunks: List[Dict[str, Any]],
+                   processed: Optional[List[Dict[str, Any]]] = None) -> bool:
+        """
+        ファイルのチャンクをVector DBに保存し、処理履歴を更新
+        
+        Args:
+            metadata: ファイルのメタデータ
+            chunks: 埋め込み生成済みのチャンク
+            processed: 指定した場合は処理履歴を書き込まずにメタデータを追加する（まとめて更新する場合）
+        """
+        success = self.save_to_vector_db(chunks)
+        
+        if success:
+            if processed is None:
+                self._update_processing_history([metadata])
+            else:
+                processed.append(metadata)
+            logger.info(f"ファイル処理完了: {metadata['file_path']}")
+        
+        return success
+
+    def _process_files(self, files: List[Path], force: bool = False) -> int:
+        """
+        ファイルを順に処理（workers が2以上ならパイプラインで並列処理）
+        
+        Returns:
+            成功したファイル数
+        """
+        # --force ではローカル埋め込みモデルも学習し直す
+        self.prepare_local_embedding(refit=force)
+        if self.workers <= 1 or len(files) <= 1:
+            success_count = 0
+            for file_path in files:
+                if self.process_file(file_path, force):
+                    success_count += 1
+            self._log_embedding_stats()
+            return success_count
+        
+        processed: List[Dict[str, Any]] = []
+        pipeline = IngestPipeline(
+            self.config, self.knowledge_base_path,
+            embed=self.create_embeddings,
+            write=lambda metadata, chunks: self._save_file(metadata, chunks, processed),
+            workers=self.workers
+        )
+        logger.info(f"パイプライン処理開始: {len(files)}ファイル ({self.workers}並列)")
+        success_count = pipeline.run(files, {} if force else self._processed_hashes())
+        self._update_processing_history(processed)
+        
+        # 完了順に登録されたチャンクを走査順に並べ直す（逐次処理と同じインデックスにする）
+        order = {str(file_path): i for i, file_path in enumerate(files)}
+        self._pending_chunks = dict(sorted(self._pending_chunks.items(),
+                                           key=lambda item: order.get(item[0], len(order))))
+        pipeline.log_stats()
+        self._log_embedding_stats()
+        return success_count
+
+    def _log_embedding_stats(self) -> None:
+        """埋め込み生成のスループット・キャッシュのヒット数をログに出力"""
+        if self.embedder is not None and self.embedder.stats.requests:
+            logger.info(f"埋め込み生成: {self.embedder.stats.summary()}")
+        if self.embedding_cache is not None and (self.embedding_cache.hits or self.embedding_cache.misses):
+            logger.info(f"埋め込みキャッシュ: ヒット {self.embedding_cache.hits}件, "
+                        f"ミス {self.embedding_cache.misses}件 ({len(self.embedding_cache)}件保存)")
+
     def _is_file_unchanged(self, metadata: Dict[str, Any]) -> bool:
         """ファイルが未変更かチェック"""
         history_file = self.index_path / "processing_history.json"
@@ -396,8 +705,24 @@ class KnowledgeIngestor:
         
         return False
 
-    def _update_processing_history(self, metadata: Dict[str, Any]) -> None:
-        """処理履歴の更新"""
+    def _processed_hashes(self) -> Dict[str, str]:
+        """処理履歴のファイルパス -> ハッシュ"""
+        history_file = self.index_path / "processing_history.json"
+        if not history_file.exists():
+            return {}
+        
+        try:
+            with open(history_file, 'r', encoding='utf-8') as f:
+                history = json.load(f)
+            return {file_path: entry["file_hash"] for file_path, entry in history.items()}
+        except Exception as e:
+            logger.warning(f"処理履歴チェックエラー: {e}")
+            return {}
+
+    def _update_processing_history(self, metadata_list: List[Dict[str, Any]]) -> None:
+        """処理履歴の更新（複数ファイル分をまとめて書き込む）"""
+        if not metadata_list:
+            return
         history_file = self.index_path / "processing_history.json"
         
         history = {}
@@ -408,13 +733,30 @@ class KnowledgeIngestor:
             except Exception:
                 pass
         
-        history[metadata["file_path"]] = {
-            "file_hash": metadata["file_hash"],
-            "processed_at": datetime.now().isoformat(),
-            "file_size": metadata["file_size"]
-        }
+        for metadata in metadata_list:
+            history[metadata["file_path"]] = {
+                "file_hash": metadata["file_hash"],
+                "processed_at": datetime.now().isoformat(),
+                "file_size": metadata["file_size"]
+            }
+        
+        try:
+            with open(history_file, 'w', encoding='utf-8') as f:
+                json.dump(history, f, ensure_ascii=False, indent=2)
+        except Exception as e:
+            logger.warning(f"処理履歴更新エラー: {e}")
+
+    def _forget_processing_history(self, file_paths: List[str]) -> None:
+        """処理履歴から指定ファイルを削除"""
+        history_file = self.index_path / "processing_history.json"
+        if not file_paths or not history_file.exists():
+            return
         
         try:
+            with open(history_file, 'r', encoding='utf-8') as f:
+                history = json.load(f)
+            for file_path in file_paths:
+                history.pop(file_path, None)
             with open(history_file, 'w', encoding='utf-8') as f:
                 json.dump(history, f, ensure_ascii=False, indent=2)
         except Exception as e:
@@ -429,10 +771,9 @@ class KnowledgeIngestor:
             logger.warning(f"処理対象ファイルが見つかりません: {category}")
             return
         
-        success_count = 0
-        for file_path in files:
-            if self.process_file(file_path, force):
-                success_count += 1
+        success_count = self._process_files(files, force)
+        
+        self.build_search_index()
         
         logger.info(f"カテゴリ処理完了: {category} ({success_count}/{len(files)} 成功)")
 
@@ -445,10 +786,9 @@ class KnowledgeIngestor:
             logger.warning("処理対象ファイルが見つかりません")
             return
         
-        success_count = 0
-        for file_path in files:
-            if self.process_file(file_path, force):
-                success_count += 1
+        success_count = self._process_files(files, force)
+        
+        self.build_search_index()
         
         logger.info(f"全ファイル処理完了 ({success_count}/{len(files)} 成功)")
 
@@ -468,8 +808,17 @@ def main():
   # 単一ファイルを処理
   python ingest_knowledge.py --file common/knowledge/company/products/sample.md
   
+  # 解析・埋め込みを4並列のパイプラインで処理（大規模なナレッジベース向け）
+  python ingest_knowledge.py --update-all --workers 4
+  
   # 強制再処理
   python ingest_knowledge.py --category customer-support --force
+  
+  # 関連文書テーブルを全件再計算（大規模コーパスでは並列実行）
+  python ingest_knowledge.py --rebuild-related
+  
+  # 追記したセグメントをシャードにまとめ直す（全件構築）
+  python ingest_knowledge.py --compact
         """
     )
     
@@ -483,6 +832,15 @@ def main():
                        help='変更チェックをスキップして強制処理')
     parser.add_argument('--config', type=str, default="common/config/knowledge_config.yml",
                        help='設定ファイルのパス')
+    parser.add_argument('--export-json', action='store_true',
+                       help='デバッグ用にローカルインデックスをJSONでも書き出し')
+    parser.add_argument('--rebuild-related', action='store_true',
+                       help='関連文書テーブルを全件再計算（related_documents.max_workers で並列実行）')
+    parser.add_argument('--compact', action='store_true',
+                       help='差分のセグメントを追記せず、全件構築でシャードにまとめ直す')
+    parser.add_argument('--workers', type=int, default=1,
+                       help='並列数（2以上で解析をプロセスプール、埋め込みをスレッドで並列化し、'
+                            '段ごとのスループットを出力）')
     parser.add_argument('--verbose', '-v', action='store_true',
                        help='詳細ログを出力')
     
@@ -492,7 +850,7 @@ def main():
         logging.getLogger().setLevel(logging.DEBUG)
     
     # 引数チェック
-    if not any([args.update_all, args.category, args.file]):
+    if not any([args.update_all, args.category, args.file, args.rebuild_related, args.compact]):
         parser.print_help()
         sys.exit(1)
     
@@ -501,7 +859,8 @@ def main():
         os.makedirs("common/logs", exist_ok=True)
         
         # インジェスター初期化
-        ingestor = KnowledgeIngestor(args.config)
+        ingestor = KnowledgeIngestor(args.config, export_json=args.export_json, workers=args.workers,
+                                     compact=args.compact)
         
         # 処理実行
         if args.update_all:
@@ -514,6 +873,14 @@ def main():
                 logger.error(f"ファイルが見つかりません: {args.file}")
                 sys.exit(1)
             ingestor.process_file(file_path, args.force)
+            ingestor.build_search_index()
+        elif args.compact:
+            # 埋め込みモデル名をインデックスに記録するため、ローカル埋め込みモデルも読み込む
+            ingestor.prepare_local_embedding()
+            ingestor.build_search_index()
+        
+        if args.rebuild_related:
+            ingestor.rebuild_related_documents()
         
         logger.info("処理完了")
         
@@ -270,9 +270,9 @@ class AgentBase(ABC):
             metadata = result.get("metadata", {})
             content = result.get("content", "")
             
-            # コンテンツを要約（長すぎる場合）
+            # コンテンツを要約（長すぎる場合はクエリの語が集まっている区間のスニペット）
             if len(content) > 500:
-                content = content[:500] + "..."
+                content = result.get("snippet") or content[:500] + "..."
             
             context_parts.append(f"### {i}. {metadata.get('file_name', '不明')}")
             context_parts.append(f"**カテゴリ**: {metadata.get('category', '不明')}")
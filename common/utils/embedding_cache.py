@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""
+チャンク本文のハッシュをキーにした埋め込みの永続キャッシュ
+
+チャンクIDはファイル全体のハッシュから作るため、ファイルを1段落だけ編集しても
+全チャンクのIDが変わります。埋め込みは (モデル名, 正規化した本文のSHA-256) で引くため、
+本文が同じチャンクは編集前の埋め込みをそのまま使い、変わったチャンクだけAPIを呼びます。
+
+モデルごとに1ファイル（common/knowledge/.index/embedding_cache/<モデル名>.bin）で、
+ヘッダの後に固定長のレコード（SHA-256 32バイト + float32 × 次元）を追記していきます。
+同じキーのレコードが複数あれば後のものを使い、書き込み途中で終了した末尾の不完全な
+レコードは次に開いたときに切り詰めます。
+
+追記だけではファイルが増え続けるため、compact で書き直します。インデックスの全件構築時は
+現在のチャンクの本文だけを残し、レコード数が max_entries の1.5倍を超えたら新しい順に
+max_entries 件だけを残します。
+
+使用例:
+    from common.utils.embedding_cache import EmbeddingCache
+
+    cache = EmbeddingCache(Path("common/knowledge/.index/embedding_cache"), "text-embedding-ada-002")
+    vectors = cache.get_many(texts)  # 未登録のテキストは None
+    cache.put_many(texts, new_vectors)
+    cache.compact(keep_texts=current_texts)  # 現在のチャンクの本文以外を削除
+"""
+
+import hashlib
+import os
+import re
+import struct
+import threading
+import unicodedata
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR_NAME = "embedding_cache"
+CACHE_MAGIC = b"KEMB"
+CACHE_VERSION = 1
+
+# レコード数の既定の上限（0=上限なし）
+DEFAULT_MAX_ENTRIES = 50000
+
+# マジック, バージョン, 次元
+_HEADER = struct.Struct("<4sII")
+_KEY_SIZE = 32
+
+
+def normalize_chunk_text(text: str) -> str:
+    """キャッシュのキーにする本文の正規化（Unicode NFC・改行コードの統一・前後の空白の除去）"""
+    text = unicodedata.normalize("NFC", text)
+    return text.replace("\r\n", "\n").replace("\r", "\n").strip()
+
+
+def text_key(text: str) -> bytes:
+    """本文のキャッシュキー（正規化した本文のSHA-256）"""
+    return hashlib.sha256(normalize_chunk_text(text).encode("utf-8")).digest()
+
+
+def cache_file_name(model: str) -> str:
+    """モデル名のキャッシュファイル名（ファイル名に使えない文字は置き換え、衝突しないようハッシュを付ける）"""
+    safe_name = re.sub(r"[^A-Za-z0-9._-]", "_", model)
+    return f"{safe_name}-{hashlib.sha256(model.encode('utf-8')).hexdigest()[:8]}.bin"
+
+
+class EmbeddingCache:
+    """モデルごとの埋め込みキャッシュ（スレッドセーフ）"""
+
+    def __init__(self, cache_dir: Path, model: str, max_entries: int = DEFAULT_MAX_ENTRIES):
+        """
+        Args:
+            cache_dir: キャッシュのディレクトリ
+            model: 埋め込みモデル名
+            max_entries: レコード数の上限（超えたら新しい順に残して書き直す、0=上限なし）
+        """
+        self.model = model
+        self.max_entries = max(0, max_entries)
+        self.path = Path(cache_dir) / cache_file_name(model)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self.dim = 0
+        self._vectors: Optional[np.ndarray] = None
+        self._rows: Dict[bytes, int] = {}
+        # 開いた後に追加した埋め込み（キー -> ベクトル）
+        self._added: Dict[bytes, List[float]] = {}
+        # ファイルのレコード数（重複を含む）
+        self._records = 0
+        self._load()
+
+    def __len__(self) -> int:
+        return len(set(self._rows) | set(self._added))
+
+    def get_many(self, texts: Sequence[str]) -> List[Optional[List[float]]]:
+        """
+        テキストの埋め込みを取得
+
+        Returns:
+            入力順の埋め込み（未登録のテキストは None）
+        """
+        results: List[Optional[List[float]]] = []
+        with self._lock:
+            for text in texts:
+                key = text_key(text)
+                vector = self._added.get(key)
+                if vector is None and key in self._rows:
+                    vector = self._vectors[self._rows[key]].tolist()
+                results.append(vector)
+            hits = sum(vector is not None for vector in results)
+            self.hits += hits
+            self.misses += len(results) - hits
+        return results
+
+    def put_many(self, texts: Sequence[str], vectors: Sequence[Optional[Sequence[float]]]) -> int:
+        """
+        埋め込みを登録してファイルに追記（None・次元の異なるベクトルは登録しない）
+
+        Returns:
+            登録した件数
+        """
+        keys = []
+        rows = []
+        with self._lock:
+            for text, vector in zip(texts, vectors):
+                if not vector:
+                    continue
+                if self.dim == 0:
+                    self.dim = len(vector)
+                if len(vector) != self.dim:
+                    logger.warning(f"埋め込みキャッシュの次元が一致しないため登録しません "
+                                   f"({len(vector)} != {self.dim})")
+                    continue
+                keys.append(text_key(text))
+                rows.append(vector)
+            if keys:
+                rows = np.asarray(rows, dtype=np.float32)
+                # ファイルから読んだ場合と同じ値になるよう float32 に丸めて保持
+                # （登録済みのキーも新しいものとして末尾に並べ直す）
+                for key, vector in zip(keys, rows.tolist()):
+                    self._added.pop(key, None)
+                    self._added[key] = vector
+                self._append(keys, rows)
+                if self.max_entries and self._records > self.max_entries * 3 // 2:
+                    self._compact(None)
+        return len(keys)
+
+    def compact(self, keep_texts: Optional[Iterable[str]] = None) -> int:
+        """
+        重複・不要なレコードを除いてファイルを書き直す
+
+        Args:
+            keep_texts: 残すテキスト（None=すべて残す。max_entries を超える分は古い順に除く）
+
+        Returns:
+            削除したレコード数
+        """
+        keep = None if keep_texts is None else {text_key(text) for text in keep_texts}
+        with self._lock:
+            return self._compact(keep)
+
+    def _compact(self, keep: Optional[set]) -> int:
+        """compact の本体（呼び出し側でロックを保持）"""
+        if self.dim == 0:
+            return 0
+        # 古い順（ファイルの位置順、開いた後に追加したものはその後）
+        order = sorted(self._rows, key=self._rows.get)
+        order = [key for key in order if key not in self._added] + list(self._added)
+        if keep is not None:
+            order = [key for key in order if key in keep]
+        if self.max_entries:
+            order = order[-self.max_entries:]
+        removed = self._records - len(order)
+        if removed <= 0:
+            return 0
+
+        records = np.empty(len(order), dtype=self._record_dtype())
+        records["key"] = order
+        for i, key in enumerate(order):
+            vector = self._added.get(key)
+            records["vector"][i] = vector if vector is not None else self._vectors[self._rows[key]]
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(_HEADER.pack(CACHE_MAGIC, CACHE_VERSION, self.dim))
+                f.write(records.tobytes())
+        except OSError as e:
+            logger.warning(f"埋め込みキャッシュの書き直しエラー {self.path}: {e}")
+            tmp_path.unlink(missing_ok=True)
+            return 0
+
+        # マップしたままのファイルは置き換えられない（Windows）ため、閉じてから置き換えて開き直す。
+        # 追加分もファイルに追記済みなので、置き換えに失敗した場合も元のファイルを開き直せばよい
+        self._vectors = None
+        self._rows = {}
+        self._added = {}
+        self._records = 0
+        try:
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning(f"埋め込みキャッシュの書き直しエラー {self.path}: {e}")
+            tmp_path.unlink(missing_ok=True)
+            removed = 0
+        self._load()
+        if not removed:
+            return 0
+        logger.info(f"埋め込みキャッシュを書き直しました ({removed}件削除, {len(order)}件保存)")
+        return removed
+
+    def _record_dtype(self) -> np.dtype:
+        return np.dtype([("key", f"V{_KEY_SIZE}"), ("vector", "<f4", (self.dim,))])
+
+    def _load(self) -> None:
+        """キャッシュファイルを読み込み（壊れていれば空のキャッシュとして作り直す）"""
+        if not self.path.exists():
+            return
+        try:
+            with open(self.path, "rb") as f:
+                magic, version, dim = _HEADER.unpack(f.read(_HEADER.size))
+            if magic != CACHE_MAGIC or version != CACHE_VERSION or dim <= 0:
+                raise ValueError("キャッシュファイルの形式が異なります")
+            self.dim = dim
+            record_dtype = self._record_dtype()
+            body_size = self.path.stat().st_size - _HEADER.size
+            count = body_size // record_dtype.itemsize
+            if body_size % record_dtype.itemsize:
+                # 書き込み途中で終了した末尾のレコードを切り詰める
+                os.truncate(self.path, _HEADER.size + count * record_dtype.itemsize)
+            self._records = count
+            if count == 0:
+                return
+            # ベクトルはマップしたまま参照する（compact で置き換える前に参照を外して閉じる）
+            records = np.memmap(self.path, dtype=record_dtype, mode="r", offset=_HEADER.size,
+                                shape=(count,))
+            self._vectors = records["vector"]
+            # 同じキーは後のレコードで上書き
+            self._rows = {key: row for row, key in enumerate(records["key"].tolist())}
+        except Exception as e:
+            logger.warning(f"埋め込みキャッシュを読み込めないため作り直します {self.path}: {e}")
+            self.dim = 0
+            self._vectors = None
+            self._rows = {}
+            self._records = 0
+            self.path.unlink(missing_ok=True)
+
+    def _append(self, keys: List[bytes], vectors: np.ndarray) -> None:
+        """レコードをファイルに追記（呼び出し側でロックを保持）"""
+        records = np.empty(len(keys), dtype=self._record_dtype())
+        records["key"] = keys
+        records["vector"] = vectors
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            is_new = not self.path.exists()
+            with open(self.path, "ab") as f:
+                if is_new:
+                    f.write(_HEADER.pack(CACHE_MAGIC, CACHE_VERSION, self.dim))
+                f.write(records.tobytes())
+            self._records += len(keys)
+        except OSError as e:
+            logger.warning(f"埋め込みキャッシュの書き込みエラー {self.path}: {e}")
@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+"""
+埋め込みベクトル生成ユーティリティ
+
+ナレッジ検索でクエリを埋め込む際に、取り込み時と同じモデルを使うための
+埋め込みプロバイダを提供します。
+
+取り込みでは BatchEmbedder で多数のテキストをまとめて埋め込みます。
+
+- embedding.batch_size 件ずつ1リクエストにまとめる
+- 一時的なエラー（接続エラー・タイムアウト・408/409/429・5xx）は指数バックオフ + ジッタで最大 max_retries 回再試行
+- 入力が原因のエラー（400/413/422）はバッチを半分に分けて送り直し、失敗したテキストだけを除く
+- 認証・モデル指定のエラー（401/403/404）は以降のリクエストを送らずに失敗とする
+- その他のエラーは再試行・分割せずにそのバッチを失敗とする
+- 同時に送るリクエスト数を max_in_flight 件までに抑える（取り込みの全スレッドで共有）
+
+接続先は環境変数 OPENAI_BASE_URL で変更できます（ローカルのスタブサーバーでの検証用）。
+
+プロバイダは embed(texts) -> 入力順のベクトルのリスト を持つオブジェクトです。
+API Keyのないオフライン環境では、取り込み時に学習したローカル埋め込み
+（common.utils.local_embeddings）をプロバイダとして使います。
+
+使用例:
+    from common.utils.embeddings import get_embedding_provider, create_batch_embedder
+
+    provider = get_embedding_provider("text-embedding-ada-002")
+    if provider:
+        vectors = provider.embed(["顧客からのAPI統合相談事例"])
+
+    embedder = create_batch_embedder(config.get("embedding", {}))
+    if embedder:
+        vectors = embedder.embed(texts)  # 失敗したテキストは None
+"""
+
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+import logging
+
+from .local_embeddings import is_local_model, load_local_model
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_EMBEDDING_MODEL = "text-embedding-ada-002"
+
+# バッチ処理の既定値（knowledge_config.yml の embedding セクション）
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_RETRY_DELAY = 1.0
+DEFAULT_MAX_RETRY_DELAY = 30.0
+DEFAULT_MAX_IN_FLIGHT = 4
+DEFAULT_TIMEOUT = 60.0
+
+# 再試行するHTTPステータス（5xxも再試行）
+RETRYABLE_STATUSES = (408, 409, 429)
+# 入力（件数・長さ）が原因とみなしてバッチを分割するHTTPステータス
+SPLITTABLE_STATUSES = (400, 413, 422)
+# 送り直しても回復しないHTTPステータス（APIキー・モデル名の誤り）
+FATAL_STATUSES = (401, 403, 404)
+# ステータスを持たない一時的なエラーの型名（openai の接続エラー・タイムアウト）
+TRANSIENT_ERROR_NAMES = ("APIConnectionError", "APITimeoutError", "Timeout", "TryAgain",
+                         "ServiceUnavailableError")
+
+
+class OpenAIEmbeddingProvider:
+    """OpenAI Embedding APIによる埋め込み生成"""
+
+    def __init__(self, model: str, api_key: str, base_url: Optional[str] = None,
+                 timeout: float = DEFAULT_TIMEOUT):
+        """
+        Args:
+            model: 埋め込みモデル名
+            api_key: APIキー
+            base_url: APIの接続先（None=既定。例: http://127.0.0.1:8000/v1）
+            timeout: 1リクエストのタイムアウト（秒）
+        """
+        self.model = model
+        self.api_key = api_key
+        self.base_url = base_url
+        self.timeout = timeout
+        self._client = None
+        self._lock = threading.Lock()
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        """
+        テキストを埋め込みベクトルに変換（1リクエスト、再試行しない）
+
+        Args:
+            texts: テキストのリスト
+
+        Returns:
+            入力順の埋め込みベクトルのリスト
+        """
+        import openai
+
+        if hasattr(openai, "OpenAI"):
+            # openai>=1.0（クライアントはスレッドセーフなので使い回す。再試行は呼び出し側で行う）
+            response = self._get_client(openai).embeddings.create(model=self.model, input=texts)
+            data = sorted(response.data, key=lambda item: item.index)
+            return [item.embedding for item in data]
+
+        response = openai.Embedding.create(model=self.model, input=texts, api_key=self.api_key,
+                                           api_base=self.base_url, request_timeout=self.timeout)
+        data = sorted(response["data"], key=lambda item: item["index"])
+        return [item["embedding"] for item in data]
+
+    def _get_client(self, openai):
+        with self._lock:
+            if self._client is None:
+                self._client = openai.OpenAI(api_key=self.api_key, base_url=self.base_url,
+                                             timeout=self.timeout, max_retries=0)
+            return self._client
+
+
+def get_embedding_provider(model: Optional[str] = None, index_path: Optional[Path] = None):
+    """
+    埋め込みプロバイダを取得
+
+    Args:
+        model: 埋め込みモデル名（None=環境変数 EMBEDDING_MODEL）
+        index_path: インデックスのディレクトリ（ローカル埋め込みのモデル名なら、そこに保存したモデルを使う）
+
+    Returns:
+        プロバイダ（APIキー未設定・ローカル埋め込みモデルが見つからない場合はNone）
+    """
+    if is_local_model(model):
+        if index_path is None:
+            logger.warning(f"ローカル埋め込みモデル {model} の読み込み先が指定されていません")
+            return None
+        return load_local_model(index_path, model)
+
+    api_key = os.getenv("OPENAI_API_KEY", "")
+    if not api_key:
+        logger.warning("OpenAI API Keyが設定されていないため、埋め込みを生成できません")
+        return None
+
+    return OpenAIEmbeddingProvider(
+        model or os.getenv("EMBEDDING_MODEL", DEFAULT_EMBEDDING_MODEL), api_key,
+        base_url=os.getenv("OPENAI_BASE_URL") or None
+    )
+
+
+def error_status(error: Exception) -> Optional[int]:
+    """エラーのHTTPステータス（ない場合はNone）"""
+    status = getattr(error, "status_code", None) or getattr(error, "http_status", None)
+    return status if isinstance(status, int) else None
+
+
+def is_retryable(error: Exception) -> bool:
+    """再試行で回復しうるエラーか（接続エラー・タイムアウト、408/409/429、5xx）"""
+    status = error_status(error)
+    if status is None:
+        return (isinstance(error, (ConnectionError, TimeoutError))
+                or any(cls.__name__ in TRANSIENT_ERROR_NAMES for cls in type(error).__mro__))
+    return status in RETRYABLE_STATUSES or status >= 500
+
+
+def is_splittable(error: Exception) -> bool:
+    """バッチを分割すれば回復しうる（入力が原因の）エラーか"""
+    return error_status(error) in SPLITTABLE_STATUSES
+
+
+class EmbeddingStats:
+    """埋め込み生成の統計（スレッドセーフ）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.embedded = 0
+        self.failed = 0
+        self.requests = 0
+        self.retries = 0
+        self.splits = 0
+        self._active = 0
+        self._busy_since = 0.0
+        self.busy_seconds = 0.0
+
+    def begin(self) -> None:
+        """embed() の開始（複数スレッドから同時に呼ばれた時間は重複して数えない）"""
+        with self._lock:
+            if self._active == 0:
+                self._busy_since = time.perf_counter()
+            self._active += 1
+
+    def end(self, embedded: int, failed: int) -> None:
+        """embed() の終了"""
+        with self._lock:
+            self._active -= 1
+            if self._active == 0:
+                self.busy_seconds += time.perf_counter() - self._busy_since
+            self.embedded += embedded
+            self.failed += failed
+
+    def count(self, requests: int = 0, retries: int = 0, splits: int = 0) -> None:
+        with self._lock:
+            self.requests += requests
+            self.retries += retries
+            self.splits += splits
+
+    @property
+    def rate(self) -> float:
+        """埋め込み件数/秒（埋め込み生成中の経過時間あたり）"""
+        return self.embedded / self.busy_seconds if self.busy_seconds > 0 else 0.0
+
+    def summary(self) -> str:
+        return (f"{self.embedded}件 ({self.rate:.1f}件/秒, {self.busy_seconds:.2f}秒), "
+                f"リクエスト {self.requests}, 再試行 {self.retries}, 分割 {self.splits}, 失敗 {self.failed}")
+
+
+class BatchEmbedder:
+    """プロバイダへのバッチ・再試行・同時リクエスト数の制御"""
+
+    def __init__(self, provider, batch_size: int = DEFAULT_BATCH_SIZE,
+                 max_retries: int = DEFAULT_MAX_RETRIES, retry_delay: float = DEFAULT_RETRY_DELAY,
+                 max_retry_delay: float = DEFAULT_MAX_RETRY_DELAY,
+                 max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+                 sleep: Callable[[float], None] = time.sleep):
+        """
+        Args:
+            provider: embed(texts) -> ベクトルのリスト を持つプロバイダ
+            batch_size: 1リクエストのテキスト数
+            max_retries: 一時的なエラーの再試行回数
+            retry_delay: 最初の再試行までの待ち時間（秒、再試行ごとに2倍）
+            max_retry_delay: 再試行の待ち時間の上限（秒）
+            max_in_flight: 同時に送るリクエスト数の上限（このインスタンスを使う全スレッドで共有）
+            sleep: 待機関数（検証用に差し替え可能）
+        """
+        self.provider = provider
+        self.batch_size = max(1, batch_size)
+        self.max_retries = max(0, max_retries)
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.max_in_flight = max(1, max_in_flight)
+        self.sleep = sleep
+        self.stats = EmbeddingStats()
+        self._in_flight = threading.BoundedSemaphore(self.max_in_flight)
+        # 認証・モデル指定のエラー（以降のリクエストは送らない）
+        self._fatal_error: Optional[Exception] = None
+
+    def embed(self, texts: List[str]) -> List[Optional[List[float]]]:
+        """
+        テキストをバッチに分けて埋め込み
+
+        Args:
+            texts: テキストのリスト
+
+        Returns:
+            入力順の埋め込みベクトル（再試行・分割しても失敗したテキストは None）
+        """
+        if not texts:
+            return []
+        self.stats.begin()
+        vectors: List[Optional[List[float]]] = [None] * len(texts)
+        try:
+            starts = range(0, len(texts), self.batch_size)
+            if len(starts) == 1:
+                vectors[:] = self._embed_batch(texts)
+            else:
+                with ThreadPoolExecutor(max_workers=min(self.max_in_flight, len(starts))) as executor:
+                    batches = executor.map(lambda start: self._embed_batch(texts[start:start + self.batch_size]),
+                                           starts)
+                    for start, batch_vectors in zip(starts, batches):
+                        vectors[start:start + len(batch_vectors)] = batch_vectors
+        finally:
+            failed = sum(vector is None for vector in vectors)
+            self.stats.end(len(vectors) - failed, failed)
+        return vectors
+
+    def _embed_batch(self, texts: List[str]) -> List[Optional[List[float]]]:
+        """1バッチを埋め込み（一時的なエラーは再試行、入力が原因のエラーは分割）"""
+        for attempt in range(self.max_retries + 1):
+            if self._fatal_error is not None:
+                return [None] * len(texts)
+            try:
+                with self._in_flight:
+                    self.stats.count(requests=1)
+                    vectors = self.provider.embed(texts)
+                if len(vectors) != len(texts):
+                    raise ValueError(f"埋め込み件数が一致しません ({len(vectors)}/{len(texts)})")
+                return vectors
+            except ImportError:
+                raise
+            except Exception as e:
+                if is_splittable(e):
+                    return self._split(texts, e)
+                if error_status(e) in FATAL_STATUSES:
+                    if self._fatal_error is None:
+                        logger.error(f"埋め込み生成エラー（APIキー・モデル名を確認してください。"
+                                     f"以降のリクエストを中止します）: {e}")
+                    self._fatal_error = e
+                    return [None] * len(texts)
+                if not is_retryable(e):
+                    logger.error(f"埋め込み生成エラー（{len(texts)}件）: {e}")
+                    return [None] * len(texts)
+                if attempt == self.max_retries:
+                    logger.error(f"埋め込み生成エラー（{self.max_retries}回再試行後、{len(texts)}件）: {e}")
+                    return [None] * len(texts)
+                delay = self._backoff(attempt)
+                logger.warning(f"埋め込み生成の一時的なエラー、{delay:.1f}秒後に再試行 "
+                               f"({attempt + 1}/{self.max_retries}): {e}")
+                self.stats.count(retries=1)
+                self.sleep(delay)
+        return [None] * len(texts)
+
+    def _split(self, texts: List[str], error: Exception) -> List[Optional[List[float]]]:
+        """バッチを半分に分けて送り直す（1件なら失敗として None）"""
+        if len(texts) == 1:
+            logger.error(f"埋め込み生成エラー（入力を除外）: {error}")
+            return [None]
+        self.stats.count(splits=1)
+        middle = len(texts) // 2
+        return self._embed_batch(texts[:middle]) + self._embed_batch(texts[middle:])
+
+    def _backoff(self, attempt: int) -> float:
+        """再試行の待ち時間（指数バックオフの上限の半分〜上限で一様にばらつかせる）"""
+        delay = min(self.max_retry_delay, self.retry_delay * (2 ** attempt))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+
+def create_batch_embedder(embedding_config: Dict[str, Any],
+                          model: Optional[str] = None) -> Optional[BatchEmbedder]:
+    """
+    設定（knowledge_config.yml の embedding セクション）からバッチ埋め込みを作成
+
+    Args:
+        embedding_config: batch_size, max_retries, retry_delay, max_retry_delay, max_in_flight, timeout
+        model: 埋め込みモデル名（None=環境変数 EMBEDDING_MODEL）
+
+    Returns:
+        BatchEmbedder（APIキー未設定の場合はNone）
+    """
+    provider = get_embedding_provider(model)
+    if provider is None:
+        return None
+    provider.timeout = embedding_config.get("timeout", DEFAULT_TIMEOUT)
+    return BatchEmbedder(
+        provider,
+        batch_size=embedding_config.get("batch_size", DEFAULT_BATCH_SIZE),
+        max_retries=embedding_config.get("max_retries", DEFAULT_MAX_RETRIES),
+        retry_delay=embedding_config.get("retry_delay", DEFAULT_RETRY_DELAY),
+        max_retry_delay=embedding_config.get("max_retry_delay", DEFAULT_MAX_RETRY_DELAY),
+        max_in_flight=embedding_config.get("max_in_flight", DEFAULT_MAX_IN_FLIGHT)
+    )
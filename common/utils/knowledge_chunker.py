@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+ナレッジファイルのスキャン・メタデータ抽出・チャンク分割
+
+取り込み（ingest_knowledge.py）と検索プロセスのライブ更新（knowledge_live.py）で
+同じチャンクになるよう、設定ファイルの supported_formats / exclude_patterns / chunking に
+基づく処理をまとめています。
+
+使用例:
+    from common.utils.knowledge_chunker import KnowledgeChunker
+
+    chunker = KnowledgeChunker(config, Path("common/knowledge"))
+    for file_path in chunker.scan():
+        metadata = chunker.extract_metadata(file_path)
+        chunks = chunker.chunk_content(file_path.read_text(encoding='utf-8'), metadata)
+"""
+
+import fnmatch
+import hashlib
+import os
+import re
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Any
+import logging
+
+import yaml
+
+from .knowledge_index import extract_chunk_fields
+
+logger = logging.getLogger(__name__)
+
+# 設定ファイルがない場合の既定値
+DEFAULT_SUPPORTED_FORMATS = [".md", ".txt", ".json", ".yml", ".yaml"]
+DEFAULT_EXCLUDE_PATTERNS = ["*.tmp", "*.log", ".*", "__pycache__", "node_modules", ".git"]
+DEFAULT_CHUNK_SIZE = 1000
+DEFAULT_CHUNK_OVERLAP = 200
+
+FRONTMATTER_PATTERN = re.compile(r'^---\s*\n(.*?)\n---\s*\n', re.DOTALL)
+HEADER_PATTERN = r'^(#{1,6}\s+.+)$'
+
+
+class KnowledgeChunker:
+    """ナレッジファイルの走査とチャンク分割"""
+
+    def __init__(self, config: Optional[Dict[str, Any]] = None,
+                 knowledge_base_path: Path = Path("common/knowledge")):
+        """
+        Args:
+            config: 設定（knowledge_config.yml の内容）
+            knowledge_base_path: ナレッジベースのルート
+        """
+        config = config or {}
+        self.knowledge_base_path = Path(knowledge_base_path)
+        self.supported_formats = config.get("supported_formats", DEFAULT_SUPPORTED_FORMATS)
+        self.exclude_patterns = config.get("exclude_patterns", DEFAULT_EXCLUDE_PATTERNS)
+        chunking_config = config.get("chunking", {})
+        self.chunk_size = chunking_config.get("chunk_size", DEFAULT_CHUNK_SIZE)
+        self.chunk_overlap = chunking_config.get("chunk_overlap", DEFAULT_CHUNK_OVERLAP)
+
+    def is_target(self, file_path: Path) -> bool:
+        """取り込み対象のファイルか（対応形式で、除外パターンに該当しない）"""
+        if file_path.suffix not in self.supported_formats:
+            return False
+        # 除外パターンチェック（.index 等の除外ディレクトリ配下も対象）
+        relative_parts = file_path.relative_to(self.knowledge_base_path).parts
+        return not any(fnmatch.fnmatch(part, pattern)
+                       for part in relative_parts for pattern in self.exclude_patterns)
+
+    def scan(self, category: Optional[str] = None) -> List[Path]:
+        """
+        ナレッジベースの対象ファイルを列挙
+
+        Args:
+            category: 対象カテゴリ（ナレッジベースからの相対ディレクトリ、None=全体）
+
+        Returns:
+            ファイルパスのリスト（カテゴリが存在しなければ空）
+        """
+        scan_path = self.knowledge_base_path / category if category else self.knowledge_base_path
+        if not scan_path.exists():
+            return []
+        return [file_path for file_path in scan_path.rglob("*")
+                if file_path.is_file() and self.is_target(file_path)]
+
+    def extract_metadata(self, file_path: Path) -> Dict[str, Any]:
+        """ファイルからメタデータを抽出"""
+        metadata = {
+            "file_path": str(file_path),
+            "file_name": file_path.name,
+            "file_size": file_path.stat().st_size,
+            "modified_time": datetime.fromtimestamp(file_path.stat().st_mtime).isoformat(),
+            "category": self.extract_category(file_path),
+            "file_hash": self.file_hash(file_path)
+        }
+
+        # ファイル内容からYAML Front Matterを抽出
+        try:
+            content = file_path.read_text(encoding='utf-8')
+            metadata.update(self.extract_frontmatter(content))
+        except Exception as e:
+            logger.warning(f"メタデータ抽出エラー {file_path}: {e}")
+
+        return metadata
+
+    def extract_category(self, file_path: Path) -> str:
+        """ファイルパスからカテゴリを抽出"""
+        relative_path = file_path.relative_to(self.knowledge_base_path)
+        return str(relative_path.parent).replace(os.sep, "/")
+
+    @staticmethod
+    def file_hash(file_path: Path) -> str:
+        """ファイルのハッシュ値を計算"""
+        hasher = hashlib.md5()
+        with open(file_path, 'rb') as f:
+            hasher.update(f.read())
+        return hasher.hexdigest()
+
+    @staticmethod
+    def extract_frontmatter(content: str) -> Dict[str, Any]:
+        """YAML Front Matterを抽出"""
+        match = FRONTMATTER_PATTERN.match(content)
+        if match:
+            try:
+                return yaml.safe_load(match.group(1))
+            except yaml.YAMLError as e:
+                logger.warning(f"YAML解析エラー: {e}")
+        return {}
+
+    def chunk_content(self, content: str, metadata: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """コンテンツをチャンクに分割"""
+        # マークダウンの見出しベースで分割を試行
+        chunks = self.split_by_headers(content)
+
+        # サイズが大きい場合は更に分割
+        final_chunks = []
+        for i, chunk_text in enumerate(chunks):
+            if len(chunk_text) <= self.chunk_size:
+                chunk_metadata = metadata.copy()
+                chunk_metadata.update({
+                    "chunk_id": f"{metadata['file_hash']}_chunk_{i}",
+                    "chunk_index": i,
+                    "chunk_size": len(chunk_text)
+                })
+                final_chunks.append({
+                    "content": chunk_text,
+                    "metadata": chunk_metadata,
+                    "fields": extract_chunk_fields(chunk_text, metadata)
+                })
+            else:
+                # 大きなチャンクを更に分割
+                sub_chunks = self.split_large_chunk(chunk_text, self.chunk_size, self.chunk_overlap)
+                for j, sub_chunk in enumerate(sub_chunks):
+                    chunk_metadata = metadata.copy()
+                    chunk_metadata.update({
+                        "chunk_id": f"{metadata['file_hash']}_chunk_{i}_{j}",
+                        "chunk_index": f"{i}.{j}",
+                        "chunk_size": len(sub_chunk)
+                    })
+                    final_chunks.append({
+                        "content": sub_chunk,
+                        "metadata": chunk_metadata,
+                        "fields": extract_chunk_fields(sub_chunk, metadata)
+                    })
+
+        return final_chunks
+
+    @staticmethod
+    def split_by_headers(content: str) -> List[str]:
+        """マークダウンの見出しでコンテンツを分割"""
+        # YAML Front Matterを除去
+        content = re.sub(r'^---\s*\n.*?\n---\s*\n', '', content, flags=re.DOTALL)
+
+        # 見出しで分割
+        parts = re.split(HEADER_PATTERN, content, flags=re.MULTILINE)
+
+        chunks = []
+        current_chunk = ""
+
+        for part in parts:
+            if re.match(HEADER_PATTERN, part):
+                if current_chunk.strip():
+                    chunks.append(current_chunk.strip())
+                current_chunk = part + "\n"
+            else:
+                current_chunk += part
+
+        if current_chunk.strip():
+            chunks.append(current_chunk.strip())
+
+        return chunks if chunks else [content]
+
+    @staticmethod
+    def split_large_chunk(text: str, chunk_size: int, overlap: int) -> List[str]:
+        """大きなチャンクを固定サイズで分割"""
+        chunks = []
+        start = 0
+
+        while start < len(text):
+            end = start + chunk_size
+            chunks.append(text[start:end])
+            start = end - overlap
+
+        return chunks
@@ -0,0 +1,389 @@
+#!/usr/bin/env python3
+"""
+メタデータのファセット絞り込み
+
+Front Matter のフィールド（resolution_status / priority / tags / date / satisfaction_score 等）に
+対する構造化フィルタを解析し、取り込み時に構築したフィールド別の値索引で評価します。
+値索引はフィールドごとに「ソート済みの値」と「値ごとの文書番号のソート済み配列」を持ち、
+一致・集合所属は二分探索、範囲指定は値の連続区間として1回のスライスで候補を求めます。
+求めた文書マスクはスコア計算の前にポスティングへ適用されます。
+
+フィルタの書き方:
+    辞書:
+        {"resolution_status": "resolved",                # 一致
+         "tags": ["api", "pricing"],                     # いずれかを含む
+         "date": {">=": "2024-10", "<": "2025"},         # 範囲（gte / gt / lte / lt も可）
+         "satisfaction_score": {">=": 4}}
+    文字列（条件は AND で連結）:
+        "resolution_status=resolved AND date>=2024-10 AND tags in (api, pricing)"
+
+文字列の値（日付を含む）は前方一致で比較するため、"date>=2024-10" は2024年10月以降、
+"date<=2024-10" は2024年10月末までを表します。文字列の一致は大文字・全角を区別しません。
+
+使用例:
+    from common.utils.knowledge_facets import parse_filters
+
+    conditions = parse_filters("resolution_status=resolved AND date>=2024-10")
+    results = searcher.search("API統合", filters=conditions)
+"""
+
+import re
+from datetime import date, datetime
+from typing import Dict, List, Optional, Any, Tuple, Union, Iterable
+
+import numpy as np
+
+from .knowledge_tokenizer import normalize_text
+
+# 範囲演算子（記号・英字表記）
+RANGE_OPERATORS = {">=": "gte", ">": "gt", "<=": "lte", "<": "lt",
+                   "gte": "gte", "gt": "gt", "lte": "lte", "lt": "lt"}
+MEMBERSHIP_OPERATORS = ("=", "==", "eq", "in")
+
+NUMBER_KIND = "number"
+STRING_KIND = "string"
+
+# 前方一致の上限に使う最大のコードポイント
+_PREFIX_END = chr(0x10FFFF)
+
+_CLAUSE_PATTERN = re.compile(r"^\s*([\w.\-]+)\s*(>=|<=|==|=|>|<|\s+in\s+)\s*(.+?)\s*$", re.IGNORECASE)
+_AND_PATTERN = re.compile(r"\s+and\s+|\s*&&\s*", re.IGNORECASE)
+# 条件は AND でしか結合できない（OR を AND の値の一部として黙って解釈しないよう検出する）
+_OR_PATTERN = re.compile(r"(?:^|\s)or(?:\s|$)|\|\|", re.IGNORECASE)
+# 式の先頭・末尾に残った AND（前後の条件がない）
+_DANGLING_AND_PATTERN = re.compile(r"^(?:and|&&)(?:\s|$)|(?:^|\s)(?:and|&&)$", re.IGNORECASE)
+
+FilterSpec = Union[None, str, Dict[str, Any], List["FacetCondition"]]
+
+
+def _flatten(value: Any) -> List[Any]:
+    """スカラー・リストの値を要素のリストに展開（Noneは除外）"""
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple, set)):
+        return [item for item in value if item is not None]
+    return [value]
+
+
+def _as_number(value: Any) -> Optional[float]:
+    """数値として解釈できればfloat、できなければNone（真偽値は数値として扱わない）"""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    return None
+
+
+def facet_text(value: Any) -> str:
+    """
+    文字列として比較する際の値のキー（NFKC・小文字化）
+
+    日付はJSON保存時と同じ str() 表記、整数値の数値は小数点なしで表します。
+    """
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    if isinstance(value, (date, datetime)):
+        return str(value)
+    return normalize_text(str(value)).strip()
+
+
+def _strip_quotes(value: str) -> str:
+    value = value.strip()
+    if len(value) >= 2 and value[0] == value[-1] and value[0] in "\"'":
+        return value[1:-1]
+    return value
+
+
+class FacetCondition:
+    """1フィールドに対する条件（op は in / gte / gt / lte / lt）"""
+
+    def __init__(self, field: str, op: str, values: List[Any]):
+        """
+        Args:
+            field: メタデータのフィールド名
+            op: 演算子（in=いずれかに一致、それ以外は範囲）
+            values: 比較する値（範囲の場合は1件）
+        """
+        self.field = field
+        self.op = op
+        self.values = list(values)
+        self.numbers = [_as_number(value) for value in self.values]
+        self.texts = [facet_text(value) for value in self.values]
+
+    def __repr__(self) -> str:
+        return f"FacetCondition({self.field!r}, {self.op!r}, {self.values!r})"
+
+    def key(self) -> tuple:
+        """キャッシュキー用の正規化表現"""
+        texts = tuple(sorted(set(self.texts))) if self.op == "in" else tuple(self.texts)
+        return (self.field, self.op, texts)
+
+    def matches(self, raw_value: Any) -> bool:
+        """
+        メタデータの値が条件を満たすか（索引のない場合・JSONインデックス用）
+
+        Args:
+            raw_value: メタデータの値（リストはいずれかの要素が満たせば一致）
+
+        Returns:
+            条件を満たすか
+        """
+        for value in _flatten(raw_value):
+            number = _as_number(value) if not isinstance(value, str) else None
+            if number is not None and None not in self.numbers:
+                if self._compare(number, self.numbers, numeric=True):
+                    return True
+            elif self._compare(facet_text(value), self.texts, numeric=False):
+                return True
+        return False
+
+    def _compare(self, key: Any, targets: List[Any], numeric: bool) -> bool:
+        if self.op == "in":
+            return key in targets
+        target = targets[0]
+        if self.op == "gte":
+            return key >= target
+        if self.op == "lt":
+            return key < target
+        # gt / lte は文字列なら前方一致の範囲（"2024-10" より後 = 2024-11 以降）
+        end = target if numeric else target + _PREFIX_END
+        return key > end if self.op == "gt" else key <= end
+
+
+def parse_filters(filters: FilterSpec) -> List[FacetCondition]:
+    """
+    フィルタ指定を条件のリストに変換
+
+    Args:
+        filters: 辞書・文字列式・条件のリスト（None=絞り込みなし）
+
+    Returns:
+        AND で評価する条件のリスト
+
+    Raises:
+        ValueError: 解釈できないフィルタ指定（OR・|| を含む式、括弧・引用符の対応が取れない式、
+                    前後に条件のない AND を含む）
+    """
+    if not filters:
+        return []
+    if isinstance(filters, str):
+        return _parse_expression(filters)
+    if isinstance(filters, dict):
+        return _parse_dict(filters)
+    if isinstance(filters, (list, tuple)) and all(isinstance(item, FacetCondition) for item in filters):
+        return list(filters)
+    raise ValueError(f"未対応のフィルタ指定です: {filters!r}")
+
+
+def _parse_dict(filters: Dict[str, Any]) -> List[FacetCondition]:
+    conditions = []
+    for field, spec in filters.items():
+        if isinstance(spec, dict):
+            for op, value in spec.items():
+                op = str(op).lower()
+                if op in RANGE_OPERATORS:
+                    conditions.append(FacetCondition(field, RANGE_OPERATORS[op], [value]))
+                elif op in MEMBERSHIP_OPERATORS:
+                    conditions.append(FacetCondition(field, "in", _flatten(value)))
+                else:
+                    raise ValueError(f"未対応のフィルタ演算子です: {field} {op}")
+        else:
+            conditions.append(FacetCondition(field, "in", _flatten(spec)))
+    return conditions
+
+
+def _mask_quoted(expression: str) -> str:
+    """
+    引用符で囲んだ値を同じ長さの空白以外の文字で伏せた式（AND・OR・括弧を値の外だけで探すため）
+
+    Raises:
+        ValueError: 引用符・括弧の対応が取れていない、または括弧が入れ子の場合
+    """
+    masked = []
+    quote = None
+    depth = 0
+    for char in expression:
+        if quote is not None:
+            masked.append("_" if char != quote else char)
+            if char == quote:
+                quote = None
+            continue
+        if char in "\"'":
+            quote = char
+        elif char == "(":
+            depth += 1
+            if depth > 1:
+                raise ValueError(f"フィルタ式の括弧は入れ子にできません: {expression!r}")
+        elif char == ")":
+            depth -= 1
+            if depth < 0:
+                raise ValueError(f"フィルタ式の括弧の対応が取れていません: {expression!r}")
+        masked.append(char)
+    if quote is not None:
+        raise ValueError(f"フィルタ式の引用符が閉じていません: {expression!r}")
+    if depth:
+        raise ValueError(f"フィルタ式の括弧の対応が取れていません: {expression!r}")
+    return "".join(masked)
+
+
+def _split_clauses(expression: str) -> List[str]:
+    """式を AND で条件に分割（引用符内の AND・OR は値の一部）"""
+    masked = _mask_quoted(expression)
+    if _OR_PATTERN.search(masked):
+        raise ValueError(f"フィルタ式の OR には対応していません（条件は AND で結合）: {expression!r}")
+    clauses = []
+    start = 0
+    for match in _AND_PATTERN.finditer(masked):
+        clauses.append(expression[start:match.start()])
+        start = match.end()
+    clauses.append(expression[start:])
+    if _DANGLING_AND_PATTERN.search(masked) or any(not clause.strip() for clause in clauses):
+        raise ValueError(f"フィルタ式の AND の前後に条件がありません: {expression!r}")
+    return clauses
+
+
+def _parse_expression(expression: str) -> List[FacetCondition]:
+    conditions = []
+    for clause in _split_clauses(expression.strip()):
+        match = _CLAUSE_PATTERN.match(clause)
+        if not match:
+            raise ValueError(f"フィルタ式を解釈できません: {clause!r}")
+
+        field, op, value = match.group(1), match.group(2).strip().lower(), match.group(3)
+        if op in RANGE_OPERATORS:
+            conditions.append(FacetCondition(field, RANGE_OPERATORS[op], [_strip_quotes(value)]))
+        else:
+            if op == "in":
+                value = value.strip()
+                if value.startswith("(") and value.endswith(")"):
+                    value = value[1:-1]
+                values = [_strip_quotes(item) for item in value.split(",") if item.strip()]
+            else:
+                values = [_strip_quotes(value)]
+            conditions.append(FacetCondition(field, "in", values))
+    return conditions
+
+
+def filters_key(conditions: List[FacetCondition]) -> Optional[tuple]:
+    """条件リストのキャッシュキー（順序に依存しない）"""
+    if not conditions:
+        return None
+    return tuple(sorted(condition.key() for condition in conditions))
+
+
+def matches_filters(metadata: Dict[str, Any], conditions: List[FacetCondition]) -> bool:
+    """メタデータが全条件を満たすか"""
+    return all(condition.matches(metadata.get(condition.field)) for condition in conditions)
+
+
+def build_facet_arrays(chunks: List[Dict[str, Any]], fields: Iterable[str]
+                       ) -> Tuple[Dict[str, Dict[str, Any]], Dict[str, np.ndarray]]:
+    """
+    チャンクのメタデータからフィールド別の値索引を構築
+
+    すべての値が数値のフィールドは数値順、それ以外は文字列順に値を並べ、
+    値ごとの文書番号を連続領域（facet_docs）に格納します。
+
+    Args:
+        chunks: チャンクのリスト（文書番号順）
+        fields: 索引を作るメタデータのフィールド名
+
+    Returns:
+        (フィールド名 -> {"kind", "section"}, セクション名 -> 配列)
+    """
+    facets: Dict[str, Dict[str, Any]] = {}
+    sections: Dict[str, np.ndarray] = {}
+
+    for field in dict.fromkeys(fields):
+        doc_values = [list(dict.fromkeys(_flatten(chunk.get("metadata", {}).get(field))))
+                      for chunk in chunks]
+        raw_values = [value for values in doc_values for value in values]
+        if not raw_values:
+            continue
+
+        numeric = all(_as_number(value) is not None and not isinstance(value, str)
+                      for value in raw_values)
+        to_key = _as_number if numeric else facet_text
+
+        entries: Dict[Any, List[int]] = {}
+        for doc, values in enumerate(doc_values):
+            for key in dict.fromkeys(to_key(value) for value in values):
+                entries.setdefault(key, []).append(doc)
+
+        keys = sorted(entries)
+        offsets = np.zeros(len(keys) + 1, dtype=np.uint64)
+        offsets[1:] = np.cumsum([len(entries[key]) for key in keys], dtype=np.uint64)
+
+        name = f"facet{len(facets)}"
+        facets[field] = {"kind": NUMBER_KIND if numeric else STRING_KIND, "section": name}
+        sections[f"{name}_values"] = np.array(keys, dtype=np.float64 if numeric else np.str_)
+        sections[f"{name}_offsets"] = offsets
+        sections[f"{name}_docs"] = np.array(
+            [doc for key in keys for doc in entries[key]], dtype=np.uint32
+        )
+
+    return facets, sections
+
+
+class FacetField:
+    """1フィールドの値索引（ソート済みの値 + 値ごとの文書番号）"""
+
+    def __init__(self, kind: str, values: np.ndarray, offsets: np.ndarray, docs: np.ndarray,
+                 doc_count: int):
+        """
+        Args:
+            kind: 値の種類（number / string）
+            values: ソート済みの値
+            offsets: 値ごとの docs 上の開始位置（値の数+1）
+            docs: 値の順に並べた文書番号
+            doc_count: 文書数
+        """
+        self.kind = kind
+        self.values = values
+        self.offsets = offsets
+        self.docs = docs
+        self.doc_count = doc_count
+
+    def _targets(self, condition: FacetCondition) -> List[Any]:
+        if self.kind == NUMBER_KIND:
+            return [number for number in condition.numbers if number is not None]
+        return condition.texts
+
+    def value_ranges(self, condition: FacetCondition) -> List[Tuple[int, int]]:
+        """条件を満たす値の区間 [開始, 終了) のリスト（値の番号）"""
+        targets = self._targets(condition)
+        if not targets:
+            return []
+
+        values = self.values
+        if condition.op == "in":
+            return [(int(np.searchsorted(values, target, "left")),
+                     int(np.searchsorted(values, target, "right"))) for target in targets]
+
+        target = targets[0]
+        end = target if self.kind == NUMBER_KIND else target + _PREFIX_END
+        low, high = 0, len(values)
+        if condition.op == "gte":
+            low = int(np.searchsorted(values, target, "left"))
+        elif condition.op == "gt":
+            low = int(np.searchsorted(values, end, "right"))
+        elif condition.op == "lte":
+            high = int(np.searchsorted(values, end, "right"))
+        elif condition.op == "lt":
+            high = int(np.searchsorted(values, target, "left"))
+        return [(low, high)]
+
+    def mask(self, condition: FacetCondition) -> np.ndarray:
+        """条件を満たす文書のブールマスク"""
+        mask = np.zeros(self.doc_count, dtype=bool)
+        for low, high in self.value_ranges(condition):
+            if low < high:
+                mask[self.docs[int(self.offsets[low]):int(self.offsets[high])]] = True
+        return mask
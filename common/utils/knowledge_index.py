@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+"""
+ナレッジベース転置インデックス
+
+取り込み時にチャンク単位の転置インデックス（ポスティングリスト・文書長）を構築し、
+検索時はクエリ語のポスティングのみを走査してBM25でスコアリングします。
+検索コストはコーパス全体ではなく、クエリ語を含む文書数に比例します。
+
+使用例:
+    from common.utils.knowledge_index import InvertedIndex, extract_chunk_fields
+    from common.utils.knowledge_tokenizer import create_tokenizer
+
+    index = InvertedIndex(tokenizer=create_tokenizer({"type": "ngram"}))
+    index.add_chunk("chunk_0", content, extract_chunk_fields(content, metadata),
+                    category="customer-support")
+    hits = index.search(index.tokenizer.tokenize("API統合 価格"), limit=5)
+"""
+
+import heapq
+import json
+import math
+import os
+import re
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Any, Tuple
+
+from .knowledge_tokenizer import create_tokenizer, normalize_text
+
+# インデックスファイル名・フォーマットバージョン
+INVERTED_INDEX_FILE = "inverted_index.json"
+INVERTED_INDEX_VERSION = 2
+INDEX_MANIFEST_FILE = "manifest.json"
+
+# BM25パラメータのデフォルト値
+DEFAULT_K1 = 1.2
+DEFAULT_B = 0.75
+
+# 検索対象フィールドと重み（タイトル・見出し×3、メタデータ×2）
+FIELDS = ("content", "title", "metadata")
+DEFAULT_FIELD_WEIGHTS = {"content": 1.0, "title": 3.0, "metadata": 2.0}
+
+_TITLE_PATTERN = re.compile(r'^#+ (.+)$', re.MULTILINE)
+
+# 検索対象にしないファイル管理用メタデータ
+_NON_TEXT_METADATA = {"file_path", "file_size", "file_hash", "modified_time",
+                      "chunk_id", "chunk_index", "chunk_size"}
+
+
+def extract_chunk_fields(content: str, metadata: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    チャンクの検索用フィールドを抽出（取り込み時に1回だけ計算）
+
+    Args:
+        content: チャンク本文
+        metadata: ファイルのメタデータ
+
+    Returns:
+        titles（見出しのリスト）・metadata_text（正規化済みメタデータ文字列）・
+        content_length（本文の文字数）を持つ辞書
+    """
+    return {
+        "titles": _TITLE_PATTERN.findall(content),
+        "metadata_text": normalize_text(" ".join(
+            str(value) for key, value in metadata.items() if key not in _NON_TEXT_METADATA
+        )),
+        "content_length": len(content)
+    }
+
+
+def load_manifest(index_path: Path) -> Dict[str, Any]:
+    """
+    インデックスのマニフェストを読み込み
+
+    Args:
+        index_path: インデックスディレクトリ
+
+    Returns:
+        マニフェスト（存在しない場合は世代0の空マニフェスト）
+    """
+    manifest_file = Path(index_path) / INDEX_MANIFEST_FILE
+    try:
+        with open(manifest_file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {"generation": 0}
+
+
+def bump_index_generation(index_path: Path, updates: Optional[Dict[str, Any]] = None) -> int:
+    """
+    インデックス世代番号を1つ進める（検索側キャッシュの無効化に使用）
+
+    Args:
+        index_path: インデックスディレクトリ
+        updates: 世代と同時に書き換えるマニフェストの項目（シャード一覧など）
+
+    Returns:
+        新しい世代番号
+    """
+    manifest = load_manifest(index_path)
+    manifest.update(updates or {})
+    manifest["generation"] = manifest.get("generation", 0) + 1
+    manifest["updated_at"] = datetime.now().isoformat()
+
+    # 一時ファイル経由で置き換え（読み手が書きかけを読まないように）
+    manifest_file = Path(index_path) / INDEX_MANIFEST_FILE
+    tmp_file = manifest_file.with_suffix(".tmp")
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_file, manifest_file)
+
+    return manifest["generation"]
+
+
+class InvertedIndex:
+    """BM25F（フィールド重み付きBM25）検索用の転置インデックス"""
+
+    def __init__(self, k1: float = DEFAULT_K1, b: float = DEFAULT_B, tokenizer=None,
+                 field_weights: Optional[Dict[str, float]] = None, store_positions: bool = False):
+        self.k1 = k1
+        self.b = b
+        self.field_weights = dict(DEFAULT_FIELD_WEIGHTS)
+        if field_weights:
+            self.field_weights.update(field_weights)
+
+        # 取り込み・検索で共通のトークナイザ（仕様はインデックスに保存）
+        self.tokenizer = tokenizer or create_tokenizer(None)
+
+        # 文書テーブル（内部文書番号 -> チャンクID・フィールド別文書長・カテゴリ）
+        self.chunk_ids: List[str] = []
+        self.doc_lengths: List[List[int]] = []
+        self.categories: List[str] = []
+
+        # ポスティングリスト（索引語 -> [[文書番号, 本文tf, タイトルtf, メタデータtf], ...]）
+        self.postings: Dict[str, List[List[int]]] = {}
+
+        # 本文の出現位置（索引語 -> ポスティングと同じ順の [[語位置...], [文字位置...]]）
+        # バイナリインデックスにのみ保存し、フレーズ・近接検索とスニペットに使用
+        self.store_positions = store_positions
+        self.positions: Dict[str, List[Tuple[List[int], List[int]]]] = {}
+
+        self._total_lengths = [0] * len(FIELDS)
+
+    @property
+    def doc_count(self) -> int:
+        """登録文書数"""
+        return len(self.chunk_ids)
+
+    @property
+    def avg_doc_length(self) -> float:
+        """平均文書長（本文フィールド）"""
+        return self.avg_field_lengths()[0]
+
+    def avg_field_lengths(self) -> List[float]:
+        """フィールド別の平均長"""
+        if not self.chunk_ids:
+            return [0.0] * len(FIELDS)
+        return [total / len(self.chunk_ids) for total in self._total_lengths]
+
+    def add_document(self, chunk_id: str, field_terms: Dict[str, List[str]],
+                     category: str = "",
+                     content_positions: Optional[Dict[str, Tuple[List[int], List[int]]]] = None) -> int:
+        """
+        文書を追加
+
+        Args:
+            chunk_id: チャンクID
+            field_terms: フィールド名 -> 索引語のリスト（self.tokenizerで分割したもの）
+            category: 文書のカテゴリ
+            content_positions: 索引語 -> 本文での (語位置のリスト, 文字位置のリスト)
+                               （store_positions の場合のみ保持）
+
+        Returns:
+            内部文書番号
+        """
+        doc = len(self.chunk_ids)
+        lengths = [len(field_terms.get(field, ())) for field in FIELDS]
+        self.chunk_ids.append(chunk_id)
+        self.doc_lengths.append(lengths)
+        self.categories.append(category)
+        for i, length in enumerate(lengths):
+            self._total_lengths[i] += length
+
+        term_freqs: Dict[str, List[int]] = {}
+        for i, field in enumerate(FIELDS):
+            for term in field_terms.get(field, ()):
+                freqs = term_freqs.get(term)
+                if freqs is None:
+                    freqs = term_freqs[term] = [0] * len(FIELDS)
+                freqs[i] += 1
+
+        for term, freqs in term_freqs.items():
+            self.postings.setdefault(term, []).append([doc] + freqs)
+            if self.store_positions:
+                self.positions.setdefault(term, []).append(
+                    (content_positions or {}).get(term, ([], []))
+                )
+
+        return doc
+
+    def add_chunk(self, chunk_id: str, content: str, fields: Dict[str, Any],
+                  category: str = "") -> int:
+        """
+        チャンクを分割してから追加
+
+        Args:
+            chunk_id: チャンクID
+            content: チャンク本文
+            fields: extract_chunk_fieldsで計算したフィールド
+            category: 文書のカテゴリ
+
+        Returns:
+            内部文書番号
+        """
+        tokenize = self.tokenizer.tokenize
+        content_positions = None
+        if self.store_positions:
+            tokens = self.tokenizer.tokenize_with_positions(content)
+            content_terms = [term for term, _, _ in tokens]
+            content_positions = {}
+            for term, position, char_offset in tokens:
+                positions, char_offsets = content_positions.setdefault(term, ([], []))
+                positions.append(position)
+                char_offsets.append(char_offset)
+        else:
+            content_terms = tokenize(content)
+        return self.add_document(chunk_id, {
+            "content": content_terms,
+            "title": tokenize(" ".join(fields["titles"])),
+            "metadata": tokenize(fields["metadata_text"])
+        }, category, content_positions)
+
+    def idf(self, term: str) -> float:
+        """索引語のIDF（BM25、常に正）"""
+        df = len(self.postings.get(term, ()))
+        n = self.doc_count
+        return math.log(1.0 + (n - df + 0.5) / (df + 0.5))
+
+    def search(self, query_terms: List[str], limit: int = 10,
+               categories: Optional[List[str]] = None) -> List[Tuple[str, float]]:
+        """
+        BM25Fで上位文書を検索
+
+        各フィールドの出現頻度をフィールド長で正規化し、重みを掛けて合算した
+        疑似頻度にBM25の飽和関数を適用します。
+
+        Args:
+            query_terms: クエリの索引語
+            limit: 最大結果数
+            categories: 対象カテゴリ（None=全体）
+
+        Returns:
+            (チャンクID, 正規化スコア) のリスト（スコア降順）
+            スコアはクエリの理論上限で割った0.0〜1.0の値
+        """
+        terms = [term for term in dict.fromkeys(query_terms) if term in self.postings]
+        if not terms or limit <= 0:
+            return []
+
+        k1 = self.k1
+        b = self.b
+        weights = [self.field_weights.get(field, 0.0) for field in FIELDS]
+        avg_lengths = [avg or 1.0 for avg in self.avg_field_lengths()]
+        doc_lengths = self.doc_lengths
+
+        scores: Dict[int, float] = {}
+        max_score = 0.0
+        for term in terms:
+            idf = self.idf(term)
+            max_score += idf * (k1 + 1.0)
+            for posting in self.postings[term]:
+                doc = posting[0]
+                lengths = doc_lengths[doc]
+                tf = 0.0
+                for i in range(len(FIELDS)):
+                    if posting[i + 1]:
+                        tf += weights[i] * posting[i + 1] / (1.0 - b + b * lengths[i] / avg_lengths[i])
+                scores[doc] = scores.get(doc, 0.0) + idf * tf * (k1 + 1.0) / (tf + k1)
+
+        if categories:
+            allowed = set(categories)
+            candidates = ((doc, score) for doc, score in scores.items()
+                          if self.categories[doc] in allowed)
+        else:
+            candidates = iter(scores.items())
+
+        top = heapq.nlargest(limit, candidates, key=lambda item: item[1])
+        return [(self.chunk_ids[doc], score / max_score) for doc, score in top]
+
+    def to_dict(self) -> Dict[str, Any]:
+        """シリアライズ用の辞書に変換"""
+        return {
+            "version": INVERTED_INDEX_VERSION,
+            "k1": self.k1,
+            "b": self.b,
+            "field_weights": self.field_weights,
+            "tokenizer": self.tokenizer.spec,
+            "fields": list(FIELDS),
+            "chunk_ids": self.chunk_ids,
+            "doc_lengths": self.doc_lengths,
+            "categories": self.categories,
+            "postings": self.postings
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "InvertedIndex":
+        """辞書からインデックスを復元"""
+        version = data.get("version")
+        if version not in (1, INVERTED_INDEX_VERSION):
+            raise ValueError(f"未対応のインデックスバージョン: {version}")
+
+        index = cls(k1=data.get("k1", DEFAULT_K1), b=data.get("b", DEFAULT_B),
+                    tokenizer=create_tokenizer(data.get("tokenizer")),
+                    field_weights=data.get("field_weights"))
+        index.chunk_ids = data["chunk_ids"]
+        index.categories = data["categories"]
+
+        if version == 1:
+            # 旧形式（本文のみ）はタイトル・メタデータの頻度0として読み込む
+            index.doc_lengths = [[length, 0, 0] for length in data["doc_lengths"]]
+            index.postings = {
+                term: [[doc, tf, 0, 0] for doc, tf in postings]
+                for term, postings in data["postings"].items()
+            }
+        else:
+            index.doc_lengths = data["doc_lengths"]
+            index.postings = data["postings"]
+
+        index._total_lengths = [sum(lengths[i] for lengths in index.doc_lengths)
+                                for i in range(len(FIELDS))]
+        return index
+
+    def save(self, path: Path) -> None:
+        """インデックスをファイルに保存"""
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, separators=(',', ':'))
+
+    @classmethod
+    def load(cls, path: Path) -> "InvertedIndex":
+        """ファイルからインデックスを読み込み"""
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls.from_dict(json.load(f))
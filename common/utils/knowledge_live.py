@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+"""
+ナレッジファイルの変更をインデックス全体を作り直さずに検索へ反映するライブ更新
+
+common/knowledge をポーリング（os.stat のmtime/サイズの比較のみ、外部サービス不要）し、
+ファイル単位の差分を読み込み済みのインデックスに重ねます。
+
+- 更新・削除されたファイルの既存チャンクは、シャードの「削除済み」ビューで検索対象から外す
+- 追加・更新されたファイルのチャンクは、ディレクトリ単位のメモリ上のセグメントに索引する
+- 差分を反映するたびに新しいインデックス（ShardedKnowledgeStore）を作って差し替え、
+  検索中のインデックスは変更しない（コピーオンライト。検索側はロックで待たない）
+
+セグメントのIDF・平均フィールド長は取り込み済みのインデックスの統計にセグメントの文書頻度を
+加えたもので計算するため、スコアは取り込み済みの文書と比較できます。
+セグメントのチャンクには埋め込みがないため、次の取り込みまでは全文検索だけで見つかります。
+
+使用例:
+    from common.utils.knowledge_live import LiveSegments
+
+    segments = LiveSegments(store, chunker)
+    if segments.poll():
+        store = segments.overlay()
+"""
+
+import os
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Any, Tuple
+import logging
+
+import numpy as np
+
+from .knowledge_chunker import KnowledgeChunker
+from .knowledge_index import InvertedIndex, load_manifest
+from .knowledge_shards import ShardedKnowledgeStore, shard_name_for
+from .knowledge_store import KnowledgeStore, build_store_bytes
+
+logger = logging.getLogger(__name__)
+
+# ポーリング間隔の既定値（秒）
+DEFAULT_POLL_INTERVAL = 2.0
+
+# ファイルの状態
+_BASE = "base"  # 取り込み済みのチャンクを使う
+_LIVE = "live"  # セグメントのチャンクを使う
+_GONE = "gone"  # 削除された
+
+
+def _file_key(file_path: str) -> str:
+    """ファイルの同一性を判定するキー（相対・絶対パスの違いを吸収）"""
+    return os.path.abspath(file_path)
+
+
+def stat_signature(file_path: Path) -> Optional[Tuple[int, int]]:
+    """ファイルの (mtime_ns, サイズ)（存在しなければNone）"""
+    try:
+        stat = file_path.stat()
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+class LiveSegments:
+    """
+    取り込み済みのインデックスに対するファイル単位の差分
+
+    取り込み済みのインデックス（base）ごとに作り直します。最初のポーリングでは
+    ファイルのサイズ・更新日時（異なればハッシュ）を取り込み時のメタデータと比較し、
+    取り込み後の変更を差分として拾います。
+    """
+
+    def __init__(self, base: ShardedKnowledgeStore, chunker: KnowledgeChunker):
+        """
+        Args:
+            base: 取り込み済みのインデックス（変更しない）
+            chunker: 取り込みと同じ設定のチャンク分割
+        """
+        self.base = base
+        self.chunker = chunker
+        self.version = 0
+        self.facet_fields = list(load_manifest(base.index_path).get("facet_fields", []))
+
+        # 取り込み済みのファイル: キー -> (シャード番号, ファイル番号, メタデータ)
+        self._base_files: Dict[str, Tuple[int, int, Dict[str, Any]]] = {}
+        for shard_no, shard in enumerate(base.shards):
+            if shard["doc_count"] == 0:
+                continue
+            for file_id, metadata in enumerate(base.shard(shard_no).files()):
+                self._base_files[_file_key(metadata.get("file_path", ""))] = (shard_no, file_id, metadata)
+
+        self._states: Dict[str, str] = {key: _BASE for key in self._base_files}
+        self._signatures: Dict[str, Optional[Tuple[int, int]]] = {}
+        # シャード番号 -> 削除済みの文書のフラグ（公開後は書き換えず、変更時は複製する）
+        self._deleted: Dict[int, np.ndarray] = {}
+        # セグメント名（ディレクトリ） -> キー -> チャンク
+        self._live_chunks: Dict[str, Dict[str, List[Dict[str, Any]]]] = {}
+        self._segments: Dict[str, KnowledgeStore] = {}
+        self._document_frequencies: Dict[str, int] = {}
+
+    @property
+    def has_changes(self) -> bool:
+        """取り込み済みのインデックスとの差分があるか"""
+        return bool(self._segments) or any(mask.any() for mask in self._deleted.values())
+
+    @property
+    def live_file_count(self) -> int:
+        """セグメントに索引しているファイル数"""
+        return sum(state == _LIVE for state in self._states.values())
+
+    def poll(self) -> bool:
+        """
+        ナレッジベースを走査して差分を反映
+
+        Returns:
+            差分が変わったか（True なら overlay() で新しいインデックスを取得する）
+        """
+        changed = False
+        changed_segments = set()
+        seen = set()
+        for file_path in self.chunker.scan():
+            key = _file_key(str(file_path))
+            seen.add(key)
+            signature = stat_signature(file_path)
+            if signature is None or self._signatures.get(key) == signature:
+                continue
+            self._signatures[key] = signature
+
+            if key in self._base_files and self._matches_base(key, file_path, signature):
+                if self._states.get(key) != _BASE:
+                    changed_segments.add(self._use_base(key))
+                    changed = True
+                continue
+            chunks = self._load_chunks(file_path)
+            if chunks is not None:
+                changed_segments.add(self._use_live(key, file_path, chunks))
+                changed = True
+
+        for key, state in list(self._states.items()):
+            if key not in seen and state != _GONE:
+                changed_segments.add(self._remove(key))
+                self._signatures.pop(key, None)
+                changed = True
+
+        if not changed:
+            return False
+        for name in changed_segments - {None}:
+            self._rebuild_segment(name)
+        self.version += 1
+        return True
+
+    def overlay(self) -> ShardedKnowledgeStore:
+        """取り込み済みのインデックスに差分を重ねた新しいインデックス"""
+        replaced = {shard_no: self.base.shard(shard_no).without_docs(deleted)
+                    for shard_no, deleted in self._deleted.items() if deleted.any()}
+        added = [(name, self._segments[name]) for name in sorted(self._segments)]
+        return self.base.with_segments(replaced, added)
+
+    def _matches_base(self, key: str, file_path: Path, signature: Tuple[int, int]) -> bool:
+        """ファイルが取り込み時と同じ内容か（サイズ・更新日時が異なればハッシュで確認）"""
+        metadata = self._base_files[key][2]
+        if metadata.get("file_size") != signature[1]:
+            return False
+        try:
+            # 取り込み時と同じ形式（秒の浮動小数点から変換）で比較
+            if metadata.get("modified_time") == datetime.fromtimestamp(file_path.stat().st_mtime).isoformat():
+                return True
+            return self.chunker.file_hash(file_path) == metadata.get("file_hash")
+        except OSError:
+            return False
+
+    def _load_chunks(self, file_path: Path) -> Optional[List[Dict[str, Any]]]:
+        """ファイルを取り込みと同じ手順でチャンクに分割（読めなければNone）"""
+        try:
+            metadata = self.chunker.extract_metadata(file_path)
+            content = file_path.read_text(encoding='utf-8')
+            return self.chunker.chunk_content(content, metadata)
+        except Exception as e:
+            logger.warning(f"ライブ更新のファイル読み込みエラー {file_path}: {e}")
+            return None
+
+    def _segment_name(self, key: str) -> str:
+        return shard_name_for(key, self.chunker.knowledge_base_path)
+
+    def _set_deleted(self, key: str, deleted: bool) -> None:
+        """取り込み済みのチャンクの削除フラグを設定（フラグは複製してから書き換える）"""
+        if key not in self._base_files:
+            return
+        shard_no, file_id, _ = self._base_files[key]
+        shard = self.base.shard(shard_no)
+        mask = self._deleted.get(shard_no)
+        mask = np.zeros(shard.doc_count, dtype=bool) if mask is None else mask.copy()
+        mask[shard.file_docs(file_id)] = deleted
+        self._deleted[shard_no] = mask
+
+    def _drop_live(self, key: str) -> Optional[str]:
+        """セグメントからファイルのチャンクを外す（外したセグメント名、なければNone）"""
+        name = self._segment_name(key)
+        if self._live_chunks.get(name, {}).pop(key, None) is None:
+            return None
+        return name
+
+    def _use_base(self, key: str) -> Optional[str]:
+        """取り込み時の内容に戻ったファイルは取り込み済みのチャンクを使う（変わったセグメント名を返す）"""
+        self._set_deleted(key, False)
+        self._states[key] = _BASE
+        return self._drop_live(key)
+
+    def _use_live(self, key: str, file_path: Path, chunks: List[Dict[str, Any]]) -> str:
+        """追加・更新されたファイルのチャンクをセグメントに登録（セグメント名を返す）"""
+        self._set_deleted(key, True)
+        self._states[key] = _LIVE
+        name = self._segment_name(key)
+        self._live_chunks.setdefault(name, {})[key] = chunks
+        logger.info(f"ライブ更新: {file_path} ({len(chunks)}チャンク)")
+        return name
+
+    def _remove(self, key: str) -> Optional[str]:
+        """削除されたファイルを検索対象から外す（変わったセグメント名を返す）"""
+        self._set_deleted(key, True)
+        self._states[key] = _GONE
+        logger.info(f"ライブ更新: {key} を削除")
+        return self._drop_live(key)
+
+    def _document_frequency(self, term: str) -> int:
+        """取り込み済みのインデックスの文書頻度（インデックスは変わらないのでキャッシュする）"""
+        frequency = self._document_frequencies.get(term)
+        if frequency is None:
+            frequency = self._document_frequencies[term] = self.base.document_frequency(term)
+        return frequency
+
+    def _rebuild_segment(self, name: str) -> None:
+        """ディレクトリのセグメントを作り直す（チャンクがなければ削除）"""
+        chunks = [chunk for file_chunks in self._live_chunks.get(name, {}).values()
+                  for chunk in file_chunks]
+        if not chunks:
+            self._live_chunks.pop(name, None)
+            self._segments.pop(name, None)
+            return
+        self._segments[name] = self._build_segment(chunks)
+
+    def _build_segment(self, chunks: List[Dict[str, Any]]) -> KnowledgeStore:
+        """チャンクを取り込み済みのインデックスと同じ設定・統計でメモリ上に索引"""
+        reference = next((self.base.shard(shard_no) for shard_no, shard in enumerate(self.base.shards)
+                          if shard["doc_count"]), None)
+        if reference is None:
+            # 取り込み済みの文書がない（セグメント単独の統計で索引）
+            index = InvertedIndex(tokenizer=self.base.tokenizer, store_positions=True)
+            self._add_chunks(index, chunks)
+            return KnowledgeStore.from_bytes(build_store_bytes(chunks, index, facet_fields=self.facet_fields))
+
+        index = InvertedIndex(
+            k1=reference.k1, b=reference.b, tokenizer=self.base.tokenizer,
+            field_weights=reference.header["field_weights"],
+            store_positions=reference.has_positions
+        )
+        self._add_chunks(index, chunks)
+        frequencies: Counter = Counter({
+            term: self._document_frequency(term) + len(postings)
+            for term, postings in index.postings.items()
+        })
+        global_stats = {
+            "doc_count": reference.stats_doc_count + index.doc_count,
+            "avg_field_lengths": reference.header["avg_field_lengths"],
+            "document_frequencies": frequencies
+        }
+        return KnowledgeStore.from_bytes(
+            build_store_bytes(chunks, index, global_stats=global_stats, facet_fields=self.facet_fields)
+        )
+
+    @staticmethod
+    def _add_chunks(index: InvertedIndex, chunks: List[Dict[str, Any]]) -> None:
+        for chunk in chunks:
+            metadata = chunk["metadata"]
+            index.add_chunk(metadata["chunk_id"], chunk["content"], chunk["fields"],
+                            category=metadata.get("category", ""))
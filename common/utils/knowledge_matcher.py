@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+複数キーワードの一括照合（Aho–Corasick法）
+
+テキストスコアの計算では、クエリ語ごとに本文・メタデータ・見出しを走査していたため、
+語数に比例して走査回数が増えていました。TermMatcher はクエリ語の集合から
+Aho–Corasick オートマトンを構築し、1回の線形走査で全語の出現回数を数えます。
+出現回数は語ごとに重なりなしで数えるため、str.count と同じ値になります。
+
+いずれかの語に含まれる文字以外の位置では照合が必ず途切れるため、走査は
+それらの文字が連続する区間（正規表現で抽出）だけを対象にします。
+同じクエリで繰り返し検索される場合に備え、構築済みの照合器はキャッシュされます。
+
+CPython ではオートマトンの走査がインタプリタ上のループになるため、語数が少ない間は
+語ごとの str.count（C実装）の方が速く、逆転するのは数百語からです（同梱ナレッジで計測）。
+そのため語数が AUTOMATON_MIN_TERMS 未満の照合器は語ごとの str.count で数えます。
+どちらの方式でも出現回数は同じです。
+
+使用例:
+    from common.utils.knowledge_matcher import compile_term_matcher
+
+    matcher = compile_term_matcher(["api", "統合"])
+    counts = matcher.count(normalize_text(content))  # matcher.terms と同じ順序の出現回数
+"""
+
+import re
+from collections import deque
+from functools import lru_cache
+from typing import Dict, List, Iterable, Tuple
+
+# キャッシュする照合器の数
+MATCHER_CACHE_SIZE = 256
+
+# オートマトンで走査する最小の語数（これ未満は語ごとの str.count）
+AUTOMATON_MIN_TERMS = 256
+
+
+class TermMatcher:
+    """クエリ語集合の照合器（語数が多い場合はAho–Corasickオートマトン）"""
+
+    def __init__(self, terms: Iterable[str], min_automaton_terms: int = AUTOMATON_MIN_TERMS):
+        """
+        Args:
+            terms: 照合する語（空文字列・重複は除外）
+            min_automaton_terms: オートマトンで走査する最小の語数
+        """
+        self.terms: List[str] = list(dict.fromkeys(term for term in terms if term))
+        self._lengths = [len(term) for term in self.terms]
+        self.uses_automaton = len(self.terms) >= min_automaton_terms
+        self._segment_pattern = None
+        if self.uses_automaton:
+            self._build_automaton()
+
+    def _build_automaton(self) -> None:
+        """トライ・失敗遷移から決定性オートマトンを構築"""
+        # トライ（状態0が根）
+        goto: List[Dict[str, int]] = [{}]
+        outputs: List[Tuple[int, ...]] = [()]
+        for term_id, term in enumerate(self.terms):
+            state = 0
+            for char in term:
+                next_state = goto[state].get(char)
+                if next_state is None:
+                    next_state = len(goto)
+                    goto[state][char] = next_state
+                    goto.append({})
+                    outputs.append(())
+                state = next_state
+            outputs[state] += (term_id,)
+
+        # 失敗遷移を幅優先で求め、遷移表を決定性オートマトンに展開
+        fail = [0] * len(goto)
+        delta: List[Dict[str, int]] = [dict(goto[0])]
+        delta.extend({} for _ in range(len(goto) - 1))
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            transitions = dict(delta[fail[state]])
+            for char, next_state in goto[state].items():
+                fail[next_state] = delta[fail[state]].get(char, 0)
+                outputs[next_state] += outputs[fail[next_state]]
+                transitions[char] = next_state
+                queue.append(next_state)
+            delta[state] = transitions
+
+        self._delta = delta
+        self._outputs = outputs
+        alphabet = sorted({char for term in self.terms for char in term})
+        self._segment_pattern = (
+            re.compile("[" + "".join(re.escape(char) for char in alphabet) + "]+")
+            if alphabet else None
+        )
+
+    def __repr__(self) -> str:
+        return f"TermMatcher({self.terms!r}, uses_automaton={self.uses_automaton})"
+
+    def count(self, text: str) -> List[int]:
+        """
+        語ごとの出現回数（重なりなし、str.count と同じ値）
+
+        Args:
+            text: 対象テキスト（語と同じ正規化を済ませたもの）
+
+        Returns:
+            self.terms と同じ順序の出現回数
+        """
+        if not self.uses_automaton:
+            return [text.count(term) for term in self.terms]
+
+        counts = [0] * len(self.terms)
+        if self._segment_pattern is None or not text:
+            return counts
+
+        delta, outputs, lengths = self._delta, self._outputs, self._lengths
+        # 語ごとに次の出現として数えられる開始位置（重なり防止）
+        next_start = [0] * len(self.terms)
+        for segment in self._segment_pattern.finditer(text):
+            state = 0
+            position = segment.start()
+            for char in segment.group():
+                position += 1
+                state = delta[state].get(char, 0)
+                for term_id in outputs[state]:
+                    start = position - lengths[term_id]
+                    if start >= next_start[term_id]:
+                        counts[term_id] += 1
+                        next_start[term_id] = position
+        return counts
+
+
+@lru_cache(maxsize=MATCHER_CACHE_SIZE)
+def _compile(terms: Tuple[str, ...]) -> TermMatcher:
+    return TermMatcher(terms)
+
+
+def compile_term_matcher(terms: Iterable[str]) -> TermMatcher:
+    """
+    クエリ語の照合器を取得（同じ語集合では構築済みのものを再利用）
+
+    Args:
+        terms: 照合する語
+
+    Returns:
+        TermMatcher（terms は語の昇順）
+    """
+    return _compile(tuple(sorted(set(term for term in terms if term))))
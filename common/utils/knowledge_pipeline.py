@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""
+ナレッジ取り込みの並列パイプライン
+
+ファイル単位の処理を3段に分け、段の間を上限付きのキューでつなぎます。
+
+1. 解析（プロセスプール）: ハッシュ計算・読み込み・Front Matter抽出・チャンク分割（CPU処理）
+2. 埋め込み（スレッド）: 埋め込みAPIの呼び出し（待ち時間が主のI/O処理）
+3. 書き込み（呼び出し元のスレッド1本）: Vector DB・ローカルインデックスへの登録
+
+後段が詰まるとキューが一杯になって前段が待つため、段の間に溜まるファイルは
+並列数 × QUEUE_SIZE_PER_WORKER 件までです。書き込みは1スレッドだけが行うので、
+書き込み先はスレッドセーフである必要がありません。
+処理履歴と一致するハッシュのファイル（未変更）は、解析段でチャンク分割を省いて書き込み段に渡します。
+
+使用例:
+    from common.utils.knowledge_pipeline import IngestPipeline
+
+    pipeline = IngestPipeline(config, Path("common/knowledge"), embed=create_embeddings,
+                              write=save_file, workers=4)
+    success_count = pipeline.run(files, known_hashes)
+    pipeline.log_stats()
+"""
+
+import queue
+import threading
+import time
+from concurrent.futures import (
+    Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor, FIRST_COMPLETED, wait
+)
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Any
+import logging
+
+from .knowledge_chunker import KnowledgeChunker
+
+logger = logging.getLogger(__name__)
+
+# 段の間のキューの長さ（並列数あたり）
+QUEUE_SIZE_PER_WORKER = 4
+
+# 段の終了を後段に伝える目印
+_DONE = None
+
+# 解析段のワーカーが使うチャンク分割（プロセスごとに初期化）
+_worker_chunker: Optional[KnowledgeChunker] = None
+
+
+def _init_worker(config: Dict[str, Any], knowledge_base_path: Path) -> None:
+    """解析段のワーカーの初期化"""
+    global _worker_chunker
+    _worker_chunker = KnowledgeChunker(config, knowledge_base_path)
+
+
+def prepare_file(file_path: str, known_hash: Optional[str] = None) -> Dict[str, Any]:
+    """
+    ファイルのメタデータ抽出・チャンク分割（解析段のワーカーで実行）
+
+    Args:
+        file_path: ファイルパス
+        known_hash: 処理履歴のハッシュ（一致すれば未変更としてチャンク分割を省く）
+
+    Returns:
+        file_path, metadata, chunks（未変更ならNone）, error（失敗時のメッセージ）, seconds（処理時間）
+    """
+    start = time.perf_counter()
+    result: Dict[str, Any] = {"file_path": file_path, "metadata": None, "chunks": None, "error": None}
+    try:
+        path = Path(file_path)
+        metadata = _worker_chunker.extract_metadata(path)
+        result["metadata"] = metadata
+        if known_hash is None or metadata["file_hash"] != known_hash:
+            result["chunks"] = _worker_chunker.chunk_content(path.read_text(encoding='utf-8'), metadata)
+    except Exception as e:
+        result["error"] = str(e)
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+
+class StageStats:
+    """段ごとの処理件数・稼働時間（スレッドセーフ）"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self.files = 0
+        self.chunks = 0
+        self.busy_seconds = 0.0
+        self.finished_at: Optional[float] = None
+
+    def add(self, chunks: int, seconds: float) -> None:
+        """
+        1ファイル分を記録
+
+        Args:
+            chunks: 処理したチャンク数
+            seconds: 処理時間（ワーカー1つあたり）
+        """
+        with self._lock:
+            self.files += 1
+            self.chunks += chunks
+            self.busy_seconds += seconds
+            self.finished_at = time.perf_counter()
+
+    def summary(self, started_at: float) -> str:
+        """スループットの要約（経過時間はパイプライン開始からこの段の最後の完了まで）"""
+        elapsed = (self.finished_at - started_at) if self.finished_at else 0.0
+        if elapsed <= 0:
+            return f"{self.name}: 0ファイル"
+        return (f"{self.name}: {self.files}ファイル / {self.chunks}チャンク, "
+                f"{self.files / elapsed:.1f}ファイル/秒, {self.chunks / elapsed:.1f}チャンク/秒 "
+                f"(稼働 {self.busy_seconds:.2f}秒, 経過 {elapsed:.2f}秒)")
+
+
+class IngestPipeline:
+    """解析（プロセス）→ 埋め込み（スレッド）→ 書き込み（単一スレッド）のパイプライン"""
+
+    def __init__(self, config: Dict[str, Any], knowledge_base_path: Path,
+                 embed: Callable[[List[Dict[str, Any]]], List[Dict[str, Any]]],
+                 write: Callable[[Dict[str, Any], List[Dict[str, Any]]], bool],
+                 workers: int = 4, embed_workers: Optional[int] = None):
+        """
+        Args:
+            config: 設定（解析段のチャンク分割に使用）
+            knowledge_base_path: ナレッジベースのルート
+            embed: チャンクに埋め込みを付ける関数（埋め込み段のスレッドから呼ぶ）
+            write: (メタデータ, チャンク) を書き込み成否を返す関数（書き込み段のみから呼ぶ）
+            workers: 解析段のプロセス数
+            embed_workers: 埋め込み段のスレッド数（None=workers と同じ）
+        """
+        self.config = config
+        self.knowledge_base_path = Path(knowledge_base_path)
+        self.embed = embed
+        self.write = write
+        self.workers = max(1, workers)
+        self.embed_workers = max(1, embed_workers or self.workers)
+        self.queue_size = self.workers * QUEUE_SIZE_PER_WORKER
+        self.stats = {
+            "parse": StageStats("解析"),
+            "embed": StageStats("埋め込み"),
+            "write": StageStats("書き込み"),
+        }
+        self._started_at = time.perf_counter()
+
+    def run(self, files: List[Path], known_hashes: Optional[Dict[str, str]] = None) -> int:
+        """
+        ファイルを処理
+
+        Args:
+            files: 処理するファイル
+            known_hashes: ファイルパス -> 処理履歴のハッシュ（一致するファイルは未変更としてスキップ）
+
+        Returns:
+            成功したファイル数（未変更でスキップしたファイルを含む）
+        """
+        known_hashes = known_hashes or {}
+        self._started_at = time.perf_counter()
+        parsed: queue.Queue = queue.Queue(maxsize=self.queue_size)
+        embedded: queue.Queue = queue.Queue(maxsize=self.queue_size)
+        executor = self._create_executor()
+
+        def feed() -> None:
+            # 投入数を抑えてプロセスプールに渡し、完了したものから埋め込み段へ
+            try:
+                in_flight: Dict[Future, str] = {}
+                for file_path in files:
+                    future = executor.submit(prepare_file, str(file_path), known_hashes.get(str(file_path)))
+                    in_flight[future] = str(file_path)
+                    if len(in_flight) >= self.queue_size:
+                        done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            parsed.put(self._parsed_result(future, in_flight.pop(future)))
+                for future in list(in_flight):
+                    parsed.put(self._parsed_result(future, in_flight.pop(future)))
+            finally:
+                for _ in range(self.embed_workers):
+                    parsed.put(_DONE)
+
+        def embed_loop() -> None:
+            try:
+                while True:
+                    item = parsed.get()
+                    if item is _DONE:
+                        return
+                    if item["chunks"]:
+                        start = time.perf_counter()
+                        try:
+                            item["chunks"] = self.embed(item["chunks"])
+                        except Exception as e:
+                            item["error"] = f"埋め込み生成エラー: {e}"
+                        self.stats["embed"].add(len(item["chunks"]), time.perf_counter() - start)
+                    embedded.put(item)
+            finally:
+                embedded.put(_DONE)
+
+        threads = [threading.Thread(target=feed, name="ingest-parse", daemon=True)]
+        threads += [threading.Thread(target=embed_loop, name=f"ingest-embed-{i}", daemon=True)
+                    for i in range(self.embed_workers)]
+        for thread in threads:
+            thread.start()
+
+        success_count = 0
+        running = self.embed_workers
+        completed = False
+        try:
+            while running:
+                item = embedded.get()
+                if item is _DONE:
+                    running -= 1
+                    continue
+                if self._write_item(item):
+                    success_count += 1
+            completed = True
+        finally:
+            # 中断時は待たずに打ち切る（前段のスレッドはデーモン）
+            executor.shutdown(wait=completed, cancel_futures=not completed)
+            if completed:
+                for thread in threads:
+                    thread.join()
+        return success_count
+
+    def log_stats(self) -> None:
+        """段ごとのスループットをログに出力"""
+        logger.info(f"パイプライン統計 (解析 {self.workers}プロセス, 埋め込み {self.embed_workers}スレッド, "
+                    f"合計 {time.perf_counter() - self._started_at:.2f}秒)")
+        for stats in self.stats.values():
+            logger.info(f"  {stats.summary(self._started_at)}")
+
+    def _create_executor(self) -> Executor:
+        """解析段のプロセスプール（作成できない環境ではスレッドで代用）"""
+        init_args = (self.config, self.knowledge_base_path)
+        try:
+            return ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                       initargs=init_args)
+        except (OSError, NotImplementedError) as e:
+            logger.warning(f"プロセスプールを作成できないため、スレッドで解析します: {e}")
+            _init_worker(*init_args)
+            return ThreadPoolExecutor(max_workers=self.workers)
+
+    def _parsed_result(self, future: Future, file_path: str) -> Dict[str, Any]:
+        """解析段の結果を取り出して記録（ワーカーの異常終了もエラー結果にする）"""
+        try:
+            result = future.result()
+        except Exception as e:
+            return {"file_path": file_path, "metadata": None, "chunks": None,
+                    "error": f"解析ワーカーの異常終了: {e}", "seconds": 0.0}
+        self.stats["parse"].add(len(result["chunks"] or []), result["seconds"])
+        return result
+
+    def _write_item(self, item: Dict[str, Any]) -> bool:
+        """1ファイル分を書き込み（書き込み段）"""
+        file_path = item["file_path"]
+        if item["error"]:
+            logger.error(f"ファイル処理エラー {file_path}: {item['error']}")
+            return False
+        if item["chunks"] is None:
+            logger.info(f"ファイル未変更のためスキップ: {file_path}")
+            return True
+
+        start = time.perf_counter()
+        try:
+            success = self.write(item["metadata"], item["chunks"])
+        except Exception as e:
+            logger.error(f"ファイル処理エラー {file_path}: {e}")
+            success = False
+        self.stats["write"].add(len(item["chunks"]), time.perf_counter() - start)
+        return success
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+フレーズ・近接検索とスニペット
+
+取り込み時にバイナリインデックスへ保存した本文の出現位置（語位置・文字位置）を使い、
+本文を再走査せずに次を求めます。
+
+- 引用符で囲んだフレーズ（"API統合"・「料金プラン」・“…”）を含む文書への絞り込み
+- クエリの語が近接して出現する文書のスコアのブースト
+- 検索結果のスニペット（クエリの語が最も集まっている区間）
+
+位置の照合は、フレーズの語をすべて含む文書（ポスティングの積集合）と、
+BM25F の上位候補の文書に対してだけ行います。
+
+近接度はクエリの各語（空白区切りの語・フレーズ）の出現を1つずつ含む最小区間から求め、
+語の間の文字数 gap に対して window / (window + gap) とします（隣接していれば1.0）。
+近接ブースト後のスコアは BM25F × (1 + weight × 近接度) で、正規化の上限も (1 + weight) 倍します。
+
+使用例:
+    from common.utils.knowledge_positions import PositionalQuery
+
+    query = PositionalQuery('"API統合" 料金', store.tokenizer)
+    hits = store.search(query.terms, limit=5, query=query)
+"""
+
+import heapq
+import re
+from collections import Counter
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+# フレーズの引用符（半角 "…"・全角 “…”・かぎ括弧 「…」）
+PHRASE_PATTERN = re.compile(r'"([^"]+)"|“([^”]+)”|「([^」]+)」')
+
+DEFAULT_PROXIMITY_WEIGHT = 0.5
+DEFAULT_PROXIMITY_WINDOW = 10
+DEFAULT_PROXIMITY_CANDIDATES = 100
+DEFAULT_SNIPPET_CHARS = 300
+
+# 語位置パターン（索引語, 先頭の語からの相対語位置）
+Pattern = List[Tuple[str, int]]
+
+
+def _pattern(tokenizer, text: str) -> Pattern:
+    """テキストを語位置パターンに変換"""
+    tokens = tokenizer.tokenize_with_positions(text)
+    if not tokens:
+        return []
+    base = min(position for _, position, _ in tokens)
+    return list(dict.fromkeys((term, position - base) for term, position, _ in tokens))
+
+
+def pattern_length(pattern: Pattern) -> int:
+    """パターンが占める語位置の長さ"""
+    return max((offset + len(term) for term, offset in pattern), default=0)
+
+
+class PositionalQuery:
+    """フレーズ・近接の評価に使うクエリの解析結果"""
+
+    def __init__(self, query: str, tokenizer,
+                 proximity_weight: float = DEFAULT_PROXIMITY_WEIGHT,
+                 proximity_window: int = DEFAULT_PROXIMITY_WINDOW,
+                 proximity_candidates: int = DEFAULT_PROXIMITY_CANDIDATES):
+        """
+        Args:
+            query: 検索クエリ（引用符で囲んだ部分はフレーズ）
+            tokenizer: インデックスと同じトークナイザ
+            proximity_weight: 近接ブーストの重み（0=ブーストしない）
+            proximity_window: 語間の文字数がこの値でブーストが半減
+            proximity_candidates: 近接度を評価する上位候補数（BM25F順）
+        """
+        phrases = [next(group for group in match.groups() if group)
+                   for match in PHRASE_PATTERN.finditer(query)]
+        rest = PHRASE_PATTERN.sub(" ", query)
+
+        # BM25F の対象は引用符の有無によらずクエリ全体の索引語
+        self.terms: List[str] = tokenizer.tokenize(query)
+        self.phrases: List[Pattern] = [pattern for pattern in (_pattern(tokenizer, text) for text in phrases)
+                                       if pattern]
+        self.words: List[Pattern] = self.phrases + [
+            pattern for pattern in (_pattern(tokenizer, word) for word in rest.split()) if pattern
+        ]
+        self.proximity_weight = max(0.0, float(proximity_weight))
+        self.proximity_window = max(1, int(proximity_window))
+        self.proximity_candidates = max(1, int(proximity_candidates))
+
+    def __repr__(self) -> str:
+        return f"PositionalQuery(phrases={self.phrases!r}, words={len(self.words)})"
+
+    @property
+    def uses_proximity(self) -> bool:
+        """近接ブーストを行うか（語が2つ以上ある場合）"""
+        return self.proximity_weight > 0 and len(self.words) >= 2
+
+    def proximity(self, gap: Optional[int]) -> float:
+        """語間の文字数から近接度（0.0〜1.0、全語が揃わなければ0）"""
+        if gap is None:
+            return 0.0
+        return self.proximity_window / (self.proximity_window + max(gap, 0))
+
+
+def min_span_gap(occurrences: List[np.ndarray], lengths: List[int]) -> Optional[int]:
+    """
+    各語の出現を1つずつ含む最小区間の、語の長さを除いた文字数
+
+    語ごとのソート済み出現位置を先頭から併合し、区間の左端を1つずつ進めます。
+
+    Args:
+        occurrences: 語ごとの出現位置（語位置、昇順）
+        lengths: 語ごとの長さ（語位置）
+
+    Returns:
+        語の間の文字数（いずれかの語が出現しなければNone）
+    """
+    if not occurrences or any(len(positions) == 0 for positions in occurrences):
+        return None
+
+    heap = [(int(positions[0]), word, 0) for word, positions in enumerate(occurrences)]
+    heapq.heapify(heap)
+    end = max(start + lengths[word] for start, word, _ in heap)
+    best = end - heap[0][0]
+    while True:
+        start, word, i = heap[0]
+        best = min(best, end - start)
+        if i + 1 == len(occurrences[word]):
+            break
+        next_start = int(occurrences[word][i + 1])
+        heapq.heapreplace(heap, (next_start, word, i + 1))
+        end = max(end, next_start + lengths[word])
+    return best - sum(lengths)
+
+
+def make_snippet(content: str, matches: List[Tuple[int, str]],
+                 width: int = DEFAULT_SNIPPET_CHARS) -> Optional[str]:
+    """
+    クエリの語が最も集まっている区間を切り出す
+
+    Args:
+        content: チャンク本文
+        matches: (本文での文字位置, 索引語) のリスト（インデックスの出現位置）
+        width: スニペットの文字数
+
+    Returns:
+        スニペット（語が出現しなければNone、本文が width 以下なら本文全体）
+    """
+    if not matches:
+        return None
+    if len(content) <= width:
+        return content
+
+    matches = sorted(matches)
+    best = (0, 0, 0, 0)  # (異なる語の数, 出現数, 区間の先頭, 区間の末尾)
+    counts: Counter = Counter()
+    right = 0
+    for left in range(len(matches)):
+        while right < len(matches) and matches[right][0] + len(matches[right][1]) <= matches[left][0] + width:
+            counts[matches[right][1]] += 1
+            right += 1
+        if right == left:
+            # 語自体が width より長い場合は区間に含めない
+            right = left + 1
+            continue
+        key = (len(counts), right - left)
+        if key > best[:2]:
+            best = key + (matches[left][0], matches[right - 1][0] + len(matches[right - 1][1]))
+        counts[matches[left][1]] -= 1
+        if counts[matches[left][1]] == 0:
+            del counts[matches[left][1]]
+
+    # 語の集まっている区間を中央に置く
+    covered_start, covered_end = best[2], best[3]
+    start = max(0, covered_start - (width - (covered_end - covered_start)) // 2)
+    start = min(start, len(content) - width)
+    end = start + width
+    return ("..." if start > 0 else "") + content[start:end] + ("..." if end < len(content) else "")
@@ -0,0 +1,601 @@
+#!/usr/bin/env python3
+"""
+関連文書テーブル
+
+取り込み時に文書（ファイル）単位のベクトルを作り、各文書と類似度の高い上位N件を
+related_documents.json に事前計算しておきます。検索側の get_related_documents は
+このテーブルを引くだけになります。
+
+文書ベクトル:
+    - embedding: チャンク埋め込みの重心（全文書に埋め込みがある場合）
+    - tfidf: 文書内の索引語のTF-IDF（他の文書にも出現する語のうち重みの大きいもののみ保持）
+    いずれもL2正規化し、コサイン類似度で比較します。
+
+差分更新:
+    変更・追加された文書の行と、近傍に変更・削除された文書を含んでいた行だけを再計算し、
+    それ以外の行には変更文書との類似度を差し込みます（コサイン類似度は対称なため、
+    変更文書の行の計算結果をそのまま使えます）。TF-IDFの場合、未変更の行のスコアは
+    前回のIDFで計算されたままになるため、定期的に全件再計算してください。
+    文書ベクトルは related_vectors.npz に保存し、セグメント追記時は変更文書のチャンクだけから
+    update_related_table でベクトルとテーブルを更新します。
+
+使用例:
+    from common.utils.knowledge_related import build_related_table, write_related_table
+
+    table, vectors = build_related_table(chunks, tokenizer, top_n=10, max_workers=4)
+    write_related_table(index_path, table, vectors)
+"""
+
+import json
+import math
+import os
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Any, Tuple, Iterable
+import logging
+
+import numpy as np
+
+from .vector_index import normalize_rows
+
+logger = logging.getLogger(__name__)
+
+RELATED_FILE = "related_documents.json"
+# 差分更新用に保存する文書ベクトル（取り込み時に未変更の文書のチャンクを読み込まずに済む）
+RELATED_VECTORS_FILE = "related_vectors.npz"
+RELATED_VERSION = 1
+DEFAULT_TOP_N = 10
+
+# TF-IDFベクトルで文書ごとに保持する語数
+MAX_TFIDF_TERMS = 64
+
+# 類似度を一度に計算するブロックの最大要素数（行数×文書数）
+_BLOCK_ELEMENTS = 4_000_000
+
+
+def _ranges(starts: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    """[starts[i], starts[i] + lengths[i]) を連結した位置の配列"""
+    total = int(lengths.sum())
+    if total == 0:
+        return np.zeros(0, dtype=np.int64)
+    offsets = np.repeat(starts.astype(np.int64) - np.cumsum(lengths) + lengths, lengths)
+    return offsets + np.arange(total)
+
+
+class DocumentVectors:
+    """文書単位の正規化済みベクトル（密な埋め込み重心、または疎なTF-IDF）"""
+
+    def __init__(self, file_paths: List[str], method: str,
+                 dense: Optional[np.ndarray] = None,
+                 sparse: Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]] = None,
+                 terms: Optional[List[str]] = None,
+                 document_frequencies: Optional[np.ndarray] = None):
+        """
+        Args:
+            file_paths: 文書（ファイルパス）の一覧
+            method: ベクトルの種類（embedding / tfidf）
+            dense: 文書数×次元の正規化済み行列
+            sparse: 疎ベクトルのCSR表現 (indptr, term_ids, weights)
+            terms: TF-IDFの語の一覧（term_ids の参照先）
+            document_frequencies: 語ごとの文書頻度（差分更新で追加文書のIDFに使用）
+        """
+        self.file_paths = file_paths
+        self.method = method
+        self.index = {file_path: i for i, file_path in enumerate(file_paths)}
+        self.dense = dense
+        self.terms = terms
+        self.document_frequencies = document_frequencies
+
+        if sparse is not None:
+            indptr, term_ids, weights = sparse
+            self._indptr, self._term_ids, self._weights = indptr, term_ids, weights
+            # 語ごとの文書リスト（CSC）
+            order = np.argsort(term_ids, kind="stable")
+            rows = np.repeat(np.arange(len(file_paths)), np.diff(indptr))
+            self._col_rows = rows[order]
+            self._col_weights = weights[order]
+            term_count = int(term_ids.max()) + 1 if len(term_ids) else 0
+            self._col_ptr = np.zeros(term_count + 1, dtype=np.int64)
+            self._col_ptr[1:] = np.cumsum(np.bincount(term_ids, minlength=term_count))
+
+    @property
+    def size(self) -> int:
+        """文書数"""
+        return len(self.file_paths)
+
+    def similarity_block(self, rows: np.ndarray) -> np.ndarray:
+        """
+        指定した文書と全文書とのコサイン類似度
+
+        Args:
+            rows: 文書番号の配列
+
+        Returns:
+            len(rows)×文書数 の類似度行列
+        """
+        if self.dense is not None:
+            return self.dense[rows] @ self.dense.T
+
+        # 疎ベクトル: 行の語ごとに語の文書リストを展開し、(行, 文書) ごとに重みの積を集計
+        starts = self._indptr[rows]
+        lengths = self._indptr[rows + 1] - starts
+        entries = _ranges(starts, lengths)
+        entry_rows = np.repeat(np.arange(len(rows)), lengths)
+        entry_terms = self._term_ids[entries]
+
+        column_starts = self._col_ptr[entry_terms]
+        column_lengths = self._col_ptr[entry_terms + 1] - column_starts
+        positions = _ranges(column_starts, column_lengths)
+        pair_rows = np.repeat(entry_rows, column_lengths)
+        pair_weights = np.repeat(self._weights[entries], column_lengths) * self._col_weights[positions]
+
+        scores = np.bincount(pair_rows * self.size + self._col_rows[positions],
+                             weights=pair_weights, minlength=len(rows) * self.size)
+        return scores.reshape(len(rows), self.size)
+
+
+def _group_by_file(chunks: Iterable[Dict[str, Any]]) -> Dict[str, List[Dict[str, Any]]]:
+    """チャンクをファイルごとにまとめる（チャンク番号順）"""
+    files: Dict[str, List[Dict[str, Any]]] = {}
+    for chunk in chunks:
+        file_path = chunk.get("metadata", {}).get("file_path", "")
+        files.setdefault(file_path, []).append(chunk)
+    for file_chunks in files.values():
+        file_chunks.sort(key=lambda chunk: _chunk_order(chunk.get("metadata", {}).get("chunk_index", 0)))
+    return dict(sorted(files.items()))
+
+
+def _chunk_order(chunk_index: Any) -> Tuple[int, ...]:
+    """チャンク番号の並び順（大きなセクションを分割したチャンクは "セクション番号.分割番号" の文字列）"""
+    try:
+        return tuple(int(part) for part in str(chunk_index).split("."))
+    except ValueError:
+        return (0,)
+
+
+def document_vectors(files: Dict[str, List[Dict[str, Any]]], tokenizer,
+                     method: str = "auto") -> DocumentVectors:
+    """
+    ファイルごとのチャンクから文書ベクトルを作成
+
+    Args:
+        files: ファイルパス -> チャンクのリスト
+        tokenizer: TF-IDFで使うトークナイザ
+        method: auto（全文書に埋め込みがあれば embedding、なければ tfidf）/ embedding / tfidf
+
+    Returns:
+        文書ベクトル
+    """
+    file_paths = list(files)
+
+    if method in ("auto", "embedding"):
+        centroids = []
+        for file_chunks in files.values():
+            embeddings = [chunk["embedding"] for chunk in file_chunks if chunk.get("embedding")]
+            if not embeddings:
+                break
+            centroids.append(np.mean(normalize_rows(np.asarray(embeddings, dtype=np.float32)), axis=0))
+        if len(centroids) == len(file_paths) and len({len(c) for c in centroids}) <= 1:
+            dense = normalize_rows(np.vstack(centroids)) if centroids else np.zeros((0, 0), np.float32)
+            return DocumentVectors(file_paths, "embedding", dense=dense)
+        if method == "embedding":
+            logger.warning("埋め込みのない文書があるため、関連文書はTF-IDFで計算します")
+
+    term_counts = [_term_counts(file_chunks, tokenizer) for file_chunks in files.values()]
+    document_frequencies: Counter = Counter()
+    for counts in term_counts:
+        document_frequencies.update(counts.keys())
+
+    terms = list(document_frequencies)
+    vocabulary = {term: term_id for term_id, term in enumerate(terms)}
+    frequencies = np.array([document_frequencies[term] for term in terms], dtype=np.int64)
+    rows = [_tfidf_row(counts, vocabulary, frequencies, len(file_paths)) for counts in term_counts]
+    return DocumentVectors(file_paths, "tfidf", sparse=_stack_rows(rows), terms=terms,
+                           document_frequencies=frequencies)
+
+
+def _term_counts(file_chunks: List[Dict[str, Any]], tokenizer) -> Counter:
+    """文書（ファイル）内の語の出現回数"""
+    counts: Counter = Counter()
+    for chunk in file_chunks:
+        counts.update(tokenizer.tokenize(chunk.get("content", "")))
+    return counts
+
+
+def _tfidf_row(counts: Counter, vocabulary: Dict[str, int], document_frequencies: np.ndarray,
+               doc_count: int) -> Tuple[np.ndarray, np.ndarray]:
+    """文書のTF-IDFベクトル（重みの大きい順の (語番号, 正規化済みの重み)）"""
+    scored = []
+    for term, tf in counts.items():
+        df = int(document_frequencies[vocabulary[term]])
+        scored.append(((1.0 + math.log(tf)) * math.log((1.0 + doc_count) / (1.0 + df)), df, term))
+    # ノルムは全語で求め、保持するのは他の文書にも出現する語（類似度に寄与する語）のみ
+    norm = math.sqrt(sum(weight * weight for weight, _, _ in scored)) or 1.0
+    shared = [(weight, term) for weight, df, term in scored if weight > 0 and df > 1]
+    top = sorted(shared, reverse=True)[:MAX_TFIDF_TERMS]
+    return (np.array([vocabulary[term] for _, term in top], dtype=np.int64),
+            np.array([weight / norm for weight, _ in top], dtype=np.float64))
+
+
+def _stack_rows(rows: List[Tuple[np.ndarray, np.ndarray]]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """文書ごとの (語番号, 重み) をCSR表現にまとめる"""
+    indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum([len(term_ids) for term_ids, _ in rows])
+    if not rows:
+        return indptr, np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64)
+    return (indptr, np.concatenate([term_ids for term_ids, _ in rows]),
+            np.concatenate([weights for _, weights in rows]))
+
+
+def _sparse_row(vectors: DocumentVectors, row: int) -> Tuple[np.ndarray, np.ndarray]:
+    """疎ベクトルの1文書分の (語番号, 重み)"""
+    start, end = vectors._indptr[row], vectors._indptr[row + 1]
+    return vectors._term_ids[start:end], vectors._weights[start:end]
+
+
+def update_document_vectors(previous: DocumentVectors, files: Dict[str, List[Dict[str, Any]]],
+                            tokenizer) -> Optional[DocumentVectors]:
+    """
+    保存済みの文書ベクトルに、変更・追加された文書のベクトルを差し替え・追加
+
+    未変更の文書のベクトルは計算し直しません。TF-IDFの文書頻度には追加された文書の語と初出の語だけを
+    加えます（変更前の版の語は引かない）。全件計算まで近似になる点は未変更の行のIDFと同じです。
+
+    Args:
+        previous: 保存済みの文書ベクトル
+        files: 変更・追加されたファイルのパス -> チャンクのリスト
+        tokenizer: TF-IDFで使うトークナイザ
+
+    Returns:
+        更新した文書ベクトル（変更文書に埋め込みがないなど、差分で更新できなければNone）
+    """
+    file_paths = sorted(set(previous.file_paths) | set(files))
+
+    if previous.method == "embedding":
+        if previous.dense is None or previous.size == 0:
+            return None
+        centroids: Dict[str, np.ndarray] = {}
+        for file_path, file_chunks in files.items():
+            embeddings = [chunk["embedding"] for chunk in file_chunks if chunk.get("embedding")]
+            if not embeddings or len(embeddings[0]) != previous.dense.shape[1]:
+                return None
+            centroids[file_path] = np.mean(normalize_rows(np.asarray(embeddings, dtype=np.float32)), axis=0)
+        dense = np.vstack([centroids[file_path] if file_path in centroids
+                           else previous.dense[previous.index[file_path]] for file_path in file_paths])
+        return DocumentVectors(file_paths, "embedding", dense=normalize_rows(dense))
+
+    if previous.terms is None or previous.document_frequencies is None:
+        return None
+    terms = list(previous.terms)
+    vocabulary = {term: term_id for term_id, term in enumerate(terms)}
+    frequencies = list(previous.document_frequencies)
+    term_counts = {file_path: _term_counts(file_chunks, tokenizer) for file_path, file_chunks in files.items()}
+    for file_path, counts in term_counts.items():
+        for term in counts:
+            if term not in vocabulary:
+                vocabulary[term] = len(terms)
+                terms.append(term)
+                frequencies.append(1)
+            elif file_path not in previous.index:
+                frequencies[vocabulary[term]] += 1
+    document_frequencies = np.array(frequencies, dtype=np.int64)
+
+    rows = [_tfidf_row(term_counts[file_path], vocabulary, document_frequencies, len(file_paths))
+            if file_path in term_counts else _sparse_row(previous, previous.index[file_path])
+            for file_path in file_paths]
+    return DocumentVectors(file_paths, "tfidf", sparse=_stack_rows(rows), terms=terms,
+                           document_frequencies=document_frequencies)
+
+
+def compute_neighbours(vectors: DocumentVectors, rows: np.ndarray, top_n: int,
+                       max_workers: int = 1, column_tops: bool = False
+                       ) -> Tuple[Dict[int, List[Tuple[int, float]]],
+                                  Optional[Tuple[np.ndarray, np.ndarray]]]:
+    """
+    指定した文書の上位N件の近傍を計算（ブロック単位、複数ブロックはスレッドで並列実行）
+
+    Args:
+        vectors: 文書ベクトル
+        rows: 計算する文書番号
+        top_n: 近傍の件数
+        max_workers: 並列数
+        column_tops: 各文書から見た、rows の中での上位N件も求めるか（差分更新用）
+
+    Returns:
+        (行の文書番号 -> [(近傍の文書番号, 類似度)],
+         column_tops=True なら各文書から見た rows 内の上位 (文書番号, 類似度) の
+         top_n×文書数 の配列の組、それ以外はNone)
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    block_size = max(1, _BLOCK_ELEMENTS // max(1, vectors.size))
+    blocks = [rows[start:start + block_size] for start in range(0, len(rows), block_size)]
+
+    def run(block: np.ndarray):
+        similarities = vectors.similarity_block(block)
+        similarities[np.arange(len(block)), block] = -np.inf  # 自分自身を除外
+
+        row_result = {int(row): _top(similarities[i], np.arange(vectors.size), top_n)
+                      for i, row in enumerate(block)}
+        column_result = None
+        if column_tops:
+            top = _column_top(similarities, top_n)
+            column_result = (block[top], np.take_along_axis(similarities, top, axis=0))
+        return row_result, column_result
+
+    if max_workers > 1 and len(blocks) > 1:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(blocks))) as executor:
+            block_results = list(executor.map(run, blocks))
+    else:
+        block_results = [run(block) for block in blocks]
+
+    row_neighbours: Dict[int, List[Tuple[int, float]]] = {}
+    column_neighbours: Optional[Tuple[np.ndarray, np.ndarray]] = None
+    for row_result, column_result in block_results:
+        row_neighbours.update(row_result)
+        if column_result is None:
+            continue
+        # ブロックごとの列の上位をつなげて、上位N件だけを残す
+        docs, values = column_result
+        if column_neighbours is not None:
+            docs = np.vstack([column_neighbours[0], docs])
+            values = np.vstack([column_neighbours[1], values])
+        top = _column_top(values, top_n)
+        column_neighbours = (np.take_along_axis(docs, top, axis=0),
+                             np.take_along_axis(values, top, axis=0))
+    return row_neighbours, column_neighbours
+
+
+def _column_top(values: np.ndarray, top_n: int) -> np.ndarray:
+    """列ごとの上位N件の行番号（top_n×列数、順不同）"""
+    if len(values) <= top_n:
+        return np.broadcast_to(np.arange(len(values))[:, np.newaxis], values.shape)
+    return np.argpartition(-values, top_n - 1, axis=0)[:top_n]
+
+
+def _top(scores: np.ndarray, docs: np.ndarray, top_n: int) -> List[Tuple[int, float]]:
+    """類似度が正の上位N件を降順で取り出す"""
+    if len(scores) > top_n:
+        top = np.argpartition(-scores, top_n - 1)[:top_n]
+    else:
+        top = np.arange(len(scores))
+    top = top[np.argsort(-scores[top], kind="stable")]
+    return [(int(docs[i]), float(scores[i])) for i in top if scores[i] > 0]
+
+
+def build_related_table(chunks: Iterable[Dict[str, Any]], tokenizer, top_n: int = DEFAULT_TOP_N,
+                        method: str = "auto", previous: Optional[Dict[str, Any]] = None,
+                        changed_files: Optional[Iterable[str]] = None, max_workers: int = 1,
+                        full_rebuild_ratio: float = 0.2) -> Tuple[Dict[str, Any], DocumentVectors]:
+    """
+    関連文書テーブルを構築（前回のテーブルがあれば差分更新）
+
+    Args:
+        chunks: 全チャンク
+        tokenizer: TF-IDFで使うトークナイザ
+        top_n: 文書ごとの関連文書数
+        method: 文書ベクトルの種類（auto / embedding / tfidf）
+        previous: 前回のテーブル（None=全件計算）
+        changed_files: 前回から変更・追加されたファイル（None=全件計算）
+        max_workers: 類似度計算の並列数
+        full_rebuild_ratio: 変更文書の割合がこれを超えたら全件計算
+
+    Returns:
+        (関連文書テーブル, 文書ベクトル)
+    """
+    files = _group_by_file(chunks)
+    vectors = document_vectors(files, tokenizer, method)
+    table = _related_table(vectors, _document_entries(files), top_n, previous, changed_files,
+                           max_workers, full_rebuild_ratio)
+    return table, vectors
+
+
+def update_related_table(chunks: Iterable[Dict[str, Any]], tokenizer, previous: Dict[str, Any],
+                         previous_vectors: DocumentVectors, top_n: int = DEFAULT_TOP_N,
+                         method: str = "auto", max_workers: int = 1,
+                         full_rebuild_ratio: float = 0.2) -> Optional[Tuple[Dict[str, Any], DocumentVectors]]:
+    """
+    変更・追加されたファイルのチャンクと保存済みの文書ベクトルから関連文書テーブルを差分更新
+
+    未変更の文書のチャンクは読み込みません（文書の情報は前回のテーブルのものを使います）。
+
+    Args:
+        chunks: 変更・追加されたファイルのチャンク
+        tokenizer: TF-IDFで使うトークナイザ
+        previous: 前回のテーブル
+        previous_vectors: 前回のテーブルと一緒に保存した文書ベクトル
+        top_n: 文書ごとの関連文書数
+        method: 文書ベクトルの種類（auto / embedding / tfidf）
+        max_workers: 類似度計算の並列数
+        full_rebuild_ratio: 変更文書の割合がこれを超えたら（保存済みのベクトルで）全件計算
+
+    Returns:
+        (関連文書テーブル, 文書ベクトル)（前回のテーブルとベクトルが対応しない・設定が異なるなど、
+        全チャンクからの計算が必要な場合はNone）
+    """
+    old_documents = previous.get("documents", {})
+    if (previous.get("version") != RELATED_VERSION
+            or previous.get("top_n") != top_n
+            or previous.get("method") != previous_vectors.method
+            or method not in ("auto", previous_vectors.method)
+            or set(old_documents) != set(previous_vectors.file_paths)):
+        return None
+
+    files = _group_by_file(chunks)
+    vectors = update_document_vectors(previous_vectors, files, tokenizer)
+    if vectors is None:
+        return None
+
+    documents = {file_path: {"metadata": entry.get("metadata", {}), "content": entry.get("content", "")}
+                 for file_path, entry in old_documents.items()}
+    documents.update(_document_entries(files))
+    table = _related_table(vectors, documents, top_n, previous, list(files), max_workers,
+                           full_rebuild_ratio)
+    return table, vectors
+
+
+def _document_entries(files: Dict[str, List[Dict[str, Any]]]) -> Dict[str, Dict[str, Any]]:
+    """テーブルに載せる文書の情報（ファイル単位のメタデータと先頭チャンクの本文）"""
+    documents: Dict[str, Dict[str, Any]] = {}
+    for file_path, file_chunks in files.items():
+        metadata = {key: value for key, value in file_chunks[0].get("metadata", {}).items()
+                    if key not in ("chunk_id", "chunk_index", "chunk_size")}
+        documents[file_path] = {"metadata": metadata, "content": file_chunks[0].get("content", "")}
+    return documents
+
+
+def _related_table(vectors: DocumentVectors, documents: Dict[str, Dict[str, Any]], top_n: int,
+                   previous: Optional[Dict[str, Any]], changed_files: Optional[Iterable[str]],
+                   max_workers: int, full_rebuild_ratio: float) -> Dict[str, Any]:
+    """文書ベクトルから近傍を求め（可能なら差分更新）、関連文書テーブルを組み立てる"""
+    file_paths = vectors.file_paths
+    related = _incremental_neighbours(vectors, top_n, previous, changed_files, max_workers,
+                                      full_rebuild_ratio)
+    if related is None:
+        rows, _ = compute_neighbours(vectors, np.arange(vectors.size), top_n, max_workers)
+        related = {file_paths[row]: [(file_paths[doc], score) for doc, score in neighbours]
+                   for row, neighbours in rows.items()}
+        logger.info(f"関連文書テーブルを全件計算しました ({vectors.size}文書, {vectors.method})")
+
+    for file_path, entry in documents.items():
+        entry["related"] = [[neighbour, round(score, 6)] for neighbour, score in related.get(file_path, [])]
+
+    return {
+        "version": RELATED_VERSION,
+        "method": vectors.method,
+        "top_n": top_n,
+        "updated_at": datetime.now().isoformat(),
+        "documents": documents
+    }
+
+
+def _incremental_neighbours(vectors: DocumentVectors, top_n: int,
+                            previous: Optional[Dict[str, Any]],
+                            changed_files: Optional[Iterable[str]], max_workers: int,
+                            full_rebuild_ratio: float) -> Optional[Dict[str, List[Tuple[str, float]]]]:
+    """前回のテーブルを差分更新（差分更新できない場合はNone）"""
+    if (previous is None or changed_files is None
+            or previous.get("version") != RELATED_VERSION
+            or previous.get("method") != vectors.method
+            or previous.get("top_n") != top_n):
+        return None
+
+    file_paths = vectors.file_paths
+    old_documents = previous.get("documents", {})
+    changed_files = set(changed_files)
+    changed = {path for path in file_paths if path in changed_files or path not in old_documents}
+    stale = changed | (set(old_documents) - set(file_paths))
+    if len(stale) > full_rebuild_ratio * max(1, vectors.size):
+        return None
+
+    # 近傍に変更・削除された文書を含んでいた行は、欠けた分を補うため再計算
+    affected = {
+        path for path in file_paths
+        if path not in changed and any(neighbour in stale for neighbour, _ in old_documents[path]["related"])
+    }
+
+    related: Dict[str, List[Tuple[str, float]]] = {}
+    rows: Dict[int, List[Tuple[int, float]]] = {}
+    columns = None
+    if changed:
+        changed_rows = np.array(sorted(vectors.index[path] for path in changed))
+        rows, columns = compute_neighbours(vectors, changed_rows, top_n, max_workers, column_tops=True)
+    if affected:
+        affected_rows = np.array(sorted(vectors.index[path] for path in affected))
+        rows.update(compute_neighbours(vectors, affected_rows, top_n, max_workers)[0])
+
+    for row, neighbours in rows.items():
+        related[file_paths[row]] = [(file_paths[doc], score) for doc, score in neighbours]
+
+    # 未変更の行には変更文書との類似度を差し込む
+    for path in file_paths:
+        if path in related:
+            continue
+        candidates = [(neighbour, score) for neighbour, score in old_documents[path]["related"]]
+        if columns is not None:
+            column = vectors.index[path]
+            candidates.extend((file_paths[int(doc)], float(score))
+                              for doc, score in zip(columns[0][:, column], columns[1][:, column])
+                              if score > 0)
+        related[path] = sorted(candidates, key=lambda item: item[1], reverse=True)[:top_n]
+
+    logger.info(f"関連文書テーブルを差分更新しました "
+                f"(変更 {len(changed)}件, 削除 {len(stale) - len(changed)}件, 再計算 {len(rows)}行)")
+    return related
+
+
+def load_related_table(index_path: Path) -> Optional[Dict[str, Any]]:
+    """関連文書テーブルを読み込み（存在しない・読めない場合はNone）"""
+    related_file = Path(index_path) / RELATED_FILE
+    if not related_file.exists():
+        return None
+    try:
+        with open(related_file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception as e:
+        logger.warning(f"関連文書テーブル読み込みエラー: {e}")
+        return None
+
+
+def write_related_table(index_path: Path, table: Dict[str, Any],
+                        vectors: Optional[DocumentVectors] = None) -> None:
+    """
+    関連文書テーブルを書き出し（一時ファイル経由で置き換え）
+
+    Args:
+        index_path: インデックスのディレクトリ
+        table: 関連文書テーブル
+        vectors: テーブルの計算に使った文書ベクトル（次回の差分更新用に保存。None=保存済みのものを削除）
+    """
+    related_file = Path(index_path) / RELATED_FILE
+    vectors_file = Path(index_path) / RELATED_VECTORS_FILE
+    # テーブルと対応しないベクトルが残らないよう、先に古いベクトルを消す
+    if vectors_file.exists():
+        vectors_file.unlink()
+
+    tmp_file = related_file.with_suffix(related_file.suffix + ".tmp")
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(table, f, ensure_ascii=False, separators=(',', ':'), default=str)
+    os.replace(tmp_file, related_file)
+
+    if vectors is not None:
+        _write_document_vectors(vectors_file, vectors)
+
+
+def _write_document_vectors(vectors_file: Path, vectors: DocumentVectors) -> None:
+    """文書ベクトルを書き出し（一時ファイル経由で置き換え）"""
+    header = {"version": RELATED_VERSION, "method": vectors.method, "file_paths": vectors.file_paths,
+              "terms": vectors.terms}
+    arrays = {"header": np.frombuffer(json.dumps(header, ensure_ascii=False).encode("utf-8"), dtype=np.uint8)}
+    if vectors.dense is not None:
+        arrays["dense"] = vectors.dense
+    else:
+        arrays.update(indptr=vectors._indptr, term_ids=vectors._term_ids, weights=vectors._weights,
+                      document_frequencies=vectors.document_frequencies)
+
+    tmp_file = vectors_file.with_name(vectors_file.name + ".tmp")
+    with open(tmp_file, 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(tmp_file, vectors_file)
+
+
+def load_document_vectors(index_path: Path) -> Optional[DocumentVectors]:
+    """関連文書テーブルと一緒に保存した文書ベクトルを読み込み（存在しない・読めない場合はNone）"""
+    vectors_file = Path(index_path) / RELATED_VECTORS_FILE
+    if not vectors_file.exists():
+        return None
+    try:
+        with np.load(vectors_file) as data:
+            header = json.loads(data["header"].tobytes().decode("utf-8"))
+            if header.get("version") != RELATED_VERSION:
+                return None
+            if "dense" in data.files:
+                return DocumentVectors(header["file_paths"], header["method"], dense=data["dense"])
+            return DocumentVectors(header["file_paths"], header["method"],
+                                   sparse=(data["indptr"], data["term_ids"], data["weights"]),
+                                   terms=header["terms"],
+                                   document_frequencies=data["document_frequencies"])
+    except Exception as e:
+        logger.warning(f"文書ベクトル読み込みエラー: {e}")
+        return None
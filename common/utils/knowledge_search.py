@@ -13,34 +13,245 @@ AIエージェントが活用できる形で提供します。
         categories=["customer-support", "company/products"],
         limit=5
     )
+    
+    # Front Matter のメタデータで絞り込み（一致・集合・日付/数値の範囲）
+    resolved = search_knowledge(
+        query="API統合",
+        filters="resolution_status=resolved AND date>=2024-10"
+    )
+    
+    # 引用符で囲んだ部分はフレーズ（その並びを含む文書に絞り込み、近接して出現する文書を優先）
+    pricing = search_knowledge('"API統合" 料金', limit=5)
+    
+    # 複数クエリは一括検索の方が効率的
+    batch = search_knowledge_batch(["API統合 料金", "セキュリティ要件"], limit=5)
+    
+    # ナレッジファイルの編集を取り込みなしで数秒以内に検索へ反映（常駐プロセス向け）
+    searcher = KnowledgeSearcher()
+    searcher.start_watching(interval_seconds=2)
 """
 
 import os
 import json
 import re
+import copy
+import time
+import heapq
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from pathlib import Path
-from typing import Dict, List, Optional, Any, Union
+from typing import Dict, List, Optional, Any, Union, Tuple, Callable
 import yaml
 import logging
+import numpy as np
 from datetime import datetime
 
+from .knowledge_tokenizer import normalize_text
+from .knowledge_matcher import TermMatcher, compile_term_matcher
+from .knowledge_index import (
+    InvertedIndex, INVERTED_INDEX_FILE, INDEX_MANIFEST_FILE, load_manifest,
+    extract_chunk_fields
+)
+from .knowledge_store import KnowledgeStore, STORE_FILE
+from .knowledge_facets import (
+    FacetCondition, FilterSpec, parse_filters, filters_key, matches_filters
+)
+from .knowledge_shards import ShardedKnowledgeStore, category_matches, shard_name_for
+from .knowledge_related import RELATED_FILE, load_related_table
+from .knowledge_pruning import PRUNING_ENABLED, PRUNING_MIN_POSTINGS
+from .knowledge_chunker import KnowledgeChunker
+from .knowledge_live import LiveSegments, DEFAULT_POLL_INTERVAL
+from .knowledge_positions import (
+    PositionalQuery, make_snippet, DEFAULT_PROXIMITY_WEIGHT, DEFAULT_PROXIMITY_WINDOW,
+    DEFAULT_PROXIMITY_CANDIDATES, DEFAULT_SNIPPET_CHARS
+)
+from .vector_index import NumpyVectorIndex, IVFFlatIndex
+from .vector_store import (
+    chroma_settings, collection_embedding_model, get_chroma_collection, from_chroma_metadata
+)
+from .embeddings import get_embedding_provider
+from .local_embeddings import DEFAULT_LOCAL_SIMILARITY_THRESHOLD, is_local_model
+
 logger = logging.getLogger(__name__)
 
+# ハイブリッド検索の既定値（knowledge_config.yml の search.hybrid で上書き）
+DEFAULT_HYBRID_CONFIG = {
+    "method": "rrf",
+    "candidates": 50,
+    "rrf_k": 60,
+    "weights": {"lexical": 1.0, "vector": 1.0}
+}
+
+# 融合結果で作り直す項目（それ以外の snippet 等は元の結果から引き継ぐ）
+FUSED_RESULT_KEYS = ("content", "metadata", "similarity", "rank", "retrievers")
+
+# ベクトル検索のコサイン類似度の閾値の既定値（knowledge_config.yml の search.similarity_threshold）
+DEFAULT_SIMILARITY_THRESHOLD = 0.7
+
+# ファセット絞り込みを後段で行う検索器（ChromaDB）で多めに取得する倍率
+FILTER_OVERFETCH = 5
+
+class _IndexSnapshot:
+    """ある世代のローカルインデックス（読み込み後は変更しない）"""
+    
+    def __init__(self, generation: int):
+        self.generation = generation
+        self.store: Optional[ShardedKnowledgeStore] = None
+        self.chunk_index: Optional[Dict[str, Any]] = None
+        self.inverted_index: Optional[InvertedIndex] = None
+        self.vector_indexes: Dict[int, NumpyVectorIndex] = {}  # シャード番号 -> ベクトルインデックス
+        # ライブ更新の差分を重ねたスナップショットの場合のみ設定
+        self.base: Optional["_IndexSnapshot"] = None
+        self.live_version = 0
+    
+    @property
+    def doc_count(self) -> int:
+        """チャンク数"""
+        if self.store is not None:
+            return self.store.doc_count
+        return len(self.chunk_index or {})
+
+class _ResultCache:
+    """
+    検索結果のLRUキャッシュ（TTL付き）
+    
+    インデックス世代が変わった時点で全エントリを破棄するため、
+    取り込み後に古い結果を返すことはありません。
+    """
+    
+    def __init__(self, max_size: int = 1000, ttl_seconds: float = 300):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[tuple, tuple]" = OrderedDict()  # key -> (有効期限, 結果)
+        self._generation = None
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "invalidations": 0}
+    
+    def _check_generation(self, generation: Any) -> None:
+        if generation != self._generation:
+            if self._entries:
+                self._stats["invalidations"] += 1
+                self._entries.clear()
+            self._generation = generation
+    
+    def get(self, key: tuple, generation: Any) -> Optional[List[Dict[str, Any]]]:
+        """キャッシュ済みの結果を取得（なければNone）"""
+        with self._lock:
+            self._check_generation(generation)
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            
+            expires_at, results = entry
+            if time.monotonic() >= expires_at:
+                del self._entries[key]
+                self._stats["expirations"] += 1
+                self._stats["misses"] += 1
+                return None
+            
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+        return copy.deepcopy(results)
+    
+    def put(self, key: tuple, generation: Any, results: List[Dict[str, Any]]) -> None:
+        """結果を登録（上限を超えたら最も古く使われたものから破棄）"""
+        results = copy.deepcopy(results)
+        with self._lock:
+            self._check_generation(generation)
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, results)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+    
+    def clear(self) -> None:
+        """全エントリを破棄"""
+        with self._lock:
+            self._entries.clear()
+    
+    def stats(self) -> Dict[str, Any]:
+        """ヒット率・破棄回数などの統計"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update({
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl_seconds,
+                "generation": self._generation
+            })
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
 class KnowledgeSearcher:
     """ナレッジベース検索クラス"""
     
-    def __init__(self, knowledge_base_path: str = "common/knowledge"):
+    def __init__(self, knowledge_base_path: str = "common/knowledge",
+                 config_path: Optional[str] = None):
         self.knowledge_base_path = Path(knowledge_base_path)
         self.index_path = Path(knowledge_base_path) / ".index"
         
+        # 検索設定（省略時は common/config/knowledge_config.yml）
+        if config_path is None:
+            config_path = self.knowledge_base_path.parent / "config" / "knowledge_config.yml"
+        self.config = self._load_config(Path(config_path))
+        
         # Vector DB設定（環境変数から取得）
         self.vector_db_type = os.getenv("VECTOR_DB_TYPE", "local")
         self.use_vector_db = self.vector_db_type != "local"
+        # ChromaDBは取り込みと同じ永続化ディレクトリを参照（クライアントはプロセス内で共有）
+        self.chroma_persist_directory, self.chroma_collection_name = chroma_settings(
+            self.config, self.knowledge_base_path.parent.parent
+        )
+        
+        # ローカルインデックスの常駐キャッシュ（ファイルのmtime/サイズで無効化）
+        self._index_lock = threading.Lock()
+        self._index_signature = None
+        self._snapshot: Optional[_IndexSnapshot] = None
+        self._cache_stats = {"hits": 0, "misses": 0, "reloads": 0}
+        
+        # ライブ更新（ナレッジファイルをポーリングし、差分を重ねたスナップショットを差し替える）
+        self._live_snapshot: Optional[_IndexSnapshot] = None
+        self._live_segments: Optional[LiveSegments] = None
+        self._watch_thread: Optional[threading.Thread] = None
+        self._watch_stop = threading.Event()
+        self._watch_lock = threading.Lock()
+        
+        # 関連文書テーブル（ファイルのmtime/サイズで無効化）
+        self._related_signature = None
+        self._related: Optional[Tuple[Dict[str, Any], Dict[str, str]]] = None
+        
+        # 検索結果キャッシュ（キーにインデックス世代を含め、取り込み時に自動で無効化）
+        cache_config = self.config.get("search", {}).get("result_cache", {})
+        self._result_cache: Optional[_ResultCache] = None
+        if cache_config.get("enabled", True):
+            self._result_cache = _ResultCache(
+                max_size=cache_config.get("max_size", 1000),
+                ttl_seconds=cache_config.get("ttl_seconds", 300)
+            )
         
         logger.info(f"KnowledgeSearcher初期化 - Vector DB: {self.vector_db_type}")
+        
+        watch_config = self.config.get("search", {}).get("watch", {}) or {}
+        if watch_config.get("enabled", False):
+            self.start_watching(watch_config.get("interval_seconds", DEFAULT_POLL_INTERVAL))
+
+    def _load_config(self, config_path: Path) -> Dict[str, Any]:
+        """設定ファイル読み込み（存在しない場合は既定値で動作）"""
+        try:
+            with open(config_path, 'r', encoding='utf-8') as f:
+                return yaml.safe_load(f) or {}
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            logger.warning(f"設定ファイル読み込みエラー: {e}")
+            return {}
 
     def search(self, query: str, categories: Optional[List[str]] = None,
-               limit: int = 10, similarity_threshold: float = 0.7) -> List[Dict[str, Any]]:
+               limit: int = 10, similarity_threshold: Optional[float] = None,
+               filters: FilterSpec = None) -> List[Dict[str, Any]]:
         """
         ナレッジベースを検索
         
@@ -48,105 +259,994 @@ class KnowledgeSearcher:
             query: 検索クエリ
             categories: 検索対象カテゴリ（None=全体）
             limit: 最大結果数
-            similarity_threshold: 類似度閾値
+            similarity_threshold: ベクトル検索のコサイン類似度の閾値（ハイブリッド検索では融合前の
+                                  ベクトル検索の候補に適用し、全文検索の候補・融合後のスコアには適用しない。
+                                  None=設定値。ローカル埋め込みのインデックスでは embedding.local の値）
+            filters: メタデータの絞り込み条件（辞書または "status=resolved AND date>=2024-10"
+                     形式の文字列、None=絞り込みなし）
             
         Returns:
-            検索結果のリスト
+            検索結果のリスト（ハイブリッド検索の similarity は順位に基づく融合スコアで、
+            検索器ごとの類似度は retrievers に入る）
+            
+        Raises:
+            ValueError: 絞り込み条件を解釈できない場合
         """
+        conditions = parse_filters(filters)
+        if self._result_cache is None:
+            return self._search_uncached(query, categories, limit, similarity_threshold, conditions)
+        
+        generation = self._current_generation()
+        if generation is None:
+            return self._search_uncached(query, categories, limit, similarity_threshold, conditions)
+        
+        key = self._result_cache_key(query, categories, limit, similarity_threshold, conditions)
+        results = self._result_cache.get(key, generation)
+        if results is None:
+            results = self._search_uncached(query, categories, limit, similarity_threshold, conditions)
+            self._result_cache.put(key, generation, results)
+        return results
+
+    def _search_uncached(self, query: str, categories: Optional[List[str]],
+                         limit: int, similarity_threshold: Optional[float],
+                         filters: Optional[List[FacetCondition]] = None) -> List[Dict[str, Any]]:
+        """キャッシュを通さずに検索"""
         if self.use_vector_db:
-            return self._vector_search(query, categories, limit, similarity_threshold)
+            if self.config.get("search", {}).get("rerank", False):
+                return self.hybrid_search(query, categories, limit, similarity_threshold,
+                                          filters)["results"]
+            return self._vector_search(query, categories, limit, similarity_threshold, filters)
         else:
-            return self._text_search(query, categories, limit)
+            return self._text_search(query, categories, limit, filters)
+
+    @staticmethod
+    def _result_cache_key(query: str, categories: Optional[List[str]],
+                          limit: int, similarity_threshold: Optional[float],
+                          filters: Optional[List[FacetCondition]] = None) -> tuple:
+        """結果キャッシュのキー（正規化したクエリ・カテゴリ集合・件数・閾値・絞り込み条件）"""
+        normalized_query = " ".join(normalize_text(query).split())
+        category_key = tuple(sorted(set(categories))) if categories else None
+        return (normalized_query, category_key, limit, similarity_threshold, filters_key(filters))
+
+    def _current_generation(self) -> Optional[Union[int, Tuple[int, int]]]:
+        """
+        現在のインデックス世代（ローカルインデックスがなければNone）
+        
+        ライブ更新の差分を重ねている場合は (世代, 差分の版) を返し、差分が変わるたびに
+        検索結果キャッシュを無効化します。インデックスがない間の結果（ナレッジファイルの直接検索）は
+        世代で無効化できず、最初の取り込みの結果をTTLまで隠してしまうため、キャッシュしません。
+        """
+        snapshot = self._load_index()
+        if snapshot is None:
+            return None
+        if snapshot.live_version:
+            return snapshot.generation, snapshot.live_version
+        return snapshot.generation
+
+    def hybrid_search(self, query: str, categories: Optional[List[str]] = None,
+                      limit: int = 10, similarity_threshold: Optional[float] = None,
+                      filters: FilterSpec = None) -> Dict[str, Any]:
+        """
+        全文検索とベクトル検索を並列実行し、順位融合した結果を返す
+        
+        各検索器の上位N件（search.hybrid.candidates）だけを融合対象とします。
+        類似度閾値は融合前のベクトル検索の候補にだけ適用します。全文検索のBM25スコアは
+        上限がなく、融合スコアは順位に基づく（上位の結果ほど1.0に近い）ため、閾値と比較しません。
+        クエリの語がローカル埋め込みの語彙にない（埋め込みがゼロベクトルの）場合は、
+        ベクトル検索の候補を空にして全文検索の結果だけを返します。
+        
+        Args:
+            query: 検索クエリ
+            categories: 検索対象カテゴリ（None=全体）
+            limit: 最大結果数
+            similarity_threshold: ベクトル検索のコサイン類似度の閾値（融合前に適用、None=設定値）
+            filters: メタデータの絞り込み条件（両方の検索器に適用）
+            
+        Returns:
+            {"results": 融合後の検索結果, "timings": 検索器ごとの所要時間(ms)}
+        """
+        conditions = parse_filters(filters)
+        hybrid_config = {**DEFAULT_HYBRID_CONFIG, **self.config.get("search", {}).get("hybrid", {})}
+        candidates = max(limit, hybrid_config["candidates"])
+        
+        def timed(retriever, *args):
+            start = time.perf_counter()
+            results = retriever(*args)
+            return results, (time.perf_counter() - start) * 1000
+        
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            lexical_future = executor.submit(timed, self._text_search, query, categories,
+                                             candidates, conditions)
+            vector_future = executor.submit(timed, self._vector_candidates, query, categories,
+                                            candidates, similarity_threshold, conditions)
+            lexical_results, lexical_ms = lexical_future.result()
+            vector_results, vector_ms = vector_future.result()
+        
+        start = time.perf_counter()
+        results = self._fuse_results(
+            {"lexical": lexical_results, "vector": vector_results}, hybrid_config, limit
+        )
+        fusion_ms = (time.perf_counter() - start) * 1000
+        
+        timings = {"lexical_ms": lexical_ms, "vector_ms": vector_ms, "fusion_ms": fusion_ms}
+        logger.info(f"ハイブリッド検索: 全文 {len(lexical_results)}件 {lexical_ms:.1f}ms / "
+                    f"ベクトル {len(vector_results)}件 {vector_ms:.1f}ms / 融合 {fusion_ms:.2f}ms")
+        return {"results": results, "timings": timings}
+
+    def search_many(self, queries: List[str], categories: Optional[List[str]] = None,
+                    limit: int = 10, similarity_threshold: Optional[float] = None,
+                    filters: FilterSpec = None) -> Dict[str, Any]:
+        """
+        複数クエリをまとめて検索
+        
+        全文検索は全クエリを先にトークン化してポスティングを1回で集計し、
+        ベクトル検索は全クエリを1回で埋め込んで行列積1回で類似度を求めます。
+        
+        Args:
+            queries: 検索クエリのリスト
+            categories: 検索対象カテゴリ（全クエリ共通、None=全体）
+            limit: クエリごとの最大結果数
+            similarity_threshold: ベクトル検索のコサイン類似度の閾値（search と同じく融合前に適用、
+                                  None=設定値）
+            filters: メタデータの絞り込み条件（全クエリ共通）
+            
+        Returns:
+            {"results": クエリ順の検索結果リスト,
+             "timings": {"total_ms": 全体の所要時間, "per_query_ms": クエリごとの所要時間}}
+            per_query_ms は各クエリ固有の処理時間に、まとめて実行した処理の時間を均等に按分したもの
+        """
+        start = time.perf_counter()
+        conditions = parse_filters(filters)
+        if not queries:
+            return {"results": [], "timings": {"total_ms": 0.0, "per_query_ms": []}}
+        
+        results: List[Optional[List[Dict[str, Any]]]] = [None] * len(queries)
+        per_query_ms = [0.0] * len(queries)
+        
+        # キャッシュにないクエリだけをまとめて検索（インデックスがない間はキャッシュしない）
+        generation = self._current_generation() if self._result_cache is not None else None
+        if generation is not None:
+            keys = [self._result_cache_key(query, categories, limit, similarity_threshold, conditions)
+                    for query in queries]
+            for i, key in enumerate(keys):
+                lookup_start = time.perf_counter()
+                results[i] = self._result_cache.get(key, generation)
+                per_query_ms[i] = (time.perf_counter() - lookup_start) * 1000
+        
+        pending = [i for i, result in enumerate(results) if result is None]
+        if pending:
+            pending_results, pending_ms = self._search_many_uncached(
+                [queries[i] for i in pending], categories, limit, similarity_threshold, conditions
+            )
+            for i, result, ms in zip(pending, pending_results, pending_ms):
+                results[i] = result
+                per_query_ms[i] += ms
+                if generation is not None:
+                    self._result_cache.put(keys[i], generation, result)
+        
+        total_ms = (time.perf_counter() - start) * 1000
+        logger.info(f"一括検索: {len(queries)}クエリ（キャッシュ外 {len(pending)}件） / {total_ms:.1f}ms")
+        return {"results": results, "timings": {"total_ms": total_ms, "per_query_ms": per_query_ms}}
+
+    def _search_many_uncached(self, queries: List[str], categories: Optional[List[str]],
+                              limit: int, similarity_threshold: Optional[float],
+                              filters: Optional[List[FacetCondition]] = None
+                              ) -> Tuple[List[List[Dict[str, Any]]], List[float]]:
+        """キャッシュを通さずに一括検索"""
+        if self.use_vector_db:
+            if self.config.get("search", {}).get("rerank", False):
+                return self._hybrid_search_many(queries, categories, limit, similarity_threshold,
+                                                filters)
+            return self._vector_search_many(queries, categories, limit, similarity_threshold,
+                                            filters=filters)
+        return self._text_search_many(queries, categories, limit, filters)
+
+    @staticmethod
+    def _amortize(shared_ms: float, own_ms: List[float]) -> List[float]:
+        """まとめて実行した処理の時間をクエリ数で按分して各クエリの時間に加える"""
+        share = shared_ms / len(own_ms) if own_ms else 0.0
+        return [ms + share for ms in own_ms]
+
+    @staticmethod
+    def _search_each(search: Callable[..., List[Dict[str, Any]]], queries: List[str],
+                     *args) -> Tuple[List[List[Dict[str, Any]]], List[float]]:
+        """一括処理できない経路ではクエリごとに検索（インデックスは常駐キャッシュを共有）"""
+        results = []
+        per_query_ms = []
+        for query in queries:
+            start = time.perf_counter()
+            results.append(search(query, *args))
+            per_query_ms.append((time.perf_counter() - start) * 1000)
+        return results, per_query_ms
+
+    def _text_search_many(self, queries: List[str], categories: Optional[List[str]],
+                          limit: int, filters: Optional[List[FacetCondition]] = None
+                          ) -> Tuple[List[List[Dict[str, Any]]], List[float]]:
+        """全文検索の一括実行（バイナリインデックスがあればポスティングを1回で集計）"""
+        snapshot = self._load_index()
+        if snapshot is not None and snapshot.store is not None:
+            store = snapshot.store
+            try:
+                start = time.perf_counter()
+                positional_queries = [self._positional_query(query, store.tokenizer) for query in queries]
+                hits_list = store.search_many(
+                    [positional.terms for positional in positional_queries], limit, categories, filters,
+                    positional_queries
+                )
+                shared_ms = (time.perf_counter() - start) * 1000
+                
+                results = []
+                own_ms = []
+                for hits, positional in zip(hits_list, positional_queries):
+                    start = time.perf_counter()
+                    results.append(self._store_results(store, hits, positional))
+                    own_ms.append((time.perf_counter() - start) * 1000)
+                return results, self._amortize(shared_ms, own_ms)
+                
+            except Exception as e:
+                logger.error(f"バイナリインデックス一括検索エラー: {e}")
+        
+        return self._search_each(self._text_search, queries, categories, limit, filters)
+
+    def _vector_search_many(self, queries: List[str], categories: Optional[List[str]],
+                            limit: int, similarity_threshold: Optional[float], fallback: bool = True,
+                            filters: Optional[List[FacetCondition]] = None
+                            ) -> Tuple[List[List[Dict[str, Any]]], List[float]]:
+        """
+        ベクトル検索の一括実行
+        
+        Args:
+            fallback: ベクトル検索できない場合に全文検索を行うか（False=空の結果）
+            filters: メタデータのファセット条件
+        """
+        batch = None
+        try:
+            if self.vector_db_type == "chroma":
+                start = time.perf_counter()
+                results = self._chroma_search_many(queries, categories, limit, similarity_threshold,
+                                                   filters)
+                shared_ms = (time.perf_counter() - start) * 1000
+                batch = results, self._amortize(shared_ms, [0.0] * len(queries))
+            elif self.vector_db_type == "numpy":
+                batch = self._numpy_vector_results_many(queries, categories, limit,
+                                                        similarity_threshold, filters)
+            else:
+                logger.warning(f"未対応のVector DB: {self.vector_db_type}")
+        except Exception as e:
+            logger.error(f"Vector DB一括検索エラー: {e}")
+        
+        if batch is not None:
+            results, per_query_ms = batch
+            # ゼロベクトルのクエリは全文検索で補う（fallback=False では空の結果）
+            missing = [i for i, result in enumerate(results) if result is None]
+            if missing and fallback:
+                text_results, text_ms = self._text_search_many([queries[i] for i in missing],
+                                                               categories, limit, filters)
+                for i, result, ms in zip(missing, text_results, text_ms):
+                    results[i] = result
+                    per_query_ms[i] += ms
+            return [result if result is not None else [] for result in results], per_query_ms
+        
+        if fallback:
+            return self._text_search_many(queries, categories, limit, filters)
+        return [[] for _ in queries], [0.0] * len(queries)
+
+    def _hybrid_search_many(self, queries: List[str], categories: Optional[List[str]],
+                            limit: int, similarity_threshold: Optional[float],
+                            filters: Optional[List[FacetCondition]] = None
+                            ) -> Tuple[List[List[Dict[str, Any]]], List[float]]:
+        """ハイブリッド検索の一括実行（全文・ベクトルの一括検索を並列に実行してクエリごとに融合）"""
+        hybrid_config = {**DEFAULT_HYBRID_CONFIG, **self.config.get("search", {}).get("hybrid", {})}
+        candidates = max(limit, hybrid_config["candidates"])
+        
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            lexical_future = executor.submit(self._text_search_many, queries, categories,
+                                             candidates, filters)
+            vector_future = executor.submit(self._vector_search_many, queries, categories,
+                                            candidates, similarity_threshold, False, filters)
+            lexical_results, lexical_ms = lexical_future.result()
+            vector_results, vector_ms = vector_future.result()
+        
+        results = []
+        per_query_ms = []
+        for i in range(len(queries)):
+            start = time.perf_counter()
+            results.append(self._fuse_results(
+                {"lexical": lexical_results[i], "vector": vector_results[i]}, hybrid_config, limit
+            ))
+            fusion_ms = (time.perf_counter() - start) * 1000
+            per_query_ms.append(max(lexical_ms[i], vector_ms[i]) + fusion_ms)
+        return results, per_query_ms
+
+    def _vector_candidates(self, query: str, categories: Optional[List[str]],
+                           limit: int, similarity_threshold: Optional[float],
+                           filters: Optional[List[FacetCondition]] = None) -> List[Dict[str, Any]]:
+        """ハイブリッド検索用のベクトル検索（失敗時は全文検索にフォールバックせず空を返す）"""
+        try:
+            if self.vector_db_type == "chroma":
+                return self._chroma_search(query, categories, limit, similarity_threshold,
+                                           filters) or []
+            elif self.vector_db_type == "numpy":
+                return self._numpy_vector_results(query, categories, limit,
+                                                  similarity_threshold, filters) or []
+            else:
+                logger.warning(f"未対応のVector DB: {self.vector_db_type}")
+                return []
+        except Exception as e:
+            logger.error(f"Vector DB検索エラー: {e}")
+            return []
+
+    @staticmethod
+    def _result_key(result: Dict[str, Any]) -> str:
+        """検索器をまたいで同一チャンクを識別するキー"""
+        metadata = result.get("metadata", {})
+        if metadata.get("chunk_id"):
+            return metadata["chunk_id"]
+        return f"{metadata.get('file_path', '')}:{hash(result.get('content', ''))}"
+
+    def _fuse_results(self, ranked_lists: Dict[str, List[Dict[str, Any]]],
+                      hybrid_config: Dict[str, Any], limit: int) -> List[Dict[str, Any]]:
+        """
+        複数の検索結果を1つの順位リストに融合
+        
+        method=rrf: Σ weight / (rrf_k + rank)（スコアの尺度に依存しない）
+        method=weighted: 検索器ごとに min-max 正規化したスコアの重み付き和
+        
+        Args:
+            ranked_lists: 検索器名 -> 順位順の検索結果
+            hybrid_config: search.hybrid 設定
+            limit: 最大結果数
+            
+        Returns:
+            融合後の検索結果（snippet 等は最初にその項目を持っていた検索器の結果から引き継ぐ。
+            similarity は0〜1に正規化した融合スコア。rrf では順位だけで決まり、
+            全検索器で1位の結果は常に1.0になるため、関連度の絶対値としては扱わない。
+            検索器ごとの元の類似度は retrievers に入る）
+        """
+        method = hybrid_config.get("method", "rrf")
+        weights = hybrid_config.get("weights", {})
+        rrf_k = hybrid_config.get("rrf_k", 60)
+        candidates = hybrid_config.get("candidates", 50)
+        
+        fused: Dict[str, Dict[str, Any]] = {}
+        total_weight = 0.0
+        for name, results in ranked_lists.items():
+            results = results[:candidates]
+            if not results:
+                continue  # 結果のない検索器は正規化の分母に含めない
+            weight = float(weights.get(name, 1.0))
+            total_weight += weight
+            
+            scores = [result.get("similarity", 0.0) for result in results]
+            low, high = min(scores), max(scores)
+            for rank, result in enumerate(results, 1):
+                if method == "weighted":
+                    normalized = (scores[rank - 1] - low) / (high - low) if high > low else 1.0
+                    contribution = weight * normalized
+                else:
+                    contribution = weight * (rrf_k + 1) / (rrf_k + rank)
+                
+                entry = fused.setdefault(self._result_key(result), {
+                    "content": result.get("content", ""),
+                    "metadata": result.get("metadata", {}),
+                    "score": 0.0,
+                    "retrievers": {},
+                    "extras": {}
+                })
+                entry["score"] += contribution
+                entry["retrievers"][name] = {"rank": rank, "similarity": scores[rank - 1]}
+                # snippet 等の検索器固有の項目は、最初に持っていた結果のものを引き継ぐ
+                for key, value in result.items():
+                    if key not in FUSED_RESULT_KEYS:
+                        entry["extras"].setdefault(key, value)
+        
+        ranked = sorted(fused.values(), key=lambda entry: entry["score"], reverse=True)[:limit]
+        
+        results = []
+        for entry in ranked:
+            results.append({
+                **entry["extras"],
+                "content": entry["content"],
+                "metadata": entry["metadata"],
+                "similarity": entry["score"] / total_weight if total_weight else 0.0,
+                "rank": len(results) + 1,
+                "retrievers": entry["retrievers"]
+            })
+        return results
 
     def _vector_search(self, query: str, categories: Optional[List[str]], 
-                      limit: int, similarity_threshold: float) -> List[Dict[str, Any]]:
+                      limit: int, similarity_threshold: Optional[float],
+                      filters: Optional[List[FacetCondition]] = None) -> List[Dict[str, Any]]:
         """Vector DBを使用した検索"""
         try:
             if self.vector_db_type == "chroma":
-                return self._chroma_search(query, categories, limit, similarity_threshold)
+                results = self._chroma_search(query, categories, limit, similarity_threshold, filters)
+                if results is None:
+                    return self._text_search(query, categories, limit, filters)
+                return results
+            elif self.vector_db_type == "numpy":
+                return self._numpy_search(query, categories, limit, similarity_threshold, filters)
             else:
                 logger.warning(f"未対応のVector DB: {self.vector_db_type}")
-                return self._text_search(query, categories, limit)
+                return self._text_search(query, categories, limit, filters)
         except Exception as e:
             logger.error(f"Vector DB検索エラー: {e}")
-            return self._text_search(query, categories, limit)
+            return self._text_search(query, categories, limit, filters)
 
     def _chroma_search(self, query: str, categories: Optional[List[str]], 
-                      limit: int, similarity_threshold: float) -> List[Dict[str, Any]]:
-        """ChromaDBを使用した検索"""
+                      limit: int, similarity_threshold: Optional[float],
+                      filters: Optional[List[FacetCondition]] = None
+                      ) -> Optional[List[Dict[str, Any]]]:
+        """ChromaDBを使用した検索（クエリの埋め込みがゼロベクトルの場合はNone）"""
+        return self._chroma_search_many([query], categories, limit, similarity_threshold, filters)[0]
+
+    def _chroma_search_many(self, queries: List[str], categories: Optional[List[str]],
+                            limit: int, similarity_threshold: Optional[float],
+                            filters: Optional[List[FacetCondition]] = None
+                            ) -> List[Optional[List[Dict[str, Any]]]]:
+        """
+        ChromaDBを使用した検索（複数クエリを1回の問い合わせで実行）
+        
+        埋め込みがゼロベクトルになるクエリ（ローカル埋め込みの語彙にない語だけのクエリ）の
+        結果は None です。
+        
+        ファセット条件はChromaDBのメタデータ（リスト値を保持できない）では評価できないため、
+        多めに取得した結果を後段で絞り込みます。
+        取り込み時に埋め込みを渡して保存したコレクションは、同じモデルでクエリを埋め込んで検索します
+        （ChromaDBの既定の埋め込み関数とは次元・ベクトル空間が異なるため）。
+        """
         try:
-            import chromadb
-            client = chromadb.Client()
-            collection = client.get_collection("knowledge_base")
+            collection = get_chroma_collection(self.chroma_persist_directory,
+                                               self.chroma_collection_name)
             
             # カテゴリフィルタ
             where_filter = None
             if categories:
                 where_filter = {"category": {"$in": categories}}
             
+            query_args: Dict[str, Any] = {"query_texts": queries}
+            model = collection_embedding_model(collection)
+            similarity_threshold = self._vector_threshold(similarity_threshold, model)
+            embedded = list(range(len(queries)))
+            if model is not None:
+                query_vectors = self._embed_queries(queries, model)
+                if query_vectors is None:
+                    logger.warning(f"クエリを埋め込めないため、ChromaDB検索をスキップします (モデル: {model})")
+                    return [[] for _ in queries]
+                # ゼロベクトル（語彙にない語だけのクエリ）はどの文書とも類似度が決まらないため問い合わせない
+                embedded = np.flatnonzero(query_vectors.any(axis=1)).tolist()
+                if not embedded:
+                    return [None for _ in queries]
+                query_args = {"query_embeddings": query_vectors[embedded].tolist()}
+            
             results = collection.query(
-                query_texts=[query],
-                n_results=limit,
-                where=where_filter
+                n_results=limit * FILTER_OVERFETCH if filters else limit,
+                where=where_filter,
+                **query_args
             )
             
-            search_results = []
-            for i, (doc, metadata, distance) in enumerate(zip(
-                results['documents'][0],
-                results['metadatas'][0], 
-                results['distances'][0]
-            )):
-                similarity = 1 - distance  # 距離を類似度に変換
-                if similarity >= similarity_threshold:
+            all_results: List[Optional[List[Dict[str, Any]]]] = [None] * len(queries)
+            for query_no, documents, metadatas, distances in zip(
+                embedded, results['documents'], results['metadatas'], results['distances']
+            ):
+                search_results = []
+                for doc, metadata, distance in zip(documents, metadatas, distances):
+                    similarity = 1 - distance  # 距離を類似度に変換
+                    if similarity < similarity_threshold:
+                        continue
+                    metadata = from_chroma_metadata(metadata)
+                    if filters and not matches_filters(metadata, filters):
+                        continue
                     search_results.append({
                         "content": doc,
                         "metadata": metadata,
                         "similarity": similarity,
-                        "rank": i + 1
+                        "rank": len(search_results) + 1
                     })
+                all_results[query_no] = search_results[:limit]
             
-            return search_results
+            return all_results
             
         except ImportError:
             logger.warning("chromadbライブラリがインストールされていません")
-            return []
+            return [[] for _ in queries]
         except Exception as e:
             logger.error(f"ChromaDB検索エラー: {e}")
-            return []
+            return [[] for _ in queries]
+
+    def _numpy_search(self, query: str, categories: Optional[List[str]],
+                      limit: int, similarity_threshold: Optional[float],
+                      filters: Optional[List[FacetCondition]] = None) -> List[Dict[str, Any]]:
+        """ローカルインデックスの埋め込み行列を使ったNumPyベクトル検索"""
+        results = self._numpy_vector_results(query, categories, limit, similarity_threshold, filters)
+        if results is None:
+            return self._text_search(query, categories, limit, filters)
+        return results
+
+    def _numpy_vector_results(self, query: str, categories: Optional[List[str]],
+                              limit: int, similarity_threshold: Optional[float],
+                              filters: Optional[List[FacetCondition]] = None
+                              ) -> Optional[List[Dict[str, Any]]]:
+        """NumPyベクトル検索の本体（埋め込みが利用できない・クエリがゼロベクトルの場合はNone）"""
+        batch = self._numpy_vector_results_many([query], categories, limit, similarity_threshold,
+                                                filters)
+        return None if batch is None else batch[0][0]
+
+    def _numpy_vector_results_many(self, queries: List[str], categories: Optional[List[str]],
+                                   limit: int, similarity_threshold: Optional[float],
+                                   filters: Optional[List[FacetCondition]] = None
+                                   ) -> Optional[Tuple[List[Optional[List[Dict[str, Any]]]], List[float]]]:
+        """
+        NumPyベクトル検索の一括実行（埋め込みAPI呼び出し1回・シャードごとに行列積1回）
+        
+        埋め込みがゼロベクトルになるクエリ（ローカル埋め込みの語彙にない語だけのクエリ）は
+        全文書との類似度が0で順位が決まらないため、結果を None にします。
+        """
+        snapshot = self._load_index()
+        if snapshot is None or snapshot.store is None or snapshot.store.embedding_model is None:
+            logger.warning("埋め込みを含むローカルインデックスがないため、ベクトル検索できません")
+            return None
+        
+        store = snapshot.store
+        start = time.perf_counter()
+        query_vectors = self._embed_queries(queries, store.embedding_model)
+        if query_vectors is None:
+            return None
+        similarity_threshold = self._vector_threshold(similarity_threshold, store.embedding_model)
+        embedded = query_vectors.any(axis=1)
+        
+        def search_shard(shard_no: int, shard_categories: Optional[List[str]]):
+            vector_index = self._get_vector_index(snapshot, shard_no)
+            if vector_index is None:
+                return [[] for _ in queries]
+            mask = store.shard(shard_no).doc_mask(shard_categories, filters)
+            if mask is not None and not mask.any():
+                return [[] for _ in queries]
+            hits_list = vector_index.search_batch(query_vectors, limit, mask, similarity_threshold)
+            return [[(store.global_doc(shard_no, doc), similarity) for doc, similarity in hits]
+                    for hits in hits_list]
+        
+        shard_results = store.map_shards(store.select_shards(categories), search_shard)
+        hits_list = [
+            heapq.nlargest(limit, (hit for result in shard_results for hit in result[query_no]),
+                           key=lambda hit: hit[1])
+            for query_no in range(len(queries))
+        ]
+        shared_ms = (time.perf_counter() - start) * 1000
+        
+        results = []
+        own_ms = []
+        for query, hits, has_vector in zip(queries, hits_list, embedded):
+            start = time.perf_counter()
+            if has_vector:
+                results.append(self._store_results(store, hits,
+                                                   self._positional_query(query, store.tokenizer)))
+            else:
+                results.append(None)
+            own_ms.append((time.perf_counter() - start) * 1000)
+        return results, self._amortize(shared_ms, own_ms)
+
+    def _store_results(self, store: ShardedKnowledgeStore, hits: List[Tuple[int, float]],
+                       query: Optional[PositionalQuery] = None) -> List[Dict[str, Any]]:
+        """
+        バイナリインデックスの (文書番号, スコア) を検索結果の形式に変換
+        
+        query を指定すると、インデックスの出現位置からクエリの語が集まっている区間を
+        snippet として付けます（本文の再走査は行わない）。
+        """
+        snippet_chars = self._positions_config().get("snippet_chars", DEFAULT_SNIPPET_CHARS)
+        results = []
+        for doc, similarity in hits:
+            chunk = store.get_chunk(doc)
+            result = {
+                "content": chunk["content"],
+                "metadata": chunk["metadata"],
+                "similarity": similarity,
+                "rank": len(results) + 1
+            }
+            if query is not None:
+                snippet = make_snippet(chunk["content"], store.match_offsets(doc, query.terms),
+                                       snippet_chars)
+                if snippet is not None:
+                    result["snippet"] = snippet
+            results.append(result)
+        return results
+
+    def _positions_config(self) -> Dict[str, Any]:
+        """出現位置（フレーズ・近接・スニペット）の設定"""
+        return self.config.get("search", {}).get("positions", {}) or {}
+
+    def _positional_query(self, query: str, tokenizer) -> PositionalQuery:
+        """クエリからフレーズ・近接の条件を作成（設定の重み・候補数を使用）"""
+        positions_config = self._positions_config()
+        return PositionalQuery(
+            query, tokenizer,
+            proximity_weight=positions_config.get("proximity_weight", DEFAULT_PROXIMITY_WEIGHT),
+            proximity_window=positions_config.get("proximity_window", DEFAULT_PROXIMITY_WINDOW),
+            proximity_candidates=positions_config.get("proximity_candidates", DEFAULT_PROXIMITY_CANDIDATES)
+        )
+
+    def _get_vector_index(self, snapshot: Optional["_IndexSnapshot"],
+                          shard_no: int) -> Optional[NumpyVectorIndex]:
+        """シャードの埋め込み行列からベクトルインデックスを取得（初回のみ構築）"""
+        if snapshot is None or snapshot.store is None:
+            return None
+        
+        vector_index = snapshot.vector_indexes.get(shard_no)
+        if vector_index is None:
+            shard = snapshot.store.shard(shard_no)
+            if shard.embedding_dim == 0:
+                return None
+            with self._index_lock:
+                if shard_no not in snapshot.vector_indexes:
+                    snapshot.vector_indexes[shard_no] = self._create_vector_index(shard)
+                vector_index = snapshot.vector_indexes[shard_no]
+        return vector_index
+
+    def _create_vector_index(self, store: KnowledgeStore) -> NumpyVectorIndex:
+        """取り込み時にIVFが構築されていれば近似検索、なければ厳密検索のインデックスを生成"""
+        normalized = store.header.get("embeddings_normalized", False)
+        ann_config = self.config.get("vector_db", {}).get("numpy", {}).get("ann") or {}
+        
+        if store.ann and store.ann.get("type") == "ivf" and ann_config.get("type", "ivf") == "ivf":
+            centroids, list_offsets, list_docs = store.ivf_lists()
+            nprobe = int(os.getenv("VECTOR_INDEX_NPROBE", ann_config.get("nprobe", 8)))
+            logger.info(f"IVFインデックスを使用 (リスト数 {store.ann['n_lists']}, nprobe {nprobe})")
+            return IVFFlatIndex(store.embeddings, centroids, list_offsets, list_docs,
+                                valid=store.embedding_mask, normalized=normalized,
+                                nprobe=nprobe)
+        
+        return NumpyVectorIndex(store.embeddings, valid=store.embedding_mask,
+                                normalized=normalized)
+
+    def _vector_threshold(self, similarity_threshold: Optional[float],
+                          model: Optional[str]) -> float:
+        """
+        ベクトル検索に使う類似度閾値（指定がなければ埋め込みモデルに応じた設定値）
+        
+        ローカル埋め込みのコサインはAPIの埋め込みより低く出るため、
+        embedding.local.similarity_threshold（既定 0.3）を使います。
+        """
+        if similarity_threshold is not None:
+            return similarity_threshold
+        if is_local_model(model):
+            local_config = self.config.get("embedding", {}).get("local", {}) or {}
+            return local_config.get("similarity_threshold", DEFAULT_LOCAL_SIMILARITY_THRESHOLD)
+        return self.config.get("search", {}).get("similarity_threshold",
+                                                 DEFAULT_SIMILARITY_THRESHOLD)
+
+    def _embed_query(self, query: str, model: Optional[str]):
+        """クエリを取り込み時と同じモデルで埋め込み（失敗時はNone）"""
+        vectors = self._embed_queries([query], model)
+        return None if vectors is None else vectors[0]
+
+    def _embed_queries(self, queries: List[str], model: Optional[str]):
+        """複数クエリを1回のAPI呼び出しで埋め込み（ローカル埋め込みは取り込み時に学習したモデル、失敗時はNone）"""
+        provider = get_embedding_provider(model, self.index_path)
+        if provider is None:
+            return None
+        try:
+            return np.asarray(provider.embed(queries), dtype=np.float32)
+        except ImportError:
+            logger.warning("openaiライブラリがインストールされていません")
+        except Exception as e:
+            logger.error(f"クエリ埋め込みエラー: {e}")
+        return None
 
     def _text_search(self, query: str, categories: Optional[List[str]], 
-                    limit: int) -> List[Dict[str, Any]]:
+                    limit: int, filters: Optional[List[FacetCondition]] = None) -> List[Dict[str, Any]]:
         """テキストベースの検索（フォールバック）"""
         logger.info("テキストベース検索を実行")
         
-        # ローカルインデックスから検索
-        index_file = self.index_path / "knowledge_index.json"
-        if index_file.exists():
-            return self._search_from_index(query, categories, limit, index_file)
+        # ローカルインデックスから検索（バイナリ > 転置インデックスJSON > 全件走査）
+        snapshot = self._load_index()
+        if snapshot is not None:
+            if snapshot.store is not None:
+                return self._search_from_store(query, categories, limit, snapshot.store, filters)
+            if snapshot.inverted_index is not None:
+                return self._search_from_inverted_index(
+                    query, categories, limit, snapshot.chunk_index, snapshot.inverted_index, filters
+                )
+            return self._search_from_index(query, categories, limit, snapshot.chunk_index, filters)
         
         # インデックスがない場合はファイル直接検索
-        return self._search_files_directly(query, categories, limit)
+        return self._search_files_directly(query, categories, limit, filters)
 
-    def _search_from_index(self, query: str, categories: Optional[List[str]], 
-                          limit: int, index_file: Path) -> List[Dict[str, Any]]:
-        """インデックスファイルから検索"""
+    def _index_files_signature(self) -> Optional[tuple]:
+        """インデックス関連ファイルのmtime/サイズ（インデックス本体がなければNone）"""
+        signature = []
+        for file_name in (STORE_FILE, "knowledge_index.json", INVERTED_INDEX_FILE, INDEX_MANIFEST_FILE):
+            try:
+                stat = (self.index_path / file_name).stat()
+                signature.append((stat.st_mtime_ns, stat.st_size))
+            except FileNotFoundError:
+                signature.append(None)
+        if signature[0] is None and signature[1] is None and signature[3] is None:
+            return None
+        return tuple(signature)
+
+    def _load_index(self) -> Optional["_IndexSnapshot"]:
+        """
+        ローカルインデックスを取得（ライブ更新の差分があれば重ねたもの）
+        
+        差分のスナップショットは監視スレッドが参照の差し替えだけで公開するため、
+        検索側は差分の反映を待ちません。
+        
+        Returns:
+            読み込み済みインデックス（インデックスがない場合はNone）
+        """
+        snapshot = self._load_base_index()
+        live_snapshot = self._live_snapshot
+        if snapshot is not None and live_snapshot is not None and live_snapshot.base is snapshot:
+            return live_snapshot
+        return snapshot
+
+    def _load_base_index(self) -> Optional["_IndexSnapshot"]:
+        """
+        取り込み済みのローカルインデックスを取得（常駐キャッシュを再利用）
+        
+        Returns:
+            読み込み済みインデックス（インデックスがない場合はNone）
+        """
+        signature = self._index_files_signature()
+        
+        with self._index_lock:
+            if signature is not None and signature == self._index_signature:
+                self._cache_stats["hits"] += 1
+                return self._snapshot
+            
+            if self._index_signature is None:
+                self._cache_stats["misses"] += 1
+            else:
+                self._cache_stats["reloads"] += 1
+            
+            # 旧スナップショットのmmapは参照がなくなった時点で解放される
+            self._snapshot = None
+            self._index_signature = None
+            if signature is None:
+                return None
+            
+            snapshot = _IndexSnapshot(load_manifest(self.index_path).get("generation", 0))
+            try:
+                # カテゴリ別シャード（旧形式の単一ファイルも1シャードとして扱う）
+                max_workers = self.config.get("search", {}).get("shards", {}).get("max_workers", 4)
+                snapshot.store = ShardedKnowledgeStore.open(self.index_path, max_workers)
+                if snapshot.store is not None and snapshot.store.doc_count == 0:
+                    # 文書のないインデックスはないものとして扱う（ファイル直接検索にフォールバック）
+                    snapshot.store = None
+                if snapshot.store is not None:
+                    pruning_config = self.config.get("search", {}).get("pruning", {}) or {}
+                    snapshot.store.set_pruning(pruning_config.get("enabled", PRUNING_ENABLED),
+                                               pruning_config.get("min_postings", PRUNING_MIN_POSTINGS))
+            except Exception as e:
+                logger.error(f"バイナリインデックス読み込みエラー: {e}")
+            
+            if snapshot.store is None and (not (self.index_path / "knowledge_index.json").exists()
+                                           or not self._load_json_index(snapshot)):
+                return None
+            
+            self._snapshot = snapshot
+            self._index_signature = signature
+            
+            logger.info(f"ローカルインデックスを読み込みました "
+                        f"({snapshot.doc_count}チャンク, 世代 {snapshot.generation})")
+            return snapshot
+
+    def _load_json_index(self, snapshot: "_IndexSnapshot") -> bool:
+        """旧形式（JSON）のインデックスを読み込み"""
+        try:
+            with open(self.index_path / "knowledge_index.json", 'r', encoding='utf-8') as f:
+                snapshot.chunk_index = json.load(f)
+        except Exception as e:
+            logger.error(f"インデックス読み込みエラー: {e}")
+            return False
+        
+        inverted_index_file = self.index_path / INVERTED_INDEX_FILE
+        if inverted_index_file.exists():
+            try:
+                snapshot.inverted_index = InvertedIndex.load(inverted_index_file)
+            except Exception as e:
+                logger.warning(f"転置インデックス読み込みエラー（全件走査で検索）: {e}")
+        return True
+
+    def start_watching(self, interval_seconds: float = DEFAULT_POLL_INTERVAL) -> None:
+        """
+        ナレッジファイルの監視を開始（追加・更新・削除を取り込みなしで検索に反映）
+        
+        バックグラウンドスレッドが interval_seconds ごとにファイルのmtime/サイズを確認し、
+        変更されたファイルだけをチャンク分割してメモリ上のセグメントに索引します。
+        ローカルインデックス（バイナリ）を使う全文検索が対象で、セグメントのチャンクは
+        次の取り込みまで埋め込みを持ちません。
+        
+        Args:
+            interval_seconds: ポーリング間隔（秒）
+        """
+        if self._watch_thread is not None and self._watch_thread.is_alive():
+            return
+        self._watch_stop.clear()
+        self._watch_thread = threading.Thread(
+            target=self._watch_loop, args=(interval_seconds,), name="knowledge-watch", daemon=True
+        )
+        self._watch_thread.start()
+        logger.info(f"ナレッジファイルの監視を開始しました (間隔 {interval_seconds}秒)")
+
+    def stop_watching(self) -> None:
+        """ナレッジファイルの監視を停止（反映済みの差分は次の取り込みまで検索に残る）"""
+        self._watch_stop.set()
+        if self._watch_thread is not None:
+            self._watch_thread.join()
+            self._watch_thread = None
+
+    def _watch_loop(self, interval_seconds: float) -> None:
+        """監視スレッドの本体"""
+        while not self._watch_stop.is_set():
+            try:
+                self.poll_knowledge_changes()
+            except Exception as e:
+                logger.error(f"ナレッジファイル監視エラー: {e}")
+            self._watch_stop.wait(interval_seconds)
+
+    def poll_knowledge_changes(self) -> bool:
+        """
+        ナレッジファイルを1回走査して差分を反映（監視スレッドから呼ばれる。手動実行も可）
+        
+        取り込みでインデックス世代が変わった場合は、新しいインデックスに対して差分を取り直します。
+        
+        Returns:
+            検索に反映する差分が変わったか
+        """
+        with self._watch_lock:
+            snapshot = self._load_base_index()
+            if snapshot is None or snapshot.store is None:
+                if self._live_snapshot is not None or self._live_segments is not None:
+                    logger.warning("バイナリのローカルインデックスがないため、ライブ更新を停止します")
+                self._live_segments = None
+                self._live_snapshot = None
+                return False
+            
+            segments = self._live_segments
+            if segments is None or segments.base is not snapshot.store:
+                chunker = KnowledgeChunker(self.config, self.knowledge_base_path)
+                segments = self._live_segments = LiveSegments(snapshot.store, chunker)
+                # 旧世代に重ねた差分は使われないので解放する
+                self._live_snapshot = None
+            if not segments.poll():
+                return False
+            self._publish_live_snapshot(snapshot, segments)
+            return True
+
+    def _publish_live_snapshot(self, snapshot: "_IndexSnapshot", segments: LiveSegments) -> None:
+        """差分を重ねたスナップショットを作成し、参照の差し替えで公開"""
+        live_snapshot = None
+        if segments.has_changes:
+            live_snapshot = _IndexSnapshot(snapshot.generation)
+            live_snapshot.store = segments.overlay()
+            # 既存シャードのベクトルインデックスは共有する（削除済みの文書はマスクで除外される）
+            live_snapshot.vector_indexes = snapshot.vector_indexes
+            live_snapshot.base = snapshot
+            live_snapshot.live_version = segments.version
+        # 検索中のスレッドは旧スナップショットを使い続ける
+        self._live_snapshot = live_snapshot
+        logger.info(f"ライブ更新を反映しました (版 {segments.version}, "
+                    f"セグメント {segments.live_file_count}ファイル)")
+
+    def get_cache_stats(self) -> Dict[str, Any]:
+        """
+        インデックスキャッシュの統計を取得
+        
+        Returns:
+            ヒット・ミス・再読み込み回数と現在のインデックス世代
+            （live_version にライブ更新の差分の版、result_cache に検索結果キャッシュの統計）
+        """
+        live_snapshot = self._live_snapshot
+        with self._index_lock:
+            stats = dict(self._cache_stats)
+            stats["generation"] = self._snapshot.generation if self._snapshot else 0
+            stats["loaded"] = self._snapshot is not None
+            stats["live_version"] = (live_snapshot.live_version
+                                     if live_snapshot is not None and live_snapshot.base is self._snapshot
+                                     else 0)
+        stats["result_cache"] = self._result_cache.stats() if self._result_cache else None
+        return stats
+
+    def dump_cache_stats(self, output_path: str) -> None:
+        """
+        キャッシュ統計をJSONファイルに書き出し（容量計画用）
+        
+        Args:
+            output_path: 出力先ファイル
+        """
+        stats = self.get_cache_stats()
+        stats["dumped_at"] = datetime.now().isoformat()
+        
+        output_file = Path(output_path)
+        output_file.parent.mkdir(parents=True, exist_ok=True)
+        with open(output_file, 'w', encoding='utf-8') as f:
+            json.dump(stats, f, ensure_ascii=False, indent=2)
+        
+        logger.info(f"キャッシュ統計を出力しました: {output_file}")
+
+    def invalidate_cache(self) -> None:
+        """インデックスキャッシュと検索結果キャッシュを破棄（次回検索時に再読み込み）"""
+        with self._index_lock:
+            self._snapshot = None
+            self._index_signature = None
+            self._related = None
+            self._related_signature = None
+        if self._result_cache is not None:
+            self._result_cache.clear()
+
+    def _search_from_store(self, query: str, categories: Optional[List[str]],
+                           limit: int, store: ShardedKnowledgeStore,
+                           filters: Optional[List[FacetCondition]] = None) -> List[Dict[str, Any]]:
+        """
+        バイナリインデックスからBM25Fで検索
+        
+        ファセット条件は値索引で、フレーズ（"..."）は出現位置で事前に絞り込み、
+        クエリの語が近接して出現する上位候補をブーストします。
+        """
         try:
-            with open(index_file, 'r', encoding='utf-8') as f:
-                index = json.load(f)
+            positional = self._positional_query(query, store.tokenizer)
+            hits = store.search(positional.terms, limit, categories, filters, positional)
+            return self._store_results(store, hits, positional)
+            
+        except Exception as e:
+            logger.error(f"バイナリインデックス検索エラー: {e}")
+            return []
+
+    def _search_from_inverted_index(self, query: str, categories: Optional[List[str]],
+                                    limit: int, chunk_index: Dict[str, Any],
+                                    inverted_index: InvertedIndex,
+                                    filters: Optional[List[FacetCondition]] = None) -> List[Dict[str, Any]]:
+        """転置インデックスからBM25で検索（ファセット条件はスコア順に後段で絞り込み）"""
+        try:
+            query_terms = inverted_index.tokenizer.tokenize(query)
+            hits = inverted_index.search(query_terms, inverted_index.doc_count if filters else limit,
+                                         categories)
             
             results = []
-            query_terms = self._extract_search_terms(query)
+            for chunk_id, score in hits:
+                chunk_data = chunk_index.get(chunk_id)
+                if chunk_data is None:
+                    continue
+                if filters and not matches_filters(chunk_data.get("metadata", {}), filters):
+                    continue
+                if len(results) >= limit:
+                    break
+                results.append({
+                    "content": chunk_data.get("content", ""),
+                    "metadata": chunk_data.get("metadata", {}),
+                    "similarity": score,
+                    "rank": len(results) + 1
+                })
+            
+            return results
+            
+        except Exception as e:
+            logger.error(f"転置インデックス検索エラー: {e}")
+            return self._search_from_index(query, categories, limit, chunk_index, filters)
+
+    def _search_from_index(self, query: str, categories: Optional[List[str]], 
+                          limit: int, index: Dict[str, Any],
+                          filters: Optional[List[FacetCondition]] = None) -> List[Dict[str, Any]]:
+        """インデックスから検索（全チャンク走査）"""
+        try:
+            results = []
+            matcher = compile_term_matcher(self._extract_search_terms(query))
             
             for chunk_id, chunk_data in index.items():
                 content = chunk_data.get("content", "")
                 metadata = chunk_data.get("metadata", {})
                 
                 # カテゴリフィルタ
-                if categories and metadata.get("category") not in categories:
+                if categories and not self._matches_categories(metadata, categories):
+                    continue
+                if filters and not matches_filters(metadata, filters):
                     continue
                 
-                # スコア計算
-                score = self._calculate_text_score(content, metadata, query_terms)
+                # スコア計算（取り込み時に計算済みのフィールドを使用）
+                fields = chunk_data.get("fields") or extract_chunk_fields(content, metadata)
+                score = self._calculate_text_score(content, fields, matcher)
                 
                 if score > 0:
                     results.append({
@@ -169,11 +1269,26 @@ class KnowledgeSearcher:
             logger.error(f"インデックス検索エラー: {e}")
             return []
 
+    def _matches_categories(self, metadata: Dict[str, Any], categories: List[str]) -> bool:
+        """ディレクトリ（配下を含む）または Front Matter の category がカテゴリに一致するか"""
+        if metadata.get("category") in categories:
+            return True
+        shard_name = shard_name_for(metadata.get("file_path", ""), self.knowledge_base_path)
+        return category_matches(shard_name, categories)
+
     def _search_files_directly(self, query: str, categories: Optional[List[str]], 
-                              limit: int) -> List[Dict[str, Any]]:
-        """ファイル直接検索"""
-        results = []
-        query_terms = self._extract_search_terms(query)
+                              limit: int, filters: Optional[List[FacetCondition]] = None
+                              ) -> List[Dict[str, Any]]:
+        """
+        ファイル直接検索（インデックスがない場合）
+        
+        ファイルをスレッドプールで読み込みながら順にスコアを計算し、上位 limit 件だけを
+        ヒープに保持します。本文は保持せず、最終的な上位のファイルだけを読み直して返すため、
+        ナレッジベースの規模によらずメモリ使用量は一定です。
+        """
+        if limit <= 0:
+            return []
+        matcher = compile_term_matcher(self._extract_search_terms(query))
         
         # 検索対象パスを決定
         search_paths = []
@@ -185,84 +1300,128 @@ class KnowledgeSearcher:
         else:
             search_paths = [self.knowledge_base_path]
         
-        # ファイル検索
-        for search_path in search_paths:
-            for file_path in search_path.rglob("*.md"):
-                try:
-                    content = file_path.read_text(encoding='utf-8')
-                    metadata = self._extract_metadata_from_file(file_path, content)
-                    
-                    score = self._calculate_text_score(content, metadata, query_terms)
-                    
-                    if score > 0:
-                        results.append({
-                            "content": content,
-                            "metadata": metadata,
-                            "similarity": score,
-                            "rank": 0
-                        })
-                        
-                except Exception as e:
-                    logger.warning(f"ファイル読み込みエラー {file_path}: {e}")
-        
-        # スコア順でソート
-        results.sort(key=lambda x: x["similarity"], reverse=True)
-        
-        # ランク設定
-        for i, result in enumerate(results[:limit]):
-            result["rank"] = i + 1
-        
-        return results[:limit]
+        def iter_files():
+            seen = set()
+            for search_path in search_paths:
+                for file_path in search_path.rglob("*.md"):
+                    if file_path not in seen:
+                        seen.add(file_path)
+                        yield file_path
+        
+        def score_file(file_path: Path) -> Optional[Tuple[float, Dict[str, Any]]]:
+            try:
+                content, stat_result = self._read_file(file_path)
+                metadata = self._extract_metadata_from_file(file_path, content, stat_result)
+                if filters and not matches_filters(metadata, filters):
+                    return None
+                fields = extract_chunk_fields(content, metadata)
+                return self._calculate_text_score(content, fields, matcher), metadata
+            except Exception as e:
+                logger.warning(f"ファイル読み込みエラー {file_path}: {e}")
+                return None
+        
+        # 上位 limit 件の最小ヒープ（(スコア, -列挙順, パス, メタデータ)、同点は列挙順を優先）
+        heap: List[Tuple[float, int, str, Dict[str, Any]]] = []
+        
+        def collect(seq: int, file_path: Path, scored: Optional[Tuple[float, Dict[str, Any]]]) -> None:
+            if scored is None or scored[0] <= 0:
+                return
+            entry = (scored[0], -seq, str(file_path), scored[1])
+            if len(heap) < limit:
+                heapq.heappush(heap, entry)
+            elif entry[:2] > heap[0][:2]:
+                heapq.heapreplace(heap, entry)
+        
+        max_workers = self.config.get("performance", {}).get("max_workers", 4)
+        max_in_flight = max(1, max_workers) * 4
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            in_flight = {}
+            for seq, file_path in enumerate(iter_files()):
+                in_flight[executor.submit(score_file, file_path)] = (seq, file_path)
+                if len(in_flight) >= max_in_flight:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        collect(*in_flight.pop(future), future.result())
+            for future in list(in_flight):
+                collect(*in_flight.pop(future), future.result())
+        
+        # 上位のファイルだけ本文を読み直す
+        results = []
+        for score, _, file_path, metadata in sorted(heap, reverse=True):
+            try:
+                content, _ = self._read_file(Path(file_path))
+            except Exception as e:
+                logger.warning(f"ファイル読み込みエラー {file_path}: {e}")
+                continue
+            results.append({
+                "content": content,
+                "metadata": metadata,
+                "similarity": score,
+                "rank": len(results) + 1
+            })
+        
+        return results
+
+    @staticmethod
+    def _read_file(file_path: Path) -> Tuple[str, os.stat_result]:
+        """ファイルを読み込み、同じファイル記述子の stat を返す（stat の再実行を避ける）"""
+        with open(file_path, 'rb') as f:
+            stat_result = os.fstat(f.fileno())
+            return f.read().decode('utf-8'), stat_result
 
     def _extract_search_terms(self, query: str) -> List[str]:
         """検索クエリからキーワードを抽出"""
-        # 日本語・英語の単語を抽出
-        terms = re.findall(r'[ぁ-んァ-ヶ一-龠a-zA-Z0-9]+', query)
+        # 日本語・英語の単語を抽出（全角・半角を正規化）
+        terms = re.findall(r'[ぁ-んァ-ヶー一-龠a-zA-Z0-9]+', normalize_text(query))
         
         # 重複除去・小文字化
         unique_terms = list(set([term.lower() for term in terms if len(term) > 1]))
         
         return unique_terms
 
-    def _calculate_text_score(self, content: str, metadata: Dict[str, Any], 
-                             query_terms: List[str]) -> float:
-        """テキストベースのスコア計算"""
-        score = 0.0
-        content_lower = content.lower()
-        
-        # コンテンツマッチング
-        for term in query_terms:
-            count = content_lower.count(term.lower())
-            score += count * 1.0
-        
-        # メタデータマッチング（重み付け）
-        metadata_text = " ".join([str(v) for v in metadata.values()]).lower()
-        for term in query_terms:
-            if term.lower() in metadata_text:
-                score += 2.0  # メタデータマッチは高スコア
-        
-        # タイトル・見出しマッチング（重み付け）
-        title_pattern = r'^#+ (.+)$'
-        titles = re.findall(title_pattern, content, re.MULTILINE)
-        title_text = " ".join(titles).lower()
-        for term in query_terms:
-            if term.lower() in title_text:
-                score += 3.0  # タイトルマッチは最高スコア
+    def _calculate_text_score(self, content: str, fields: Dict[str, Any], 
+                             matcher: TermMatcher) -> float:
+        """
+        テキストベースのスコア計算
+        
+        Args:
+            content: チャンク本文
+            fields: extract_chunk_fieldsで計算したフィールド（見出し・メタデータ文字列・本文長）
+            matcher: 検索キーワードの照合器（compile_term_matcher で取得）
+            
+        Returns:
+            0.0〜1.0のスコア
+        """
+        if not matcher.terms:
+            return 0.0
+        
+        # 本文・メタデータ・見出しをそれぞれ1回だけ走査して全キーワードを照合
+        content_counts = matcher.count(normalize_text(content))
+        metadata_counts = matcher.count(fields["metadata_text"])
+        title_counts = matcher.count(normalize_text(" ".join(fields["titles"])))
+        
+        # コンテンツマッチング + メタデータマッチ（重み付け）+ タイトル・見出しマッチ（最高スコア）
+        score = float(sum(content_counts))
+        score += 2.0 * sum(1 for count in metadata_counts if count)
+        score += 3.0 * sum(1 for count in title_counts if count)
         
         # 正規化（コンテンツ長で調整）
-        content_length = len(content)
+        content_length = fields["content_length"]
         if content_length > 0:
             score = score / (content_length / 1000)  # 1000文字あたりのスコア
         
         return min(score, 1.0)  # 最大1.0に制限
 
-    def _extract_metadata_from_file(self, file_path: Path, content: str) -> Dict[str, Any]:
-        """ファイルからメタデータを抽出"""
+    def _extract_metadata_from_file(self, file_path: Path, content: str,
+                                    stat_result: Optional[os.stat_result] = None) -> Dict[str, Any]:
+        """ファイルからメタデータを抽出（stat_result があればファイルの stat を省略）"""
+        if stat_result is None:
+            stat_result = file_path.stat()
         metadata = {
             "file_path": str(file_path),
             "file_name": file_path.name,
             "category": self._extract_category_from_path(file_path),
-            "modified_time": datetime.fromtimestamp(file_path.stat().st_mtime).isoformat()
+            "modified_time": datetime.fromtimestamp(stat_result.st_mtime).isoformat()
         }
         
         # YAML Front Matterを抽出
@@ -293,7 +1452,73 @@ class KnowledgeSearcher:
         return {}
 
     def get_related_documents(self, document_path: str, limit: int = 5) -> List[Dict[str, Any]]:
-        """関連文書を取得"""
+        """
+        関連文書を取得
+        
+        取り込み時に計算した関連文書テーブルを引きます（文書単位、similarity は文書ベクトルの
+        コサイン類似度）。テーブルにない文書はタグ・カテゴリによる検索で求めます。
+        
+        Args:
+            document_path: 基準文書のパス
+            limit: 最大結果数
+            
+        Returns:
+            関連文書のリスト
+        """
+        related = self._lookup_related_documents(document_path, limit)
+        if related is not None:
+            return related
+        return self._related_documents_by_search(document_path, limit)
+
+    def _lookup_related_documents(self, document_path: str,
+                                  limit: int) -> Optional[List[Dict[str, Any]]]:
+        """関連文書テーブルから取得（テーブルにない文書はNone）"""
+        related = self._load_related_table()
+        if related is None:
+            return None
+        
+        documents, aliases = related
+        key = document_path if document_path in documents else aliases.get(
+            str(Path(document_path).resolve())
+        )
+        if key is None:
+            return None
+        
+        results = []
+        for neighbour, similarity in documents[key]["related"][:limit]:
+            entry = documents.get(neighbour)
+            if entry is None:
+                continue
+            results.append({
+                "content": entry["content"],
+                "metadata": entry["metadata"],
+                "similarity": similarity,
+                "rank": len(results) + 1
+            })
+        return results
+
+    def _load_related_table(self) -> Optional[Tuple[Dict[str, Any], Dict[str, str]]]:
+        """関連文書テーブルを取得（ファイルが変わるまで常駐キャッシュを再利用）"""
+        try:
+            stat = (self.index_path / RELATED_FILE).stat()
+            signature = (stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            return None
+        
+        with self._index_lock:
+            if signature == self._related_signature:
+                return self._related
+            
+            table = load_related_table(self.index_path)
+            documents = table.get("documents", {}) if table else {}
+            # 絶対パスで指定された場合も引けるよう別名を用意
+            aliases = {str(Path(file_path).resolve()): file_path for file_path in documents}
+            self._related = (documents, aliases) if table else None
+            self._related_signature = signature
+            return self._related
+
+    def _related_documents_by_search(self, document_path: str, limit: int) -> List[Dict[str, Any]]:
+        """タグ・カテゴリで検索して関連文書を取得（関連文書テーブルがない場合）"""
         try:
             file_path = Path(document_path)
             if not file_path.exists():
@@ -326,7 +1551,8 @@ class KnowledgeSearcher:
 _searcher = None
 
 def search_knowledge(query: str, categories: Optional[List[str]] = None,
-                    limit: int = 10, similarity_threshold: float = 0.7) -> List[Dict[str, Any]]:
+                    limit: int = 10, similarity_threshold: Optional[float] = None,
+                    filters: FilterSpec = None) -> List[Dict[str, Any]]:
     """
     ナレッジベース検索のグローバル関数
     
@@ -334,7 +1560,8 @@ def search_knowledge(query: str, categories: Optional[List[str]] = None,
         query: 検索クエリ
         categories: 検索対象カテゴリ
         limit: 最大結果数
-        similarity_threshold: 類似度閾値
+        similarity_threshold: 類似度閾値（None=設定値）
+        filters: メタデータの絞り込み条件（例: "resolution_status=resolved AND date>=2024-10"）
         
     Returns:
         検索結果のリスト
@@ -343,7 +1570,30 @@ def search_knowledge(query: str, categories: Optional[List[str]] = None,
     if _searcher is None:
         _searcher = KnowledgeSearcher()
     
-    return _searcher.search(query, categories, limit, similarity_threshold)
+    return _searcher.search(query, categories, limit, similarity_threshold, filters)
+
+def search_knowledge_batch(queries: List[str], categories: Optional[List[str]] = None,
+                           limit: int = 10, similarity_threshold: Optional[float] = None,
+                           filters: FilterSpec = None) -> List[List[Dict[str, Any]]]:
+    """
+    複数クエリを一括検索するグローバル関数
+    
+    Args:
+        queries: 検索クエリのリスト
+        categories: 検索対象カテゴリ（全クエリ共通）
+        limit: クエリごとの最大結果数
+        similarity_threshold: 類似度閾値（None=設定値）
+        filters: メタデータの絞り込み条件（全クエリ共通）
+        
+    Returns:
+        クエリ順の検索結果リスト
+    """
+    global _searcher
+    if _searcher is None:
+        _searcher = KnowledgeSearcher()
+    
+    return _searcher.search_many(queries, categories, limit, similarity_threshold,
+                                 filters)["results"]
 
 def get_related_documents(document_path: str, limit: int = 5) -> List[Dict[str, Any]]:
     """
@@ -0,0 +1,635 @@
+#!/usr/bin/env python3
+"""
+カテゴリ別シャードのナレッジインデックス
+
+ローカルインデックスを common/knowledge/<category>/ のディレクトリ構成と同じ単位の
+シャード（knowledge_index.bin）に分割し、マニフェスト（manifest.json）で一覧を管理します。
+カテゴリ絞り込みのある検索は該当シャードだけを開いてスコアを計算し、
+絞り込みのない検索は全シャードを並列に検索して上位k件をマージします。
+
+各シャードはコーパス全体の文書頻度・平均フィールド長を保持するため、
+シャードをまたいでもスコアは単一インデックスの場合と一致します。
+
+差分の取り込みでは既存のシャードを書き換えず、変更したファイルのチャンクだけを
+新しい世代ディレクトリにセグメント（シャードと同じ形式のストア）として追記します。
+マニフェストは segments にセグメントの一覧を、各ストアの hidden_files に新しいセグメントで
+置き換えられたファイルの番号を持ち、読み込み時に古いチャンクを検索対象から外します。
+セグメントのIDF・平均フィールド長は追記時点の統計で計算するため、セグメントが増えると
+スコアが全件構築の場合から少しずつずれます。compact（全件構築）でシャードにまとめ直します。
+
+ディレクトリ構成:
+    .index/manifest.json                              世代番号・シャード・セグメント一覧
+    .index/shards/g<世代>/<カテゴリ>/knowledge_index.bin
+
+使用例:
+    from common.utils.knowledge_shards import ShardedKnowledgeStore
+
+    store = ShardedKnowledgeStore.open(index_path)
+    terms = store.tokenizer.tokenize("API統合")
+    for doc, score in store.search(terms, limit=5, categories=["customer-support"]):
+        chunk = store.get_chunk(doc)
+"""
+
+import bisect
+import heapq
+import json
+import shutil
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+from pathlib import Path
+from typing import Dict, List, Optional, Any, Tuple, Iterator, Callable
+import logging
+
+import numpy as np
+
+from .knowledge_index import (
+    InvertedIndex, INVERTED_INDEX_FILE, FIELDS, extract_chunk_fields, load_manifest, bump_index_generation
+)
+from .knowledge_facets import FacetCondition
+from .knowledge_positions import PositionalQuery
+from .knowledge_postings import DEFAULT_POSTING_ENCODING
+from .knowledge_pruning import BLOCK_SIZE, PRUNING_ENABLED, PRUNING_MIN_POSTINGS
+from .knowledge_store import KnowledgeStore, STORE_FILE, write_knowledge_store
+from .knowledge_tokenizer import create_tokenizer
+
+logger = logging.getLogger(__name__)
+
+SHARDS_DIR = "shards"
+SHARDED_LAYOUT = "sharded"
+
+# ナレッジベース直下のファイルが入るシャード
+ROOT_SHARD = "."
+
+# セグメント数の既定の上限（取り込み時にこの数に達したら全件構築でまとめ直す）
+DEFAULT_MAX_SEGMENTS = 8
+
+
+def shard_name_for(file_path: str, knowledge_base_path: Path) -> str:
+    """
+    ファイルが属するシャード名（ナレッジベースからの相対ディレクトリ）
+
+    Args:
+        file_path: ナレッジファイルのパス
+        knowledge_base_path: ナレッジベースのルート
+
+    Returns:
+        シャード名（例: "customer-support/inquiries"、直下のファイルは "."）
+    """
+    try:
+        relative = Path(file_path).resolve().relative_to(Path(knowledge_base_path).resolve())
+    except ValueError:
+        return ROOT_SHARD
+    return relative.parent.as_posix()
+
+
+def category_matches(shard_name: str, categories: List[str]) -> bool:
+    """シャードがカテゴリ（ディレクトリ）そのものか、その配下にあるか"""
+    for category in categories:
+        category = category.strip("/")
+        if shard_name == category or shard_name.startswith(category + "/"):
+            return True
+    return False
+
+
+def _global_stats(shard_indexes: Dict[str, InvertedIndex]) -> Dict[str, Any]:
+    """シャードの転置インデックスからコーパス全体の文書数・平均フィールド長・文書頻度を集計"""
+    doc_count = sum(index.doc_count for index in shard_indexes.values())
+    totals = [0.0] * len(FIELDS)
+    frequencies: Counter = Counter()
+    for index in shard_indexes.values():
+        for i, avg in enumerate(index.avg_field_lengths()):
+            totals[i] += avg * index.doc_count
+        for term, postings in index.postings.items():
+            frequencies[term] += len(postings)
+
+    return {
+        "doc_count": doc_count,
+        "avg_field_lengths": [total / doc_count if doc_count else 0.0 for total in totals],
+        "document_frequencies": frequencies
+    }
+
+
+def write_sharded_index(index_path: Path, shard_chunks: Dict[str, List[Dict[str, Any]]],
+                        shard_indexes: Dict[str, InvertedIndex],
+                        embedding_model: Optional[str] = None,
+                        ann_config: Optional[Dict[str, Any]] = None,
+                        facet_fields: Optional[List[str]] = None,
+                        posting_encoding: str = DEFAULT_POSTING_ENCODING) -> Tuple[int, int]:
+    """
+    シャードを新しい世代ディレクトリに書き出し、マニフェストを切り替え
+
+    既存の世代のファイルは書き換えないため、検索中のプロセスは切り替え前の
+    シャードを読み続けられます。
+
+    Args:
+        index_path: インデックスディレクトリ
+        shard_chunks: シャード名 -> チャンクのリスト（転置インデックスの文書番号順）
+        shard_indexes: シャード名 -> 転置インデックス
+        embedding_model: 埋め込みを生成したモデル名
+        ann_config: 近似最近傍インデックスの設定
+        facet_fields: ファセット絞り込み用の値索引を作るメタデータのフィールド
+        posting_encoding: ポスティングの格納形式（"delta-varint"=圧縮, "raw"=非圧縮）
+
+    Returns:
+        (新しい世代番号, 書き出した合計バイト数)
+    """
+    index_path = Path(index_path)
+    previous = load_manifest(index_path)
+    generation = previous.get("generation", 0) + 1
+    generation_dir = Path(SHARDS_DIR) / f"g{generation}"
+    stats = _global_stats(shard_indexes)
+
+    shards = []
+    total_size = 0
+    for name in sorted(shard_chunks):
+        index = shard_indexes[name]
+        relative_file = generation_dir / name / STORE_FILE
+        total_size += write_knowledge_store(index_path / relative_file, shard_chunks[name], index,
+                                            embedding_model, ann_config, stats, facet_fields,
+                                            posting_encoding)
+        shards.append({
+            "name": name,
+            "file": relative_file.as_posix(),
+            "doc_count": index.doc_count,
+            "categories": sorted(set(index.categories))
+        })
+
+    tokenizer_spec = next(iter(shard_indexes.values())).tokenizer.spec if shard_indexes else None
+    new_generation = bump_index_generation(index_path, {
+        "layout": SHARDED_LAYOUT,
+        "shards": shards,
+        "segments": [],
+        "doc_count": stats["doc_count"],
+        "tokenizer": tokenizer_spec,
+        "embedding_model": embedding_model,
+        "facet_fields": list(facet_fields or []),
+        "positions": any(index.store_positions for index in shard_indexes.values()),
+        "block_size": BLOCK_SIZE,
+        "posting_encoding": posting_encoding
+    })
+    if new_generation != generation:
+        logger.warning(f"インデックス世代が想定と異なります (想定 {generation}, 実際 {new_generation})")
+
+    _remove_old_generations(index_path, [previous, load_manifest(index_path)])
+
+    # 単一ファイル形式からの移行
+    legacy_store = index_path / STORE_FILE
+    if legacy_store.exists():
+        legacy_store.unlink()
+
+    return new_generation, total_size
+
+
+def append_segment(index_path: Path, shard_chunks: Dict[str, List[Dict[str, Any]]],
+                   shard_indexes: Dict[str, InvertedIndex],
+                   embedding_model: Optional[str] = None,
+                   ann_config: Optional[Dict[str, Any]] = None,
+                   facet_fields: Optional[List[str]] = None,
+                   posting_encoding: str = DEFAULT_POSTING_ENCODING) -> Tuple[int, int]:
+    """
+    変更したファイルのチャンクをセグメントとして新しい世代ディレクトリに追記し、マニフェストを切り替え
+
+    既存のシャード・セグメントのファイルは書き換えません。同じファイルの古いチャンクは、
+    そのストアのマニフェストの hidden_files にファイル番号を加えて検索対象から外します。
+
+    Args:
+        index_path: インデックスディレクトリ（シャード形式で構築済みであること）
+        shard_chunks: シャード名 -> 変更したファイルのチャンクのリスト（転置インデックスの文書番号順）
+        shard_indexes: シャード名 -> 転置インデックス
+        embedding_model: 埋め込みを生成したモデル名
+        ann_config: 近似最近傍インデックスの設定
+        facet_fields: ファセット絞り込み用の値索引を作るメタデータのフィールド
+        posting_encoding: ポスティングの格納形式
+
+    Returns:
+        (新しい世代番号, 書き出した合計バイト数)
+    """
+    index_path = Path(index_path)
+    previous = load_manifest(index_path)
+    base = ShardedKnowledgeStore.open(index_path)
+    generation = previous.get("generation", 0) + 1
+    generation_dir = Path(SHARDS_DIR) / f"g{generation}"
+
+    # 置き換えたファイルの古いチャンクを隠す（ストアの並びは ShardedKnowledgeStore.open と同じ）
+    replaced_files = {chunk["metadata"]["file_path"] for chunks in shard_chunks.values() for chunk in chunks}
+    entries = [dict(entry) for entry in previous.get("shards", []) + previous.get("segments", [])]
+    # 今回隠す文書を索引し直し、統計から差し引く語の文書頻度・フィールド長を求める
+    removed = InvertedIndex(tokenizer=base.tokenizer) if base is not None else None
+    for shard_no, entry in enumerate(entries):
+        if not entry["doc_count"]:
+            continue
+        store = base.shard(shard_no)
+        hidden = set(entry.get("hidden_files", []))
+        for file_id, metadata in enumerate(store.files()):
+            if file_id not in hidden and metadata.get("file_path") in replaced_files:
+                hidden.add(file_id)
+                for doc in store.file_docs(file_id):
+                    chunk = store.get_chunk(int(doc))
+                    removed.add_chunk(chunk["metadata"]["chunk_id"], chunk["content"],
+                                      extract_chunk_fields(chunk["content"], metadata))
+        if hidden:
+            entry["hidden_files"] = sorted(hidden)
+    hidden_docs = removed.doc_count if removed is not None else 0
+
+    # IDF・平均フィールド長は直近のストアの統計から隠した文書を除き、セグメントの文書を加えて計算
+    stats = _global_stats(shard_indexes)
+    reference = next((base.shard(shard_no) for shard_no in reversed(range(len(entries)))
+                      if entries[shard_no]["doc_count"]), None)
+    if reference is not None:
+        reference_count = reference.stats_doc_count
+        doc_count = reference_count - hidden_docs + stats["doc_count"]
+        totals = [
+            reference_avg * reference_count - removed_avg * hidden_docs + added_avg * stats["doc_count"]
+            for reference_avg, removed_avg, added_avg in zip(
+                reference.header["avg_field_lengths"], removed.avg_field_lengths(), stats["avg_field_lengths"]
+            )
+        ]
+        stats = {
+            "doc_count": doc_count,
+            "avg_field_lengths": [max(total, 0.0) / doc_count if doc_count else 0.0 for total in totals],
+            "document_frequencies": Counter({
+                term: max(base.document_frequency(term) - len(removed.postings.get(term, ())), 0) + frequency
+                for term, frequency in stats["document_frequencies"].items()
+            })
+        }
+
+    segments = []
+    total_size = 0
+    for name in sorted(shard_chunks):
+        index = shard_indexes[name]
+        relative_file = generation_dir / name / STORE_FILE
+        total_size += write_knowledge_store(index_path / relative_file, shard_chunks[name], index,
+                                            embedding_model, ann_config, stats, facet_fields,
+                                            posting_encoding)
+        segments.append({
+            "name": name,
+            "file": relative_file.as_posix(),
+            "doc_count": index.doc_count,
+            "categories": sorted(set(index.categories))
+        })
+
+    shard_count = len(previous.get("shards", []))
+    new_generation = bump_index_generation(index_path, {
+        "shards": entries[:shard_count],
+        "segments": entries[shard_count:] + segments,
+        "doc_count": previous.get("doc_count", 0) + sum(index.doc_count for index in shard_indexes.values())
+                     - hidden_docs,
+        "embedding_model": embedding_model or previous.get("embedding_model")
+    })
+    if new_generation != generation:
+        logger.warning(f"インデックス世代が想定と異なります (想定 {generation}, 実際 {new_generation})")
+
+    _remove_old_generations(index_path, [previous, load_manifest(index_path)])
+    return new_generation, total_size
+
+
+def _remove_old_generations(index_path: Path, manifests: List[Dict[str, Any]]) -> None:
+    """
+    どのマニフェストからも参照されない世代ディレクトリを削除
+
+    セグメントを追記した世代は古い世代のシャードを参照し続けるため、世代番号ではなく
+    参照で判断します。切り替え直後も旧マニフェストを読んだ検索プロセスが開けるよう、
+    直前のマニフェストが参照するディレクトリも残します。
+
+    Args:
+        index_path: インデックスディレクトリ
+        manifests: 残すマニフェスト（現在・直前）
+    """
+    shards_root = Path(index_path) / SHARDS_DIR
+    if not shards_root.exists():
+        return
+
+    referenced = {
+        Path(entry["file"]).parts[1]
+        for manifest in manifests
+        for entry in chain(manifest.get("shards", []), manifest.get("segments", []))
+        if entry.get("file")
+    }
+    for generation_dir in shards_root.iterdir():
+        if generation_dir.name.startswith("g") and generation_dir.name not in referenced:
+            shutil.rmtree(generation_dir, ignore_errors=True)
+
+
+class ShardedKnowledgeStore:
+    """
+    シャード群を1つのインデックスとして扱う読み取りクラス
+
+    文書番号はシャードを順に連結した通し番号です。
+    シャードは最初に検索対象になった時点で mmap で開きます。
+    """
+
+    def __init__(self, index_path: Path, shards: List[Dict[str, Any]],
+                 tokenizer_spec: Optional[Dict[str, Any]] = None,
+                 embedding_model: Optional[str] = None, max_workers: int = 4,
+                 stores: Optional[List[KnowledgeStore]] = None):
+        """
+        Args:
+            index_path: インデックスディレクトリ
+            shards: マニフェストのシャード一覧
+            tokenizer_spec: 取り込み時のトークナイザ設定
+            embedding_model: 埋め込みを生成したモデル名（埋め込みがなければNone）
+            max_workers: 複数シャードを並列に検索するスレッド数
+            stores: 開き済みのシャード（省略時は必要になった時点で開く）
+        """
+        self.index_path = Path(index_path)
+        self.shards = shards
+        self.tokenizer = create_tokenizer(tokenizer_spec)
+        self.embedding_model = embedding_model
+        self.max_workers = max_workers
+
+        self._offsets = [0]
+        for shard in shards:
+            self._offsets.append(self._offsets[-1] + shard["doc_count"])
+        self.doc_count = self._offsets[-1]
+
+        self._stores: List[Optional[KnowledgeStore]] = list(stores) if stores else [None] * len(shards)
+        self._lock = threading.Lock()
+        self._pruning = (PRUNING_ENABLED, PRUNING_MIN_POSTINGS)
+
+    @classmethod
+    def open(cls, index_path: Path, max_workers: int = 4) -> Optional["ShardedKnowledgeStore"]:
+        """
+        マニフェストのシャード一覧から開く（旧形式の単一ファイルにも対応）
+
+        Returns:
+            インデックス（バイナリインデックスがない場合はNone）
+        """
+        index_path = Path(index_path)
+        manifest = load_manifest(index_path)
+        if manifest.get("layout") == SHARDED_LAYOUT:
+            # セグメントはシャードの後ろに続く（文書番号も続き番号）
+            return cls(index_path, manifest.get("shards", []) + manifest.get("segments", []),
+                       manifest.get("tokenizer"), manifest.get("embedding_model"), max_workers)
+
+        store_file = index_path / STORE_FILE
+        if store_file.exists():
+            return cls.from_store(KnowledgeStore.open(store_file), index_path)
+        return None
+
+    @classmethod
+    def from_store(cls, store: KnowledgeStore, index_path: Path = Path(".")) -> "ShardedKnowledgeStore":
+        """単一のバイナリインデックスを1シャードとして扱う"""
+        shard = {"name": ROOT_SHARD, "file": None, "doc_count": store.doc_count,
+                 "categories": store.categories}
+        return cls(index_path, [shard], store.tokenizer.spec, store.embedding_model,
+                   max_workers=1, stores=[store])
+
+    @property
+    def shard_names(self) -> List[str]:
+        """シャード名の一覧"""
+        return [shard["name"] for shard in self.shards]
+
+    @property
+    def opened_shard_count(self) -> int:
+        """開き済みのシャード数"""
+        return sum(store is not None for store in self._stores)
+
+    def shard(self, shard_no: int) -> KnowledgeStore:
+        """シャードを取得（初回のみ mmap で開き、後のセグメントで置き換えられたファイルの文書を除く）"""
+        store = self._stores[shard_no]
+        if store is None:
+            with self._lock:
+                if self._stores[shard_no] is None:
+                    store = KnowledgeStore.open(self.index_path / self.shards[shard_no]["file"])
+                    hidden_files = self.shards[shard_no].get("hidden_files")
+                    if hidden_files:
+                        store = store.without_docs(np.isin(store.section("doc_files"), hidden_files))
+                    store.pruning, store.pruning_min_postings = self._pruning
+                    self._stores[shard_no] = store
+                store = self._stores[shard_no]
+        return store
+
+    def set_pruning(self, enabled: bool, min_postings: int = PRUNING_MIN_POSTINGS) -> None:
+        """
+        動的枝刈りの設定（開き済みのシャードと、これから開くシャードに適用）
+
+        Args:
+            enabled: 上位k件に入りえない文書の採点を省くか
+            min_postings: 枝刈りを行う最小のポスティング数（クエリ語の合計）
+        """
+        with self._lock:
+            self._pruning = (enabled, min_postings)
+            for store in self._stores:
+                if store is not None:
+                    store.pruning, store.pruning_min_postings = self._pruning
+
+    def pruning_stats(self) -> Dict[str, Any]:
+        """開き済みシャードの枝刈り統計の合計（scored_ratio は採点したポスティングの割合）"""
+        totals: Counter = Counter()
+        for store in self._stores:
+            if store is not None:
+                stats = store.pruning_stats.as_dict()
+                totals.update({key: value for key, value in stats.items() if key != "scored_ratio"})
+        stats = {key: totals[key] for key in ("queries", "pruned_queries", "postings", "scored")}
+        stats["scored_ratio"] = stats["scored"] / stats["postings"] if stats["postings"] else 1.0
+        return stats
+
+    def with_segments(self, replaced: Dict[int, KnowledgeStore],
+                      added: List[Tuple[str, KnowledgeStore]]) -> "ShardedKnowledgeStore":
+        """
+        シャードを差し替え・追加した新しいインデックスを作る（コピーオンライト）
+
+        元のインデックスは変更せず、差し替えないシャードは開き済みのストアを共有します。
+        差し替えるストアは文書番号を変えないこと（削除済みのビューなど）。
+        追加したシャードの文書番号は既存のシャードの後ろに続きます。
+
+        Args:
+            replaced: シャード番号 -> 差し替えるストア
+            added: (シャード名, ストア) のリスト（メモリ上のストア）
+
+        Returns:
+            新しいインデックス
+        """
+        shards = list(self.shards)
+        stores = [replaced.get(shard_no) or self.shard(shard_no) for shard_no in range(len(shards))]
+        for name, store in added:
+            shards.append({"name": name, "file": None, "doc_count": store.doc_count,
+                           "categories": store.categories})
+            stores.append(store)
+        for store in stores:
+            store.pruning, store.pruning_min_postings = self._pruning
+
+        overlay = ShardedKnowledgeStore(self.index_path, shards, self.tokenizer.spec,
+                                        self.embedding_model, self.max_workers, stores)
+        overlay._pruning = self._pruning
+        return overlay
+
+    def document_frequency(self, term: str) -> int:
+        """語のコーパス全体の文書頻度（未登録は0、セグメントがあれば新しいストアの値を優先）"""
+        for shard_no in reversed(range(len(self.shards))):
+            shard = self.shards[shard_no]
+            if shard["doc_count"] == 0:
+                continue
+            store = self.shard(shard_no)
+            term_id = store.term_id(term)
+            if term_id is not None:
+                # 各シャードはコーパス全体の文書頻度を保持している
+                return store.term_document_frequency(term_id)
+        return 0
+
+    def global_doc(self, shard_no: int, doc: int) -> int:
+        """シャード内の文書番号を通し番号に変換"""
+        return self._offsets[shard_no] + doc
+
+    def _locate(self, doc: int) -> Tuple[int, int]:
+        """通し番号から (シャード番号, シャード内の文書番号) を求める"""
+        shard_no = bisect.bisect_right(self._offsets, doc) - 1
+        return shard_no, doc - self._offsets[shard_no]
+
+    def select_shards(self, categories: Optional[List[str]]) -> List[Tuple[int, Optional[List[str]]]]:
+        """
+        カテゴリ絞り込みの対象シャードを選択
+
+        ディレクトリがカテゴリと一致するか配下にあるシャードは全文書が対象です。
+        それ以外でも、Front Matterの category が一致する文書を含むシャードは
+        その文書だけを対象にします。
+
+        Args:
+            categories: 対象カテゴリ（None=全体）
+
+        Returns:
+            (シャード番号, シャード内で適用するカテゴリ絞り込み（None=シャード全体）) のリスト
+        """
+        selected = []
+        wanted = set(categories or ())
+        for shard_no, shard in enumerate(self.shards):
+            if shard["doc_count"] == 0:
+                continue
+            if not categories or category_matches(shard["name"], categories):
+                selected.append((shard_no, None))
+            elif wanted & set(shard.get("categories", ())):
+                selected.append((shard_no, list(categories)))
+        return selected
+
+    def map_shards(self, selected: List[Tuple[int, Optional[List[str]]]],
+                   func: Callable[[int, Optional[List[str]]], Any]) -> List[Any]:
+        """選択したシャードに関数を適用（複数シャードはスレッドで並列実行）"""
+        if len(selected) <= 1 or self.max_workers <= 1:
+            return [func(shard_no, shard_categories) for shard_no, shard_categories in selected]
+
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(selected))) as executor:
+            futures = [executor.submit(func, shard_no, shard_categories)
+                       for shard_no, shard_categories in selected]
+            return [future.result() for future in futures]
+
+    def search(self, query_terms: List[str], limit: int = 10,
+               categories: Optional[List[str]] = None,
+               filters: Optional[List[FacetCondition]] = None,
+               query: Optional[PositionalQuery] = None) -> List[Tuple[int, float]]:
+        """
+        対象シャードをBM25Fで検索して上位k件をマージ
+
+        Args:
+            query_terms: クエリの索引語
+            limit: 最大結果数
+            categories: 対象カテゴリ（None=全体）
+            filters: メタデータのファセット条件（None=絞り込みなし）
+            query: フレーズ・近接の条件（シャードごとに評価）
+
+        Returns:
+            (通し文書番号, 正規化スコア) のリスト（スコア降順）
+        """
+        def search_shard(shard_no: int, shard_categories: Optional[List[str]]):
+            hits, upper_bounds = self.shard(shard_no).score(query_terms, limit, shard_categories,
+                                                            filters, query)
+            return [(self.global_doc(shard_no, doc), score) for doc, score in hits], upper_bounds
+
+        shard_results = self.map_shards(self.select_shards(categories), search_shard)
+        return self._merge([hits for hits, _ in shard_results],
+                           [upper_bounds for _, upper_bounds in shard_results], limit)
+
+    @staticmethod
+    def _merge(shard_hits: List[List[Tuple[int, float]]], shard_upper_bounds: List[Dict[str, float]],
+               limit: int) -> List[Tuple[int, float]]:
+        """
+        シャードごとの生スコアをマージして上位k件を正規化
+
+        各シャードは全体の文書頻度でスコアを計算しているため、生スコアはそのまま比較でき、
+        正規化の分母は対象シャードに出現した語の理論上限の和になります。
+        """
+        upper_bounds: Dict[str, float] = {}
+        for bounds in shard_upper_bounds:
+            upper_bounds.update(bounds)
+        top = heapq.nlargest(limit, chain.from_iterable(shard_hits), key=lambda hit: hit[1])
+        return KnowledgeStore.normalize_hits(top, upper_bounds)
+
+    def search_many(self, query_terms_list: List[List[str]], limit: int = 10,
+                    categories: Optional[List[str]] = None,
+                    filters: Optional[List[FacetCondition]] = None,
+                    queries: Optional[List[Optional[PositionalQuery]]] = None
+                    ) -> List[List[Tuple[int, float]]]:
+        """
+        複数クエリをまとめて検索（シャードごとに一括検索してクエリ別にマージ）
+
+        Args:
+            query_terms_list: クエリごとの索引語
+            limit: クエリごとの最大結果数
+            categories: 対象カテゴリ（全クエリ共通）
+            filters: メタデータのファセット条件（全クエリ共通）
+            queries: クエリごとのフレーズ・近接の条件
+
+        Returns:
+            クエリ順の (通し文書番号, 正規化スコア) リスト
+        """
+        def search_shard(shard_no: int, shard_categories: Optional[List[str]]):
+            hits_list, upper_bounds_list = self.shard(shard_no).score_many(
+                query_terms_list, limit, shard_categories, filters, queries
+            )
+            return ([[(self.global_doc(shard_no, doc), score) for doc, score in hits]
+                     for hits in hits_list], upper_bounds_list)
+
+        shard_results = self.map_shards(self.select_shards(categories), search_shard)
+        return [
+            self._merge([hits_list[query_no] for hits_list, _ in shard_results],
+                        [bounds_list[query_no] for _, bounds_list in shard_results], limit)
+            for query_no in range(len(query_terms_list))
+        ]
+
+    def chunk_id(self, doc: int) -> str:
+        """通し文書番号からチャンクIDを取得"""
+        shard_no, local_doc = self._locate(doc)
+        return self.shard(shard_no).chunk_id(local_doc)
+
+    def get_chunk(self, doc: int) -> Dict[str, Any]:
+        """通し文書番号からチャンク（本文・メタデータ）を復元"""
+        shard_no, local_doc = self._locate(doc)
+        return self.shard(shard_no).get_chunk(local_doc)
+
+    def match_offsets(self, doc: int, query_terms: List[str]) -> List[Tuple[int, str]]:
+        """通し文書番号の本文でクエリの索引語が出現する文字位置（スニペット用）"""
+        shard_no, local_doc = self._locate(doc)
+        return self.shard(shard_no).match_offsets(local_doc, query_terms)
+
+    def iter_chunks(self) -> Iterator[Dict[str, Any]]:
+        """全シャードのチャンクを取り込み時の形式（fields・embedding付き）で列挙"""
+        for shard_no in range(len(self.shards)):
+            if self.shards[shard_no]["doc_count"]:
+                yield from self.shard(shard_no).iter_chunks()
+
+    def export_json(self, index_path: Path) -> None:
+        """
+        デバッグ用に全シャードをまとめてJSON形式で書き出し
+
+        Args:
+            index_path: 出力先ディレクトリ
+        """
+        selected = self.select_shards(None)
+        if not selected:
+            return
+
+        first = self.shard(selected[0][0])
+        chunk_index = {}
+        inverted_index = InvertedIndex(
+            k1=first.k1, b=first.b, tokenizer=self.tokenizer,
+            field_weights=first.header["field_weights"]
+        )
+        for chunk in self.iter_chunks():
+            chunk_index[chunk["metadata"]["chunk_id"]] = chunk
+            inverted_index.add_chunk(chunk["metadata"]["chunk_id"], chunk["content"],
+                                     chunk["fields"], chunk["metadata"].get("category", ""))
+
+        with open(Path(index_path) / "knowledge_index.json", 'w', encoding='utf-8') as f:
+            json.dump(chunk_index, f, ensure_ascii=False, indent=2, default=str)
+        inverted_index.save(Path(index_path) / INVERTED_INDEX_FILE)
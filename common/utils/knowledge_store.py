@@ -0,0 +1,1037 @@
+#!/usr/bin/env python3
+"""
+ナレッジインデックスのバイナリ格納形式
+
+転置インデックス・文書テーブル・埋め込み行列を1つのバージョン付きバイナリファイル
+（knowledge_index.bin）にまとめ、検索側は mmap でゼロコピー参照します。
+複数のエージェントプロセスが同じページキャッシュを共有できるため、
+JSONを各プロセスで辞書に展開する場合に比べて読み込み時間とメモリ使用量を抑えられます。
+
+ファイル構成:
+    [8B マジック][4B バージョン][4B ヘッダ長][JSONヘッダ][8Bアラインの各セクション]
+
+    - 文字列テーブル: string_offsets (uint64) + string_data (UTF-8)
+    - 語彙・ポスティング: term_strings / term_postings と、
+      非圧縮形式は posting_docs / posting_tfs、圧縮形式（既定）は posting_data / block_offsets /
+      block_last_docs （文書番号の差分とフィールド別tfの可変長整数。ブロック単位で展開できる）
+    - 文書テーブル: doc_* （チャンクID・本文・ファイル・カテゴリ・フィールド長）
+    - ファイルテーブル: file_metadata （ファイル単位のメタデータを1回だけ保持）
+    - 埋め込み行列: embeddings (L2正規化済みfloat32, 文書数×次元) + embedding_mask
+    - 近似最近傍（任意）: ivf_centroids / ivf_offsets / ivf_docs （IVF-flatのリスト）
+    - 全体統計（シャード時）: term_df （コーパス全体での各語の文書頻度）
+    - ファセット（任意）: facet<N>_values / facet<N>_offsets / facet<N>_docs
+      （メタデータのフィールドごとのソート済みの値と、値ごとの文書番号）
+    - 出現位置（任意）: posting_positions （ポスティングごとの開始位置）/ positions / position_chars
+      （本文での語位置と文字位置。フレーズ・近接検索とスニペットに使用）
+    - スコア上限: term_blocks / block_max （ポスティングのブロックごとのBM25Fスコアの最大値。
+      上位k件に入りえない文書の採点を省く動的枝刈りに使用）
+
+使用例:
+    from common.utils.knowledge_store import KnowledgeStore, write_knowledge_store
+
+    write_knowledge_store(path, chunks, inverted_index)
+    store = KnowledgeStore.open(path)
+    for doc, score in store.search(store.tokenizer.tokenize("API統合"), limit=5):
+        chunk = store.get_chunk(doc)
+"""
+
+import copy
+import io
+import json
+import math
+import mmap
+import os
+import struct
+from pathlib import Path
+from typing import Dict, List, Optional, Any, Tuple, Iterator
+
+import numpy as np
+
+from .knowledge_index import (
+    InvertedIndex, INVERTED_INDEX_FILE, FIELDS, DEFAULT_K1, DEFAULT_B, extract_chunk_fields
+)
+from .knowledge_facets import FacetCondition, FacetField, build_facet_arrays
+from .knowledge_positions import PositionalQuery, Pattern, min_span_gap, pattern_length
+from .knowledge_postings import (
+    RAW_ENCODING, VARINT_ENCODING, POSTING_ENCODINGS, DEFAULT_POSTING_ENCODING,
+    encode_postings, decode_blocks
+)
+from .knowledge_pruning import (
+    BLOCK_SIZE, PRUNING_ENABLED, PRUNING_MIN_POSTINGS, PruningStats, TermBlocks, block_max_top_k, block_upper_bounds
+)
+from .knowledge_tokenizer import create_tokenizer
+from .vector_index import IVFFlatIndex, normalize_rows
+
+# ファイル名・フォーマット定義
+STORE_FILE = "knowledge_index.bin"
+STORE_MAGIC = b"KNIDX\x00\x00\x00"
+STORE_VERSION = 1
+
+_PREAMBLE = struct.Struct("<8sII")
+_ALIGN = 8
+
+# チャンク固有のメタデータ（ファイル単位のメタデータとは別に保持）
+_CHUNK_METADATA_KEYS = ("chunk_id", "chunk_index", "chunk_size")
+
+_NO_POSITIONS = np.zeros(0, dtype=np.uint32)
+
+
+class _StoreWriter:
+    """セクションを順に書き出すヘルパー"""
+
+    def __init__(self):
+        self.sections: Dict[str, Dict[str, Any]] = {}
+        self._buffer = io.BytesIO()
+
+    def add(self, name: str, array: np.ndarray) -> None:
+        """配列をセクションとして追加（8バイト境界に揃える）"""
+        array = np.ascontiguousarray(array)
+        padding = -self._buffer.tell() % _ALIGN
+        self._buffer.write(b"\x00" * padding)
+        self.sections[name] = {
+            "offset": self._buffer.tell(),
+            "dtype": array.dtype.str,
+            "shape": list(array.shape)
+        }
+        self._buffer.write(array.tobytes())
+
+    def getvalue(self) -> bytes:
+        return self._buffer.getvalue()
+
+
+class _StringTable:
+    """文字列テーブルの構築（同一文字列は1回だけ格納）"""
+
+    def __init__(self):
+        self._ids: Dict[str, int] = {}
+        self._data: List[bytes] = []
+
+    def add(self, value: str) -> int:
+        string_id = self._ids.get(value)
+        if string_id is None:
+            string_id = self._ids[value] = len(self._data)
+            self._data.append(value.encode("utf-8"))
+        return string_id
+
+    def arrays(self) -> Tuple[np.ndarray, np.ndarray]:
+        offsets = np.zeros(len(self._data) + 1, dtype=np.uint64)
+        offsets[1:] = np.cumsum([len(data) for data in self._data], dtype=np.uint64)
+        blob = np.frombuffer(b"".join(self._data), dtype=np.uint8)
+        return offsets, blob
+
+
+def _file_metadata(metadata: Dict[str, Any]) -> Dict[str, Any]:
+    """チャンクのメタデータからファイル単位のメタデータを取り出す"""
+    return {key: value for key, value in metadata.items() if key not in _CHUNK_METADATA_KEYS}
+
+
+def _to_json(value: Any) -> str:
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'), default=str)
+
+
+def bm25_idf(doc_count: int, document_frequency: int) -> float:
+    """BM25のIDF（常に正）"""
+    return math.log(1.0 + (doc_count - document_frequency + 0.5) / (document_frequency + 0.5))
+
+
+def bm25f_scores(tfs: np.ndarray, lengths: np.ndarray, idf, field_weights: np.ndarray,
+                 avg_lengths: np.ndarray, k1: float, b: float) -> np.ndarray:
+    """
+    ポスティングのBM25Fスコア（取り込み時のスコア上限と検索時の採点で共通）
+
+    Args:
+        tfs: フィールド別tf（ポスティング数×フィールド数）
+        lengths: 文書のフィールド別長（ポスティング数×フィールド数）
+        idf: 語のIDF（スカラーまたはポスティングごとの配列）
+        field_weights: フィールドの重み
+        avg_lengths: フィールド別の平均長
+        k1: 出現頻度の飽和係数
+        b: 文書長正規化の強さ
+    """
+    norms = 1.0 - b + b * lengths / avg_lengths
+    tf = (tfs * field_weights / norms).sum(axis=1)
+    return idf * tf * (k1 + 1.0) / (tf + k1)
+
+
+def build_store_bytes(chunks: List[Dict[str, Any]], inverted_index: InvertedIndex,
+                      embedding_model: Optional[str] = None,
+                      ann_config: Optional[Dict[str, Any]] = None,
+                      global_stats: Optional[Dict[str, Any]] = None,
+                      facet_fields: Optional[List[str]] = None,
+                      posting_encoding: str = DEFAULT_POSTING_ENCODING) -> bytes:
+    """
+    チャンクと転置インデックスからバイナリ表現を生成
+
+    Args:
+        chunks: チャンクのリスト（inverted_index の文書番号順）
+        inverted_index: 構築済みの転置インデックス
+        embedding_model: 埋め込みを生成したモデル名（検索時のクエリ埋め込みに使用）
+        ann_config: 近似最近傍インデックスの設定（vector_index セクション、None=構築しない）
+        global_stats: シャード分割時のコーパス全体の統計
+                      （doc_count / avg_field_lengths / document_frequencies）。
+                      指定するとIDF・平均フィールド長に全体の値を使い、シャード間でスコアを比較できる
+        facet_fields: ファセット絞り込み用の値索引を作るメタデータのフィールド（None=作らない）
+        posting_encoding: ポスティングの格納形式（"delta-varint"=圧縮, "raw"=非圧縮）
+
+    Returns:
+        knowledge_index.bin の内容
+    """
+    if len(chunks) != inverted_index.doc_count:
+        raise ValueError("チャンク数と転置インデックスの文書数が一致しません")
+    if posting_encoding not in POSTING_ENCODINGS:
+        raise ValueError(f"未対応のポスティング形式: {posting_encoding}")
+
+    strings = _StringTable()
+    doc_count = len(chunks)
+    field_count = len(FIELDS)
+
+    # ファイルテーブル（メタデータはファイルごとに1回だけ保持）
+    file_ids: Dict[str, int] = {}
+    file_metadata: List[int] = []
+    categories: Dict[str, int] = {}
+
+    doc_chunk_ids = np.zeros(doc_count, dtype=np.uint32)
+    doc_contents = np.zeros(doc_count, dtype=np.uint32)
+    doc_chunk_index = np.zeros(doc_count, dtype=np.uint32)
+    doc_files = np.zeros(doc_count, dtype=np.uint32)
+    doc_categories = np.zeros(doc_count, dtype=np.uint32)
+    doc_lengths = np.asarray(inverted_index.doc_lengths, dtype=np.uint32).reshape(doc_count, field_count)
+
+    embedding_dim = max((len(chunk.get("embedding") or ()) for chunk in chunks), default=0)
+    embeddings = np.zeros((doc_count, embedding_dim), dtype=np.float32)
+    embedding_mask = np.zeros(doc_count, dtype=np.uint8)
+
+    for doc, chunk in enumerate(chunks):
+        metadata = chunk.get("metadata", {})
+        file_path = metadata.get("file_path", "")
+        if file_path not in file_ids:
+            file_ids[file_path] = len(file_metadata)
+            file_metadata.append(strings.add(_to_json(_file_metadata(metadata))))
+
+        category = inverted_index.categories[doc]
+        doc_chunk_ids[doc] = strings.add(inverted_index.chunk_ids[doc])
+        doc_contents[doc] = strings.add(chunk.get("content", ""))
+        doc_chunk_index[doc] = strings.add(_to_json(metadata.get("chunk_index", 0)))
+        doc_files[doc] = file_ids[file_path]
+        doc_categories[doc] = categories.setdefault(category, len(categories))
+
+        embedding = chunk.get("embedding")
+        if embedding and len(embedding) == embedding_dim:
+            embeddings[doc] = embedding
+            embedding_mask[doc] = 1
+
+    # コサイン類似度を行列積だけで求められるよう正規化して保存
+    embeddings = normalize_rows(embeddings)
+
+    # 語彙はUTF-8バイト順に並べ、検索時は二分探索する
+    terms = sorted(inverted_index.postings, key=lambda term: term.encode("utf-8"))
+    term_strings = np.array([strings.add(term) for term in terms], dtype=np.uint32)
+    term_postings = np.zeros(len(terms) + 1, dtype=np.uint64)
+    posting_lists = [inverted_index.postings[term] for term in terms]
+    term_postings[1:] = np.cumsum([len(postings) for postings in posting_lists], dtype=np.uint64)
+
+    flat_postings = np.array(
+        [posting for postings in posting_lists for posting in postings], dtype=np.int64
+    ).reshape(-1, field_count + 1)
+    posting_docs = flat_postings[:, 0].astype(np.uint32)
+    posting_tfs = np.minimum(flat_postings[:, 1:], np.iinfo(np.uint16).max).astype(np.uint16)
+
+    has_positions = inverted_index.store_positions
+    if has_positions:
+        position_lists = [entry for term in terms for entry in inverted_index.positions[term]]
+        posting_positions = np.zeros(len(position_lists) + 1, dtype=np.uint64)
+        posting_positions[1:] = np.cumsum([len(positions) for positions, _ in position_lists],
+                                          dtype=np.uint64)
+        positions = np.array([position for positions, _ in position_lists for position in positions],
+                             dtype=np.uint32)
+        position_chars = np.array([char for _, chars in position_lists for char in chars],
+                                  dtype=np.uint32)
+
+    string_offsets, string_data = strings.arrays()
+
+    writer = _StoreWriter()
+    writer.add("string_offsets", string_offsets)
+    writer.add("string_data", string_data)
+    writer.add("term_strings", term_strings)
+    writer.add("term_postings", term_postings)
+    if posting_encoding == VARINT_ENCODING:
+        posting_data, block_offsets, block_last_docs = encode_postings(
+            posting_docs, posting_tfs, term_postings, BLOCK_SIZE
+        )
+        writer.add("posting_data", posting_data)
+        writer.add("block_offsets", block_offsets)
+        writer.add("block_last_docs", block_last_docs)
+    else:
+        writer.add("posting_docs", posting_docs)
+        writer.add("posting_tfs", posting_tfs)
+    writer.add("doc_chunk_ids", doc_chunk_ids)
+    writer.add("doc_contents", doc_contents)
+    writer.add("doc_chunk_index", doc_chunk_index)
+    writer.add("doc_files", doc_files)
+    writer.add("doc_categories", doc_categories)
+    writer.add("doc_lengths", doc_lengths)
+    writer.add("file_metadata", np.array(file_metadata, dtype=np.uint32))
+    writer.add("embeddings", embeddings)
+    writer.add("embedding_mask", embedding_mask)
+    if has_positions:
+        writer.add("posting_positions", posting_positions)
+        writer.add("positions", positions)
+        writer.add("position_chars", position_chars)
+
+    ann = _build_ann(writer, embeddings, embedding_mask.astype(bool), ann_config)
+
+    stats_doc_count = doc_count
+    avg_field_lengths = inverted_index.avg_field_lengths()
+    document_frequencies = np.diff(term_postings).astype(np.int64)
+    if global_stats:
+        stats_doc_count = global_stats["doc_count"]
+        avg_field_lengths = global_stats["avg_field_lengths"]
+        frequencies = global_stats["document_frequencies"]
+        document_frequencies = np.array([frequencies[term] for term in terms], dtype=np.int64)
+        writer.add("term_df", document_frequencies.astype(np.uint32))
+
+    # ポスティングのブロックごとのスコア上限（検索時と同じ式で採点した最大値）
+    idfs = np.array([bm25_idf(stats_doc_count, int(df)) for df in document_frequencies],
+                    dtype=np.float64)
+    posting_scores = bm25f_scores(
+        posting_tfs, doc_lengths[posting_docs],
+        np.repeat(idfs, np.diff(term_postings).astype(np.int64)),
+        np.array([inverted_index.field_weights.get(field, 0.0) for field in FIELDS], dtype=np.float32),
+        np.array([avg or 1.0 for avg in avg_field_lengths], dtype=np.float32),
+        inverted_index.k1, inverted_index.b
+    )
+    term_blocks, block_max = block_upper_bounds(posting_scores, term_postings, BLOCK_SIZE)
+    writer.add("term_blocks", term_blocks)
+    writer.add("block_max", block_max)
+
+    facets, facet_sections = build_facet_arrays(chunks, facet_fields or [])
+    for name, array in facet_sections.items():
+        writer.add(name, array)
+    body = writer.getvalue()
+
+    header = {
+        "doc_count": doc_count,
+        "term_count": len(terms),
+        "file_count": len(file_metadata),
+        "embedding_dim": embedding_dim,
+        "embedding_model": embedding_model,
+        "embeddings_normalized": True,
+        "ann": ann,
+        "fields": list(FIELDS),
+        "k1": inverted_index.k1,
+        "b": inverted_index.b,
+        "field_weights": inverted_index.field_weights,
+        "avg_field_lengths": avg_field_lengths,
+        "stats_doc_count": stats_doc_count,
+        "tokenizer": inverted_index.tokenizer.spec,
+        "categories": list(categories),
+        "facets": facets,
+        "positions": has_positions,
+        "block_size": BLOCK_SIZE,
+        "posting_encoding": posting_encoding,
+        "sections": writer.sections
+    }
+    header_bytes = _to_json(header).encode("utf-8")
+    header_bytes += b" " * (-(_PREAMBLE.size + len(header_bytes)) % _ALIGN)
+
+    return _PREAMBLE.pack(STORE_MAGIC, STORE_VERSION, len(header_bytes)) + header_bytes + body
+
+
+def _build_ann(writer: _StoreWriter, embeddings: np.ndarray, embedding_mask: np.ndarray,
+               ann_config: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """
+    埋め込み数が閾値以上ならIVF-flatのリストを学習してセクションに追加
+
+    Returns:
+        ヘッダに記録するANN情報（構築しない場合はNone）
+    """
+    if not ann_config or ann_config.get("type", "flat") != "ivf":
+        return None
+
+    embedded = int(embedding_mask.sum())
+    if embedded == 0 or embedded < ann_config.get("min_docs", 10000):
+        return None
+
+    centroids, list_offsets, list_docs = IVFFlatIndex.train(
+        embeddings,
+        valid=embedding_mask,
+        n_lists=ann_config.get("n_lists", 0),
+        iterations=ann_config.get("kmeans_iterations", 10),
+        sample_size=ann_config.get("kmeans_sample_size", 50000)
+    )
+    writer.add("ivf_centroids", centroids)
+    writer.add("ivf_offsets", list_offsets)
+    writer.add("ivf_docs", list_docs)
+    return {"type": "ivf", "n_lists": int(centroids.shape[0])}
+
+
+def write_knowledge_store(path: Path, chunks: List[Dict[str, Any]],
+                          inverted_index: InvertedIndex,
+                          embedding_model: Optional[str] = None,
+                          ann_config: Optional[Dict[str, Any]] = None,
+                          global_stats: Optional[Dict[str, Any]] = None,
+                          facet_fields: Optional[List[str]] = None,
+                          posting_encoding: str = DEFAULT_POSTING_ENCODING) -> int:
+    """
+    バイナリインデックスを書き出し（一時ファイル経由で置き換え）
+
+    検索中のプロセスは置き換え前のファイルを mmap したまま読み続けられます。
+
+    Args:
+        path: 出力先ファイル
+        chunks: チャンクのリスト（inverted_index の文書番号順）
+        inverted_index: 構築済みの転置インデックス
+        embedding_model: 埋め込みを生成したモデル名
+        ann_config: 近似最近傍インデックスの設定
+        global_stats: シャード分割時のコーパス全体の統計
+        facet_fields: ファセット絞り込み用の値索引を作るメタデータのフィールド
+        posting_encoding: ポスティングの格納形式
+
+    Returns:
+        書き出したバイト数
+    """
+    data = build_store_bytes(chunks, inverted_index, embedding_model, ann_config, global_stats,
+                             facet_fields, posting_encoding)
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    path = Path(path)
+    tmp_path = path.with_suffix(path.suffix + ".tmp")
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return len(data)
+
+
+class _TermCache:
+    """
+    一括検索のクエリ間で共有する語ごとの計算結果
+
+    ポスティング（ブロックごとのスコア上限を含む）は対象文書によらず共有し、
+    全件採点したスコアは同じ対象文書マスクで採点するクエリの間だけ共有します。
+    """
+
+    def __init__(self):
+        self.blocks: Dict[int, TermBlocks] = {}
+        self.scores: Dict[int, Tuple[np.ndarray, np.ndarray]] = {}
+
+
+class KnowledgeStore:
+    """mmap で開いたバイナリインデックスの読み取りクラス"""
+
+    def __init__(self, buffer, path: Optional[Path] = None):
+        self.path = path
+        self._buffer = buffer
+
+        magic, version, header_length = _PREAMBLE.unpack_from(buffer, 0)
+        if magic != STORE_MAGIC:
+            raise ValueError("ナレッジインデックスのファイル形式ではありません")
+        if version != STORE_VERSION:
+            raise ValueError(f"未対応のインデックスバージョン: {version}")
+
+        header_start = _PREAMBLE.size
+        self.header = json.loads(bytes(buffer[header_start:header_start + header_length]))
+        body_offset = header_start + header_length
+
+        # 各セクションはバッファへのビュー（コピーしない）
+        self._sections: Dict[str, np.ndarray] = {}
+        for name, section in self.header["sections"].items():
+            dtype = np.dtype(section["dtype"])
+            shape = tuple(section["shape"])
+            count = int(np.prod(shape)) if shape else 1
+            array = np.frombuffer(buffer, dtype=dtype, count=count,
+                                  offset=body_offset + section["offset"])
+            self._sections[name] = array.reshape(shape)
+
+        self.doc_count = self.header["doc_count"]
+        # IDFの計算に使う文書数（シャードの場合はコーパス全体）
+        self.stats_doc_count = self.header.get("stats_doc_count", self.doc_count)
+        self._term_df = self._sections.get("term_df")
+        self.term_count = self.header["term_count"]
+        self.embedding_dim = self.header["embedding_dim"]
+        self.embedding_model: Optional[str] = self.header.get("embedding_model")
+        self.categories: List[str] = self.header["categories"]
+        self.k1 = self.header.get("k1", DEFAULT_K1)
+        self.b = self.header.get("b", DEFAULT_B)
+        self.tokenizer = create_tokenizer(self.header.get("tokenizer"))
+
+        self._field_weights = np.array(
+            [self.header["field_weights"].get(field, 0.0) for field in FIELDS], dtype=np.float32
+        )
+        self._avg_lengths = np.array(
+            [avg or 1.0 for avg in self.header["avg_field_lengths"]], dtype=np.float32
+        )
+        self._string_offsets = self._sections["string_offsets"]
+        self._string_data = self._sections["string_data"]
+
+        # 動的枝刈り（スコア上限のない旧形式のインデックスは常に全件採点）
+        self.block_size: Optional[int] = self.header.get("block_size")
+        self.pruning = PRUNING_ENABLED
+        self.pruning_min_postings = PRUNING_MIN_POSTINGS
+        self.pruning_stats = PruningStats()
+
+        # ポスティングの格納形式（旧形式のインデックスは非圧縮）
+        self.posting_encoding: str = self.header.get("posting_encoding", RAW_ENCODING)
+        if self.posting_encoding not in POSTING_ENCODINGS:
+            raise ValueError(f"未対応のポスティング形式: {self.posting_encoding}")
+
+        # 削除済みとして検索対象から外す文書（without_docs で作ったビューのみ）
+        self._deleted: Optional[np.ndarray] = None
+
+        self.facets: Dict[str, FacetField] = {
+            field: FacetField(info["kind"], self._sections[f"{info['section']}_values"],
+                              self._sections[f"{info['section']}_offsets"],
+                              self._sections[f"{info['section']}_docs"], self.doc_count)
+            for field, info in self.header.get("facets", {}).items()
+        }
+
+    @classmethod
+    def open(cls, path: Path) -> "KnowledgeStore":
+        """ファイルを読み取り専用で mmap して開く"""
+        with open(path, 'rb') as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(buffer, Path(path))
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "KnowledgeStore":
+        """メモリ上のバイト列から開く（ベンチマーク・検証用）"""
+        return cls(data)
+
+    def without_docs(self, deleted: np.ndarray) -> "KnowledgeStore":
+        """
+        文書を削除済みとして扱うビュー（バッファ・セクションは共有し、元のストアは変更しない）
+
+        削除済みの文書はすべての絞り込みマスクから除外されるため、検索結果に現れません。
+        IDF・平均フィールド長は元のままです（次の取り込みで再計算される）。
+        ビューからさらにビューを作った場合、削除済みの文書は両方のフラグを合わせたものです。
+
+        Args:
+            deleted: 削除済みの文書のフラグ（文書数分）
+        """
+        view = copy.copy(self)
+        view._deleted = deleted if self._deleted is None else (self._deleted | deleted)
+        return view
+
+    def section(self, name: str) -> np.ndarray:
+        """セクションのビューを取得"""
+        return self._sections[name]
+
+    @property
+    def embeddings(self) -> np.ndarray:
+        """埋め込み行列（文書数×次元、float32のビュー）"""
+        return self._sections["embeddings"]
+
+    @property
+    def embedding_mask(self) -> np.ndarray:
+        """埋め込みを持つ文書のフラグ"""
+        return self._sections["embedding_mask"].astype(bool)
+
+    @property
+    def ann(self) -> Optional[Dict[str, Any]]:
+        """近似最近傍インデックスの情報（未構築ならNone）"""
+        return self.header.get("ann")
+
+    def ivf_lists(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """IVF-flatの (centroids, list_offsets, list_docs) ビューを取得"""
+        return (self._sections["ivf_centroids"], self._sections["ivf_offsets"],
+                self._sections["ivf_docs"])
+
+    def string(self, string_id: int) -> str:
+        """文字列テーブルから1件デコード"""
+        start = int(self._string_offsets[string_id])
+        end = int(self._string_offsets[string_id + 1])
+        return self._string_data[start:end].tobytes().decode("utf-8")
+
+    def _term_bytes(self, term_index: int) -> bytes:
+        string_id = int(self._sections["term_strings"][term_index])
+        start = int(self._string_offsets[string_id])
+        end = int(self._string_offsets[string_id + 1])
+        return self._string_data[start:end].tobytes()
+
+    def term_id(self, term: str) -> Optional[int]:
+        """語彙を二分探索して語番号を取得（未登録はNone）"""
+        key = term.encode("utf-8")
+        low, high = 0, self.term_count
+        while low < high:
+            mid = (low + high) // 2
+            if self._term_bytes(mid) < key:
+                low = mid + 1
+            else:
+                high = mid
+        if low < self.term_count and self._term_bytes(low) == key:
+            return low
+        return None
+
+    def postings(self, term_id: int) -> Tuple[np.ndarray, np.ndarray]:
+        """語のポスティング（文書番号, フィールド別tf）を取得（非圧縮形式はビュー、圧縮形式は展開したもの）"""
+        if self.posting_encoding == VARINT_ENCODING:
+            term_blocks = self._sections["term_blocks"]
+            return decode_blocks(self._sections["posting_data"], self._sections["block_offsets"],
+                                 int(term_blocks[term_id]), int(term_blocks[term_id + 1]), 0, len(FIELDS))
+        term_postings = self._sections["term_postings"]
+        start = int(term_postings[term_id])
+        end = int(term_postings[term_id + 1])
+        return (self._sections["posting_docs"][start:end],
+                self._sections["posting_tfs"][start:end])
+
+    def _posting_index(self, term_id: int, doc: int) -> Optional[int]:
+        """
+        語のポスティングで文書の位置を求める（出現しなければNone）
+
+        圧縮形式はブロックの最後の文書番号を二分探索し、該当ブロックだけを展開します。
+        """
+        term_postings = self._sections["term_postings"]
+        start = int(term_postings[term_id])
+        if self.posting_encoding == VARINT_ENCODING:
+            term_blocks = self._sections["term_blocks"]
+            first_block = int(term_blocks[term_id])
+            last_docs = self._sections["block_last_docs"][first_block:int(term_blocks[term_id + 1])]
+            block = int(np.searchsorted(last_docs, doc))
+            if block == len(last_docs):
+                return None
+            docs, _ = decode_blocks(self._sections["posting_data"], self._sections["block_offsets"],
+                                    first_block + block, first_block + block + 1,
+                                    int(last_docs[block - 1]) if block else 0, len(FIELDS))
+            start += block * self.block_size
+        else:
+            docs = self._sections["posting_docs"][start:int(term_postings[term_id + 1])]
+        i = int(np.searchsorted(docs, doc))
+        if i == len(docs) or docs[i] != doc:
+            return None
+        return start + i
+
+    def idf(self, document_frequency: int) -> float:
+        """BM25のIDF（常に正）"""
+        return bm25_idf(self.stats_doc_count, document_frequency)
+
+    def term_idf(self, term_id: int) -> float:
+        """語のIDF（シャードの場合はコーパス全体の文書頻度を使用）"""
+        return self.idf(self.term_document_frequency(term_id))
+
+    def term_document_frequency(self, term_id: int) -> int:
+        """語の文書頻度（シャードの場合はコーパス全体の値）"""
+        if self._term_df is not None:
+            return int(self._term_df[term_id])
+        term_postings = self._sections["term_postings"]
+        return int(term_postings[term_id + 1]) - int(term_postings[term_id])
+
+    def category_mask(self, categories: Optional[List[str]]) -> Optional[np.ndarray]:
+        """カテゴリ絞り込み用の文書マスク（None=全体）"""
+        if not categories:
+            return None
+        wanted = set(categories)
+        allowed = [i for i, category in enumerate(self.categories) if category in wanted]
+        return np.isin(self._sections["doc_categories"], allowed)
+
+    def facet_mask(self, conditions: Optional[List[FacetCondition]]) -> Optional[np.ndarray]:
+        """
+        ファセット条件を満たす文書のマスク（None=絞り込みなし）
+
+        値索引のあるフィールドは索引で、ないフィールドはファイル単位のメタデータを
+        走査して評価します（ファイル数分のデコードのみ）。
+        """
+        if not conditions:
+            return None
+
+        mask = np.ones(self.doc_count, dtype=bool)
+        file_metadata = None
+        for condition in conditions:
+            facet = self.facets.get(condition.field)
+            if facet is not None:
+                mask &= facet.mask(condition)
+                continue
+            if file_metadata is None:
+                file_metadata = self.files()
+            file_ok = np.array([condition.matches(metadata.get(condition.field))
+                                for metadata in file_metadata], dtype=bool)
+            mask &= file_ok[self._sections["doc_files"]]
+        return mask
+
+    def doc_mask(self, categories: Optional[List[str]] = None,
+                 filters: Optional[List[FacetCondition]] = None) -> Optional[np.ndarray]:
+        """カテゴリ・ファセット条件を合わせた対象文書のマスク（None=全体、削除済みの文書は常に除外）"""
+        mask = None
+        for part in (self.category_mask(categories), self.facet_mask(filters),
+                     None if self._deleted is None else ~self._deleted):
+            if part is not None:
+                mask = part if mask is None else mask & part
+        return mask
+
+    def search(self, query_terms: List[str], limit: int = 10,
+               categories: Optional[List[str]] = None,
+               filters: Optional[List[FacetCondition]] = None,
+               query: Optional[PositionalQuery] = None) -> List[Tuple[int, float]]:
+        """
+        BM25Fで上位文書を検索（NumPyでベクトル化）
+
+        Args:
+            query_terms: クエリの索引語（self.tokenizerで分割したもの）
+            limit: 最大結果数
+            categories: 対象カテゴリ（None=全体）
+            filters: メタデータのファセット条件（None=絞り込みなし）
+            query: フレーズ・近接の条件（出現位置を保存したインデックスのみ有効）
+
+        Returns:
+            (文書番号, 正規化スコア) のリスト（スコア降順、スコアは0.0〜1.0）
+        """
+        hits, upper_bounds = self.score(query_terms, limit, categories, filters, query)
+        return self.normalize_hits(hits, upper_bounds)
+
+    def score(self, query_terms: List[str], limit: int = 10,
+              categories: Optional[List[str]] = None,
+              filters: Optional[List[FacetCondition]] = None,
+              query: Optional[PositionalQuery] = None
+              ) -> Tuple[List[Tuple[int, float]], Dict[str, float]]:
+        """
+        BM25Fの生スコアで上位文書を検索
+
+        カテゴリ・ファセット・フレーズの絞り込みはスコア計算の前にポスティングへ適用し、
+        近接ブーストは上位候補に対してだけ計算します。
+        枝刈りを有効にしていてクエリ語のポスティングが多い場合は、上位候補に入りえない
+        文書の採点をブロックごとのスコア上限で省きます（結果は全件採点と同じ）。
+
+        Returns:
+            ((文書番号, 生スコア) のリスト, 索引語 -> スコアの理論上限)
+            理論上限の合計で割ると0.0〜1.0に正規化できる（シャードをまたいで合算する場合に使用）
+        """
+        return self._score_query(query_terms, limit, self.doc_mask(categories, filters), query)
+
+    def _score_query(self, query_terms: List[str], limit: int, mask: Optional[np.ndarray],
+                     query: Optional[PositionalQuery] = None,
+                     term_cache: Optional[_TermCache] = None
+                     ) -> Tuple[List[Tuple[int, float]], Dict[str, float]]:
+        """
+        対象文書のマスクを求めた後の score の本体
+
+        Args:
+            mask: カテゴリ・ファセットの対象文書（フレーズの絞り込みはこの中で行う）
+            term_cache: 複数クエリの間で共有する語ごとの計算結果（None=共有しない）
+        """
+        cache_scores = term_cache is not None
+        if query is not None and query.phrases and self.has_positions:
+            mask = self.phrase_mask(query.phrases, mask)
+            cache_scores = False  # マスクがクエリ固有になるため全件採点のスコアは共有しない
+        term_ids: Dict[str, int] = {}
+        for term in dict.fromkeys(query_terms):
+            term_id = self.term_id(term)
+            if term_id is not None:
+                term_ids[term] = term_id
+        upper_bounds = {term: self.term_idf(term_id) * (self.k1 + 1.0)
+                        for term, term_id in term_ids.items()}
+        self._scale_upper_bounds(query, upper_bounds)
+
+        if not term_ids or limit <= 0:
+            return [], upper_bounds
+
+        term_postings = self._sections["term_postings"]
+        postings = sum(int(term_postings[term_id + 1]) - int(term_postings[term_id])
+                       for term_id in term_ids.values())
+        if self.pruning and self.block_size and postings >= self.pruning_min_postings:
+            # 近接ブーストで順位が入れ替わりうる上位候補までは正確に求める
+            k = max(limit, query.proximity_candidates) if self._uses_proximity(query) else limit
+            docs, scores, scored = block_max_top_k(
+                [self._term_blocks(term_id, term_cache) for term_id in term_ids.values()], k,
+                self.posting_scores, mask
+            )
+            self.pruning_stats.add(postings, scored, pruned=True)
+        else:
+            doc_parts = []
+            score_parts = []
+            for term_id in term_ids.values():
+                if not cache_scores:
+                    term_docs, term_scores = self._term_scores(term_id, mask, term_cache)
+                else:
+                    if term_id not in term_cache.scores:
+                        term_cache.scores[term_id] = self._term_scores(term_id, mask, term_cache)
+                    term_docs, term_scores = term_cache.scores[term_id]
+                doc_parts.append(term_docs)
+                score_parts.append(term_scores)
+            docs, inverse = np.unique(np.concatenate(doc_parts), return_inverse=True)
+            scores = np.bincount(inverse, weights=np.concatenate(score_parts))
+            self.pruning_stats.add(postings, sum(len(part) for part in doc_parts), pruned=False)
+        return self._rank(docs, scores, limit, query), upper_bounds
+
+    def _uses_proximity(self, query: Optional[PositionalQuery]) -> bool:
+        return query is not None and query.uses_proximity and self.has_positions
+
+    def _scale_upper_bounds(self, query: Optional[PositionalQuery], upper_bounds: Dict[str, float]) -> None:
+        """近接ブーストを行う場合はスコアの理論上限を (1 + 重み) 倍にする（ヒットの有無によらない）"""
+        if self._uses_proximity(query):
+            for term in upper_bounds:
+                upper_bounds[term] *= 1.0 + query.proximity_weight
+
+    def _rank(self, docs: np.ndarray, scores: np.ndarray, limit: int,
+              query: Optional[PositionalQuery]) -> List[Tuple[int, float]]:
+        """上位k件を取り出す（近接ブーストを行う場合は上位候補を近接度で並べ替え）"""
+        if not self._uses_proximity(query):
+            return self._top_k(docs, scores, limit)
+
+        candidates = self._top_k(docs, scores, max(limit, query.proximity_candidates))
+        words = [self._resolve_pattern(word) for word in query.words]
+        if any(word is None for word in words):
+            # いずれかの語がこのインデックスに出現しない（全候補の近接度が0）
+            return candidates[:limit]
+
+        lengths = [pattern_length(word) for word in query.words]
+        boosted = []
+        for doc, score in candidates:
+            gap = min_span_gap([self.pattern_starts(word, doc) for word in words], lengths)
+            boosted.append((doc, score * (1.0 + query.proximity_weight * query.proximity(gap))))
+        boosted.sort(key=lambda hit: hit[1], reverse=True)
+        return boosted[:limit]
+
+    @staticmethod
+    def normalize_hits(hits: List[Tuple[int, float]],
+                       upper_bounds: Dict[str, float]) -> List[Tuple[int, float]]:
+        """生スコアをクエリの理論上限で割って0.0〜1.0に正規化"""
+        max_score = sum(upper_bounds.values())
+        if max_score <= 0:
+            return []
+        return [(doc, score / max_score) for doc, score in hits]
+
+    def posting_scores(self, docs: np.ndarray, tfs: np.ndarray, idf: float) -> np.ndarray:
+        """ポスティングのBM25Fスコア"""
+        return bm25f_scores(tfs, self._sections["doc_lengths"][docs], idf, self._field_weights,
+                            self._avg_lengths, self.k1, self.b)
+
+    def _term_scores(self, term_id: int, mask: Optional[np.ndarray] = None,
+                     term_cache: Optional[_TermCache] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """語のポスティング（マスクで絞り込み後）に対するBM25Fスコア"""
+        if term_cache is not None:
+            term_blocks = self._term_blocks(term_id, term_cache)
+            docs, tfs = term_blocks.docs, term_blocks.tfs
+        else:
+            docs, tfs = self.postings(term_id)
+        if mask is not None:
+            keep = mask[docs]
+            docs, tfs = docs[keep], tfs[keep]
+        return docs, self.posting_scores(docs, tfs, self.term_idf(term_id))
+
+    def _term_blocks(self, term_id: int, term_cache: Optional[_TermCache] = None) -> TermBlocks:
+        """語のポスティングとブロックごとのスコア上限（term_cache があればクエリ間で共有）"""
+        if term_cache is not None and term_id in term_cache.blocks:
+            return term_cache.blocks[term_id]
+        docs, tfs = self.postings(term_id)
+        term_blocks = self._sections["term_blocks"]
+        block_max = self._sections["block_max"][int(term_blocks[term_id]):int(term_blocks[term_id + 1])]
+        result = TermBlocks(docs, tfs, self.term_idf(term_id), block_max, self.block_size)
+        if term_cache is not None:
+            term_cache.blocks[term_id] = result
+        return result
+
+    def search_many(self, query_terms_list: List[List[str]], limit: int = 10,
+                    categories: Optional[List[str]] = None,
+                    filters: Optional[List[FacetCondition]] = None,
+                    queries: Optional[List[Optional[PositionalQuery]]] = None
+                    ) -> List[List[Tuple[int, float]]]:
+        """
+        複数クエリをまとめてBM25Fで検索
+
+        対象文書のマスクは1回だけ求め、クエリごとに score と同じ方法（ブロックごとの
+        スコア上限による枝刈りを含む）で採点します。全件採点する語のスコアはクエリ間で共有します。
+
+        Args:
+            query_terms_list: クエリごとの索引語
+            limit: クエリごとの最大結果数
+            categories: 対象カテゴリ（全クエリ共通、None=全体）
+            filters: メタデータのファセット条件（全クエリ共通）
+            queries: クエリごとのフレーズ・近接の条件（query_terms_list と同じ順）
+
+        Returns:
+            クエリ順の (文書番号, 正規化スコア) リスト
+        """
+        hits_list, upper_bounds_list = self.score_many(query_terms_list, limit, categories, filters,
+                                                       queries)
+        return [self.normalize_hits(hits, upper_bounds)
+                for hits, upper_bounds in zip(hits_list, upper_bounds_list)]
+
+    def score_many(self, query_terms_list: List[List[str]], limit: int = 10,
+                   categories: Optional[List[str]] = None,
+                   filters: Optional[List[FacetCondition]] = None,
+                   queries: Optional[List[Optional[PositionalQuery]]] = None
+                   ) -> Tuple[List[List[Tuple[int, float]]], List[Dict[str, float]]]:
+        """
+        複数クエリをまとめて生スコアで検索
+
+        Returns:
+            (クエリ順の (文書番号, 生スコア) リスト, クエリ順の 索引語 -> スコアの理論上限)
+        """
+        mask = self.doc_mask(categories, filters)
+        term_cache = _TermCache()
+        hits_list: List[List[Tuple[int, float]]] = []
+        upper_bounds_list: List[Dict[str, float]] = []
+        for query_no, query_terms in enumerate(query_terms_list):
+            hits, upper_bounds = self._score_query(query_terms, limit, mask,
+                                                   queries[query_no] if queries else None, term_cache)
+            hits_list.append(hits)
+            upper_bounds_list.append(upper_bounds)
+        return hits_list, upper_bounds_list
+
+    @staticmethod
+    def _top_k(docs: np.ndarray, scores: np.ndarray, limit: int) -> List[Tuple[int, float]]:
+        """上位k件を取り出してスコア降順（同点は文書番号順）に並べる"""
+        if len(docs) == 0:
+            return []
+        if len(docs) > limit:
+            # k番目のスコアと同点の文書もすべて残してから並べる（同点の選び方を一定にする）
+            kth = np.partition(scores, len(scores) - limit)[len(scores) - limit]
+            top = np.flatnonzero(scores >= kth)
+        else:
+            top = np.arange(len(docs))
+        top = top[np.lexsort((docs[top], -scores[top]))][:limit]
+        return [(int(docs[i]), float(scores[i])) for i in top]
+
+    @property
+    def has_positions(self) -> bool:
+        """本文の出現位置を保存しているか"""
+        return bool(self.header.get("positions"))
+
+    def doc_positions(self, term_id: int, doc: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        語の文書内での出現位置をビューで取得
+
+        Returns:
+            (語位置, 本文での文字位置)（本文に出現しなければ空配列）
+        """
+        posting = self._posting_index(term_id, doc)
+        if posting is None:
+            return _NO_POSITIONS, _NO_POSITIONS
+        posting_positions = self._sections["posting_positions"]
+        begin = int(posting_positions[posting])
+        end = int(posting_positions[posting + 1])
+        return self._sections["positions"][begin:end], self._sections["position_chars"][begin:end]
+
+    def _resolve_pattern(self, pattern: Pattern) -> Optional[List[Tuple[int, int]]]:
+        """パターンの索引語を語番号に変換（未登録の語を含めばNone）"""
+        resolved = []
+        for term, offset in pattern:
+            term_id = self.term_id(term)
+            if term_id is None:
+                return None
+            resolved.append((term_id, offset))
+        return resolved
+
+    def pattern_starts(self, resolved: List[Tuple[int, int]], doc: int) -> np.ndarray:
+        """語番号のパターンが文書に出現する先頭の語位置（昇順）"""
+        starts = None
+        for term_id, offset in resolved:
+            positions = self.doc_positions(term_id, doc)[0].astype(np.int64) - offset
+            starts = positions if starts is None else np.intersect1d(starts, positions, assume_unique=True)
+            if len(starts) == 0:
+                break
+        return starts if starts is not None else _NO_POSITIONS.astype(np.int64)
+
+    def phrase_mask(self, phrases: List[Pattern], mask: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        すべてのフレーズを本文に含む文書のマスク
+
+        フレーズの語をすべて含む文書（ポスティングの積集合）だけ出現位置を照合します。
+
+        Args:
+            phrases: フレーズの語位置パターン
+            mask: 照合の対象にする文書（None=全体）
+        """
+        result = np.ones(self.doc_count, dtype=bool) if mask is None else mask.copy()
+        for phrase in phrases:
+            resolved = self._resolve_pattern(phrase)
+            if resolved is None:
+                return np.zeros(self.doc_count, dtype=bool)
+
+            candidates = None
+            for term_id, _ in resolved:
+                docs = self.postings(term_id)[0]
+                candidates = docs if candidates is None else np.intersect1d(candidates, docs,
+                                                                           assume_unique=True)
+            candidates = candidates[result[candidates]]
+
+            phrase_docs = np.zeros(self.doc_count, dtype=bool)
+            for doc in candidates:
+                if len(self.pattern_starts(resolved, int(doc))):
+                    phrase_docs[doc] = True
+            result &= phrase_docs
+        return result
+
+    def match_offsets(self, doc: int, query_terms: List[str]) -> List[Tuple[int, str]]:
+        """
+        クエリの索引語が本文に出現する文字位置（スニペット用）
+
+        Returns:
+            (本文での文字位置, 索引語) のリスト（出現位置を保存していなければ空）
+        """
+        if not self.has_positions:
+            return []
+        matches = []
+        for term in dict.fromkeys(query_terms):
+            term_id = self.term_id(term)
+            if term_id is not None:
+                matches.extend((int(char), term) for char in self.doc_positions(term_id, doc)[1])
+        return matches
+
+    def chunk_id(self, doc: int) -> str:
+        """文書番号からチャンクIDを取得"""
+        return self.string(int(self._sections["doc_chunk_ids"][doc]))
+
+    def files(self) -> List[Dict[str, Any]]:
+        """ファイルテーブル（ファイル番号順のメタデータ）"""
+        return [json.loads(self.string(int(string_id))) for string_id in self._sections["file_metadata"]]
+
+    def file_docs(self, file_id: int) -> np.ndarray:
+        """ファイルのチャンクの文書番号（昇順）"""
+        return np.flatnonzero(self._sections["doc_files"] == file_id)
+
+    def file_metadata(self, doc: int) -> Dict[str, Any]:
+        """文書が属するファイルのメタデータ"""
+        file_id = int(self._sections["doc_files"][doc])
+        return json.loads(self.string(int(self._sections["file_metadata"][file_id])))
+
+    def get_chunk(self, doc: int) -> Dict[str, Any]:
+        """
+        文書番号からチャンク（本文・メタデータ）を復元
+
+        Args:
+            doc: 文書番号
+
+        Returns:
+            content / metadata を持つ辞書
+        """
+        content = self.string(int(self._sections["doc_contents"][doc]))
+        metadata = self.file_metadata(doc)
+        metadata.update({
+            "chunk_id": self.chunk_id(doc),
+            "chunk_index": json.loads(self.string(int(self._sections["doc_chunk_index"][doc]))),
+            "chunk_size": len(content)
+        })
+        return {"content": content, "metadata": metadata}
+
+    def iter_chunks(self) -> Iterator[Dict[str, Any]]:
+        """全チャンクを取り込み時の形式（fields・embedding付き）で列挙（削除済みの文書は除く）"""
+        embeddings = self.embeddings
+        embedding_mask = self._sections["embedding_mask"]
+        for doc in range(self.doc_count):
+            if self._deleted is not None and self._deleted[doc]:
+                continue
+            chunk = self.get_chunk(doc)
+            chunk["fields"] = extract_chunk_fields(chunk["content"], self.file_metadata(doc))
+            chunk["embedding"] = embeddings[doc].tolist() if embedding_mask[doc] else None
+            yield chunk
+
+    def export_json(self, index_path: Path) -> None:
+        """
+        デバッグ用にJSON形式（knowledge_index.json / inverted_index.json）で書き出し
+
+        Args:
+            index_path: 出力先ディレクトリ
+        """
+        chunk_index = {}
+        inverted_index = InvertedIndex(
+            k1=self.k1, b=self.b, tokenizer=self.tokenizer,
+            field_weights=self.header["field_weights"]
+        )
+        for chunk in self.iter_chunks():
+            chunk_index[chunk["metadata"]["chunk_id"]] = chunk
+            inverted_index.add_chunk(chunk["metadata"]["chunk_id"], chunk["content"],
+                                     chunk["fields"], chunk["metadata"].get("category", ""))
+
+        with open(Path(index_path) / "knowledge_index.json", 'w', encoding='utf-8') as f:
+            json.dump(chunk_index, f, ensure_ascii=False, indent=2, default=str)
+        inverted_index.save(Path(index_path) / INVERTED_INDEX_FILE)
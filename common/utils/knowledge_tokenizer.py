@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+"""
+ナレッジベース検索用トークナイザ
+
+日本語テキストを文字n-gram（または形態素）に分割し、取り込み時と検索時で
+同一の索引語を生成します。NFKC正規化により全角・半角の表記揺れを吸収します。
+
+使用例:
+    from common.utils.knowledge_tokenizer import create_tokenizer
+
+    tokenizer = create_tokenizer({"type": "ngram", "ngram_sizes": [2]})
+    terms = tokenizer.tokenize("ＡＰＩ統合の料金")  # ['api', '統合', '合の', 'の料', '料金']
+
+    # 位置付き（索引語, 語位置, 元テキストでの文字位置）
+    tokens = tokenizer.tokenize_with_positions("ＡＰＩ 統合")  # [('api', 0, 0), ('統合', 3, 4)]
+
+語位置は索引対象の文字（英数字・日本語の連続）だけを数えた位置で、空白・記号は数えません。
+"API統合" と "API 統合" は同じ語位置の並びになるため、フレーズ・近接の判定に使えます。
+"""
+
+import bisect
+import re
+import unicodedata
+from typing import Dict, List, Optional, Any, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 英数字の単語と、日本語（ひらがな・カタカナ・長音・漢字）の連続を抽出
+_RUN_PATTERN = re.compile(r'[a-z0-9]+|[ぁ-んァ-ヶー一-龠々〆ヵヶ]+')
+
+# 従来の正規表現分割（互換用）
+_LEGACY_PATTERN = re.compile(r'[ぁ-んァ-ヶ一-龠a-zA-Z0-9]+')
+
+# 索引語を作る文字の種別（run_char_class の戻り値）
+RUN_CLASS_NONE = 0
+RUN_CLASS_ALNUM = 1
+RUN_CLASS_JAPANESE = 2
+
+
+def normalize_text(text: str) -> str:
+    """
+    検索用にテキストを正規化（NFKC・小文字化）
+
+    全角英数字は半角に、半角カタカナは全角に統一されます。
+
+    Args:
+        text: 対象テキスト
+
+    Returns:
+        正規化済みテキスト
+    """
+    return unicodedata.normalize("NFKC", text).lower()
+
+
+def run_char_class(char: str) -> int:
+    """
+    正規化済みの1文字が、索引語のどの連続（英数字の単語・日本語の連続）に属するか
+
+    トークナイザーが語を切り出す分類と同じです。連続をまとめて扱う高速な処理
+    （ローカル埋め込みの特徴計算など）は、この分類で文字の種別表を作ります。
+
+    Args:
+        char: 正規化済みの1文字
+
+    Returns:
+        RUN_CLASS_NONE（索引しない）/ RUN_CLASS_ALNUM（英数字）/ RUN_CLASS_JAPANESE（日本語）
+    """
+    if not _RUN_PATTERN.fullmatch(char):
+        return RUN_CLASS_NONE
+    return RUN_CLASS_ALNUM if char.isascii() else RUN_CLASS_JAPANESE
+
+
+def normalize_with_offsets(text: str) -> Tuple[str, List[int]]:
+    """
+    正規化済みテキストと、その各文字に対応する元テキストの文字位置
+
+    大半のテキストは1文字ずつ正規化した結果が全体の正規化と一致するため、それで対応を取ります。
+    半角カタカナの濁点など前の文字と合成される場合は、結合文字を前の文字とまとめて正規化します。
+
+    Args:
+        text: 対象テキスト
+
+    Returns:
+        (正規化済みテキスト, 正規化済みテキストの文字ごとの元テキストでの位置)
+    """
+    if text.isascii():
+        return text.lower(), list(range(len(text)))
+
+    normalized = normalize_text(text)
+    parts = [normalize_text(char) for char in text]
+    if "".join(parts) != normalized:
+        # 結合文字をまとめて正規化し、結果はまとめた区間の先頭の文字に対応させる
+        parts = [""] * len(text)
+        start = 0
+        for i in range(1, len(text) + 1):
+            if i < len(text) and (unicodedata.combining(text[i]) or text[i] in "\uff9e\uff9f"):
+                continue
+            parts[start] = normalize_text(text[start:i])
+            start = i
+
+    if "".join(parts) != normalized:
+        # 文字単位の正規化と一致しない場合は長さの比で近似
+        scale = len(text) / max(len(normalized), 1)
+        return normalized, [min(int(i * scale), max(len(text) - 1, 0)) for i in range(len(normalized))]
+    return normalized, [i for i, part in enumerate(parts) for _ in part]
+
+
+class _RunPositions:
+    """正規化済みテキストの位置から語位置（索引対象の文字だけを数えた位置）を求める"""
+
+    def __init__(self, normalized: str):
+        self.starts: List[int] = []
+        self.positions: List[int] = []
+        position = 0
+        for match in _RUN_PATTERN.finditer(normalized):
+            self.starts.append(match.start())
+            self.positions.append(position)
+            position += len(match.group())
+
+    def position(self, index: int) -> int:
+        """連続区間内の文字位置 index の語位置"""
+        if not self.starts:
+            return 0
+        run = max(bisect.bisect_right(self.starts, index) - 1, 0)
+        return self.positions[run] + index - self.starts[run]
+
+
+class RegexTokenizer:
+    """従来の正規表現による単語分割（文字種の連続を1語とする）"""
+
+    def __init__(self):
+        self.spec = {"type": "regex"}
+
+    def tokenize(self, text: str) -> List[str]:
+        """テキストを索引語に分割（重複あり・出現順）"""
+        return [term.lower() for term in _LEGACY_PATTERN.findall(text) if len(term) > 1]
+
+    def tokenize_with_positions(self, text: str) -> List[Tuple[str, int, int]]:
+        """(索引語, 語位置, 文字位置) のリスト（tokenize と同じ順序）"""
+        tokens = []
+        position = 0
+        for match in _LEGACY_PATTERN.finditer(text):
+            term = match.group()
+            if len(term) > 1:
+                tokens.append((term.lower(), position, match.start()))
+            position += len(term)
+        return tokens
+
+
+class NgramTokenizer:
+    """日本語を文字n-gram、英数字を単語単位で分割するトークナイザ"""
+
+    def __init__(self, ngram_sizes: Optional[List[int]] = None):
+        self.ngram_sizes = sorted(set(ngram_sizes or [2]))
+        self.spec = {"type": "ngram", "ngram_sizes": self.ngram_sizes}
+
+    def tokenize(self, text: str) -> List[str]:
+        """テキストを索引語に分割（重複あり・出現順）"""
+        terms = []
+        for run in _RUN_PATTERN.findall(normalize_text(text)):
+            if run.isascii():
+                if len(run) > 1:
+                    terms.append(run)
+                continue
+            terms.extend(self._ngrams(run))
+        return terms
+
+    def tokenize_with_positions(self, text: str) -> List[Tuple[str, int, int]]:
+        """(索引語, 語位置, 文字位置) のリスト（tokenize と同じ順序）"""
+        normalized, offsets = normalize_with_offsets(text)
+        tokens = []
+        position = 0
+        for match in _RUN_PATTERN.finditer(normalized):
+            run, start = match.group(), match.start()
+            if run.isascii():
+                if len(run) > 1:
+                    tokens.append((run, position, offsets[start]))
+            elif len(run) < self.ngram_sizes[0]:
+                tokens.append((run, position, offsets[start]))
+            else:
+                for n in self.ngram_sizes:
+                    tokens.extend((run[i:i + n], position + i, offsets[start + i])
+                                  for i in range(len(run) - n + 1))
+            position += len(run)
+        return tokens
+
+    def _ngrams(self, run: str) -> List[str]:
+        """日本語の連続文字列からn-gramを生成（最小nより短い場合はそのまま）"""
+        if len(run) < self.ngram_sizes[0]:
+            return [run]
+
+        grams = []
+        for n in self.ngram_sizes:
+            grams.extend(run[i:i + n] for i in range(len(run) - n + 1))
+        return grams
+
+
+class MorphologicalTokenizer:
+    """形態素解析器（fugashi / janome）による分割"""
+
+    def __init__(self, backend: str):
+        self.backend = backend
+        self.spec = {"type": "morph", "backend": backend}
+
+        if backend == "fugashi":
+            import fugashi
+            tagger = fugashi.Tagger()
+            self._split = lambda text: [word.surface for word in tagger(text)]
+        elif backend == "janome":
+            from janome.tokenizer import Tokenizer
+            tokenizer = Tokenizer()
+            self._split = lambda text: list(tokenizer.tokenize(text, wakati=True))
+        else:
+            raise ValueError(f"未対応の形態素解析バックエンド: {backend}")
+
+    def tokenize(self, text: str) -> List[str]:
+        """テキストを索引語に分割（重複あり・出現順）"""
+        terms = []
+        for surface in self._split(normalize_text(text)):
+            for run in _RUN_PATTERN.findall(surface):
+                if run.isascii() and len(run) < 2:
+                    continue
+                terms.append(run)
+        return terms
+
+    def tokenize_with_positions(self, text: str) -> List[Tuple[str, int, int]]:
+        """(索引語, 語位置, 文字位置) のリスト（tokenize と同じ順序）"""
+        normalized, offsets = normalize_with_offsets(text)
+        run_positions = _RunPositions(normalized)
+        tokens = []
+        cursor = 0
+        for surface in self._split(normalized):
+            index = normalized.find(surface, cursor)
+            if index < 0:
+                index = cursor
+            cursor = index + len(surface)
+            for match in _RUN_PATTERN.finditer(surface):
+                run = match.group()
+                if run.isascii() and len(run) < 2:
+                    continue
+                start = min(index + match.start(), len(offsets) - 1)
+                tokens.append((run, run_positions.position(start), offsets[start]))
+        return tokens
+
+
+def _detect_morph_backend() -> Optional[str]:
+    """ローカルにインストールされている形態素解析器を検出"""
+    for backend in ("fugashi", "janome"):
+        try:
+            __import__(backend)
+            return backend
+        except ImportError:
+            continue
+    return None
+
+
+def create_tokenizer(spec: Optional[Dict[str, Any]] = None):
+    """
+    設定からトークナイザを生成
+
+    Args:
+        spec: トークナイザ設定（type: ngram / morph / regex）
+              None の場合は従来の正規表現分割
+
+    Returns:
+        tokenize(text) と spec を持つトークナイザ
+    """
+    if not spec:
+        return RegexTokenizer()
+
+    tokenizer_type = spec.get("type", "ngram")
+
+    if tokenizer_type == "regex":
+        return RegexTokenizer()
+
+    if tokenizer_type == "morph":
+        backend = spec.get("backend", spec.get("morph_backend", "auto"))
+        if backend == "auto":
+            backend = _detect_morph_backend()
+        if backend:
+            try:
+                return MorphologicalTokenizer(backend)
+            except ImportError:
+                pass
+        logger.warning("形態素解析器が利用できないため、n-gramトークナイザを使用します")
+
+    return NgramTokenizer(spec.get("ngram_sizes", [2]))
@@ -0,0 +1,505 @@
+#!/usr/bin/env python3
+"""
+オフライン環境向けのローカル埋め込み（ハッシュ化TF-IDF + SVD射影）
+
+OpenAI API Keyのない環境でもベクトル検索できるよう、NumPyだけで動く埋め込みを提供します。
+
+1. トークナイザ（取り込み・検索と同じ設定）で索引語に分割し、語をハッシュで特徴番号に変換
+2. 取り込み時にコーパスの標本から文書頻度（IDF）を数え、TF-IDF行列の上位特異ベクトルを
+   乱択SVDで求める（射影行列: 特徴数 × 次元）
+3. 埋め込みは TF-IDF ベクトル（L2正規化）に射影行列を掛けたもの
+
+学習したモデルは common/knowledge/.index/local_embedding-<指紋>.npz に保存し、モデル名
+（local-hash-svd:<指紋>）をインデックスに記録します。検索時はインデックスのモデル名で
+同じモデルを読み込むため、クエリとチャンクは同じ射影で埋め込まれます。
+モデルのファイルは指紋ごとに別なので、学習し直しても新しい世代のインデックスに
+切り替わるまでは、検索側は旧世代のインデックスと旧モデルを使い続けられます。
+
+使用例:
+    from common.utils.local_embeddings import LocalEmbeddingModel
+
+    model = LocalEmbeddingModel.fit(texts, {"type": "ngram", "ngram_sizes": [2]}, dim=256)
+    model.save(Path("common/knowledge/.index"))  # local_embedding-<指紋>.npz
+    vectors = model.embed(["顧客からのAPI統合相談事例"])
+
+    model = load_local_model(Path("common/knowledge/.index"), "local-hash-svd:0123abcd4567")
+"""
+
+import hashlib
+import json
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import logging
+
+import numpy as np
+
+from .knowledge_tokenizer import (
+    RUN_CLASS_ALNUM, RUN_CLASS_JAPANESE, RUN_CLASS_NONE, NgramTokenizer, create_tokenizer,
+    normalize_text, run_char_class,
+)
+
+logger = logging.getLogger(__name__)
+
+LOCAL_MODEL_PREFIX = "local-hash-svd"
+# モデルのファイル名（<指紋> はモデル名の指紋）。指紋のない名前は以前の形式
+LOCAL_MODEL_FILE = "local_embedding-{fingerprint}.npz"
+LEGACY_LOCAL_MODEL_FILE = "local_embedding.npz"
+# 検索側でインデックスごとに保持するモデル数（切り替え前後の世代）
+_MAX_LOADED_PER_INDEX = 2
+
+# 既定値（knowledge_config.yml の embedding.local セクション）
+DEFAULT_LOCAL_DIM = 256
+DEFAULT_HASH_FEATURES = 2 ** 20
+DEFAULT_MAX_FEATURES = 50000
+DEFAULT_FIT_SAMPLE_SIZE = 10000
+DEFAULT_SVD_ITERATIONS = 2
+# ベクトル検索のコサイン類似度の閾値の既定値。TF-IDF+SVDのコサインはAPIの埋め込みより低く出るため、
+# 検索設定の閾値（0.7）とは別に持つ。生成コーパスでの測定: クエリの語を含むチャンクの96%が0.3以上、
+# クエリの語を含まないチャンクで0.3以上は0.7%（0.7では関連チャンクの64%しか残らない）
+DEFAULT_LOCAL_SIMILARITY_THRESHOLD = 0.3
+
+# 乱択SVDの余分な次元数・乱数の種
+_OVERSAMPLE = 10
+_SEED = 0
+
+# 語のハッシュ（FNV-1a を文字単位で適用。Pythonの hash() はプロセスごとに変わるため使わない）
+_FNV_OFFSET = np.uint64(0xcbf29ce484222325)
+_FNV_PRIME = np.uint64(0x100000001b3)
+# ハッシュに使う語の先頭文字数（長いURL等で文字配列が大きくなりすぎないように）
+_MAX_TERM_CHARS = 32
+
+# 疎行列の積で一度に密行列にする行数（作業用メモリ: この数 × バッチ内の特徴数 × 4バイト）
+_PRODUCT_ROWS = 256
+
+
+def is_local_model(model: Optional[str]) -> bool:
+    """ローカル埋め込みのモデル名か"""
+    return bool(model) and model.startswith(f"{LOCAL_MODEL_PREFIX}:")
+
+
+def hash_terms(terms: Sequence[str], n_features: int) -> np.ndarray:
+    """
+    索引語を特徴番号に変換（ベクトル化）
+
+    Args:
+        terms: 索引語のリスト
+        n_features: ハッシュの値域
+
+    Returns:
+        int64 の特徴番号の配列
+    """
+    if not terms:
+        return np.zeros(0, dtype=np.int64)
+    # 固定長のUnicode配列を文字コードの行列として扱い、文字の位置ごとにまとめて混ぜる
+    chars = np.array([term[:_MAX_TERM_CHARS] for term in terms])
+    codes = chars.view(np.uint32).reshape(len(terms), -1).astype(np.uint64)
+    hashes = np.full(len(terms), _FNV_OFFSET, dtype=np.uint64)
+    for column in codes.T:
+        hashes = _fnv_mix(hashes, column)
+    return (hashes % np.uint64(n_features)).astype(np.int64)
+
+
+def _fnv_mix(hashes: np.ndarray, codes: np.ndarray) -> np.ndarray:
+    """FNV-1a で文字コードを1文字分混ぜる（文字コード0は語の終わりとして混ぜない）"""
+    return np.where(codes != 0, (hashes ^ codes) * _FNV_PRIME, hashes)
+
+
+_char_classes: Optional[np.ndarray] = None
+
+
+def _run_char_classes() -> np.ndarray:
+    """基本多言語面の文字ごとの種別（run_char_class の表）"""
+    global _char_classes
+    if _char_classes is None:
+        _char_classes = np.array([run_char_class(chr(code)) for code in range(0x10000)],
+                                 dtype=np.uint8)
+    return _char_classes
+
+
+def ngram_term_hashes(texts: Sequence[str], ngram_sizes: Sequence[int],
+                      n_features: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    NgramTokenizer の索引語の特徴番号を、語の文字列を作らずに計算（ベクトル化）
+
+    tokenizer.tokenize() の結果を hash_terms() に通したものと同じ特徴番号になります
+    （順序は異なる）。
+
+    Args:
+        texts: テキストのリスト
+        ngram_sizes: n-gram長（昇順）
+        n_features: ハッシュの値域
+
+    Returns:
+        (テキストの番号, 特徴番号) の int64 配列
+    """
+    normalized = [normalize_text(text or "") for text in texts]
+    # 索引しない文字（空白）で区切って連結し、文字コードの配列として扱う
+    codes = np.frombuffer(" ".join(normalized).encode("utf-32-le"), dtype=np.uint32)
+    text_starts = np.zeros(len(texts), dtype=np.int64)
+    text_starts[1:] = np.cumsum([len(text) + 1 for text in normalized[:-1]])
+    classes = np.where(codes < 0x10000, _run_char_classes()[np.minimum(codes, 0xffff)], 0)
+
+    # 連続する同じ種別の文字（トークナイザーが切り出す1つの連続）を区間にする
+    change = np.flatnonzero(np.diff(classes, prepend=0, append=0))
+    run_starts, run_ends = change[:-1], change[1:]
+    run_classes = classes[run_starts]
+    keep = run_classes != RUN_CLASS_NONE
+    run_starts, run_ends, run_classes = run_starts[keep], run_ends[keep], run_classes[keep]
+    run_lengths = run_ends - run_starts
+    codes = codes.astype(np.uint64)
+
+    # 語の開始位置と長さ（英数字: 2文字以上の単語全体、日本語: n-gram、最小nより短ければ全体）
+    term_starts = []
+    term_lengths = []
+    words = (run_classes == RUN_CLASS_ALNUM) & (run_lengths > 1)
+    short = (run_classes == RUN_CLASS_JAPANESE) & (run_lengths < ngram_sizes[0])
+    for selected in (words, short):
+        term_starts.append(run_starts[selected])
+        term_lengths.append(run_lengths[selected])
+    positions = np.flatnonzero(classes == RUN_CLASS_JAPANESE)
+    japanese = run_classes == RUN_CLASS_JAPANESE
+    ends = np.repeat(run_ends[japanese], run_lengths[japanese])
+    for n in ngram_sizes:
+        fits = ends - positions >= n
+        term_starts.append(positions[fits])
+        term_lengths.append(np.full(int(fits.sum()), n, dtype=np.int64))
+    term_starts = np.concatenate(term_starts).astype(np.int64)
+    term_lengths = np.minimum(np.concatenate(term_lengths), _MAX_TERM_CHARS)
+
+    hashes = np.full(len(term_starts), _FNV_OFFSET, dtype=np.uint64)
+    for k in range(int(term_lengths.max()) if len(term_lengths) else 0):
+        active = np.flatnonzero(term_lengths > k)
+        hashes[active] = _fnv_mix(hashes[active], codes[term_starts[active] + k])
+    rows = np.searchsorted(text_starts, term_starts, side="right") - 1
+    return rows, (hashes % np.uint64(n_features)).astype(np.int64)
+
+
+def _row_batches(rows: np.ndarray, n_rows: int):
+    """疎行列（rows の昇順）を _PRODUCT_ROWS 行ずつに分けた (先頭行, 終了行, 要素の範囲)"""
+    for first in range(0, n_rows, _PRODUCT_ROWS):
+        last = min(first + _PRODUCT_ROWS, n_rows)
+        span = slice(*np.searchsorted(rows, [first, last]))
+        yield first, last, span
+
+
+def _dense_batch(rows: np.ndarray, cols: np.ndarray, values: np.ndarray, first: int,
+                 last: int) -> Tuple[np.ndarray, np.ndarray]:
+    """行バッチを、バッチ内に出現する列だけの密行列にする（行列積をBLASで計算するため）"""
+    used, local_cols = np.unique(cols, return_inverse=True)
+    dense = np.zeros((last - first, len(used)), dtype=np.float32)
+    dense[rows - first, local_cols] = values
+    return used, dense
+
+
+def sparse_product(rows: np.ndarray, cols: np.ndarray, values: np.ndarray,
+                   n_rows: int, matrix: np.ndarray) -> np.ndarray:
+    """
+    疎行列 X（rows の昇順に並んだ (行, 列, 値)）と密行列の積 X @ matrix
+
+    Args:
+        rows, cols, values: 疎行列の非ゼロ要素（rows の昇順、(行, 列) の重複なし）
+        n_rows: X の行数
+        matrix: 密行列（X の列数 × k）
+
+    Returns:
+        n_rows × k の float32 行列
+    """
+    result = np.zeros((n_rows, matrix.shape[1]), dtype=np.float32)
+    for first, last, span in _row_batches(rows, n_rows):
+        if span.start == span.stop:
+            continue
+        used, dense = _dense_batch(rows[span], cols[span], values[span], first, last)
+        result[first:last] = dense @ matrix[used]
+    return result
+
+
+def sparse_t_product(rows: np.ndarray, cols: np.ndarray, values: np.ndarray,
+                     n_cols: int, matrix: np.ndarray) -> np.ndarray:
+    """
+    疎行列 X の転置と密行列の積 Xᵀ @ matrix
+
+    Args:
+        rows, cols, values: 疎行列の非ゼロ要素（rows の昇順、(行, 列) の重複なし）
+        n_cols: X の列数
+        matrix: 密行列（X の行数 × k）
+
+    Returns:
+        n_cols × k の float32 行列
+    """
+    result = np.zeros((n_cols, matrix.shape[1]), dtype=np.float32)
+    for first, last, span in _row_batches(rows, len(matrix)):
+        if span.start == span.stop:
+            continue
+        used, dense = _dense_batch(rows[span], cols[span], values[span], first, last)
+        result[used] += dense.T @ matrix[first:last]
+    return result
+
+
+class LocalEmbeddingModel:
+    """ハッシュ化TF-IDF + SVD射影による埋め込みモデル（embed はスレッドセーフ）"""
+
+    def __init__(self, settings: Dict[str, Any], features: np.ndarray, idf: np.ndarray,
+                 components: np.ndarray):
+        """
+        Args:
+            settings: 学習時の設定（tokenizer, dim, hash_features, max_features）
+            features: 使用する特徴番号（昇順）
+            idf: 特徴ごとのIDF
+            components: 射影行列（特徴数 × 次元）
+        """
+        self.settings = settings
+        self.tokenizer = create_tokenizer(settings["tokenizer"])
+        self.hash_features = int(settings["hash_features"])
+        self.features = np.asarray(features, dtype=np.int64)
+        self.idf = np.asarray(idf, dtype=np.float32)
+        self.components = np.ascontiguousarray(components, dtype=np.float32)
+        digest = hashlib.sha256()
+        for array in (self.features, self.idf, self.components):
+            digest.update(array.tobytes())
+        self.name = f"{LOCAL_MODEL_PREFIX}:{digest.hexdigest()[:12]}"
+
+    @property
+    def dim(self) -> int:
+        return self.components.shape[1]
+
+    @classmethod
+    def fit(cls, texts: Sequence[str], tokenizer_spec: Dict[str, Any], dim: int = DEFAULT_LOCAL_DIM,
+            hash_features: int = DEFAULT_HASH_FEATURES, max_features: int = DEFAULT_MAX_FEATURES,
+            iterations: int = DEFAULT_SVD_ITERATIONS) -> "LocalEmbeddingModel":
+        """
+        コーパスの標本からモデルを学習
+
+        Args:
+            texts: 学習に使うテキスト（チャンク本文）
+            tokenizer_spec: トークナイザ設定（取り込み・検索と同じもの）
+            dim: 埋め込みの次元（標本数・特徴数より多くはできない）
+            hash_features: ハッシュの値域
+            max_features: 使用する特徴数の上限（文書頻度の高い順）
+            iterations: 乱択SVDのべき乗反復の回数（多いほど精度↑・学習時間↑）
+
+        Returns:
+            学習済みモデル
+        """
+        start = time.perf_counter()
+        tokenizer = create_tokenizer(tokenizer_spec)
+        settings = cls.make_settings(tokenizer_spec, dim, hash_features, max_features)
+        rows, hashed, tf = cls._term_counts(tokenizer, texts, hash_features)
+
+        # 文書頻度の高い特徴を使う（1文書にしか出ない特徴は文書間の類似度に寄与しない）
+        candidates, df = np.unique(hashed, return_counts=True)
+        if not len(candidates):
+            raise ValueError("学習に使える語がありません")
+        if (df >= 2).any():
+            candidates, df = candidates[df >= 2], df[df >= 2]
+        if len(candidates) > max_features:
+            keep = np.sort(np.argsort(-df, kind="stable")[:max_features])
+            candidates, df = candidates[keep], df[keep]
+        idf = (np.log((1 + len(texts)) / (1 + df)) + 1).astype(np.float32)
+
+        cols = np.searchsorted(candidates, hashed)
+        known = (cols < len(candidates)) & (candidates[np.minimum(cols, len(candidates) - 1)] == hashed)
+        rows, cols = rows[known], cols[known]
+        values = cls._tfidf(rows, tf[known] * idf[cols], len(texts))
+
+        dim = max(1, min(dim, len(texts), len(candidates)))
+        components = cls._randomized_svd(rows, cols, values, len(texts), len(candidates), dim,
+                                         iterations)
+        model = cls(settings, candidates, idf, components)
+        logger.info(f"ローカル埋め込みモデルを学習しました ({model.name}, {len(texts)}チャンク, "
+                    f"特徴 {len(candidates)}, {model.dim}次元, {time.perf_counter() - start:.2f}秒)")
+        return model
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        """
+        テキストを埋め込みベクトルに変換（プロバイダとしてのインターフェース）
+
+        Args:
+            texts: テキストのリスト
+
+        Returns:
+            入力順の埋め込みベクトル（既知の語を含まないテキストはゼロベクトル）
+        """
+        return self.embed_array(texts).tolist()
+
+    def embed_array(self, texts: Sequence[str]) -> np.ndarray:
+        """テキストを埋め込み（テキスト数 × 次元の float32 行列、L2正規化済み）"""
+        if not texts:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        rows, hashed, tf = self._term_counts(self.tokenizer, texts, self.hash_features)
+        cols = np.searchsorted(self.features, hashed)
+        known = (cols < len(self.features)) & (
+            self.features[np.minimum(cols, len(self.features) - 1)] == hashed
+        )
+        rows, cols = rows[known], cols[known]
+        values = self._tfidf(rows, tf[known] * self.idf[cols], len(texts))
+        vectors = sparse_product(rows, cols, values, len(texts), self.components)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    def save(self, index_path: Path) -> Path:
+        """
+        モデルをインデックスのディレクトリに指紋付きのファイル名で保存（一時ファイルに書いてから置き換え）
+
+        他の指紋のモデルのファイルは変更しないため、インデックスが参照するモデルに影響しません。
+        """
+        path = Path(index_path) / local_model_file(self.name)
+        temp_path = path.with_name(path.name + ".tmp")
+        with open(temp_path, "wb") as f:
+            np.savez(f, features=self.features, idf=self.idf, components=self.components,
+                     settings=np.array(json.dumps(self.settings, sort_keys=True)))
+        temp_path.replace(path)
+        return path
+
+    @classmethod
+    def load(cls, index_path: Path, model: str) -> Optional["LocalEmbeddingModel"]:
+        """
+        モデル名のモデルを読み込み
+
+        Args:
+            index_path: インデックスのディレクトリ
+            model: モデル名（local-hash-svd:<指紋>）
+
+        Returns:
+            モデル（ないか壊れている・名前が一致しなければNone）
+        """
+        for file_name in (local_model_file(model), LEGACY_LOCAL_MODEL_FILE):
+            loaded = cls._load_file(Path(index_path) / file_name)
+            if loaded is not None and loaded.name == model:
+                return loaded
+        return None
+
+    @classmethod
+    def _load_file(cls, path: Path) -> Optional["LocalEmbeddingModel"]:
+        """モデルのファイルを読み込み（ないか壊れていればNone）"""
+        if not path.exists():
+            return None
+        try:
+            with np.load(path) as data:
+                return cls(json.loads(str(data["settings"])), data["features"], data["idf"],
+                           data["components"])
+        except Exception as e:
+            logger.warning(f"ローカル埋め込みモデルの読み込みエラー {path}: {e}")
+            return None
+
+    @staticmethod
+    def make_settings(tokenizer_spec: Dict[str, Any], dim: int = DEFAULT_LOCAL_DIM,
+                      hash_features: int = DEFAULT_HASH_FEATURES,
+                      max_features: int = DEFAULT_MAX_FEATURES) -> Dict[str, Any]:
+        """学習時の設定（保存したモデルが現在の設定で学習したものかの比較に使用）"""
+        return {"tokenizer": create_tokenizer(tokenizer_spec).spec, "dim": int(dim),
+                "hash_features": int(hash_features), "max_features": int(max_features)}
+
+    @staticmethod
+    def _term_counts(tokenizer, texts: Sequence[str],
+                     hash_features: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """テキストごとの (行, 特徴番号, 出現回数)（行・特徴番号の昇順）"""
+        if isinstance(tokenizer, NgramTokenizer):
+            rows, hashed = ngram_term_hashes(texts, tokenizer.ngram_sizes, hash_features)
+        else:
+            terms: List[str] = []
+            lengths = np.zeros(len(texts), dtype=np.int64)
+            for i, text in enumerate(texts):
+                text_terms = tokenizer.tokenize(text or "")
+                terms.extend(text_terms)
+                lengths[i] = len(text_terms)
+            rows = np.repeat(np.arange(len(texts), dtype=np.int64), lengths)
+            hashed = hash_terms(terms, hash_features)
+        keys = rows * hash_features + hashed
+        keys, counts = np.unique(keys, return_counts=True)
+        return keys // hash_features, keys % hash_features, counts.astype(np.float32)
+
+    @staticmethod
+    def _tfidf(rows: np.ndarray, weights: np.ndarray, n_rows: int) -> np.ndarray:
+        """(出現回数 × IDF) を対数で飽和させ、行ごとにL2正規化"""
+        values = np.log1p(weights).astype(np.float32)
+        norms = np.sqrt(np.bincount(rows, weights=values * values, minlength=n_rows))
+        norms[norms == 0] = 1.0
+        return (values / norms[rows]).astype(np.float32)
+
+    @staticmethod
+    def _randomized_svd(rows: np.ndarray, cols: np.ndarray, values: np.ndarray,
+                        n_rows: int, n_cols: int, dim: int, iterations: int) -> np.ndarray:
+        """
+        疎なTF-IDF行列の上位 dim 個の右特異ベクトル（乱択SVD、べき乗反復付き）
+
+        Returns:
+            n_cols × dim の射影行列
+        """
+        rng = np.random.default_rng(_SEED)
+        width = min(dim + _OVERSAMPLE, n_rows, n_cols)
+
+        def product(matrix):
+            return sparse_product(rows, cols, values, n_rows, matrix)
+
+        def t_product(matrix):
+            return sparse_t_product(rows, cols, values, n_cols, matrix)
+
+        basis, _ = np.linalg.qr(product(rng.standard_normal((n_cols, width)).astype(np.float32)))
+        for _ in range(iterations):
+            basis, _ = np.linalg.qr(t_product(basis))
+            basis, _ = np.linalg.qr(product(basis))
+        # B = Qᵀ X の特異値分解から右特異ベクトルを得る
+        _, _, vt = np.linalg.svd(t_product(basis).T, full_matrices=False)
+        return np.ascontiguousarray(vt[:dim].T, dtype=np.float32)
+
+
+def local_model_file(model: str) -> str:
+    """モデル名のモデルのファイル名"""
+    return LOCAL_MODEL_FILE.format(fingerprint=model.split(":", 1)[-1])
+
+
+def remove_unused_local_models(index_path: Path, keep: Sequence[Optional[str]]) -> None:
+    """
+    指定したモデル以外のモデルのファイルを削除
+
+    Args:
+        index_path: インデックスのディレクトリ
+        keep: 残すモデル名（現在・直前のマニフェストが参照するモデル）
+    """
+    keep_files = {local_model_file(model) for model in keep if is_local_model(model)}
+    index_path = Path(index_path)
+    for path in index_path.glob(LOCAL_MODEL_FILE.format(fingerprint="*")):
+        if path.name not in keep_files:
+            path.unlink(missing_ok=True)
+    # 以前の形式（指紋のないファイル名）は、使われていれば指紋付きのファイル名に移す
+    legacy_path = index_path / LEGACY_LOCAL_MODEL_FILE
+    if legacy_path.exists():
+        legacy = LocalEmbeddingModel._load_file(legacy_path)
+        if legacy is not None and local_model_file(legacy.name) in keep_files:
+            legacy.save(index_path)
+        legacy_path.unlink(missing_ok=True)
+
+
+# 検索側で読み込んだモデル（モデル名に指紋を含むため、名前が同じなら同じモデル）
+_loaded_models: Dict[Tuple[str, str], LocalEmbeddingModel] = {}
+_loaded_lock = threading.Lock()
+
+
+def load_local_model(index_path: Path, model: str) -> Optional[LocalEmbeddingModel]:
+    """
+    インデックスに記録されたモデル名のローカル埋め込みモデルを読み込み（プロセス内で共有）
+
+    Args:
+        index_path: インデックスのディレクトリ
+        model: インデックスに記録されたモデル名
+
+    Returns:
+        モデル（保存したモデルが見つからない場合はNone）
+    """
+    key = (str(index_path), model)
+    with _loaded_lock:
+        if key in _loaded_models:
+            return _loaded_models[key]
+        loaded = LocalEmbeddingModel.load(Path(index_path), model)
+        if loaded is None:
+            logger.warning(f"インデックスのローカル埋め込みモデル {model} が見つかりません")
+            return None
+        # 切り替え前後の世代のモデルだけを残し、それより古いモデルは破棄
+        same_index = [old_key for old_key in _loaded_models if old_key[0] == key[0]]
+        for old_key in same_index[:max(0, len(same_index) - _MAX_LOADED_PER_INDEX + 1)]:
+            del _loaded_models[old_key]
+        _loaded_models[key] = loaded
+        return loaded
@@ -0,0 +1,350 @@
+#!/usr/bin/env python3
+"""
+NumPyによるオフラインベクトル検索
+
+全チャンクの埋め込みを連続した正規化済みfloat32行列として保持し、
+1回の行列・ベクトル積と argpartition で上位k件を求めます。
+外部サービスを使わずに動作します（VECTOR_DB_TYPE=numpy）。
+大規模な埋め込み集合向けに、IVF-flat による近似最近傍検索も提供します。
+
+使用例:
+    from common.utils.vector_index import NumpyVectorIndex
+
+    index = NumpyVectorIndex(store.embeddings, valid=store.embedding_mask, normalized=True)
+    hits = index.search(query_vector, limit=5, threshold=0.7)
+"""
+
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """
+    行ベクトルをL2正規化（ゼロベクトルはそのまま）
+
+    Args:
+        matrix: 行列（または1次元ベクトル）
+
+    Returns:
+        正規化済みのfloat32配列
+    """
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class NumpyVectorIndex:
+    """正規化済み埋め込み行列に対するコサイン類似度検索"""
+
+    # マスクで残る行がこの割合未満なら、該当行だけを取り出して積を計算する
+    PREFILTER_RATIO = 0.5
+
+    def __init__(self, embeddings: np.ndarray, valid: Optional[np.ndarray] = None,
+                 normalized: bool = False):
+        """
+        Args:
+            embeddings: 文書数×次元の埋め込み行列
+            valid: 埋め込みを持つ文書のマスク（None=全文書）
+            normalized: 既にL2正規化済みか（Trueならコピーせずに参照）
+        """
+        if normalized and embeddings.dtype == np.float32 and embeddings.flags.c_contiguous:
+            self.matrix = embeddings
+        else:
+            self.matrix = np.ascontiguousarray(normalize_rows(embeddings))
+        self.valid = None if valid is None else np.asarray(valid, dtype=bool)
+
+    @property
+    def size(self) -> int:
+        """登録文書数"""
+        return self.matrix.shape[0]
+
+    @property
+    def dim(self) -> int:
+        """埋め込み次元"""
+        return self.matrix.shape[1] if self.matrix.ndim == 2 else 0
+
+    def _combined_mask(self, mask: Optional[np.ndarray]) -> Optional[np.ndarray]:
+        if mask is None:
+            return self.valid
+        if self.valid is None:
+            return mask
+        return mask & self.valid
+
+    def search(self, query_vector: np.ndarray, limit: int = 10,
+               mask: Optional[np.ndarray] = None,
+               threshold: Optional[float] = None) -> List[Tuple[int, float]]:
+        """
+        1クエリの上位k件を検索
+
+        Args:
+            query_vector: クエリの埋め込み
+            limit: 最大結果数
+            mask: 対象文書のブールマスク（カテゴリ絞り込み等、None=全体）
+            threshold: 類似度閾値（コサイン類似度がこれ未満の結果は除外）
+
+        Returns:
+            (文書番号, コサイン類似度) のリスト（類似度降順）
+        """
+        if self.size == 0 or limit <= 0:
+            return []
+
+        query = normalize_rows(query_vector)
+        mask = self._combined_mask(mask)
+
+        if mask is not None and mask.mean() < self.PREFILTER_RATIO:
+            # 事前絞り込み: 対象行だけで行列・ベクトル積を計算
+            docs = np.flatnonzero(mask)
+            scores = self.matrix[docs] @ query
+        else:
+            docs = None
+            scores = self.matrix @ query
+            if mask is not None:
+                scores = np.where(mask, scores, -np.inf)
+
+        return self._top_k(scores, docs, limit, threshold)
+
+    def search_batch(self, query_vectors: np.ndarray, limit: int = 10,
+                     mask: Optional[np.ndarray] = None,
+                     threshold: Optional[float] = None) -> List[List[Tuple[int, float]]]:
+        """
+        複数クエリをまとめて検索（行列・行列積1回）
+
+        Args:
+            query_vectors: クエリ数×次元の行列
+            limit: クエリごとの最大結果数
+            mask: 対象文書のブールマスク（全クエリ共通）
+            threshold: 類似度閾値
+
+        Returns:
+            クエリ順の検索結果リスト
+        """
+        query_vectors = np.atleast_2d(query_vectors)
+        if self.size == 0 or limit <= 0:
+            return [[] for _ in range(len(query_vectors))]
+
+        queries = normalize_rows(query_vectors)
+        mask = self._combined_mask(mask)
+
+        if mask is not None and mask.mean() < self.PREFILTER_RATIO:
+            docs = np.flatnonzero(mask)
+            scores = queries @ self.matrix[docs].T
+        else:
+            docs = None
+            scores = queries @ self.matrix.T
+            if mask is not None:
+                scores = np.where(mask[np.newaxis, :], scores, -np.inf)
+
+        return [self._top_k(row, docs, limit, threshold) for row in scores]
+
+    @staticmethod
+    def _top_k(scores: np.ndarray, docs: Optional[np.ndarray], limit: int,
+               threshold: Optional[float]) -> List[Tuple[int, float]]:
+        """argpartition で上位k件を取り出して類似度降順に並べる"""
+        if len(scores) > limit:
+            top = np.argpartition(-scores, limit - 1)[:limit]
+        else:
+            top = np.arange(len(scores))
+        top = top[np.argsort(-scores[top], kind="stable")]
+
+        results = []
+        for i in top:
+            score = float(scores[i])
+            if score == -np.inf or (threshold is not None and score < threshold):
+                break
+            results.append((int(docs[i]) if docs is not None else int(i), score))
+        return results
+
+
+class IVFFlatIndex(NumpyVectorIndex):
+    """
+    IVF-flat による近似最近傍検索
+
+    埋め込みを k-means（球面k-means）の粗いセントロイドで複数のリストに分割し、
+    検索時はクエリに近い nprobe 個のリストに属する文書だけを厳密に比較します。
+    nprobe を増やすほど再現率が上がり、レイテンシも増えます。
+
+    カテゴリ等で絞り込む場合、対象文書が nprobe 個のリストの平均文書数以下なら対象文書だけを
+    厳密に比較し、それより多ければ絞り込み後の候補が limit 件に達するまで近い順にリストを追加します。
+    """
+
+    def __init__(self, embeddings: np.ndarray, centroids: np.ndarray,
+                 list_offsets: np.ndarray, list_docs: np.ndarray,
+                 valid: Optional[np.ndarray] = None, normalized: bool = False,
+                 nprobe: int = 8):
+        """
+        Args:
+            embeddings: 文書数×次元の埋め込み行列
+            centroids: リスト数×次元のセントロイド（正規化済み）
+            list_offsets: リストごとの list_docs 上の開始位置（リスト数+1）
+            list_docs: リスト順に並べた文書番号
+            valid: 埋め込みを持つ文書のマスク
+            normalized: 埋め込みが正規化済みか
+            nprobe: 検索するリスト数
+        """
+        super().__init__(embeddings, valid=valid, normalized=normalized)
+        self.centroids = centroids
+        self.list_offsets = list_offsets
+        self.list_docs = list_docs
+        self.nprobe = nprobe
+
+    @property
+    def n_lists(self) -> int:
+        """リスト数"""
+        return self.centroids.shape[0]
+
+    @staticmethod
+    def train(matrix: np.ndarray, valid: Optional[np.ndarray] = None, n_lists: int = 0,
+              iterations: int = 10, sample_size: int = 50000,
+              seed: int = 0) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        球面k-meansでセントロイドを学習し、全文書をリストに割り当てる
+
+        Args:
+            matrix: 正規化済みの埋め込み行列
+            valid: 埋め込みを持つ文書のマスク
+            n_lists: リスト数（0=√文書数）
+            iterations: k-meansの反復回数
+            sample_size: 学習に使う最大文書数（割り当ては全文書）
+            seed: 乱数シード
+
+        Returns:
+            (centroids, list_offsets, list_docs)
+        """
+        docs = np.arange(matrix.shape[0]) if valid is None else np.flatnonzero(valid)
+        if n_lists <= 0:
+            n_lists = int(np.sqrt(len(docs)))
+        n_lists = max(1, min(n_lists, len(docs)))
+
+        rng = np.random.default_rng(seed)
+        sample = docs if len(docs) <= sample_size else rng.choice(docs, sample_size, replace=False)
+        training = matrix[sample]
+        centroids = training[rng.choice(len(training), n_lists, replace=False)].copy()
+
+        for _ in range(iterations):
+            assignment = IVFFlatIndex._assign(training, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, training)
+            counts = np.bincount(assignment, minlength=n_lists)
+
+            # 空になったリストはランダムな文書で再初期化
+            empty = np.flatnonzero(counts == 0)
+            if len(empty):
+                sums[empty] = training[rng.choice(len(training), len(empty), replace=False)]
+            centroids = normalize_rows(sums)
+
+        assignment = IVFFlatIndex._assign(matrix[docs], centroids)
+        order = np.argsort(assignment, kind="stable")
+        list_docs = docs[order].astype(np.uint32)
+        list_offsets = np.zeros(n_lists + 1, dtype=np.uint64)
+        list_offsets[1:] = np.cumsum(np.bincount(assignment, minlength=n_lists))
+
+        return centroids.astype(np.float32), list_offsets, list_docs
+
+    @staticmethod
+    def _assign(vectors: np.ndarray, centroids: np.ndarray, batch_size: int = 8192) -> np.ndarray:
+        """各ベクトルを最も近いセントロイドに割り当て（メモリ節約のためバッチ処理）"""
+        assignment = np.empty(len(vectors), dtype=np.int64)
+        for start in range(0, len(vectors), batch_size):
+            block = vectors[start:start + batch_size]
+            assignment[start:start + batch_size] = np.argmax(block @ centroids.T, axis=1)
+        return assignment
+
+    def _prefilter(self, mask: Optional[np.ndarray]) -> Optional[np.ndarray]:
+        """
+        絞り込みの対象文書が少なければ、その文書番号を返す（厳密検索の方が比較する文書が少ない）
+
+        Returns:
+            対象文書の文書番号（リストを探索する場合はNone）
+        """
+        if mask is None:
+            return None
+        budget = len(self.list_docs) * min(self.nprobe, self.n_lists) / self.n_lists
+        docs = np.flatnonzero(self._combined_mask(mask))
+        return docs if len(docs) <= budget else None
+
+    def _candidates(self, centroid_scores: np.ndarray, mask: Optional[np.ndarray],
+                    limit: int) -> np.ndarray:
+        """
+        近いリストを nprobe 個選び、属する文書番号を集める
+
+        絞り込みで候補が limit 件に満たない場合は、近い順にリストを追加します。
+        """
+        nprobe = min(self.nprobe, self.n_lists)
+        offsets = self.list_offsets
+        if mask is None:
+            probe = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe]
+            return np.concatenate(
+                [self.list_docs[int(offsets[i]):int(offsets[i + 1])] for i in probe]
+            )
+
+        parts = []
+        found = 0
+        for probed, i in enumerate(np.argsort(-centroid_scores), 1):
+            docs = self.list_docs[int(offsets[i]):int(offsets[i + 1])]
+            docs = docs[mask[docs]]
+            parts.append(docs)
+            found += len(docs)
+            if probed >= nprobe and found >= limit:
+                break
+        return np.concatenate(parts) if parts else np.empty(0, dtype=self.list_docs.dtype)
+
+    def search(self, query_vector: np.ndarray, limit: int = 10,
+               mask: Optional[np.ndarray] = None,
+               threshold: Optional[float] = None) -> List[Tuple[int, float]]:
+        """
+        1クエリの上位k件を近似検索
+
+        Args:
+            query_vector: クエリの埋め込み
+            limit: 最大結果数
+            mask: 対象文書のブールマスク（None=全体）
+            threshold: 類似度閾値
+
+        Returns:
+            (文書番号, コサイン類似度) のリスト（類似度降順）
+        """
+        if self.size == 0 or self.n_lists == 0 or limit <= 0:
+            return []
+
+        query = normalize_rows(query_vector)
+        candidates = self._prefilter(mask)
+        if candidates is None:
+            candidates = self._candidates(self.centroids @ query, mask, limit)
+        if len(candidates) == 0:
+            return []
+        return self._top_k(self.matrix[candidates] @ query, candidates, limit, threshold)
+
+    def search_batch(self, query_vectors: np.ndarray, limit: int = 10,
+                     mask: Optional[np.ndarray] = None,
+                     threshold: Optional[float] = None) -> List[List[Tuple[int, float]]]:
+        """
+        複数クエリを近似検索（セントロイドとの比較は行列積1回）
+
+        Args:
+            query_vectors: クエリ数×次元の行列
+            limit: クエリごとの最大結果数
+            mask: 対象文書のブールマスク
+            threshold: 類似度閾値
+
+        Returns:
+            クエリ順の検索結果リスト
+        """
+        query_vectors = np.atleast_2d(query_vectors)
+        if self.size == 0 or self.n_lists == 0 or limit <= 0:
+            return [[] for _ in range(len(query_vectors))]
+
+        queries = normalize_rows(query_vectors)
+        centroid_scores = queries @ self.centroids.T
+
+        prefiltered = self._prefilter(mask)
+        results = []
+        for query, scores in zip(queries, centroid_scores):
+            candidates = prefiltered if prefiltered is not None else self._candidates(scores, mask, limit)
+            if len(candidates) == 0:
+                results.append([])
+                continue
+            results.append(self._top_k(self.matrix[candidates] @ query, candidates,
+                                       limit, threshold))
+        return results
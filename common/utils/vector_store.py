@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+Vector DB接続の共有レイヤー
+
+取り込み（ingest_knowledge.py）と検索（KnowledgeSearcher）が同じ永続化ディレクトリの
+ChromaDBを参照するよう、knowledge_config.yml の vector_db.chroma.persist_directory に
+紐づく永続クライアントをプロセスごとに1つだけ生成し、コレクションのハンドルも再利用します。
+クライアントは最初に使われた時点で生成され、生成・取得はスレッドセーフです。
+
+使用例:
+    from common.utils.vector_store import get_chroma_collection, chroma_settings
+
+    persist_directory, collection_name = chroma_settings(config)
+    collection = get_chroma_collection(persist_directory, collection_name)
+    results = collection.query(query_texts=["API統合"], n_results=5)
+"""
+
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Dict, Optional, Any, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PERSIST_DIRECTORY = "common/vector_db/chroma"
+DEFAULT_COLLECTION_NAME = "knowledge_base"
+# 取り込み時に埋め込みを生成したモデル名を記録するコレクションのメタデータのキー
+EMBEDDING_MODEL_KEY = "embedding_model"
+
+_lock = threading.Lock()
+_clients: Dict[str, Any] = {}  # 永続化ディレクトリ -> クライアント
+_collections: Dict[Tuple[str, str], Any] = {}  # (永続化ディレクトリ, コレクション名) -> ハンドル
+_owner_pid = os.getpid()
+
+
+def chroma_settings(config: Dict[str, Any],
+                    base_path: Optional[Path] = None) -> Tuple[str, str]:
+    """
+    設定からChromaDBの永続化ディレクトリとコレクション名を取得
+
+    Args:
+        config: knowledge_config.yml の内容
+        base_path: 相対パスの基準ディレクトリ（None=カレントディレクトリ）
+
+    Returns:
+        (永続化ディレクトリの絶対パス, コレクション名)
+    """
+    vector_db_config = config.get("vector_db", {}) or {}
+    persist_directory = Path(
+        (vector_db_config.get("chroma", {}) or {}).get("persist_directory", DEFAULT_PERSIST_DIRECTORY)
+    )
+    if not persist_directory.is_absolute() and base_path is not None:
+        persist_directory = Path(base_path) / persist_directory
+    collection_name = vector_db_config.get("collection_name", DEFAULT_COLLECTION_NAME)
+    return str(persist_directory.resolve()), collection_name
+
+
+def _check_process() -> None:
+    """fork後の子プロセスでは親のクライアントを使わない（呼び出し側でロック取得済み）"""
+    global _owner_pid
+    if os.getpid() != _owner_pid:
+        _clients.clear()
+        _collections.clear()
+        _owner_pid = os.getpid()
+
+
+def get_chroma_client(persist_directory: str) -> Any:
+    """
+    永続化ディレクトリに紐づくChromaDBクライアントを取得（初回のみ生成）
+
+    Args:
+        persist_directory: 永続化ディレクトリ
+
+    Returns:
+        chromadb のクライアント
+
+    Raises:
+        ImportError: chromadb がインストールされていない場合
+    """
+    with _lock:
+        _check_process()
+        client = _clients.get(persist_directory)
+        if client is None:
+            client = _clients[persist_directory] = _create_client(persist_directory)
+        return client
+
+
+def _create_client(persist_directory: str) -> Any:
+    import chromadb
+
+    Path(persist_directory).mkdir(parents=True, exist_ok=True)
+    if hasattr(chromadb, "PersistentClient"):
+        client = chromadb.PersistentClient(path=persist_directory)
+    else:
+        # chromadb 0.3系
+        from chromadb.config import Settings
+        client = chromadb.Client(Settings(chroma_db_impl="duckdb+parquet",
+                                          persist_directory=persist_directory))
+    logger.info(f"ChromaDBクライアントを生成しました: {persist_directory}")
+    return client
+
+
+def get_chroma_collection(persist_directory: str, collection_name: str = DEFAULT_COLLECTION_NAME,
+                          create: bool = False) -> Any:
+    """
+    コレクションのハンドルを取得（取得済みのハンドルを再利用）
+
+    Args:
+        persist_directory: 永続化ディレクトリ
+        collection_name: コレクション名
+        create: 存在しない場合に作成するか（False=存在しなければ chromadb の例外）
+
+    Returns:
+        chromadb のコレクション
+    """
+    key = (persist_directory, collection_name)
+    with _lock:
+        _check_process()
+        collection = _collections.get(key)
+        if collection is not None:
+            return collection
+
+    client = get_chroma_client(persist_directory)
+    if create:
+        collection = client.get_or_create_collection(collection_name)
+    else:
+        collection = client.get_collection(collection_name)
+
+    with _lock:
+        return _collections.setdefault(key, collection)
+
+
+def collection_embedding_model(collection: Any) -> Optional[str]:
+    """
+    コレクションの埋め込みを生成したモデル名を取得
+
+    Returns:
+        モデル名（ChromaDBの既定の埋め込み関数で保存した場合はNone）
+    """
+    return (getattr(collection, "metadata", None) or {}).get(EMBEDDING_MODEL_KEY)
+
+
+def set_collection_embedding_model(collection: Any, model: str) -> None:
+    """
+    コレクションの埋め込みを生成したモデル名を記録（検索側は同じモデルでクエリを埋め込む）
+
+    Args:
+        collection: chromadb のコレクション
+        model: 埋め込みモデル名
+    """
+    if collection_embedding_model(collection) == model:
+        return
+    # 距離関数（hnsw:*）は作成後に変更できないため、それ以外のメタデータだけを渡す
+    metadata = {key: value for key, value in (collection.metadata or {}).items()
+                if not key.startswith("hnsw:")}
+    metadata[EMBEDDING_MODEL_KEY] = model
+    collection.modify(metadata=metadata)
+
+
+def reset_chroma_clients() -> None:
+    """保持しているクライアント・コレクションのハンドルを破棄（コレクション削除後などに使用）"""
+    with _lock:
+        _clients.clear()
+        _collections.clear()
+
+
+def to_chroma_metadata(metadata: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    メタデータをChromaDBに保存できる形式に変換
+
+    ChromaDBのメタデータは str / int / float / bool のみ保持できるため、
+    リスト・辞書はJSON文字列に、日付は文字列に変換し、Noneは除外します。
+    """
+    converted = {}
+    for key, value in metadata.items():
+        if value is None:
+            continue
+        if isinstance(value, (str, int, float, bool)):
+            converted[key] = value
+        elif isinstance(value, (list, tuple, dict)):
+            converted[key] = json.dumps(value, ensure_ascii=False, default=str)
+        else:
+            converted[key] = str(value)
+    return converted
+
+
+def from_chroma_metadata(metadata: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """to_chroma_metadata で文字列化したリスト・辞書を復元"""
+    restored = {}
+    for key, value in (metadata or {}).items():
+        if isinstance(value, str) and value[:1] in "[{":
+            try:
+                value = json.loads(value)
+            except ValueError:
+                pass
+        restored[key] = value
+    return restored
@@ -0,0 +1,76 @@
+"""
+テスト共通のフィクスチャ
+
+一時ディレクトリにナレッジファイルを書き出し、取り込みと同じ手順
+（チャンク分割 → ローカル埋め込み → カテゴリ別シャードの書き出し）でインデックスを作ります。
+"""
+
+import sys
+from pathlib import Path
+from typing import Dict
+
+import pytest
+import yaml
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from common.utils.knowledge_chunker import KnowledgeChunker  # noqa: E402
+from common.utils.knowledge_index import InvertedIndex, extract_chunk_fields  # noqa: E402
+from common.utils.knowledge_shards import shard_name_for, write_sharded_index  # noqa: E402
+from common.utils.knowledge_tokenizer import create_tokenizer  # noqa: E402
+from common.utils.local_embeddings import LocalEmbeddingModel  # noqa: E402
+
+TOKENIZER_SPEC = {"type": "ngram"}
+
+
+def build_knowledge_index(knowledge_base_path: Path, files: Dict[str, str]) -> None:
+    """
+    ナレッジファイルを書き出してローカルインデックス（埋め込み付き）を構築
+
+    Args:
+        knowledge_base_path: ナレッジベースのルート
+        files: ナレッジベースからの相対パス -> 本文
+    """
+    chunker = KnowledgeChunker({}, knowledge_base_path)
+    chunks = []
+    for relative_path, content in files.items():
+        file_path = knowledge_base_path / relative_path
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        file_path.write_text(content, encoding="utf-8")
+        chunks.extend(chunker.chunk_content(content, chunker.extract_metadata(file_path)))
+
+    model = LocalEmbeddingModel.fit([chunk["content"] for chunk in chunks], TOKENIZER_SPEC,
+                                    dim=8, hash_features=1 << 14, max_features=2000)
+    for chunk, vector in zip(chunks, model.embed([chunk["content"] for chunk in chunks])):
+        chunk["embedding"] = vector
+
+    tokenizer = create_tokenizer(TOKENIZER_SPEC)
+    shard_chunks, shard_indexes = {}, {}
+    for chunk in chunks:
+        metadata = chunk["metadata"]
+        name = shard_name_for(metadata["file_path"], knowledge_base_path)
+        if name not in shard_indexes:
+            shard_chunks[name] = []
+            shard_indexes[name] = InvertedIndex(tokenizer=tokenizer, store_positions=True)
+        shard_chunks[name].append(chunk)
+        shard_indexes[name].add_chunk(metadata["chunk_id"], chunk["content"],
+                                      extract_chunk_fields(chunk["content"], metadata),
+                                      category=metadata.get("category", ""))
+
+    index_path = knowledge_base_path / ".index"
+    model.save(index_path)
+    write_sharded_index(index_path, shard_chunks, shard_indexes, model.name)
+
+
+@pytest.fixture
+def knowledge_base(tmp_path, monkeypatch):
+    """一時ナレッジベース（ナレッジベースのパスと設定ファイルのパスを返す）"""
+    knowledge_base_path = tmp_path / "knowledge"
+    (knowledge_base_path / ".index").mkdir(parents=True)
+    config_path = tmp_path / "knowledge_config.yml"
+    config_path.write_text(yaml.safe_dump({
+        "tokenizer": TOKENIZER_SPEC,
+        "search": {"rerank": True, "result_cache": {"enabled": False}}
+    }), encoding="utf-8")
+    monkeypatch.setenv("VECTOR_DB_TYPE", "numpy")
+    return knowledge_base_path, config_path
@@ -0,0 +1,50 @@
+"""フィルタ式の解釈のテスト"""
+
+import pytest
+
+from common.utils.knowledge_facets import parse_filters
+
+
+def conditions(filters):
+    return [(condition.field, condition.op, condition.values) for condition in parse_filters(filters)]
+
+
+def test_parse_and_expression():
+    assert conditions("resolution_status=resolved AND date>=2024-10 && tags in (api, billing)") == [
+        ("resolution_status", "in", ["resolved"]),
+        ("date", "gte", ["2024-10"]),
+        ("tags", "in", ["api", "billing"]),
+    ]
+
+
+def test_quoted_values_keep_connectives():
+    assert conditions('title="API or billing" AND summary=\'a && b\'') == [
+        ("title", "in", ["API or billing"]),
+        ("summary", "in", ["a && b"]),
+    ]
+
+
+@pytest.mark.parametrize("expression", [
+    "status=resolved OR status=open",
+    "status=resolved or status=open",
+    "status=resolved || status=open",
+    "status=resolved OR",
+])
+def test_or_is_rejected(expression):
+    with pytest.raises(ValueError, match="OR"):
+        parse_filters(expression)
+
+
+@pytest.mark.parametrize("expression", [
+    "tags in (api, billing",
+    "tags in api, billing)",
+    "tags in ((api))",
+    'title="API',
+    "status=resolved AND",
+    "AND status=resolved",
+    "status=resolved AND date>=2024-10 &&",
+    "(status=resolved AND date>=2024-10)",
+])
+def test_unbalanced_expression_is_rejected(expression):
+    with pytest.raises(ValueError):
+        parse_filters(expression)
@@ -0,0 +1,57 @@
+"""関連文書テーブルの差分更新のテスト"""
+
+import numpy as np
+
+from common.utils.knowledge_related import (
+    build_related_table, load_document_vectors, load_related_table, update_related_table, write_related_table
+)
+from common.utils.knowledge_tokenizer import create_tokenizer
+
+TOKENIZER = create_tokenizer({"type": "ngram"})
+WORDS = ["営業", "請求書", "API", "統合", "顧客", "分析", "広告", "予算", "契約", "メール"]
+
+
+def chunk(file_no, seed, embedding=True):
+    rng = np.random.default_rng(seed)
+    result = {
+        "content": " ".join(rng.choice(WORDS, size=30)),
+        "metadata": {"file_path": f"doc_{file_no:02d}.md", "chunk_index": 0, "title": f"doc {file_no}"},
+    }
+    if embedding:
+        result["embedding"] = rng.normal(size=8).tolist()
+    return result
+
+
+def test_update_from_stored_vectors_matches_full_chunks(tmp_path):
+    chunks = [chunk(i, i) for i in range(30)]
+    table, vectors = build_related_table(chunks, TOKENIZER, top_n=5)
+    write_related_table(tmp_path, table, vectors)
+
+    # 1件変更・1件追加（未変更の文書のチャンクは渡さない）
+    changed = [chunk(3, 100), chunk(30, 130)]
+    updated, updated_vectors = update_related_table(changed, TOKENIZER, load_related_table(tmp_path),
+                                                    load_document_vectors(tmp_path), top_n=5)
+
+    expected, _ = build_related_table([c for c in chunks if c["metadata"]["file_path"] != "doc_03.md"] + changed,
+                                      TOKENIZER, top_n=5, previous=table,
+                                      changed_files=["doc_03.md", "doc_30.md"])
+    assert updated_vectors.method == "embedding"
+    assert updated["documents"] == expected["documents"]
+
+
+def test_update_needs_full_chunks_without_embeddings(tmp_path):
+    chunks = [chunk(i, i) for i in range(10)]
+    table, vectors = build_related_table(chunks, TOKENIZER, top_n=5)
+
+    assert update_related_table([chunk(3, 100, embedding=False)], TOKENIZER, table, vectors, top_n=5) is None
+    assert update_related_table([chunk(3, 100)], TOKENIZER, table, vectors, top_n=3) is None
+
+
+def test_split_sections_keep_chunk_order():
+    chunks = [chunk(0, 0), chunk(0, 1), chunk(0, 2), chunk(1, 3)]
+    for c, index in zip(chunks, [2, "1.1", "1.0", 0]):
+        c["metadata"]["chunk_index"] = index
+
+    table, _ = build_related_table(chunks, TOKENIZER, top_n=5)
+
+    assert table["documents"]["doc_00.md"]["content"] == chunks[2]["content"]
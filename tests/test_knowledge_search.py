@@ -0,0 +1,86 @@
+"""KnowledgeSearcher のハイブリッド検索のテスト"""
+
+from common.utils.knowledge_search import KnowledgeSearcher
+
+from conftest import build_knowledge_index
+
+FILES = {
+    "customer-support/api.md": "# API統合の相談\n\n" + "導入の経緯を説明します。" * 30
+                               + "API統合の料金プランについて問い合わせがありました。" + "補足です。" * 30,
+    "customer-support/billing.md": "# 請求書の再発行\n\n請求書の再発行の手順を案内しました。",
+    "company/products.md": "# 製品概要\n\nSaaSプラットフォームの製品概要です。",
+}
+
+# 埋め込みの学習には2文書以上に出る語が必要なため、語を共有する文書を並べる
+VECTOR_FILES = {
+    "customer-support/api.md": "# API統合\n\nAPI統合の料金プランについて問い合わせがありました。",
+    "customer-support/api-pricing.md": "# 料金体系\n\nAPI統合の料金体系を説明しました。",
+    "customer-support/billing.md": "# 請求書の再発行\n\n請求書の再発行の手順を案内しました。",
+    "customer-support/invoice.md": "# 請求書の送付先\n\n請求書の送付先を変更しました。",
+    "company/products.md": "# 製品概要\n\nSaaSプラットフォームの製品概要です。",
+}
+
+
+def test_hybrid_search_keeps_snippet(knowledge_base):
+    knowledge_base_path, config_path = knowledge_base
+    build_knowledge_index(knowledge_base_path, FILES)
+    searcher = KnowledgeSearcher(str(knowledge_base_path), str(config_path))
+
+    results = searcher.hybrid_search("API統合 料金", limit=3, similarity_threshold=0.0)["results"]
+
+    top = results[0]
+    assert top["metadata"]["file_path"].endswith("api.md")
+    assert "lexical" in top["retrievers"]
+    assert "API統合" in top["snippet"]
+    assert len(top["snippet"]) < len(top["content"])
+
+
+def test_search_uses_hybrid_results_with_snippet(knowledge_base):
+    knowledge_base_path, config_path = knowledge_base
+    build_knowledge_index(knowledge_base_path, FILES)
+    searcher = KnowledgeSearcher(str(knowledge_base_path), str(config_path))
+
+    results = searcher.search("請求書 再発行", limit=3, similarity_threshold=0.0)
+
+    assert results[0]["metadata"]["file_path"].endswith("billing.md")
+    assert "retrievers" in results[0]
+    assert "請求書" in results[0]["snippet"]
+
+
+def test_unknown_query_terms_give_no_vector_results(knowledge_base):
+    knowledge_base_path, config_path = knowledge_base
+    build_knowledge_index(knowledge_base_path, VECTOR_FILES)
+    searcher = KnowledgeSearcher(str(knowledge_base_path), str(config_path))
+
+    # 語彙にない語だけのクエリは埋め込みがゼロベクトルになり、閾値0でも任意の文書を返さない
+    assert searcher.hybrid_search("zzqx", limit=3, similarity_threshold=0.0)["results"] == []
+    assert searcher.search_many(["zzqx", "請求書 再発行"], limit=3,
+                                similarity_threshold=0.0)["results"][0] == []
+
+
+def test_local_model_uses_local_similarity_threshold(knowledge_base):
+    knowledge_base_path, config_path = knowledge_base
+    build_knowledge_index(knowledge_base_path, VECTOR_FILES)
+    searcher = KnowledgeSearcher(str(knowledge_base_path), str(config_path))
+
+    # このクエリのローカル埋め込みのコサインは0.5〜0.6（検索設定の既定値0.7では候補が残らない）
+    results = searcher.hybrid_search("API統合 請求書", limit=5)["results"]
+    assert any("vector" in result["retrievers"] for result in results)
+
+    results = searcher.hybrid_search("API統合 請求書", limit=5, similarity_threshold=0.7)["results"]
+    assert not any("vector" in result["retrievers"] for result in results)
+
+
+def test_results_without_index_are_not_cached(knowledge_base):
+    knowledge_base_path, config_path = knowledge_base
+    config_path.write_text(config_path.read_text(encoding="utf-8").replace("enabled: false", "enabled: true"),
+                           encoding="utf-8")
+    (knowledge_base_path / "billing.md").write_text("# 請求書\n\n請求書の再発行の手順です。", encoding="utf-8")
+    searcher = KnowledgeSearcher(str(knowledge_base_path), str(config_path))
+    assert len(searcher.search("請求書", limit=5)) == 1
+
+    # インデックスがない間はナレッジファイルを直接検索するため、ファイルの追加がすぐに反映される
+    (knowledge_base_path / "invoice.md").write_text("# 請求書の送付\n\n請求書の送付先です。", encoding="utf-8")
+
+    assert len(searcher.search("請求書", limit=5)) == 2
+    assert len(searcher.search_many(["請求書"], limit=5)["results"][0]) == 2